@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, File, Chat, Message
+from .models import User, File, Chat, Message, ChatTrace
 
 # Register your models here.
 
@@ -7,3 +7,4 @@ admin.site.register(User)
 admin.site.register(File)
 admin.site.register(Chat)
 admin.site.register(Message)
+admin.site.register(ChatTrace)
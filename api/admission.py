@@ -0,0 +1,339 @@
+"""
+Admission control for the LLM-backed endpoints.
+
+Two layers, both answering with HTTP 429 + `Retry-After` instead of letting
+requests pile up on workers:
+
+* Request rate — a token bucket per (endpoint, user_id). `AdmissionMiddleware`
+  resolves the user from the request (user_id in the body / form, or the
+  owner of chat_id) and rejects the request before the view runs.
+* LLM concurrency — `llm_slot()` wraps every model call (`langchain`,
+  `text2sql`, `make_title`). At most ADMISSION_MAX_INFLIGHT_LLM calls run at
+  once; the rest wait in per-user FIFO queues served round-robin, so one user
+  with many requests cannot starve the others. When the queue is full (checked
+  up front by the middleware) or a wait exceeds ADMISSION_QUEUE_TIMEOUT the
+  request fails fast with 429.
+
+State is in-process by default. With ADMISSION_BACKEND="cache" the buckets
+and a global in-flight counter live in a Django cache (ADMISSION_CACHE, e.g.
+Redis / Memcached) so several workers share the limits; the per-process fair
+queue still orders waiters inside each worker.
+"""
+import contextvars
+import json
+import logging
+import math
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Iterator
+
+from django.conf import settings
+from django.http import HttpRequest, JsonResponse
+
+from .tracing import REGISTRY, span
+
+logger = logging.getLogger(__name__)
+
+# 요청 경로 → 속도 제한 이름 (settings.ADMISSION_RATES 의 키)
+ENDPOINTS = {
+    "/api/chat/start": "chat.start",
+    "/api/chat/query": "chat.query",
+    "/api/files/upload": "files.upload",
+    "/api/batch/start": "batch.start",
+}
+_PERIODS = {"s": 1, "m": 60, "h": 3600}
+_LEASE = 300        # 초. cache 백엔드 in-flight 카운터 키 수명 (죽은 워커가 남긴 카운트 정리)
+
+
+class Saturated(Exception):
+    """허용량 초과. retry_after 초 뒤에 다시 시도하라는 의미"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def _cfg(name: str, default):
+    return getattr(settings, f"ADMISSION_{name}", default)
+
+
+def parse_rate(rate: str) -> tuple[int, float]:
+    """'20/m' → (버킷 크기 20, 초당 충전량 20/60)"""
+    count, _, unit = rate.partition("/")
+    if not count.isdigit() or unit not in _PERIODS:
+        raise ValueError(f"rate must look like '20/m' (s, m or h), got {rate!r}")
+    return int(count), int(count) / _PERIODS[unit]
+
+
+# ── token buckets ────────────────────────────────────────────
+class MemoryBuckets:
+    """프로세스 내 token bucket. take() 는 (허용 여부, 다음 토큰까지 남은 초)"""
+
+    def __init__(self, max_keys: int = 10_000):
+        self._lock = threading.Lock()
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()   # key → (tokens, updated)
+        self._max_keys = max_keys
+
+    def take(self, key: str, capacity: int, refill: float) -> tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / refill
+
+
+class CacheBuckets:
+    """
+    Django cache 를 공유하는 워커 간 제한. 캐시에는 원자적 read-modify-write 가 없어
+    token bucket 대신 같은 허용량의 고정 윈도(capacity 회 / capacity÷refill 초) 카운터를 쓴다.
+    """
+
+    def __init__(self, alias: str):
+        from django.core.cache import caches
+        self._cache = caches[alias]
+
+    def take(self, key: str, capacity: int, refill: float) -> tuple[bool, float]:
+        window = capacity / refill
+        now = time.time()
+        slot = int(now // window)
+        ck = f"adm:bucket:{key}:{slot}"
+        self._cache.add(ck, 0, timeout=math.ceil(window) + 1)
+        try:
+            n = self._cache.incr(ck)
+        except ValueError:           # 키가 그 사이 만료됨
+            self._cache.add(ck, 1, timeout=math.ceil(window) + 1)
+            n = 1
+        return n <= capacity, 0.0 if n <= capacity else (slot + 1) * window - now
+
+
+# ── fair in-flight limiter ───────────────────────────────────
+class FairLimiter:
+    """
+    동시 실행 수 제한 + 사용자별 대기열 라운드 로빈.
+    슬롯이 비면 가장 오래 기다린 '사용자'가 아니라 순서상 다음 사용자의 첫 요청에 넘긴다.
+    """
+
+    def __init__(self, capacity: int, max_queue: int):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.in_use = 0
+        self.queued = 0
+        self._lock = threading.Lock()
+        self._queues: OrderedDict[str, deque[threading.Event]] = OrderedDict()
+        self._hold = 2.0             # 슬롯 점유 시간 이동 평균 (초), Retry-After 추정용
+
+    def retry_after(self) -> float:
+        return self._hold * (self.queued + 1) / self.capacity
+
+    def full(self) -> bool:
+        return self.in_use >= self.capacity and self.queued >= self.max_queue
+
+    def acquire(self, user: str, timeout: float) -> None:
+        with self._lock:
+            if self.in_use < self.capacity and not self.queued:
+                self.in_use += 1
+                return
+            if self.queued >= self.max_queue:
+                raise Saturated("server is busy", self.retry_after())
+            ev = threading.Event()
+            self._queues.setdefault(user, deque()).append(ev)
+            self.queued += 1
+        if ev.wait(timeout):
+            return
+        with self._lock:
+            if ev.is_set():          # 타임아웃 직후 슬롯을 넘겨받음
+                return
+            q = self._queues[user]
+            q.remove(ev)
+            if not q:
+                del self._queues[user]
+            self.queued -= 1
+        raise Saturated("server is busy", self.retry_after())
+
+    def release(self, held: float) -> None:
+        with self._lock:
+            self._hold = 0.8 * self._hold + 0.2 * held
+            if self._queues:
+                user, q = next(iter(self._queues.items()))
+                ev = q.popleft()
+                if q:
+                    self._queues.move_to_end(user)
+                else:
+                    del self._queues[user]
+                self.queued -= 1
+                ev.set()             # 슬롯을 그대로 넘긴다 (in_use 유지)
+            else:
+                self.in_use -= 1
+
+
+# ── process-wide state ───────────────────────────────────────
+_STATE_LOCK = threading.Lock()
+_buckets: MemoryBuckets | CacheBuckets | None = None
+_limiter: FairLimiter | None = None
+# 현재 요청의 사용자. contextvar 라 헤징 스레드(copy_context)에도 전달된다
+_user: contextvars.ContextVar[str | None] = contextvars.ContextVar("admission_user", default=None)
+
+
+def _state() -> tuple[MemoryBuckets | CacheBuckets, FairLimiter]:
+    global _buckets, _limiter
+    if _limiter is None:
+        with _STATE_LOCK:
+            if _limiter is None:
+                if _cfg("BACKEND", "memory") == "cache":
+                    _buckets = CacheBuckets(_cfg("CACHE", "default"))
+                else:
+                    _buckets = MemoryBuckets()
+                _limiter = FairLimiter(_cfg("MAX_INFLIGHT_LLM", 8), _cfg("MAX_QUEUE", 32))
+    return _buckets, _limiter
+
+
+def reset() -> None:
+    """설정을 다시 읽도록 상태를 버린다 (테스트·벤치마크용)"""
+    global _buckets, _limiter
+    with _STATE_LOCK:
+        _buckets, _limiter = None, None
+
+
+def check_rate(endpoint: str, user: str) -> None:
+    rate = _cfg("RATES", {}).get(endpoint)
+    if not rate:
+        return
+    capacity, refill = parse_rate(rate)
+    buckets, _ = _state()
+    allowed, wait = buckets.take(f"{endpoint}:{user}", capacity, refill)
+    if not allowed:
+        REGISTRY.inc("pos_admission_rejected_total", endpoint=endpoint, reason="rate")
+        raise Saturated("rate limit exceeded", wait)
+
+
+def _global_acquire(deadline: float) -> None:
+    from django.core.cache import caches
+    cache, cap, key = caches[_cfg("CACHE", "default")], _cfg("GLOBAL_MAX_INFLIGHT_LLM", 32), "adm:llm_inflight"
+    while True:
+        cache.add(key, 0, timeout=_LEASE)
+        try:
+            if cache.incr(key) <= cap:
+                return
+            cache.decr(key)
+        except ValueError:
+            continue
+        if time.monotonic() >= deadline:
+            raise Saturated("server is busy", 1)
+        time.sleep(0.05 + random.random() * 0.05)
+
+
+def _global_release() -> None:
+    from django.core.cache import caches
+    try:
+        caches[_cfg("CACHE", "default")].decr("adm:llm_inflight")
+    except ValueError:
+        pass
+
+
+@contextmanager
+def llm_slot() -> Iterator[None]:
+    """LLM 호출 하나를 감싼다. 자리가 날 때까지 공정 대기열에서 기다리고, 넘치면 Saturated."""
+    if not _cfg("ENABLED", True):
+        yield
+        return
+    _, limiter = _state()
+    user = _user.get() or "-"
+    timeout = _cfg("QUEUE_TIMEOUT", 15)
+    shared = _cfg("BACKEND", "memory") == "cache"
+    with span("admission.wait"):
+        limiter.acquire(user, timeout)
+        if shared:
+            try:
+                _global_acquire(time.monotonic() + timeout)
+            except Saturated:
+                limiter.release(0)
+                raise
+    t0 = time.monotonic()
+    try:
+        yield
+    finally:
+        if shared:
+            _global_release()
+        limiter.release(time.monotonic() - t0)
+
+
+@contextmanager
+def acting_for(user_id: str) -> Iterator[None]:
+    """요청 밖(배치 작업 스레드 등)의 LLM 호출도 user_id 의 공정 대기열로 보낸다"""
+    token = _user.set(f"user:{user_id}")
+    try:
+        yield
+    finally:
+        _user.reset(token)
+
+
+# ── middleware ───────────────────────────────────────────────
+def _request_user(request: HttpRequest) -> str:
+    user = None
+    if request.content_type == "application/json":
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            body = {}
+        if isinstance(body, dict):
+            user = body.get("user_id")
+            if not user and body.get("chat_id"):
+                from .models import Chat
+                user = Chat.objects.filter(chat_id=body["chat_id"]).values_list("user_id", flat=True).first()
+    elif request.method == "POST":
+        user = request.POST.get("user_id")
+    # 사용자를 알 수 없으면 클라이언트 주소 기준으로 제한
+    return f"user:{user}" if user else f"ip:{request.META.get('REMOTE_ADDR', '-')}"
+
+
+def _too_many(exc: Saturated) -> JsonResponse:
+    response = JsonResponse({"response": 429, "message": exc.reason,
+                             "data": {"retry_after": exc.retry_after}}, status=429)
+    response["Retry-After"] = str(exc.retry_after)
+    return response
+
+
+class AdmissionMiddleware:
+    """LLM 을 쓰는 엔드포인트의 사용자별 속도 제한 + 포화 시 즉시 429"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        endpoint = ENDPOINTS.get(request.path)
+        if endpoint is None or request.method != "POST" or not _cfg("ENABLED", True):
+            return self.get_response(request)
+
+        user = _request_user(request)
+        try:
+            check_rate(endpoint, user)
+            _, limiter = _state()
+            if endpoint != "files.upload" and limiter.full():
+                REGISTRY.inc("pos_admission_rejected_total", endpoint=endpoint, reason="busy")
+                raise Saturated("server is busy", limiter.retry_after())
+        except Saturated as e:
+            return _too_many(e)
+
+        token = _user.set(user)
+        try:
+            return self.get_response(request)
+        finally:
+            _user.reset(token)
+
+    def process_exception(self, request, exception):
+        # 뷰 실행 중 LLM 대기열이 넘친 경우
+        if isinstance(exception, Saturated):
+            REGISTRY.inc("pos_admission_rejected_total", endpoint=ENDPOINTS.get(request.path, "-"),
+                         reason="queue")
+            return _too_many(exception)
+        return None
@@ -1,5 +1,6 @@
 import dotenv
 import re
+from contextlib import closing
 from typing import Generator, Union
 
 from langchain_core.messages.utils import trim_messages
@@ -10,22 +11,50 @@ from langchain_core.messages import (
 )
 from langchain_openai.chat_models import ChatOpenAI
 
+from .resilience import invoke, stream
+from .tracing import span, record_usage
+
 # Load environment variables from .env file
 dotenv.load_dotenv()
 
+def prefix_messages(
+    system_prompt: str | None,
+    schema: str | None = None,
+    examples: str | None = None,
+    schema_label: str = "file의 db schema"
+) -> list[SystemMessage]:
+    """
+    매 호출 맨 앞에 오는 고정 부분: system prompt → schema → few-shot 예시.
+    같은 채팅의 다음 턴, 같은 파일의 다른 채팅에서도 바이트 단위로 같아야
+    provider 쪽 prompt cache 가 적중하므로, 여기에는 턴마다 바뀌는 내용을 넣지 않는다.
+    질문마다 고르는 few-shot 예시(api/fewshot.py)는 맨 뒤라 앞부분의 cache 는 그대로 적중한다.
+    """
+    prefix = []
+    if system_prompt:
+        prefix.append(SystemMessage(content=system_prompt))
+    if schema:
+        prefix.append(SystemMessage(content=f"{schema_label}:\n{schema}"))
+    if examples:
+        prefix.append(SystemMessage(content=examples))
+    return prefix
+
+
 def langchain(
     model: ChatOpenAI,
     system_prompt: str | None,
     prev_messages: list[dict[str, str]] | None,
     message: str,
     max_tokens: int = 4096,
-    streaming: bool = False
+    streaming: bool = False,
+    schema: str | None = None
 ) -> str:
     """
     Args:
       system_prompt: 모델에게 주는 초기 지시문 (system 역할)
       prev_messages: 과거 대화 기록, [{"role":"user"|"assistant","content": "..."}]
       message:       최종 사용자의 질문 내용
+      max_tokens:    대화 기록에 쓸 토큰 한도 (system prompt·schema prefix 는 항상 유지)
+      schema:        파일 DB schema. system prompt 바로 뒤 고정 위치에 들어간다
 
     Returns:
       모델이 생성한 응답 문자열
@@ -35,34 +64,37 @@ def langchain(
         max_tokens=max_tokens,
         strategy="last",
         token_counter=model,
-        include_system=True,
         allow_partial=True,
         start_on="human"
     )
     
-    messages = []
-    if system_prompt:
-        messages.append(SystemMessage(content=system_prompt))
-        
+    history = []
     if prev_messages:
         for item in prev_messages:
             if item["role"] == "user":
-                messages.append(HumanMessage(content=item["content"]))
+                history.append(HumanMessage(content=item["content"]))
             elif item["role"] == "assistant":
-                messages.append(AIMessage(content=item["content"]))
+                history.append(AIMessage(content=item["content"]))
                 
-    trimmed = trimmer.invoke(messages) if messages else []
+    # 고정 prefix 는 자르지 않고, 오래된 대화 기록부터 잘라낸다
+    with span("llm.trim"):
+        trimmed = trimmer.invoke(history) if history else []
+    trimmed = prefix_messages(system_prompt, schema) + trimmed
     trimmed.append(HumanMessage(content=message))
     
     if streaming:
         def gen():
-            for chunk in model.stream(trimmed):
-                delta = chunk.content
-                if delta:
-                    yield delta
+            with span("llm.chat") as sp, closing(stream(model, trimmed, "llm.chat", purpose="answer", sp=sp)) as chunks:
+                for chunk in chunks:
+                    delta = chunk.content
+                    if delta:
+                        yield delta
         return gen()
     else:
-        return model.invoke(trimmed).content
+        with span("llm.chat") as sp:
+            response = invoke(model, trimmed, "llm.chat", purpose="answer")
+            record_usage(sp, response)
+        return response.content
 
 
 POS_TEXT2SQL_PROMPT = r"""You are “POS-SQL-Gen”, an expert assistant that turns natural-language
@@ -73,86 +105,27 @@ Rules
   with ``` – no prose, no comments outside the fence.
 - Use only table / column names that exist in the schema provided by the user
   (never invent names; ask for clarification if unsure).
-- Use ISO-8601 dates; rely on SQLite helpers (DATE, strftime) when filtering
-  by month or day.
+- Columns annotated [date YYYY-MM-DD], [time HH:MM:SS] or [timestamp …] are
+  already normalized ISO text: filter them with plain comparisons / ranges
+  (date >= '2025-03-01' AND date < '2025-04-01'), never wrap the column in
+  DATE() or strftime() – that disables the index.
+- Prefer derived columns when the schema has them: month ('YYYY-MM'),
+  weekday (0=Mon … 6=Sun), hour (0-23).
+- [currency] and [boolean 0/1] columns are plain numbers; [category: …] lists
+  the exact values to use in WHERE clauses.
 - When a filter is implied (e.g., “지난달”, “최근 3개월”), compute the correct
   date range directly in SQL.
 - SQL query must be valid and executable in SQLite.
 - If the question is ambigous or too complex, ask for clarification.
-
-Few-shot Examples  
-Schema excerpt for all examples  
-- Table orders      (order_id INTEGER, order_date DATE, customer_id INTEGER, total REAL)
-- Table order_items (order_id INTEGER, product_id INTEGER, quantity INTEGER, line_total REAL)
-- Table products    (product_id INTEGER, product_name TEXT, category TEXT, current_stock INTEGER)
-- Table customers   (customer_id INTEGER, gender TEXT, age_group TEXT)
-
-### 1. 지난달 가장 많이 팔린 메뉴
-NL → “지난달 가장 많이 팔린 메뉴는?”
-```sql
-SELECT p.product_name,
-       SUM(oi.quantity) AS total_qty
-FROM   order_items AS oi
-JOIN   orders      AS o  USING(order_id)
-JOIN   products    AS p  USING(product_id)
-WHERE  o.order_date >= DATE('now','start of month','-1 month')
-  AND  o.order_date <  DATE('now','start of month')
-GROUP  BY p.product_id
-ORDER  BY total_qty DESC
-LIMIT  1;
-```
-
-### 2. 최근 3개월 매출 추이
-NL → “최근 3개월 매출 추이 보여줘”
-```sql
-SELECT strftime('%Y-%m', o.order_date) AS month,
-       SUM(o.total)                    AS monthly_sales
-FROM   orders AS o
-WHERE  o.order_date >= DATE('now','start of month','-3 months')
-GROUP  BY month
-ORDER  BY month;
-```
-
-### 3. 20대 여성 고객 인기 상품
-NL → “20대 여성 고객이 가장 많이 산 상품은?”
-```sql
-SELECT p.product_name,
-       SUM(oi.quantity) AS total_qty
-FROM   order_items AS oi
-JOIN   orders      AS o  USING(order_id)
-JOIN   customers   AS c  ON c.customer_id = o.customer_id
-JOIN   products    AS p  USING(product_id)
-WHERE  c.gender = 'F'
-  AND  c.age_group = '20s'
-GROUP  BY p.product_id
-ORDER  BY total_qty DESC
-LIMIT  1;
-```
-
-### 4. 재고 부족 상품
-NL → “재고 부족 또는 폐기율 높은 상품은?”
-```sql
-SELECT product_name,
-       current_stock
-FROM   products
-WHERE  current_stock < 10;
-```
-
-### 5. 신제품 출시 전-후 매출 비교
-NL → “신제품 출시 후 기존 메뉴 매출은?”
-```sql
--- assume launch_date = '2025-04-01'
-SELECT CASE WHEN o.order_date < '2025-04-01' THEN 'Before' ELSE 'After' END AS period,
-       SUM(o.total) AS sales
-FROM   orders AS o
-WHERE  o.order_date BETWEEN DATE('2025-01-01') AND DATE('now')
-GROUP  BY period;
-```"""
+- Verified examples, when given, were answered correctly on data with the
+  same columns; follow their patterns but answer the question actually asked."""
 
 def text2sql(
     model: ChatOpenAI,
     query: str,
-    db_schema: str
+    db_schema: str,
+    previous: tuple[str, str] | None = None,
+    examples: str | None = None
 ) -> str:
     """
     간단한 Text-to-SQL 변환 함수.
@@ -160,6 +133,8 @@ def text2sql(
     Args:
         query:       자연어 질문 문자열
         db_schema:   대상 데이터베이스의 스키마 (텍스트)
+        previous:    (이전 SQL, 오류 메시지). 검증에 실패한 SQL 을 다시 만들 때 힌트로 붙인다
+        examples:    비슷한 질문의 검증된 SQL 예시 (api/fewshot.py). schema 뒤에 붙는다
     
     Returns:
         SQL 쿼리문 (```sql ...``` 사이의 내용만)
@@ -170,16 +145,20 @@ def text2sql(
     #         "Output ONLY the SQL between ```sql``` fences."
     # )
     
-    messages = [
-        SystemMessage(content=POS_TEXT2SQL_PROMPT),
-        HumanMessage(content=(
-            f"Database schema:\n{db_schema}\n\n"
-            f"Convert the following question into SQL and wrap it in ```sql``` fences:\n"
-            f"NL Question: {query}"
-        ))
+    request = (
+        f"Convert the following question into SQL and wrap it in ```sql``` fences:\n"
+        f"NL Question: {query}"
+    )
+    if previous:
+        request += (f"\n\nA previous attempt failed validation; fix it.\n"
+                    f"```sql\n{previous[0]}\n```\nError: {previous[1]}")
+    messages = prefix_messages(POS_TEXT2SQL_PROMPT, db_schema, examples, schema_label="Database schema") + [
+        HumanMessage(content=request)
     ]
     
-    response = model.invoke(messages)
+    with span("text2sql") as sp:
+        response = invoke(model, messages, "text2sql", purpose="sql")
+        record_usage(sp, response)
     content = response.content
     
     match = re.search(r"```sql\s*(.*?)\s*```", content, re.DOTALL | re.IGNORECASE)
@@ -216,7 +195,9 @@ def make_title(
         ))
     ]
     
-    response = model.invoke(messages)
+    with span("make_title") as sp:
+        response = invoke(model, messages, "make_title", purpose="title")
+        record_usage(sp, response)
     content = response.content.strip()
     if len(content) > max_length:
         content = content[:max_length]
@@ -0,0 +1,241 @@
+"""
+Batch questions: run a list of analytic questions against one file as a job.
+
+`POST /api/batch/start` stores a `BatchJob` with one `BatchItem` per question
+and returns at once; `start()` hands the job to a dispatcher thread and
+`GET /api/batch/result` reads the items back as they finish.
+
+* Bounded pool — the questions of every job run on one process-wide pool of
+  BATCH_WORKERS threads, so throughput grows with workers rather than with the
+  number of requests. Each LLM call still goes through `admission.llm_slot()`
+  in the job owner's fair queue, so a batch cannot starve interactive chats.
+* Shared caches — a job uses one FileSet, so the schema text, pruned schemas
+  (schema_index), the few-shot index and SQLite connections are built once.
+  The first question runs alone before the rest fan out, so the provider's
+  prompt cache already holds the system prompt + schema prefix when the
+  other workers send theirs.
+* Deduplication — repeated questions (case / whitespace ignored) are answered
+  once; SQL that normalizes to the same text (comments, keyword case,
+  whitespace, trailing ';') runs once and the other items reuse its result
+  (`shared_with` = position of the item that ran it).
+
+Each question goes through the template fast path first, otherwise text2sql
+(EXPLAIN validation, escalation) and execution with the rollup rewrite — the
+chat view helpers, passed in as `generate_sql(question, data, notes)` and
+`query(data, sql, notes)` — under its own LLM_REQUEST_DEADLINE. No
+natural-language summary is written; the first BATCH_MAX_ROWS rows of the
+result are stored. Items record queue / generate / sql / total milliseconds.
+"""
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable
+
+import pandas as pd
+import sqlparse
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from . import fastpath, fewshot
+from .admission import acting_for
+from .fileset import FileSet
+from .models import BatchItem, BatchJob
+from .resilience import request_deadline
+from .tracing import REGISTRY, span
+
+logger = logging.getLogger(__name__)
+
+Status = BatchJob.JobStatus
+Source = BatchItem.ItemSource
+GenerateSql = Callable[[str, FileSet, list[str]], str]
+Query = Callable[[FileSet, str, list[str]], "pd.DataFrame | list | int"]
+
+_SPACE = re.compile(r"\s+")
+
+
+# ── worker pool ──────────────────────────────────────────────
+_POOL: ThreadPoolExecutor | None = None
+_POOL_LOCK = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = ThreadPoolExecutor(max_workers=settings.BATCH_WORKERS, thread_name_prefix="batch")
+    return _POOL
+
+
+def reset() -> None:
+    """풀을 버리고 BATCH_WORKERS 를 다시 읽는다 (테스트·벤치마크용; 돌던 질문은 끝까지 돈다)"""
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+# ── deduplication keys ───────────────────────────────────────
+def question_key(question: str) -> str:
+    return _SPACE.sub(" ", question).strip().lower()
+
+
+def sql_key(sql: str) -> str:
+    """주석·키워드 대소문자·공백·끝의 ';' 만 다른 SQL 은 같은 키"""
+    text = sqlparse.format(sql, strip_comments=True, keyword_case="upper")
+    return _SPACE.sub(" ", text).strip().rstrip(";").rstrip()
+
+
+# ── one job ──────────────────────────────────────────────────
+@dataclass
+class _Job:
+    job: BatchJob
+    data: FileSet
+    generate_sql: GenerateSql
+    query: Query
+    started: float = field(default_factory=time.perf_counter)
+    results: dict[str, tuple[int, Future]] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def execute(self, position: int, sql: str, notes: list[str]):
+        """같은 SQL 은 한 번만 실행한다. (결과, 먼저 실행한 항목의 position 또는 None)"""
+        key = sql_key(sql)
+        with self.lock:
+            owner = self.results.get(key)
+            if owner is None:
+                future = Future()
+                self.results[key] = (position, future)
+        if owner is not None:
+            REGISTRY.inc("pos_batch_sql_shared_total")
+            return owner[1].result(), owner[0]
+        try:
+            result = self.query(self.data, sql, notes)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result, None
+
+
+def _store(item: BatchItem, result) -> None:
+    if not isinstance(result, pd.DataFrame):
+        item.result, item.row_count = None, 0
+        return
+    item.row_count = len(result)
+    item.result = json.loads(result.head(settings.BATCH_MAX_ROWS)
+                             .to_json(orient="split", index=False, date_format="iso", force_ascii=False))
+
+
+def _solve(ctx: _Job, item: BatchItem) -> BatchItem:
+    """질문 하나: fast path → (text2sql → 실행). 결과와 소요 시간을 항목에 채운다 (저장은 작업 스레드가)"""
+    t0 = time.perf_counter()
+    item.queue_ms = (t0 - ctx.started) * 1000
+    notes: list[str] = []
+    try:
+        with span("batch.question") as sp:
+            fast = fastpath.answer(item.question, ctx.data)
+            if fast is not None:
+                item.item_source = Source.FASTPATH
+                item.sql, item.answer_text, item.image_url = fast.sql, fast.text, fast.image_url
+                item.generate_ms = (time.perf_counter() - t0) * 1000
+            else:
+                item.item_source = Source.LLM
+                with request_deadline(settings.LLM_REQUEST_DEADLINE):
+                    item.sql = ctx.generate_sql(item.question, ctx.data, notes)
+                t1 = time.perf_counter()
+                item.generate_ms = (t1 - t0) * 1000
+                result, item.shared_with = ctx.execute(item.position, item.sql, notes)
+                item.sql_ms = (time.perf_counter() - t1) * 1000
+                _store(item, result)
+            sp.set(source=item.item_source, rows=item.row_count)
+        item.item_status = Status.COMPLETED
+    except Exception as e:
+        logger.warning("[batch %s] question %d failed: %s", ctx.job.job_id, item.position, e)
+        item.error = f"{e}"
+        item.item_status = Status.FAILED
+    finally:
+        item.total_ms = (time.perf_counter() - t0) * 1000
+        REGISTRY.inc("pos_batch_questions_total", source=item.item_source or "-",
+                     status=Status(item.item_status).label.lower())
+        # few-shot 검색이 연 DB 커넥션. 풀 스레드는 요청 사이클 밖이라 자동으로 닫히지 않는다
+        connection.close()
+    return item
+
+
+def _finish(ctx: _Job, item: BatchItem) -> None:
+    """끝난 항목 저장 (메타데이터 DB 쓰기는 작업 스레드 하나에서만). 행을 돌려준 SQL 은 few-shot 예시로"""
+    item.save()
+    if item.item_source == Source.LLM and item.row_count:
+        fewshot.record(ctx.job.user_id_id, None, ctx.data.primary.file_sqlpath, item.question, item.sql)
+
+
+def _copy(item: BatchItem, original: BatchItem) -> None:
+    """같은 질문이 다시 나온 항목은 먼저 나온 항목의 답을 그대로 쓴다"""
+    for name in ("item_status", "sql", "answer_text", "image_url", "result", "row_count", "error"):
+        setattr(item, name, getattr(original, name))
+    item.item_source = Source.DUPLICATE
+    item.shared_with = original.position
+    item.save()
+
+
+def run(job_id: int, generate_sql: GenerateSql, query: Query) -> None:
+    """작업 하나를 끝까지 실행한다. 질문은 공유 풀에서 돌고, 이 스레드는 순서를 잡고 결과를 저장한다"""
+    job = BatchJob.objects.select_related("file_id").get(job_id=job_id)
+    t0 = time.perf_counter()
+    try:
+        job.job_status = Status.RUNNING
+        job.save(update_fields=["job_status"])
+        ctx = _Job(job, FileSet([job.file_id]), generate_sql, query)
+
+        originals: dict[str, BatchItem] = {}
+        duplicates: list[tuple[BatchItem, BatchItem]] = []
+        for item in job.items.order_by("position"):
+            key = question_key(item.question)
+            if key in originals:
+                duplicates.append((item, originals[key]))
+            else:
+                originals[key] = item
+        unique = list(originals.values())
+
+        with span("batch.job", questions=len(unique)), acting_for(job.user_id_id):
+            pool = _pool()
+
+            def submit(item: BatchItem) -> Future:
+                # admission 사용자(contextvar)를 워커 스레드로 넘긴다
+                return pool.submit(contextvars.copy_context().run, _solve, ctx, item)
+
+            # 첫 질문을 먼저 끝내 system prompt + schema prefix 를 provider prompt cache 에 올린다
+            head = unique[:1] if len(unique) > 1 else []
+            for group in (head, unique[len(head):]):
+                for future in as_completed([submit(item) for item in group]):
+                    _finish(ctx, future.result())
+
+        for item, original in duplicates:
+            _copy(item, original)
+        REGISTRY.inc("pos_batch_duplicate_questions_total", len(duplicates))
+        job.job_status = Status.COMPLETED
+    except Exception as e:
+        logger.exception("[batch %s] job failed", job_id)
+        job.job_status = Status.FAILED
+        job.job_error = f"{e}"
+        BatchItem.objects.filter(job_id=job, item_status=Status.PENDING).update(
+            item_status=Status.FAILED, error="batch job failed")
+    finally:
+        job.total_ms = (time.perf_counter() - t0) * 1000
+        job.finished_at = timezone.now()
+        job.save()
+        REGISTRY.inc("pos_batch_jobs_total", status=Status(job.job_status).label.lower())
+        connection.close()
+
+
+def start(job_id: int, generate_sql: GenerateSql, query: Query) -> None:
+    """작업을 백그라운드 스레드에서 시작하고 바로 돌아온다"""
+    threading.Thread(target=run, args=(job_id, generate_sql, query),
+                     name=f"batch-job-{job_id}", daemon=True).start()
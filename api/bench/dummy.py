@@ -0,0 +1,17 @@
+"""test/make_dummy_csv.py 를 벤치마크 명령에서 모듈로 불러오기 위한 헬퍼"""
+import importlib.util
+import sys
+from pathlib import Path
+
+from django.conf import settings
+
+
+def load_generator():
+    if "make_dummy_csv" in sys.modules:
+        return sys.modules["make_dummy_csv"]
+    path = Path(settings.BASE_DIR) / "test" / "make_dummy_csv.py"
+    spec = importlib.util.spec_from_file_location("make_dummy_csv", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module     # 프로세스 풀 워커가 청크 함수를 찾을 수 있도록
+    spec.loader.exec_module(module)
+    return module
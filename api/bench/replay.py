@@ -0,0 +1,34 @@
+"""
+Recorded LLM replies for offline runs of the chat pipeline.
+
+`ReplayResponder` picks a reply the same way the real model is expected to
+behave: title / text2sql requests are recognised by their system prompt,
+chat turns by what the backend fed back in the last message (SQL preview,
+batch results, saved plot …). The recordings live in `recordings.json`.
+"""
+import json
+from pathlib import Path
+
+RECORDINGS_PATH = Path(__file__).resolve().parent / "recordings.json"
+
+
+class ReplayResponder:
+    def __init__(self, path: str | Path = RECORDINGS_PATH):
+        self.recordings = json.loads(Path(path).read_text(encoding="utf-8"))
+
+    @property
+    def questions(self) -> dict[str, str]:
+        return self.recordings["questions"]
+
+    def __call__(self, messages: list[dict]) -> str:
+        system = str(messages[0].get("content", "")) if messages else ""
+        if "title generator" in system:
+            return self.recordings["title"]
+        if "POS-SQL-Gen" in system:
+            return self.recordings["text2sql"]
+
+        last = str(messages[-1].get("content", "")) if messages else ""
+        for rule in self.recordings["chat"]:
+            if rule["last_contains"] in last:
+                return rule["reply"]
+        return "<END>"
@@ -0,0 +1,271 @@
+"""
+Local stub server speaking the OpenAI chat-completions protocol.
+
+Used by the offline benchmarks and tests so the chat pipeline can run end to
+end (real ChatOpenAI client, real HTTP) without calling OpenAI:
+
+    with StubOpenAIServer(responder) as stub:
+        model = OfflineChatOpenAI(model="gpt-4o-2024-08-06", base_url=stub.base_url, api_key="stub")
+
+`responder(messages) -> str` decides the reply text from the request's
+message list. `/embeddings` answers with the hashed n-gram vectors of
+`schema_index` ("local" embedder), so schema retrieval runs offline too.
+Latency and failures can be injected for resilience tests.
+Provider prompt caching is imitated: a request whose leading messages match
+an earlier request reports the shared prefix as `cached_tokens`.
+"""
+import base64
+import hashlib
+import json
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+import faiss
+import numpy as np
+from langchain_openai.chat_models import ChatOpenAI
+
+from ..schema_index import local_embed
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+# OpenAI 규칙: 1024 토큰 이상인 prefix 부터 128 토큰 단위로 캐시
+CACHE_MIN_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+
+
+class OfflineChatOpenAI(ChatOpenAI):
+    """
+    ChatOpenAI whose token counter does not need tiktoken's encoding download
+    (trim_messages counts tokens before every call). Everything else — HTTP,
+    SSE parsing, usage metadata — is the real client.
+    """
+
+    def get_num_tokens_from_messages(self, messages, tools=None) -> int:
+        return sum(_approx_tokens(str(m.content)) + 4 for m in messages)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.stub._on_connect()
+
+    def log_message(self, *args):       # 조용히
+        pass
+
+    def do_POST(self):
+        stub: "StubOpenAIServer" = self.server.stub
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        status = stub._next_failure()
+        delay = stub.delay(body) if callable(stub.delay) else stub.delay
+        if delay:
+            time.sleep(delay)
+        if status:
+            return self._send_json(status, {"error": {"message": "injected failure", "type": "server_error"}})
+
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            return self._chat(stub, body)
+        if self.path.rstrip("/").endswith("/embeddings"):
+            return self._embeddings(body)
+        self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    # ── /chat/completions ────────────────────────────────────
+    def _chat(self, stub: "StubOpenAIServer", body: dict):
+        messages = body.get("messages", [])
+        text = stub.responder(messages)
+        prompt_tokens = sum(_approx_tokens(str(m.get("content", ""))) for m in messages)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": _approx_tokens(text),
+            "total_tokens": prompt_tokens + _approx_tokens(text),
+            "prompt_tokens_details": {"cached_tokens": min(prompt_tokens, stub._cached_tokens(messages))},
+        }
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()),
+                "model": body.get("model", "stub")}
+        stub._record(body)
+
+        if not body.get("stream"):
+            if stub.stream_chunk_delay:      # 같은 생성 속도를 흉내 (응답 전체를 다 만든 뒤 보냄)
+                time.sleep(stub.stream_chunk_delay * -(-len(text) // stub.stream_chunk_chars))
+            return self._send_json(200, {
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        # SSE, chunked transfer
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(payload) -> bool:
+            data = f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n".encode()
+            try:
+                self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+                return True
+            except (BrokenPipeError, ConnectionResetError):
+                stub._on_cancel()
+                return False
+
+        chunk = {**base, "object": "chat.completion.chunk"}
+        pieces = [text[i:i + stub.stream_chunk_chars] for i in range(0, len(text), stub.stream_chunk_chars)]
+        for i, piece in enumerate(pieces):
+            if i == stub.stream_cut_after:
+                # 끝 chunk(0) 없이 연결을 끊는다 → 클라이언트는 읽다가 연결 오류
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            delta = {"content": piece} if i else {"role": "assistant", "content": piece}
+            if not event({**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}):
+                return
+            if stub.stream_chunk_delay:
+                time.sleep(stub.stream_chunk_delay)
+        event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            event({**chunk, "choices": [], "usage": usage})
+        event("[DONE]")
+        try:
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    # ── /embeddings ──────────────────────────────────────────
+    def _embeddings(self, body: dict):
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        vecs = np.stack([local_embed(str(t)) for t in texts])
+        faiss.normalize_L2(vecs)
+        data = []
+        for i, vec in enumerate(vecs):
+            # openai 클라이언트는 기본으로 base64 (float32 little-endian) 를 요청한다
+            embedding = base64.b64encode(vec.astype("<f4").tobytes()).decode() \
+                if body.get("encoding_format") == "base64" else vec.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(_approx_tokens(str(t)) for t in texts)
+        self._send_json(200, {"object": "list", "data": data, "model": body.get("model", "stub"),
+                              "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def _send_json(self, status: int, payload: dict):
+        raw = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+
+class StubOpenAIServer:
+    """
+    Args:
+        responder:   messages(list[dict]) → reply text
+        delay:       seconds (or body → seconds) to wait before answering
+        failures:    answer the first N requests with `failure_status`
+        stream_chunk_chars / stream_chunk_delay: SSE chunking for stream=True; the delay per
+                     chunk is also spent before a non-streamed reply (simulated generation time)
+        stream_cut_after: drop the connection after this many SSE chunks (mid-stream failure)
+        prompt_cache: report cached_tokens for prefixes shared with earlier requests
+    """
+
+    def __init__(
+        self,
+        responder: Callable[[list[dict]], str],
+        delay: float | Callable[[dict], float] = 0.0,
+        failures: int = 0,
+        failure_status: int = 500,
+        stream_chunk_chars: int = 8,
+        stream_chunk_delay: float = 0.0,
+        stream_cut_after: int | None = None,
+        prompt_cache: bool = True,
+    ):
+        self.responder = responder
+        self.delay = delay
+        self.failures = failures
+        self.failure_status = failure_status
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_chunk_delay = stream_chunk_delay
+        self.stream_cut_after = stream_cut_after
+        self.prompt_cache = prompt_cache
+
+        self._lock = threading.Lock()
+        self.connections = 0        # 새 TCP 연결 수
+        self.requests = 0           # 요청 수 (실패 포함)
+        self.cancelled_streams = 0  # 클라이언트가 중간에 끊은 스트림 수
+        self.bodies: list[dict] = []
+        self._prefixes: OrderedDict[str, None] = OrderedDict()   # 본 적 있는 메시지 prefix 해시 (LRU)
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ── bookkeeping (handler 스레드에서 호출) ─────────────────
+    def _on_connect(self):
+        with self._lock:
+            self.connections += 1
+
+    def _on_cancel(self):
+        with self._lock:
+            self.cancelled_streams += 1
+
+    def _next_failure(self) -> int:
+        with self._lock:
+            self.requests += 1
+            if self.failures > 0:
+                self.failures -= 1
+                return self.failure_status
+        return 0
+
+    def _record(self, body: dict):
+        with self._lock:
+            self.bodies.append(body)
+
+    def _cached_tokens(self, messages: list[dict]) -> int:
+        """이전 요청과 메시지 단위로 같은 앞부분의 토큰 수 (1024 미만이면 0, 128 단위 내림)"""
+        if not self.prompt_cache:
+            return 0
+        digest, tokens, shared = hashlib.sha1(), 0, 0
+        with self._lock:
+            for m in messages:
+                digest.update(f"{m.get('role')}\x00{m.get('content', '')}\x01".encode())
+                tokens += _approx_tokens(str(m.get("content", "")))
+                key = digest.hexdigest()
+                if key in self._prefixes:
+                    shared = tokens
+                self._prefixes[key] = None
+                self._prefixes.move_to_end(key)
+            while len(self._prefixes) > 4096:
+                self._prefixes.popitem(last=False)
+        return 0 if shared < CACHE_MIN_TOKENS else shared // CACHE_BLOCK_TOKENS * CACHE_BLOCK_TOKENS
@@ -0,0 +1,283 @@
+"""
+Typed ingestion: detect column kinds on the first chunk of an upload and store
+every chunk in normalized, sortable forms.
+
+    date       'YYYY-MM-DD'            (2025/1/3, 2025.01.03, Excel dates …)
+    time       'HH:MM:SS'              ('0 days 13:27:39', '9:05', Excel times …)
+    timestamp  'YYYY-MM-DD HH:MM:SS'
+    currency   INTEGER / REAL          ('₩1,200', '3,500원', '$3.50' …)
+    boolean    INTEGER 0/1             (promo_flag, age_restricted, Y/N …)
+    integer    id-like columns (store_id, 매장코드 …) stay integers even if only 0/1 appear
+    category   TEXT, low cardinality   (distinct values listed in the schema)
+
+ISO strings compare and sort correctly as TEXT, so LLM SQL can filter with
+`date >= '2025-03-01'` and use an index instead of wrapping every row in
+DATE()/strftime(). Derived `month` ('YYYY-MM'), `weekday` (0=Mon … 6=Sun) and
+`hour` (0-23) columns are added from the first date / time column.
+
+The detected types are kept in the `_column_types` table of the same DB and
+rendered into `file_schema` by `ingest.build_schema_text`.
+"""
+import re
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, time
+
+import numpy as np
+import pandas as pd
+
+META_TABLE     = "_column_types"
+SAMPLE_ROWS    = 2_000
+CATEGORY_MAX   = 50          # 이 이하의 서로 다른 값 → 범주형
+CATEGORY_SHOWN = 12          # 스키마에 나열할 범주 값 수
+DATE_MIN_SHARE = 0.95        # 날짜/시각은 이 비율 이상 맞으면 인정 (나머지는 원래 값 유지)
+
+_DATE_RE        = re.compile(r"^\d{4}[-/.]\d{1,2}[-/.]\d{1,2}$")
+_TIMESTAMP_RE   = re.compile(r"^\d{4}[-/.]\d{1,2}[-/.]\d{1,2}[ T]\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?$")
+_TIME_RE        = re.compile(r"^(\d+ days )?\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?$")
+_ISO_DATE       = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_ISO_TIMESTAMP  = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+_ISO_TIME       = re.compile(r"^\d{2}:\d{2}:\d{2}$")
+_LEGACY_TIME    = re.compile(r"^\d+ days \d{2}:\d{2}:\d{2}$")
+_CURRENCY_RE    = re.compile(r"^[₩$€£¥]?\s*-?[\d,]+(\.\d+)?\s*(원|KRW|USD)?$", re.I)
+_CURRENCY_MARK  = re.compile(r"[₩$€£¥,]|원|KRW|USD", re.I)
+_BOOL_STRINGS   = {"y": 1, "n": 0, "yes": 1, "no": 0, "true": 1, "false": 0}
+_BOOL_HINT      = re.compile(r"(flag|^is_|^has_|_yn$|restricted|enabled|여부)", re.I)
+_ID_HINT        = re.compile(r"(^id$|_id$|^id_|_no$|code$|번호|코드)", re.I)
+_MONEY_HINT     = re.compile(r"(price|amount|total|sales|revenue|cost|금액|가격|매출|단가)", re.I)
+
+
+@dataclass
+class ColumnType:
+    kind: str                 # date | time | timestamp | currency | boolean | category | integer | real | text
+    detail: str = ""          # 스키마 설명에 붙일 부가 정보 (형식, 범주 값 …)
+    derived_from: str = ""    # 파생 컬럼이면 원본 컬럼 이름
+
+
+# ── detection ────────────────────────────────────────────────
+def _all_match(values: pd.Series, pattern: re.Pattern, share: float = 1.0) -> bool:
+    return bool(len(values)) and values.str.match(pattern).mean() >= share
+
+
+def _detect(name: str, s: pd.Series) -> ColumnType:
+    s = s.dropna()
+    if s.empty:
+        return ColumnType("text")
+
+    if pd.api.types.is_bool_dtype(s):
+        return ColumnType("boolean", "0/1")
+    if pd.api.types.is_datetime64_any_dtype(s):
+        if (s.dt.normalize() == s).all():
+            return ColumnType("date", "YYYY-MM-DD")
+        return ColumnType("timestamp", "YYYY-MM-DD HH:MM:SS")
+    if pd.api.types.is_numeric_dtype(s):
+        integral = pd.api.types.is_integer_dtype(s) or bool((s % 1 == 0).all())
+        if integral and _ID_HINT.search(name):
+            # 표본에 0/1 만 있는 store_id 같은 식별자를 플래그·금액으로 보지 않는다
+            return ColumnType("integer")
+        uniq = set(np.unique(s.to_numpy()).tolist()[:3])
+        if uniq <= {0, 1} and (uniq == {0, 1} or _BOOL_HINT.search(name)):
+            return ColumnType("boolean", "0/1")
+        if _MONEY_HINT.search(name):
+            return ColumnType("currency")
+        return ColumnType("integer" if integral else "real")
+
+    if s.map(lambda v: isinstance(v, time)).all():
+        return ColumnType("time", "HH:MM:SS")
+    if s.map(lambda v: isinstance(v, datetime)).all():
+        return _detect(name, pd.to_datetime(s))
+
+    text = s.astype(str).str.strip()
+    if _all_match(text, _DATE_RE, DATE_MIN_SHARE):
+        return ColumnType("date", "YYYY-MM-DD")
+    if _all_match(text, _TIMESTAMP_RE, DATE_MIN_SHARE):
+        return ColumnType("timestamp", "YYYY-MM-DD HH:MM:SS")
+    if _all_match(text, _TIME_RE, DATE_MIN_SHARE):
+        return ColumnType("time", "HH:MM:SS")
+    if _all_match(text, _CURRENCY_RE) and text.str.contains(_CURRENCY_MARK).any():
+        return ColumnType("currency")
+    lowered = set(text.str.lower().unique()[:3])
+    if lowered <= set(_BOOL_STRINGS) and len(lowered) <= 2:
+        return ColumnType("boolean", "0/1")
+
+    distinct = text.value_counts()
+    if len(distinct) <= CATEGORY_MAX and len(distinct) <= len(text) / 2:
+        shown = ", ".join(distinct.index[:CATEGORY_SHOWN])
+        more = " …" if len(distinct) > CATEGORY_SHOWN else ""
+        return ColumnType("category", shown + more)
+    return ColumnType("text")
+
+
+def infer_types(df: pd.DataFrame) -> dict[str, ColumnType]:
+    """첫 청크(최대 SAMPLE_ROWS 행)로 컬럼 타입을 결정하고 파생 컬럼을 추가한다."""
+    sample = df.head(SAMPLE_ROWS)
+    types = {col: _detect(str(col), sample[col]) for col in df.columns}
+
+    date_col = next((c for c, t in types.items() if t.kind in ("date", "timestamp")), None)
+    time_col = next((c for c, t in types.items() if t.kind == "time"), None)
+    stamp_col = next((c for c, t in types.items() if t.kind == "timestamp"), None)
+    if date_col is not None:
+        if "month" not in types:
+            types["month"] = ColumnType("text", "YYYY-MM", derived_from=date_col)
+        if "weekday" not in types:
+            types["weekday"] = ColumnType("integer", "0=Mon … 6=Sun", derived_from=date_col)
+    hour_src = time_col or stamp_col
+    if hour_src is not None and "hour" not in types:
+        types["hour"] = ColumnType("integer", "0-23", derived_from=hour_src)
+    return types
+
+
+# ── normalization ────────────────────────────────────────────
+_TIME_STR: np.ndarray | None = None
+
+
+def _time_strings(seconds: pd.Series) -> pd.Series:
+    global _TIME_STR
+    if _TIME_STR is None:
+        _TIME_STR = np.array([f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(86_400)],
+                             dtype=object)
+    valid = seconds.notna()
+    out = pd.Series(None, index=seconds.index, dtype=object)
+    out[valid] = _TIME_STR[seconds[valid].astype(np.int64).to_numpy() % 86_400]
+    return out
+
+
+def _keep_unparsed(parsed: pd.Series, original: pd.Series) -> pd.Series:
+    # 해석하지 못한 값은 버리지 않고 원래 문자열로 남긴다
+    return parsed.where(parsed.notna() | original.isna(), original.astype(object))
+
+
+def _already(s: pd.Series, pattern: re.Pattern) -> bool:
+    # 이미 정규형인 문자열 열이면 다시 파싱/포맷하지 않는다 (생성기 CSV 등 대부분의 경우)
+    if s.dtype != object or pd.api.types.infer_dtype(s, skipna=True) != "string":
+        return False
+    return bool(s.dropna().str.match(pattern).all())
+
+
+def _iso(dt: pd.Series, unit: str) -> pd.Series:
+    """datetime64 → ISO 문자열. Series.dt.strftime 은 값마다 파이썬 포맷을 거쳐 느리므로 numpy 로 변환"""
+    out = np.datetime_as_string(dt.to_numpy(dtype="datetime64[ns]").astype(f"datetime64[{unit}]"))
+    if unit == "s":
+        out = np.char.replace(out, "T", " ")
+    return pd.Series(out, index=dt.index, dtype=object).where(dt.notna())
+
+
+def _to_datetime(s: pd.Series, kind: str) -> tuple[pd.Series, bool]:
+    """(datetime64 열, 원래 값이 이미 정규형 문자열인지)"""
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s, False
+    if _already(s, _ISO_DATE if kind == "date" else _ISO_TIMESTAMP):
+        fmt = "%Y-%m-%d" if kind == "date" else "%Y-%m-%d %H:%M:%S"
+        return pd.to_datetime(s, format=fmt, errors="coerce"), True
+    text = s.astype(str).str.strip().str.replace(r"[/.]", "-", regex=True)
+    return pd.to_datetime(text.where(s.notna()), errors="coerce", format="mixed"), False
+
+
+def _normalize_time(s: pd.Series) -> pd.Series:
+    if _already(s, _ISO_TIME):
+        return s
+    if _already(s, _LEGACY_TIME):      # pandas timedelta 를 그대로 CSV 로 쓴 '0 days 13:27:39'
+        return s.str[-8:]
+    if s.map(lambda v: isinstance(v, time) or v is None).all():
+        secs = s.map(lambda v: v.hour * 3600 + v.minute * 60 + v.second if v is not None else np.nan)
+        return _time_strings(secs)
+    text = s.astype(str).str.strip().str.replace(r"^\d+ days ", "", regex=True)
+    text = text.where(~text.str.match(r"^\d{1,2}:\d{2}$"), text + ":00")
+    secs = pd.to_timedelta(text.where(s.notna()), errors="coerce").dt.total_seconds()
+    return _keep_unparsed(_time_strings(secs), s)
+
+
+def _normalize_currency(s: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(s):
+        return _numeric_or_original(s, s)
+    text = s.astype(str).str.replace(_CURRENCY_MARK, "", regex=True).str.strip()
+    return _numeric_or_original(pd.to_numeric(text.where(s.notna()), errors="coerce"), s)
+
+
+def _normalize_bool(s: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(s) or pd.api.types.is_bool_dtype(s):
+        return _numeric_or_original(s.astype(float), s)
+    return _numeric_or_original(s.astype(str).str.strip().str.lower().map(_BOOL_STRINGS), s)
+
+
+def _numeric_or_original(num: pd.Series, original: pd.Series) -> pd.Series:
+    # 청크 안에 해석 못 한 값이 하나라도 있으면 열 전체를 원래 값 그대로 둔다
+    if num.notna().sum() != original.notna().sum():
+        return original
+    return num.astype("Int64") if (num.dropna() % 1 == 0).all() else num
+
+
+def apply_types(df: pd.DataFrame, types: dict[str, ColumnType]) -> pd.DataFrame:
+    """infer_types 결과대로 청크를 정규화하고 파생 컬럼을 채운다."""
+    df = df.copy()
+    parsed: dict[str, pd.Series] = {}
+    for col, t in types.items():
+        if t.derived_from or col not in df.columns:
+            continue
+        s = df[col]
+        if t.kind in ("date", "timestamp"):
+            dt, canonical = _to_datetime(s, t.kind)
+            parsed[col] = dt
+            if not canonical:
+                df[col] = _keep_unparsed(_iso(dt, "D" if t.kind == "date" else "s"), s)
+        elif t.kind == "time":
+            df[col] = _normalize_time(s)
+        elif t.kind == "currency":
+            df[col] = _normalize_currency(s)
+        elif t.kind == "boolean":
+            df[col] = _normalize_bool(s)
+        elif t.kind == "integer" and pd.api.types.is_float_dtype(s):
+            df[col] = _numeric_or_original(s, s)
+
+    for col, t in types.items():
+        if not t.derived_from:
+            continue
+        src = t.derived_from
+        if col == "month":
+            df[col] = _iso(parsed[src], "M")
+        elif col == "weekday":
+            df[col] = parsed[src].dt.dayofweek.astype("Int64")
+        elif col == "hour":
+            if src in parsed:
+                df[col] = parsed[src].dt.hour.astype("Int64")
+            else:
+                df[col] = pd.to_numeric(df[src].str[:2], errors="coerce").astype("Int64")
+    return df
+
+
+# ── metadata ─────────────────────────────────────────────────
+def write_types(conn: sqlite3.Connection, table: str, types: dict[str, ColumnType]) -> None:
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {META_TABLE} ("
+                 "table_name TEXT, column_name TEXT, kind TEXT, detail TEXT, derived_from TEXT, "
+                 "PRIMARY KEY (table_name, column_name))")
+    conn.executemany(f"INSERT OR REPLACE INTO {META_TABLE} VALUES (?, ?, ?, ?, ?)",
+                     [(table, col, t.kind, t.detail, t.derived_from) for col, t in types.items()])
+
+
+def read_types(conn: sqlite3.Connection) -> dict[str, dict[str, ColumnType]]:
+    try:
+        rows = conn.execute(f"SELECT table_name, column_name, kind, detail, derived_from FROM {META_TABLE}")
+    except sqlite3.OperationalError:
+        return {}
+    out: dict[str, dict[str, ColumnType]] = {}
+    for table, col, kind, detail, derived in rows:
+        out.setdefault(table, {})[col] = ColumnType(kind, detail or "", derived or "")
+    return out
+
+
+def index_columns(conn: sqlite3.Connection, table: str, types: dict[str, ColumnType]) -> None:
+    """날짜/시각 컬럼에 인덱스 (ISO 문자열이라 범위 조건이 그대로 인덱스를 탄다)"""
+    for col, t in types.items():
+        if t.kind in ("date", "timestamp") and not t.derived_from:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{table}_{col}" ON "{table}" ("{col}")')
+
+
+def describe(t: ColumnType) -> str:
+    """스키마 텍스트용 주석, 예: [date YYYY-MM-DD] / [category: Card, Cash] / [derived from date: 0=Mon … 6=Sun]"""
+    if t.derived_from:
+        return f"[derived from {t.derived_from}: {t.detail}]"
+    if t.kind in ("integer", "real", "text"):
+        return ""
+    if t.kind == "category":
+        return f"[category: {t.detail}]"
+    return f"[{t.kind} {t.detail}]".replace(" ]", "]")
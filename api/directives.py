@@ -0,0 +1,81 @@
+"""
+Streaming parser for the chat loop's reply directives.
+
+The system prompts make a tool turn consist of a directive and its fenced
+code and nothing else:
+
+    [T2S]        ```sql …```          (the loop regenerates SQL with text2sql)
+    [T2S_BATCH]  ```sql …``` × ≤ 5
+    [PLOT]       ```python …```
+
+`read_reply()` consumes `backend.langchain(streaming=True)` and decides the
+directive from the first characters. It stops reading (which closes the HTTP
+stream, so the model stops generating) as soon as the turn is complete: right
+after `[T2S]`, after the python fence closes for `[PLOT]`, and after the last
+SQL fence for `[T2S_BATCH]`. Plain answers are read to the end of the stream
+(`<END>` is their last token anyway, and the usage chunk follows it). The returned text is what the non-streaming call would have
+produced, minus the tail the loop never looks at.
+"""
+import re
+from dataclasses import dataclass
+from typing import Iterable
+
+from .tracing import REGISTRY
+
+DIRECTIVES = ("[T2S_BATCH]", "[T2S]", "[PLOT]")
+_FENCE = {
+    "[T2S_BATCH]": re.compile(r"```sql\s*(.*?)\s*```", re.S | re.I),
+    "[PLOT]": re.compile(r"```python\s*(.*?)\s*```", re.S | re.I),
+}
+
+
+@dataclass
+class Reply:
+    text: str
+    directive: str | None
+    stopped_early: bool = False
+
+
+def _directive(text: str) -> str | None | bool:
+    """결정된 지시문, 지시문이 아님(None), 아직 모름(False)"""
+    for d in DIRECTIVES:
+        if text.startswith(d):
+            return d
+    if any(d.startswith(text) for d in DIRECTIVES):
+        return False
+    return None
+
+
+def _complete(directive: str | None, text: str, max_fences: int) -> bool:
+    if directive == "[T2S]":
+        return True
+    if directive == "[PLOT]":
+        return _FENCE["[PLOT]"].search(text) is not None
+    if directive == "[T2S_BATCH]":
+        fences = list(_FENCE["[T2S_BATCH]"].finditer(text))
+        if len(fences) >= max_fences:
+            return True
+        # 닫힌 fence 뒤에 다른 fence 가 아닌 내용이 오면 더 받을 쿼리가 없다
+        tail = text[fences[-1].end():].lstrip() if fences else ""
+        return bool(tail) and not "```".startswith(tail[:3])
+    return False
+
+
+def read_reply(chunks: Iterable[str], max_fences: int = 5) -> Reply:
+    text, directive = "", False
+    stream = iter(chunks)
+    try:
+        for delta in stream:
+            text += delta
+            if directive is False:
+                directive = _directive(text)
+                if directive is False:
+                    continue
+            if _complete(directive, text, max_fences):
+                REGISTRY.inc("pos_llm_stream_early_stops_total", directive=directive)
+                return Reply(text, directive, stopped_early=True)
+        return Reply(text, directive or None)
+    finally:
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()         # 남은 생성 취소 (HTTP 스트림 종료)
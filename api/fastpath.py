@@ -0,0 +1,555 @@
+"""
+Template fast path: answer the most common POS questions without an LLM call.
+
+    "지난달 가장 많이 팔린 메뉴는?"          → top_items   (top-N items by quantity or sales)
+    "최근 3개월 매출 추이 그래프로 보여줘"    → sales_trend (sales per day / week / month / year)
+    "카드와 현금 결제 매출을 비교해줘"        → split       (sales share per payment type or channel)
+
+`answer()` strips the Korean relative-date phrase (resolved with
+`utils.get_date` / `get_weekdate`), the granularity and the top-N count from
+the question, then requires EVERY remaining token to belong to one
+template's vocabulary (particles such as 은/는/을/를/별로 are allowed). Any
+word the templates do not know — an item name, a second period, a filter —
+means the question is not a plain template question and it falls through to
+the LLM loop (`answer()` returns None).
+
+SQL is built from the file's schema profile: the typed columns recorded at
+ingest (`_column_types`) give the date / item / amount / qty / channel /
+payment columns. Only single-file chats are handled.
+Enabled templates: settings.FASTPATH_TEMPLATES; FASTPATH_ENABLED=0 turns the
+fast path off.
+"""
+import logging
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+from django.conf import settings
+
+from . import utils
+from .column_types import read_types
+from .fileset import FileSet
+from .plot_cache import render_plot
+from .tracing import REGISTRY, span
+
+logger = logging.getLogger(__name__)
+
+MAX_PROFILES = 64
+DEFAULT_TOP_N = 5
+TABLE_ROWS = 31             # 추이 표에 넣을 최대 구간 수 (넘으면 최근 구간만)
+
+
+@dataclass
+class FastAnswer:
+    template: str
+    title: str
+    text: str
+    sql: str
+    preview: str
+    image_url: str | None = None
+
+    @property
+    def internal_log(self) -> str:
+        return f"FASTPATH {self.template}\n\nSQL:\n{self.sql}\n\nResult preview:\n{self.preview}"
+
+
+# ── schema profile ───────────────────────────────────────────
+@dataclass(frozen=True)
+class Profile:
+    table: str
+    date: str
+    item: str | None = None
+    amount: str | None = None
+    qty: str | None = None
+    channel: str | None = None
+    payment: str | None = None
+
+
+_HINTS = {
+    "item": re.compile(r"^(item|menu|product)(_?name)?$|상품명?|메뉴명?|품목", re.I),
+    "qty": re.compile(r"^(qty|quantity|수량|판매수량)$", re.I),
+    "channel": re.compile(r"channel|채널|order_type|주문경로", re.I),
+    "payment": re.compile(r"pay|결제", re.I),
+}
+_AMOUNT = re.compile(r"^(total_price|total|total_amount|sales|amount|revenue|매출|매출액|판매금액|결제금액)$", re.I)
+
+_PROFILES: "OrderedDict[tuple[str, int], Profile | None]" = OrderedDict()
+_PROFILES_LOCK = threading.Lock()
+
+
+def _build_profile(db_path: str) -> Profile | None:
+    with closing(sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)) as conn:
+        tables = read_types(conn)
+    for table, cols in tables.items():
+        date_col = next((c for c, t in cols.items()
+                         if t.kind in ("date", "timestamp") and not t.derived_from), None)
+        if date_col is None:
+            continue
+        role = {name: next((c for c, t in cols.items() if hint.search(c) and not t.derived_from
+                            and (name != "qty" or t.kind in ("integer", "real"))), None)
+                for name, hint in _HINTS.items()}
+        money = [c for c, t in cols.items() if t.kind == "currency"]
+        amount = next((c for c in money if _AMOUNT.match(c)), None)
+        if amount is None and len(money) == 1 and not re.search(r"unit|단가", money[0], re.I):
+            amount = money[0]
+        return Profile(table, date_col, amount=amount, **role)
+    return None
+
+
+def profile(data: FileSet) -> Profile | None:
+    """파일 DB 의 컬럼 역할 (파일 하나인 채팅만). 경로·mtime 기준으로 캐시"""
+    if len(data.files) != 1:
+        return None
+    path = data.primary.file_sqlpath
+    try:
+        key = (path, Path(path).stat().st_mtime_ns)
+    except OSError:
+        return None
+    with _PROFILES_LOCK:
+        if key in _PROFILES:
+            _PROFILES.move_to_end(key)
+            return _PROFILES[key]
+    try:
+        prof = _build_profile(path)
+    except sqlite3.Error as e:
+        logger.warning("[fastpath] cannot profile %s: %s", path, e)
+        prof = None
+    with _PROFILES_LOCK:
+        _PROFILES[key] = prof
+        while len(_PROFILES) > MAX_PROFILES:
+            _PROFILES.popitem(last=False)
+    return prof
+
+
+# ── relative periods ─────────────────────────────────────────
+@dataclass(frozen=True)
+class Period:
+    label: str
+    start: str              # 포함
+    end: str                # 미포함
+
+    @property
+    def days(self) -> int:
+        return (date.fromisoformat(self.end) - date.fromisoformat(self.start)).days
+
+    def text(self) -> str:
+        last = (date.fromisoformat(self.end) - timedelta(days=1)).isoformat()
+        return f"{self.label}({self.start} ~ {last})"
+
+    def where(self, col: str) -> str:
+        # ISO 문자열이라 date / timestamp 컬럼 모두 범위 조건이 인덱스를 탄다
+        return f"WHERE {col} >= '{self.start}' AND {col} < '{self.end}'"
+
+
+_NUMS = {"한": 1, "하나": 1, "두": 2, "세": 3, "네": 4, "다섯": 5, "여섯": 6, "일곱": 7, "여덟": 8,
+         "아홉": 9, "열": 10}
+_N = r"(\d+|한|두|세|네|다섯|여섯|일곱|여덟|아홉|열)"
+_JOSA = r"(?:에|의|에는|동안|동안의|간|간의|은|는|까지)?"
+
+
+def _num(token: str) -> int:
+    return int(token) if token.isdigit() else _NUMS[token]
+
+
+def _today(**diff) -> str:
+    return utils.get_date(**diff)
+
+
+def _month_start(iso: str) -> str:
+    return iso[:8] + "01"
+
+
+def _year_start(iso: str) -> str:
+    return iso[:5] + "01-01"
+
+
+def _rolling(m: re.Match) -> Period:
+    n, unit = _num(m.group(1)), m.group(2)
+    if unit == "일":
+        start = _today(day_diff=-(n - 1))
+    elif unit in ("주", "주일"):
+        start = _today(week_diff=-n, day_diff=1)
+    elif unit in ("개월", "달"):
+        start = _today(month_diff=-n, day_diff=1)
+    else:
+        start = _today(year_diff=-n, day_diff=1)
+    return Period(f"최근 {n}{unit}", start, _today(day_diff=1))
+
+
+def _phrase(pattern: str) -> re.Pattern:
+    return re.compile(rf"(?<!\S)(?:{pattern}){_JOSA}(?!\S)")
+
+
+# utils.get_weekdate 의 weekday 는 일=1 … 토=7 (월요일 = 2)
+_PERIODS: list[tuple[re.Pattern, Callable[[re.Match], Period]]] = [
+    (_phrase(rf"(?:최근|지난)\s*{_N}\s*(일|주일|주|개월|달|년)(?:간|동안)?"), _rolling),
+    (_phrase("오늘"), lambda m: Period("오늘", _today(), _today(day_diff=1))),
+    (_phrase("어제"), lambda m: Period("어제", _today(day_diff=-1), _today())),
+    (_phrase(r"이번\s*주|금주"), lambda m: Period("이번 주", utils.get_weekdate(0, 2), _today(day_diff=1))),
+    (_phrase(r"(?:지난|저번)\s*주|전주"),
+     lambda m: Period("지난주", utils.get_weekdate(-1, 2), utils.get_weekdate(0, 2))),
+    (_phrase(r"이번\s*달|금월"), lambda m: Period("이번 달", _month_start(_today()), _today(day_diff=1))),
+    (_phrase(r"(?:지난|저번)\s*달|전월"),
+     lambda m: Period("지난달", _month_start(_today(month_diff=-1)), _month_start(_today()))),
+    (_phrase("올해|금년"), lambda m: Period("올해", _year_start(_today()), _today(day_diff=1))),
+    (_phrase(r"작년|지난\s*해|전년"),
+     lambda m: Period("작년", _year_start(_today(year_diff=-1)), _year_start(_today()))),
+]
+
+# 구간 단위: (표시 이름, SQL 식)
+_GRAINS = {
+    "day": ("일별", "substr({c}, 1, 10)"),
+    "week": ("주별", "strftime('%Y-W%W', {c})"),
+    "month": ("월별", "substr({c}, 1, 7)"),
+    "year": ("연도별", "substr({c}, 1, 4)"),
+}
+_GRAIN_RE = re.compile(r"(?<!\S)(일별|일자별|날짜별|일간|주별|주간|월별|월간|달별|연도별|년도별|연별|연간)"
+                       r"(?:로|로는|의|로의)?(?!\S)")
+_GRAIN_OF = {"일": "day", "날": "day", "주": "week", "월": "month", "달": "month", "연": "year", "년": "year"}
+_TOP_N_RE = re.compile(rf"(?<!\S)(?:(?:상위|top|베스트|best)\s*{_N}(?:개|위|가지)?|{_N}\s*(?:개|위|가지)(?:만|까지)?)(?!\S)",
+                       re.I)
+
+
+# ── question parsing ─────────────────────────────────────────
+@dataclass
+class Question:
+    stems: list[str]
+    period: Period | None
+    grain: str | None
+    top_n: int | None
+    plot: bool
+
+
+_PARTICLES = sorted(["은", "는", "이", "가", "을", "를", "의", "에", "도", "만", "로", "으로", "와", "과",
+                     "랑", "이랑", "하고", "에서", "별", "별로", "로는", "으로는", "에서는"], key=len, reverse=True)
+_PLOT_WORDS = {"그래프", "차트", "그려줘", "그려주세요", "그려줄래", "시각화", "시각화해줘", "시각화해주세요"}
+_COMMON = {
+    "좀", "한번", "뭐", "뭐야", "뭐지", "뭐였어", "뭐였지", "뭔가요", "뭔지", "뭘까", "무엇", "무엇인가요", "무엇인지",
+    "어때", "어때요", "어떻게", "어떤", "어땠어", "어땠나요", "알려줘", "알려주세요", "알려줄래", "보여줘",
+    "보여주세요", "보여줄래", "정리해줘", "정리해주세요", "분석해줘", "확인해줘", "말해줘", "해줘", "궁금해",
+    "궁금합니다", "인가요", "이야", "야", "요", "전체", "총", "되나요", "돼", "됐어", "됐나요", "되었나요",
+} | _PLOT_WORDS
+
+
+def _take(pattern: re.Pattern, text: str) -> tuple[re.Match | None, str]:
+    """pattern 이 한 번만 나오면 (match, 지운 text). 두 번 이상이면 템플릿 질문이 아님 → (None, None)"""
+    matches = list(pattern.finditer(text))
+    if len(matches) > 1:
+        return None, None
+    if not matches:
+        return None, text
+    m = matches[0]
+    return m, text[:m.start()] + " " + text[m.end():]
+
+
+def parse(question: str) -> Question | None:
+    text = re.sub(r"[?!.,~\"'’”]", " ", question.lower())
+    period = None
+    for pattern, build in _PERIODS:
+        m, rest = _take(pattern, text)
+        if rest is None or (m is not None and period is not None):
+            return None             # 기간이 둘 이상 (비교 질문 등)
+        if m is not None:
+            period, text = build(m), rest
+    grain_m, text = _take(_GRAIN_RE, text)
+    if text is None:
+        return None
+    top_m, text = _take(_TOP_N_RE, text)
+    if text is None:
+        return None
+    top_n = _num(next(g for g in top_m.groups() if g)) if top_m else None
+    grain = _GRAIN_OF[grain_m.group(1)[0]] if grain_m else None
+    stems = [_stem(tok) for tok in text.split()]
+    return Question(stems, period, grain, top_n, any(s in _PLOT_WORDS for s in stems))
+
+
+def _stem(token: str, depth: int = 2) -> str:
+    """알려진 단어 + 조사 → 단어. 모르는 단어는 그대로 (템플릿 어휘 검사에서 걸러진다)"""
+    if token in _VOCAB or depth == 0:
+        return token
+    for p in _PARTICLES:
+        if token.endswith(p) and len(token) > len(p):
+            stem = _stem(token[:-len(p)], depth - 1)
+            if stem in _VOCAB:
+                return stem
+    return token
+
+
+# ── templates ────────────────────────────────────────────────
+def _won(v) -> str:
+    return f"{v:,.0f}원"
+
+
+def _topic(noun: str) -> str:
+    """받침에 맞는 보조사: 메뉴는 / 상품은"""
+    last = ord(noun[-1]) - 0xAC00
+    return noun + ("은" if 0 <= last < 11172 and last % 28 else "는")
+
+
+def _count(v) -> str:
+    return f"{v:,.0f}개"
+
+
+def _plot_code(kind: str, x: list, y: list, title: str, xlabel: str, ylabel: str) -> str:
+    marker = ", marker='o'" if kind == "plot" and len(x) <= TABLE_ROWS else ""
+    step = max(1, len(x) // 12)     # x 눈금은 12개 안팎만 표시
+    return (
+        "import matplotlib.pyplot as plt\n\n"
+        f"x = {[str(v) for v in x]!r}\n"
+        f"y = {[round(float(v), 2) for v in y]!r}\n\n"
+        "plt.figure(figsize=(8, 4))\n"
+        f"plt.{kind}(x, y{marker})\n"
+        f"plt.title({title!r})\n"
+        f"plt.xlabel({xlabel!r})\n"
+        f"plt.ylabel({ylabel!r})\n"
+        f"plt.xticks(range(0, len(x), {step}), x[::{step}], rotation=45, ha='right')\n"
+        "plt.tight_layout()\n"
+    )
+
+
+def _q(col: str) -> str:
+    return '"' + col.replace('"', '""') + '"'
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _period_words(q: Question) -> tuple[str, str]:
+    """(제목용 기간, 본문용 기간)"""
+    if q.period is None:
+        return "", "전체 기간"
+    return q.period.label, q.period.text()
+
+
+@dataclass(frozen=True)
+class Template:
+    vocab: frozenset[str]
+    matches: Callable[[Question, Profile], bool]
+    build: Callable[[Question, Profile, FileSet], FastAnswer | None]   # None → LLM 으로
+
+
+# top_items ─────────────────────────────────
+_ITEM_NOUNS = {"메뉴", "상품", "품목", "제품", "아이템", "인기메뉴", "인기상품"}
+_RANK_WORDS = {"가장", "제일", "많이", "잘", "인기", "인기있는", "베스트", "best", "top", "순위", "랭킹", "상위",
+               "인기메뉴", "인기상품"}
+_TOP_VOCAB = _ITEM_NOUNS | _RANK_WORDS | {
+    "팔린", "팔린거", "팔린게", "팔렸어", "팔렸나요", "판매된", "판매량", "판매", "많은", "높은", "매출", "매출액",
+    "기준", "것", "거", "건", "게", "목록", "리스트"}
+
+
+def _by_sales(q: Question) -> bool:
+    """'매출이 가장 높은 메뉴' → 매출 순, '가장 많이 팔린 메뉴' → 판매량 순"""
+    stems = set(q.stems)
+    return bool(stems & {"매출", "매출액"}) and not stems & {"팔린", "팔린거", "팔린게", "판매량", "많이"}
+
+
+def _top_matches(q: Question, p: Profile) -> bool:
+    stems = set(q.stems)
+    return (p.item is not None and bool(stems & _ITEM_NOUNS) and (bool(stems & _RANK_WORDS) or q.top_n is not None)
+            and (p.amount is not None or not _by_sales(q)))
+
+
+def _top_build(q: Question, p: Profile, data: FileSet) -> FastAnswer:
+    by_sales = _by_sales(q)
+    noun = next((s for s in q.stems if s in _ITEM_NOUNS), "메뉴").removeprefix("인기")
+    qty = f"SUM({_q(p.qty)})" if p.qty else "COUNT(*)"
+    cols = [f"{_q(p.item)} AS item", f"{qty} AS qty"] + ([f"SUM({_q(p.amount)}) AS sales"] if p.amount else [])
+    order = "sales" if by_sales else "qty"
+    where = q.period.where(_q(p.date)) if q.period else ""
+    sql = (f"SELECT {', '.join(cols)}\nFROM {_q(p.table)}\n{where}\nGROUP BY 1\n"
+           f"ORDER BY {order} DESC\nLIMIT {q.top_n or DEFAULT_TOP_N}").replace("\n\n", "\n")
+    df = data.query(sql)
+    title_period, period = _period_words(q)
+    title = f"{title_period} 인기 {noun}".strip()
+    if df.empty:
+        return FastAnswer("top_items", title, f"{period} 판매 데이터가 없습니다.", sql, "(no rows)")
+
+    best = df.iloc[0]
+    figures = [f"판매량 {_count(best['qty'])}"] + ([f"매출 {_won(best['sales'])}"] if p.amount else [])
+    lead = "매출이 가장 높은" if by_sales else "가장 많이 팔린"
+    text = f"{period} {lead} {_topic(noun)} **{best['item']}**입니다 ({', '.join(figures)})."
+    table = df.rename(columns={"item": noun, "qty": "판매량", "sales": "매출"})
+    table.insert(0, "순위", range(1, len(table) + 1))
+    if len(df) > 1:
+        text += f"\n\n{table.to_markdown(index=False, floatfmt=',.0f', intfmt=',')}"
+    image_url = None
+    if q.plot:
+        y = df["sales" if by_sales else "qty"]
+        image_url, _ = render_plot(_plot_code("bar", df["item"].tolist(), y.tolist(), title, noun,
+                                              "매출(원)" if by_sales else "판매량"))
+    return FastAnswer("top_items", title, text, sql, df.head(5).to_markdown(index=False), image_url)
+
+
+# sales_trend ───────────────────────────────
+_TREND_WORDS = {"추이", "추세", "변화", "흐름", "트렌드", "변했어", "변했나요", "바뀌었어"}
+_METRIC_WORDS = {"매출", "매출액", "판매", "판매량", "판매액"}
+_TREND_VOCAB = _TREND_WORDS | _METRIC_WORDS
+
+
+def _trend_matches(q: Question, p: Profile) -> bool:
+    stems = set(q.stems)
+    by_qty = "판매량" in stems
+    return bool(stems & _TREND_WORDS) and bool(stems & _METRIC_WORDS) and (by_qty or p.amount is not None)
+
+
+def _trend_build(q: Question, p: Profile, data: FileSet) -> FastAnswer:
+    by_qty = "판매량" in q.stems
+    grain = q.grain or ("month" if q.period is None or q.period.days > 186
+                        else "week" if q.period.days > 31 else "day")
+    grain_label, expr = _GRAINS[grain]
+    value = (f"SUM({_q(p.qty)})" if p.qty else "COUNT(*)") if by_qty else f"SUM({_q(p.amount)})"
+    where = q.period.where(_q(p.date)) if q.period else ""
+    sql = (f"SELECT {expr.format(c=_q(p.date))} AS period, {value} AS value\nFROM {_q(p.table)}\n{where}\n"
+           f"GROUP BY 1\nORDER BY 1").replace("\n\n", "\n")
+    df = data.query(sql)
+    metric, fmt = ("판매량", _count) if by_qty else ("매출", _won)
+    title_period, period = _period_words(q)
+    title = f"{title_period} {grain_label} {metric} 추이".strip()
+    if df.empty:
+        return FastAnswer("sales_trend", title, f"{period} 판매 데이터가 없습니다.", sql, "(no rows)")
+
+    hi, lo = df.loc[df["value"].idxmax()], df.loc[df["value"].idxmin()]
+    text = (f"{period} {grain_label} {metric} 추이입니다. {len(df)}개 구간 합계 {fmt(df['value'].sum())}, "
+            f"평균 {fmt(df['value'].mean())}이며 가장 높은 구간은 {hi['period']} ({fmt(hi['value'])}), "
+            f"가장 낮은 구간은 {lo['period']} ({fmt(lo['value'])})입니다.")
+    first, last = df["value"].iloc[0], df["value"].iloc[-1]
+    if len(df) > 1 and first:
+        text += f" 첫 구간 대비 마지막 구간은 {(last - first) / first * 100:+.1f}% 입니다."
+    table = df.tail(TABLE_ROWS).rename(columns={"period": "구간", "value": metric})
+    note = f" (최근 {TABLE_ROWS}개 구간)" if len(df) > TABLE_ROWS else ""
+    text += f"\n\n{table.to_markdown(index=False, floatfmt=',.0f', intfmt=',')}{note}"
+    image_url = None
+    if q.plot:
+        image_url, _ = render_plot(_plot_code("plot", df["period"].tolist(), df["value"].tolist(), title,
+                                              "구간", "판매량" if by_qty else "매출(원)"))
+    return FastAnswer("sales_trend", title, text, sql, df.head(5).to_markdown(index=False), image_url)
+
+
+# split ─────────────────────────────────────
+_PAYMENT_WORDS = {"결제", "결제수단", "결제방법", "결제유형", "결제방식", "수단", "방법", "유형", "방식"}
+_CHANNEL_WORDS = {"채널", "판매채널", "주문채널", "주문경로", "경로"}
+# 특정 값을 가리키는 단어 → 파일의 값과 맞춰 볼 패턴 (영문 라벨 / 한글 라벨)
+_PAYMENT_VALUES = {"카드": r"card|카드", "현금": r"cash|현금", "모바일": r"mobile|모바일",
+                   "간편결제": r"mobile|pay|간편", "페이": r"pay|페이"}
+_CHANNEL_VALUES = {"매장": r"store|매장|홀", "배달": r"deliver|배달", "배달앱": r"deliver|배달",
+                   "키오스크": r"kiosk|키오스크", "포장": r"take|togo|포장"}
+_COMPARE_WORDS = {"비교", "비교해줘", "비교해주세요", "차이"}
+_SALES_WORDS = {"매출", "매출액"}
+_COUNT_WORDS = {"건수", "주문", "주문수"}
+_SHARE_WORDS = _COMPARE_WORDS | _SALES_WORDS | {"비율", "비중", "분포", "점유율"}
+_SPLIT_VOCAB = (_PAYMENT_WORDS | _CHANNEL_WORDS | set(_PAYMENT_VALUES) | set(_CHANNEL_VALUES) | _SHARE_WORDS
+                | _COUNT_WORDS | {"나눠서", "구분해서", "각각"})
+
+
+def _split_dimension(q: Question, p: Profile) -> tuple[str, str, dict[str, str]] | None:
+    """(컬럼, 표시 이름, 질문에 나온 값 단어 → 패턴)"""
+    stems = set(q.stems)
+    payment = bool(stems & (_PAYMENT_WORDS | set(_PAYMENT_VALUES)))
+    channel = bool(stems & (_CHANNEL_WORDS | set(_CHANNEL_VALUES)))
+    if payment == channel:
+        return None
+    if payment and p.payment:
+        return p.payment, "결제 수단", {w: _PAYMENT_VALUES[w] for w in q.stems if w in _PAYMENT_VALUES}
+    if channel and p.channel:
+        return p.channel, "판매 채널", {w: _CHANNEL_VALUES[w] for w in q.stems if w in _CHANNEL_VALUES}
+    return None
+
+
+def _by_count(q: Question) -> bool:
+    """'채널별 주문 건수' → 건수 순. 매출과 건수를 함께 물으면 무엇으로 나눌지 모호하므로 템플릿 질문이 아님"""
+    return bool(set(q.stems) & _COUNT_WORDS)
+
+
+def _split_matches(q: Question, p: Profile) -> bool:
+    stems = set(q.stems)
+    dim = _split_dimension(q, p)
+    if dim is None or p.amount is None or not stems & (_SHARE_WORDS | _COUNT_WORDS):
+        return False
+    if _by_count(q) and stems & _SALES_WORDS:
+        return False
+    # 값 하나('배달 매출은?', '현금 결제 비율')는 그 값 하나의 수치를 묻는 질문 → LLM 으로.
+    # 값 둘 이상은 비교 질문('카드와 현금 결제 매출을 비교해줘')일 때만 그 값들로 걸러서 답한다
+    values = dim[2]
+    return not values or (len(values) >= 2 and bool(stems & _COMPARE_WORDS))
+
+
+def _split_build(q: Question, p: Profile, data: FileSet) -> FastAnswer | None:
+    col, label, values = _split_dimension(q, p)
+    by_count = _by_count(q)
+    conds = [q.period.where(_q(p.date)).removeprefix("WHERE ")] if q.period else []
+    if values:
+        labels = data.query(f"SELECT DISTINCT {_q(col)} AS label FROM {_q(p.table)} "
+                            f"WHERE {_q(col)} IS NOT NULL")["label"].astype(str).tolist()
+        picked = {w: [v for v in labels if re.search(pat, v, re.I)] for w, pat in values.items()}
+        if not all(picked.values()):
+            return None         # 파일에 없는 값 → LLM 으로
+        chosen = sorted({v for vs in picked.values() for v in vs})
+        conds.append(f"{_q(col)} IN ({', '.join(_literal(v) for v in chosen)})")
+    where = f"WHERE {' AND '.join(conds)}" if conds else ""
+    order = "orders" if by_count else "sales"
+    sql = (f"SELECT {_q(col)} AS label, COUNT(*) AS orders, SUM({_q(p.amount)}) AS sales\nFROM {_q(p.table)}\n"
+           f"{where}\nGROUP BY 1\nORDER BY {order} DESC").replace("\n\n", "\n")
+    df = data.query(sql)
+    metric = "주문 건수" if by_count else "매출"
+    title_period, period = _period_words(q)
+    title = f"{title_period} {label}별 {metric} 비중".strip()
+    if df.empty:
+        return FastAnswer("split", title, f"{period} 판매 데이터가 없습니다.", sql, "(no rows)")
+
+    df["share"] = df[order] / df[order].sum() * 100
+    if by_count:
+        parts = ", ".join(f"{r.label} {r.share:.1f}% ({r.orders:,}건)" for r in df.itertuples())
+    else:
+        parts = ", ".join(f"{r.label} {r.share:.1f}% ({_won(r.sales)})" for r in df.itertuples())
+    text = f"{period} {label}별 {metric} 비중입니다. {parts}."
+    table = df.rename(columns={"label": label, "orders": "건수", "sales": "매출", "share": "비중(%)"})
+    text += f"\n\n{table.to_markdown(index=False, floatfmt=',.1f', intfmt=',')}"
+    image_url = None
+    if q.plot:
+        image_url, _ = render_plot(_plot_code("bar", df["label"].tolist(), df[order].tolist(), title,
+                                              label, "건수" if by_count else "매출(원)"))
+    return FastAnswer("split", title, text, sql, df.head(5).to_markdown(index=False), image_url)
+
+
+TEMPLATES: dict[str, Template] = {
+    "top_items": Template(frozenset(_TOP_VOCAB), _top_matches, _top_build),
+    "sales_trend": Template(frozenset(_TREND_VOCAB), _trend_matches, _trend_build),
+    "split": Template(frozenset(_SPLIT_VOCAB), _split_matches, _split_build),
+}
+_VOCAB = _COMMON.union(*(t.vocab for t in TEMPLATES.values()))
+
+
+# ── entry point ──────────────────────────────────────────────
+def answer(question: str, data: FileSet | None) -> FastAnswer | None:
+    """템플릿 질문이면 LLM 없이 만든 답, 아니면 None (LLM 루프로)"""
+    if data is None or not getattr(settings, "FASTPATH_ENABLED", True):
+        return None
+    with span("fastpath") as sp:
+        q = parse(question)
+        prof = profile(data) if q is not None else None
+        if q is None or prof is None:
+            return None
+        for name in getattr(settings, "FASTPATH_TEMPLATES", tuple(TEMPLATES)):
+            template = TEMPLATES.get(name)
+            if template is None or not set(q.stems) <= template.vocab | _COMMON or not template.matches(q, prof):
+                continue
+            try:
+                result = template.build(q, prof, data)
+            except Exception as e:       # 템플릿 SQL 이 이 파일에서 실패하면 LLM 에 맡긴다
+                logger.warning("[fastpath] %s failed: %s", name, e)
+                REGISTRY.inc("pos_fastpath_errors_total", template=name)
+                return None
+            if result is None:          # 질문의 값이 이 파일에 없음 등
+                return None
+            sp.set(template=name)
+            REGISTRY.inc("pos_fastpath_answers_total", template=name)
+            return result
+    return None
@@ -0,0 +1,243 @@
+"""
+Few-shot store for text2sql: verified (question, schema fingerprint, SQL) triples.
+
+When SQL written by text2sql runs without error and returns rows, `record()`
+keeps it as a `SqlExample` of that user together with
+
+* schema_fingerprint — a hash of the file's table / column names, and
+* refs — the table / column names the SQL uses (sqlparse, aliases excluded).
+
+`examples_for(user_id, db_path, question)` searches the user's stored
+questions with a faiss IndexFlatIP (question embeddings from
+SCHEMA_EMBEDDING_MODEL), keeps the examples that can run on the current file
+(same fingerprint, or every ref exists in it) and renders the FEWSHOT_K most
+similar within FEWSHOT_TOKEN_BUDGET tokens. SEED_EXAMPLES, written for the
+flat `table1` our ingestion produces, cover users without history.
+
+Indexes live in memory per user and are synced incrementally (rows with
+example_id above the last one seen), so examples recorded by other workers
+are picked up on the next request.
+"""
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import faiss
+import sqlparse
+from django.conf import settings
+from sqlparse import tokens as T
+
+from .models import SqlExample
+from .schema_index import embed, vectors
+from .tracing import REGISTRY, span
+
+logger = logging.getLogger(__name__)
+
+SEARCH_K      = 32        # 호환성 검사 전에 가져올 후보 수
+MAX_USERS     = 256       # 메모리에 둘 사용자별 인덱스 수
+MAX_FILES     = 256       # 스키마 지문 캐시
+
+HEADER = "Verified examples on this kind of data (questions answered correctly before; adapt, don't copy blindly):"
+
+# 이력이 없는 사용자용. 컬럼이 현재 파일에 모두 있을 때만 쓰인다
+SEED_EXAMPLES: list[tuple[str, str]] = [
+    ("지난달 가장 많이 팔린 메뉴는?",
+     "SELECT item_name, SUM(qty) AS total_qty\nFROM table1\n"
+     "WHERE date >= DATE('now', 'start of month', '-1 month') AND date < DATE('now', 'start of month')\n"
+     "GROUP BY item_name\nORDER BY total_qty DESC\nLIMIT 1;"),
+    ("최근 3개월 매출 추이 보여줘",
+     "SELECT month, SUM(total_price) AS monthly_sales\nFROM table1\n"
+     "WHERE date >= DATE('now', 'start of month', '-3 months')\nGROUP BY month\nORDER BY month;"),
+    ("결제 수단별 매출 비중은?",
+     "SELECT payment_type, SUM(total_price) AS sales,\n"
+     "       ROUND(100.0 * SUM(total_price) / (SELECT SUM(total_price) FROM table1), 1) AS share_pct\n"
+     "FROM table1\nGROUP BY payment_type\nORDER BY sales DESC;"),
+    ("요일별 평균 하루 매출",
+     "SELECT weekday, AVG(daily_sales) AS avg_daily_sales\n"
+     "FROM (SELECT date, weekday, SUM(total_price) AS daily_sales FROM table1 GROUP BY date, weekday)\n"
+     "GROUP BY weekday\nORDER BY weekday;"),
+    ("4월 1일 신메뉴 출시 전후 매출 비교",
+     "SELECT CASE WHEN date < '2025-04-01' THEN 'Before' ELSE 'After' END AS period,\n"
+     "       SUM(total_price) AS sales\nFROM table1\nGROUP BY period;"),
+    ("시간대별 주문 건수",
+     "SELECT hour, COUNT(DISTINCT transaction_id) AS orders\nFROM table1\nGROUP BY hour\nORDER BY hour;"),
+    ("채널별 객단가",
+     "SELECT channel, SUM(total_price) * 1.0 / COUNT(DISTINCT transaction_id) AS avg_ticket\n"
+     "FROM table1\nGROUP BY channel\nORDER BY avg_ticket DESC;"),
+]
+
+
+# ── schema fingerprint / SQL references ──────────────────────
+_SIGNATURES: "OrderedDict[tuple[str, int], tuple[str, frozenset[str]]]" = OrderedDict()
+_SIGNATURES_LOCK = threading.Lock()
+
+
+def signature(db_path: str | Path) -> tuple[str, frozenset[str]]:
+    """(테이블·컬럼 이름 해시, 소문자 이름 집합). `_` 내부 테이블은 뺀다"""
+    db_path = str(db_path)
+    key = (db_path, Path(db_path).stat().st_mtime_ns)
+    with _SIGNATURES_LOCK:
+        if key in _SIGNATURES:
+            _SIGNATURES.move_to_end(key)
+            return _SIGNATURES[key]
+    parts, names = [], set()
+    with closing(sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)) as conn:
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') "
+                                             "ORDER BY name") if not r[0].startswith(("_", "sqlite_"))]
+        for tbl in tables:
+            cols = [r[1] for r in conn.execute(f'PRAGMA table_info("{tbl}")')]
+            parts.append(f"{tbl}:{','.join(cols)}")
+            names.update(n.lower() for n in [tbl, *cols])
+    result = hashlib.sha1("\n".join(parts).encode()).hexdigest(), frozenset(names)
+    with _SIGNATURES_LOCK:
+        _SIGNATURES[key] = result
+        while len(_SIGNATURES) > MAX_FILES:
+            _SIGNATURES.popitem(last=False)
+    return result
+
+
+def refs(sql: str) -> frozenset[str]:
+    """SQL 이 쓰는 테이블·컬럼 이름 (함수 이름, AS 별칭, t.col 의 t 는 뺀다)"""
+    toks = [t for stmt in sqlparse.parse(sql) for t in stmt.flatten()
+            if not t.is_whitespace and t.ttype not in T.Comment]
+    names, aliases = set(), set()
+    for i, tok in enumerate(toks):
+        if tok.ttype in T.Name:
+            name = tok.value.lower()
+        elif tok.ttype in T.String.Symbol:
+            name = tok.value[1:-1].replace(tok.value[0] * 2, tok.value[0]).lower()
+        else:
+            continue
+        if i + 1 < len(toks) and toks[i + 1].value in ("(", "."):
+            continue
+        (aliases if i and toks[i - 1].normalized == "AS" else names).add(name)
+    return frozenset(names - aliases)
+
+
+# ── per-user index ───────────────────────────────────────────
+@dataclass
+class _Example:
+    question: str
+    sql: str
+    fingerprint: str
+    refs: frozenset[str]
+
+
+@dataclass
+class _Library:
+    examples: list[_Example] = field(default_factory=list)
+    index: faiss.Index | None = None
+    last_id: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def add(self, examples: list[_Example]) -> None:
+        vecs = embed([e.question for e in examples])
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(vecs.shape[1])
+        self.index.add(vecs)
+        self.examples.extend(examples)
+
+
+_LIBRARIES: "OrderedDict[tuple, _Library]" = OrderedDict()
+_LIBRARIES_LOCK = threading.Lock()
+
+
+def _library(key: tuple) -> _Library:
+    with _LIBRARIES_LOCK:
+        lib = _LIBRARIES.get(key)
+        if lib is None:
+            lib = _LIBRARIES[key] = _Library()
+            while len(_LIBRARIES) > MAX_USERS:
+                _LIBRARIES.popitem(last=False)
+        _LIBRARIES.move_to_end(key)
+        return lib
+
+
+def _seeds() -> _Library:
+    lib = _library(("seed", settings.SCHEMA_EMBEDDING_MODEL))
+    with lib.lock:
+        if lib.index is None:
+            lib.add([_Example(q, sql, "", refs(sql)) for q, sql in SEED_EXAMPLES])
+    return lib
+
+
+def _user(user_id: str) -> _Library:
+    lib = _library(("user", user_id, settings.SCHEMA_EMBEDDING_MODEL))
+    with lib.lock:
+        rows = list(SqlExample.objects.filter(user_id=user_id, example_id__gt=lib.last_id)
+                    .order_by("example_id")
+                    .values_list("example_id", "question", "sql", "schema_fingerprint", "refs"))
+        if rows:
+            lib.add([_Example(q, sql, fp, frozenset(r for r in rs.split(",") if r)) for _, q, sql, fp, rs in rows])
+            lib.last_id = rows[-1][0]
+    return lib
+
+
+def reset() -> None:
+    """메모리 인덱스를 버린다 (테스트·벤치마크용; DB 를 되돌린 뒤 같은 example_id 가 다시 쓰일 때)"""
+    with _LIBRARIES_LOCK:
+        _LIBRARIES.clear()
+
+
+def _tokens(text: str) -> int:
+    # 영문·SQL 은 4글자에 1토큰, 한글은 글자마다 1토큰 정도로 어림한다
+    return int(sum(1 if ord(c) > 127 else 0.25 for c in text)) + 1
+
+
+# ── public API ───────────────────────────────────────────────
+def examples_for(user_id: str, db_path: str | Path, question: str) -> str | None:
+    """현재 파일에서 실행할 수 있는 비슷한 질문의 검증된 SQL 예시 (없으면 None)"""
+    if not settings.FEWSHOT_ENABLED or not question.strip():
+        return None
+    try:
+        fingerprint, names = signature(db_path)
+        with span("fewshot.retrieve") as sp:
+            qv = vectors([question])
+            candidates = []
+            for lib in (_user(user_id), _seeds()):
+                if lib.index is None:
+                    continue
+                scores, ids = lib.index.search(qv, min(SEARCH_K, lib.index.ntotal))
+                candidates += [(s, lib.examples[i]) for s, i in zip(scores[0], ids[0])
+                               if i >= 0 and (lib.examples[i].fingerprint == fingerprint
+                                              or lib.examples[i].refs <= names)]
+            picked, used, seen = [], 0, set()
+            for _, ex in sorted(candidates, key=lambda c: -c[0]):
+                block = f"### {ex.question}\n```sql\n{ex.sql}\n```"
+                cost = _tokens(block)
+                if ex.sql in seen or used + cost > settings.FEWSHOT_TOKEN_BUDGET:
+                    continue
+                picked.append(block)
+                seen.add(ex.sql)
+                used += cost
+                if len(picked) == settings.FEWSHOT_K:
+                    break
+            sp.set(examples=len(picked))
+    except Exception:
+        logger.exception("few-shot retrieval failed")
+        return None
+    REGISTRY.inc("pos_fewshot_examples_total", len(picked))
+    return HEADER + "\n\n" + "\n\n".join(picked) if picked else None
+
+
+def record(user_id: str, chat_id: int | None, db_path: str | Path, question: str, sql: str) -> None:
+    """오류 없이 실행된 text2sql 결과를 저장한다 (같은 예시는 한 번만)"""
+    if not settings.FEWSHOT_ENABLED:
+        return
+    question, sql = question.strip(), sql.strip()
+    try:
+        fingerprint, _ = signature(db_path)
+        digest = hashlib.sha1(f"{user_id}\0{fingerprint}\0{question}\0{sql}".encode()).hexdigest()
+        _, created = SqlExample.objects.get_or_create(digest=digest, defaults={
+            "user_id_id": user_id, "chat_id_id": chat_id, "question": question, "sql": sql,
+            "schema_fingerprint": fingerprint, "refs": ",".join(sorted(refs(sql)))})
+    except Exception:
+        logger.exception("few-shot example not recorded")
+        return
+    if created:
+        REGISTRY.inc("pos_fewshot_recorded_total")
@@ -0,0 +1,168 @@
+"""
+File delivery for /media/ (uploads, plot images) and /static/.
+
+`settings.FILE_DELIVERY` selects how the bytes reach the client:
+
+* "python"      FileResponse over a raw file descriptor. Under a WSGI server
+                with `wsgi.file_wrapper` (gunicorn, uWSGI) the body goes out via
+                os.sendfile, so image bytes never enter the interpreter.
+                ETag / Last-Modified / If-None-Match / If-Modified-Since and
+                single `Range: bytes=a-b` requests are handled here.
+* "x-sendfile"  Empty response + `X-Sendfile: <absolute path>` (Apache
+                mod_xsendfile, lighttpd, Caddy); the proxy serves the file.
+* "x-accel"     Empty response + `X-Accel-Redirect: <FILE_ACCEL_PREFIX><root>/<path>`
+                for an nginx `internal` location, e.g.
+
+                    location /_protected/media/ { internal; alias /srv/app/media/; }
+
+In the proxy modes the proxy takes care of validators and ranges itself.
+"""
+import mimetypes
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .pagination import etag_matches
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class _FileRange:
+    """[start, start + length) 구간만 읽히는 파일 래퍼. sendfile 을 위해 fileno 를 노출한다."""
+
+    def __init__(self, f, start: int, length: int):
+        f.seek(start)
+        self._f = f
+        self._left = length
+        self.name = f.name
+
+    def read(self, size: int = -1) -> bytes:
+        if self._left <= 0:
+            return b""
+        size = self._left if size is None or size < 0 else min(size, self._left)
+        data = self._f.read(size)
+        self._left -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self._f.fileno()
+
+    def close(self) -> None:
+        self._f.close()
+
+
+def _etag(st: os.stat_result) -> str:
+    # nginx 와 같은 형식: "<mtime>-<size>" (내용 해시 없이 stat 만으로 계산)
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _not_modified(request: HttpRequest, etag: str, mtime: float) -> bool:
+    if request.headers.get("If-None-Match"):
+        return etag_matches(request, etag)
+    since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+    return since is not None and int(mtime) <= since
+
+
+def _parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    단일 `bytes=a-b` / `bytes=a-` / `bytes=-n` 만 해석한다.
+    Returns:
+        (start, end) 포함 구간, 형식이 틀리거나 다중 구간이면 None (→ 전체 전송)
+    Raises:
+        ValueError: 만족할 수 없는 구간 (→ 416)
+    """
+    m = RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    first, last = m.group(1), m.group(2)
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _range_applies(request: HttpRequest, etag: str, mtime: float) -> bool:
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def _proxy_response(full_path: Path, root_name: str, rel_path: str, mode: str) -> HttpResponse:
+    content_type, _ = mimetypes.guess_type(full_path.name)
+    response = HttpResponse(content_type=content_type or "application/octet-stream")
+    if mode == "x-sendfile":
+        response["X-Sendfile"] = str(full_path)
+    else:
+        prefix = getattr(settings, "FILE_ACCEL_PREFIX", "/_protected/")
+        response["X-Accel-Redirect"] = f"{prefix.rstrip('/')}/{root_name}/{rel_path}"
+    return response
+
+
+@require_safe
+def serve_file(request: HttpRequest, path: str, document_root: str | Path,
+               root_name: str = "media", cache_control: str = "private, no-cache") -> HttpResponse:
+    """`django.views.static.serve` 대체. urls.py 에서 document_root / root_name 을 넘겨 쓴다."""
+    try:
+        full_path = Path(safe_join(document_root, path))
+    except SuspiciousFileOperation:
+        raise Http404("not found")
+    try:
+        st = full_path.stat()
+    except OSError:
+        raise Http404("not found")
+    if not full_path.is_file():
+        raise Http404("not found")
+
+    mode = getattr(settings, "FILE_DELIVERY", "python")
+    if mode != "python":
+        return _proxy_response(full_path, root_name, path, mode)
+
+    etag = _etag(st)
+    if _not_modified(request, etag, st.st_mtime):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        response["Cache-Control"] = cache_control
+        return response
+
+    size = st.st_size
+    rng = None
+    if request.headers.get("Range") and _range_applies(request, etag, st.st_mtime):
+        try:
+            rng = _parse_range(request.headers["Range"], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    # buffering=0: 위치 이동이 바로 lseek 로 반영되어 sendfile 이 올바른 오프셋에서 시작한다
+    f = open(full_path, "rb", buffering=0)
+    content_type = mimetypes.guess_type(full_path.name)[0] or "application/octet-stream"
+    if rng is None:
+        response = FileResponse(f, content_type=content_type)
+        response["Content-Length"] = size
+    else:
+        start, end = rng
+        response = FileResponse(_FileRange(f, start, end - start + 1), content_type=content_type, status=206)
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(st.st_mtime)
+    response["Accept-Ranges"] = "bytes"
+    response["Cache-Control"] = cache_control
+    return response
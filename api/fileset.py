@@ -0,0 +1,283 @@
+"""
+Query several uploaded files from one chat.
+
+Each upload is its own SQLite DB (table1, table2 …). For a chat with more than
+one file, queries run on a pooled read-only connection that ATTACHes every
+file DB as f1, f2 … (in file_id order), so tables are addressed as
+`f1.table1`, `f2.table1` and nothing is copied.
+
+Tables whose column lists are identical across files (e.g. this month's and
+last month's export of the same POS) additionally get a TEMP union view
+
+    all_table1 = SELECT 'may.csv' AS source_file, * FROM f1.table1
+                 UNION ALL SELECT 'june.csv', * FROM f2.table1
+
+so a cross-file comparison is one GROUP BY source_file. Connections (and
+their views) are built lazily on first use and cached per file set; the key
+includes each DB's mtime, so a re-processed file gets a fresh entry.
+"""
+import contextvars
+import logging
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+
+from .models import File
+from .rollups import Rewrite, rewrite
+from .schema_index import prune
+from .tracing import REGISTRY, span
+from .utils import execute_sqlite_queries, execute_sqlite_query, explain_sqlite_query
+
+logger = logging.getLogger(__name__)
+
+MAX_FILES       = 8        # SQLite 기본 ATTACH 한도(10)보다 작게
+POOL_SIZE       = 4        # 파일 세트당 커넥션 수 ([T2S_BATCH] 병렬 실행용)
+MAX_SETS        = 16       # 동시에 열어 둘 파일 세트 수 (LRU)
+ACQUIRE_TIMEOUT = 30       # 초
+
+
+class FileSetError(ValueError):
+    """채팅에 붙일 수 없는 파일 조합"""
+
+
+# ── pooled connections ───────────────────────────────────────
+@dataclass
+class _Entry:
+    key: tuple
+    files: list[tuple[str, str]]                  # (alias 로 쓸 원본 파일 이름, db 경로)
+    schema: str = ""
+    idle: queue.LifoQueue = field(default_factory=queue.LifoQueue)
+    opened: int = 0
+    closed: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+_SETS: "OrderedDict[tuple, _Entry]" = OrderedDict()
+_SETS_LOCK = threading.Lock()
+
+
+def _key(files: list[File]) -> tuple:
+    parts = []
+    for f in files:
+        try:
+            mtime = Path(f.file_sqlpath).stat().st_mtime_ns
+        except OSError:
+            raise FileSetError(f"database of file {f.file_id} is missing")
+        parts.append((f.file_id, f.file_sqlpath, mtime))
+    return tuple(parts)
+
+
+def _tables(conn: sqlite3.Connection, alias: str) -> dict[str, tuple[str, ...]]:
+    names = [r[0] for r in conn.execute(
+        f"SELECT name FROM {alias}.sqlite_master WHERE type IN ('table', 'view') ORDER BY name")]
+    return {n: tuple(r[1] for r in conn.execute(f'PRAGMA {alias}.table_info("{n}")'))
+            for n in names if not n.startswith(("_", "sqlite_"))}
+
+
+def _union_views(conn: sqlite3.Connection, entry: _Entry) -> list[tuple[str, list[str], tuple[str, ...]]]:
+    """컬럼 구성이 같은 테이블끼리 묶어 TEMP 뷰 all_<table> 를 만든다."""
+    groups: dict[tuple[str, ...], list[tuple[str, str]]] = {}
+    for i, _ in enumerate(entry.files, 1):
+        for table, cols in _tables(conn, f"f{i}").items():
+            groups.setdefault(cols, []).append((f"f{i}", table))
+
+    views, used = [], set()
+    for cols, members in groups.items():
+        if len({alias for alias, _ in members}) < 2:
+            continue
+        name = f"all_{members[0][1]}"
+        while name in used:
+            name += "_"
+        used.add(name)
+        selects = []
+        for alias, table in members:
+            source = entry.files[int(alias[1:]) - 1][0].replace("'", "''")
+            selects.append(f"SELECT '{source}' AS source_file, * FROM {alias}.\"{table}\"")
+        conn.execute(f'CREATE TEMP VIEW IF NOT EXISTS "{name}" AS ' + " UNION ALL ".join(selects))
+        views.append((name, [f"{a}.{t}" for a, t in members], cols))
+    return views
+
+
+def _open(entry: _Entry) -> sqlite3.Connection:
+    with span("fileset.open", files=len(entry.files)):
+        conn = sqlite3.connect("file::memory:", uri=True, check_same_thread=False)
+        for i, (_, path) in enumerate(entry.files, 1):
+            conn.execute(f"ATTACH DATABASE ? AS f{i}", (f"{Path(path).resolve().as_uri()}?mode=ro",))
+        views = _union_views(conn, entry)
+        if not entry.schema:
+            entry.schema = _schema_text(conn, entry, views)
+    REGISTRY.inc("pos_fileset_connections_opened_total")
+    return conn
+
+
+def _acquire(entry: _Entry) -> sqlite3.Connection:
+    try:
+        return entry.idle.get_nowait()
+    except queue.Empty:
+        pass
+    with entry.lock:
+        can_open = entry.opened < POOL_SIZE
+        if can_open:
+            entry.opened += 1
+    if can_open:
+        try:
+            return _open(entry)
+        except Exception:
+            with entry.lock:
+                entry.opened -= 1
+            raise
+    return entry.idle.get(timeout=ACQUIRE_TIMEOUT)
+
+
+def _release(entry: _Entry, conn: sqlite3.Connection) -> None:
+    if entry.closed:
+        conn.close()
+    else:
+        entry.idle.put(conn)
+
+
+def _close(entry: _Entry) -> None:
+    entry.closed = True
+    while True:
+        try:
+            entry.idle.get_nowait().close()
+        except queue.Empty:
+            break
+
+
+def _entry(files: list[File]) -> _Entry:
+    key = _key(files)
+    with _SETS_LOCK:
+        entry = _SETS.get(key)
+        if entry is not None:
+            _SETS.move_to_end(key)
+            REGISTRY.inc("pos_fileset_cache_total", result="hit")
+            return entry
+        entry = _SETS[key] = _Entry(key, [(f.file_name, f.file_sqlpath) for f in files])
+        REGISTRY.inc("pos_fileset_cache_total", result="miss")
+        while len(_SETS) > MAX_SETS:
+            _close(_SETS.popitem(last=False)[1])
+    return entry
+
+
+def forget_file(file_id: int) -> None:
+    """파일 삭제 시 그 파일이 들어 있는 세트의 커넥션을 닫는다."""
+    with _SETS_LOCK:
+        for key in [k for k in _SETS if any(part[0] == file_id for part in k)]:
+            _close(_SETS.pop(key))
+
+
+# ── schema text ──────────────────────────────────────────────
+def _file_tables_text(schema: str, alias: str) -> list[str]:
+    # 파일별 file_schema 의 "- table1: ..." 줄을 "- f1.table1: ..." 로 바꿔 재사용
+    return [f"  - {alias}.{line[2:]}" for line in schema.splitlines() if line.startswith("- ")]
+
+
+def _schema_text(conn: sqlite3.Connection, entry: _Entry, views) -> str:
+    ids = [part[0] for part in entry.key]
+    schemas = dict(File.objects.filter(file_id__in=ids).values_list("file_id", "file_schema"))
+    lines = ["Attached files (address tables as f<n>.<table>):"]
+    for i, ((name, _), file_id) in enumerate(zip(entry.files, ids), 1):
+        lines.append(f"- f{i} = {name}")
+        lines.extend(_file_tables_text(schemas.get(file_id, ""), f"f{i}"))
+    if views:
+        lines.append("Union views (all rows of the files below + source_file TEXT = original file name; "
+                     "prefer these for cross-file comparisons):")
+        for name, members, cols in views:
+            lines.append(f"- {name} = {' ∪ '.join(members)}: source_file, " + ", ".join(cols))
+    return "\n".join(lines)
+
+
+# ── public API ───────────────────────────────────────────────
+class FileSet:
+    """채팅에 연결된 파일들. 파일이 하나면 기존처럼 그 파일 DB 를 직접 쓴다."""
+
+    def __init__(self, files: list[File]):
+        if not files:
+            raise FileSetError("no files")
+        if len(files) > MAX_FILES:
+            raise FileSetError(f"at most {MAX_FILES} files can be attached to a chat")
+        self.files = sorted(files, key=lambda f: f.file_id)
+
+    @property
+    def primary(self) -> File:
+        return self.files[0]
+
+    @property
+    def business_category(self) -> str:
+        return self.primary.file_business_category
+
+    @property
+    def schema(self) -> str:
+        if len(self.files) == 1:
+            return self.primary.file_schema
+        entry = _entry(self.files)
+        if not entry.schema:
+            conn = _acquire(entry)     # 첫 커넥션을 열면서 스키마 텍스트도 만든다
+            _release(entry, conn)
+        return entry.schema
+
+    def schema_for(self, question: str) -> str:
+        """질문에 필요한 컬럼만 남긴 스키마 (단일 파일의 넓은 테이블만, api/schema_index.py)"""
+        if len(self.files) != 1:
+            return self.schema
+        return prune(self.primary.file_sqlpath, self.primary.file_schema, question)
+
+    def query(self, sql: str) -> pd.DataFrame | list | int:
+        if len(self.files) == 1:
+            return execute_sqlite_query(self.primary.file_sqlpath, sql, True)
+        entry = _entry(self.files)
+        conn = _acquire(entry)
+        try:
+            with span("sql", files=len(self.files)) as sp:
+                cur = conn.execute(sql)
+                if cur.description is None:
+                    return cur.rowcount
+                rows = cur.fetchall()
+                sp.set(rows=len(rows))
+                return pd.DataFrame(rows, columns=[c[0] for c in cur.description])
+        finally:
+            _release(entry, conn)
+
+    def explain(self, sql: str) -> str | None:
+        """실행하지 않고 EXPLAIN 으로 검증. 통과하면 None, 아니면 SQLite 오류 메시지"""
+        if len(self.files) == 1:
+            return explain_sqlite_query(self.primary.file_sqlpath, sql)
+        entry = _entry(self.files)
+        conn = _acquire(entry)
+        try:
+            conn.execute(f"EXPLAIN {sql}")
+            return None
+        except sqlite3.Error as e:
+            return str(e)
+        finally:
+            _release(entry, conn)
+
+    def rewrite(self, sql: str) -> Rewrite | None:
+        """단일 파일이면 롤업 테이블로 답할 수 있는 집계 쿼리를 바꾼 SQL (api/rollups.py)"""
+        if len(self.files) != 1:
+            return None
+        return rewrite(self.primary.file_sqlpath, sql)
+
+    def query_batch(self, queries: list[str], max_workers: int = POOL_SIZE) -> list[pd.DataFrame | Exception]:
+        if len(self.files) == 1:
+            return execute_sqlite_queries(self.primary.file_sqlpath, queries, max_workers=max_workers)
+
+        def run(sql: str) -> pd.DataFrame | Exception:
+            try:
+                result = self.query(sql)
+                return result if isinstance(result, pd.DataFrame) else pd.DataFrame()
+            except Exception as e:
+                return e
+
+        with span("sql.batch", queries=len(queries)), \
+             ThreadPoolExecutor(max_workers=max(1, min(max_workers, POOL_SIZE, len(queries)))) as pool:
+            # 요청 trace(contextvar)를 작업마다 복사해 워커의 "sql" span 도 trace 에 남긴다
+            futures = [pool.submit(contextvars.copy_context().run, run, sql) for sql in queries]
+            return [f.result() for f in futures]
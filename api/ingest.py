@@ -0,0 +1,527 @@
+"""
+Spreadsheet ingestion: uploaded .xlsx → one SQLite table per sheet.
+
+* Rows are streamed straight from the sheet XML (pull parser, shared
+  strings and date formats resolved with openpyxl's helpers), so no cell
+  object model is built and memory stays flat regardless of sheet size.
+* A header row is detected in the first rows of every sheet, so title /
+  blank rows above the header are skipped and header-less sheets get
+  col1, col2 … names.
+* Large workbooks load sheets in parallel processes; each worker writes to a
+  private temporary SQLite file which is then ATTACHed and copied into the
+  destination DB, so workers never contend for the same write lock.
+* Every table (CSV included) goes through the typed-ingestion stage in
+  `column_types`: dates / times / money / flags are normalized chunk by chunk,
+  derived month / weekday / hour columns are added and the detected types are
+  recorded in `_column_types` and shown in the schema text.
+* layout="compact" stores category columns as integer codes with `_dict_*`
+  lookup tables; the rows live in `_data_<table>` and a view with the
+  original table / column names keeps LLM SQL unchanged.
+* rollups=True also materializes date × category rollup tables that
+  `rollups.rewrite` answers aggregate queries from.
+* .xls (Excel 97-2003) needs the optional `xlrd` package.
+"""
+import multiprocessing
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import pandas as pd
+from openpyxl.styles.numbers import is_date_format
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel
+
+from .column_types import ColumnType, apply_types, describe, index_columns, infer_types, read_types, write_types
+from .rollups import build_rollups
+
+HEADER_SCAN_ROWS   = 20
+BATCH_ROWS         = 5_000
+PARALLEL_MIN_BYTES = 2 * 1024 * 1024    # 이보다 작은 파일은 프로세스 기동 비용이 더 크다
+SHEET_TABLE        = "sheet"            # 워커 임시 DB 안의 테이블 이름
+LAYOUTS            = ("plain", "compact")
+DICT_MAX_VALUES    = 65_535             # 이보다 서로 다른 값이 많으면 사전 인코딩하지 않음
+
+
+class UnsupportedSpreadsheet(ValueError):
+    """읽을 수 없는 스프레드시트 형식"""
+
+
+# ── schema text ──────────────────────────────────────────────
+def next_table_name(conn: sqlite3.Connection) -> str:
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+    idx = 1
+    while f"table{idx}" in existing:
+        idx += 1
+    return f"table{idx}"
+
+
+def build_schema_text(conn: sqlite3.Connection, db_path: Path, notes: dict[str, str] | None = None,
+                      columns: dict[str, set[str]] | None = None) -> str:
+    """
+    LLM 프롬프트에 넣을 사람이 읽는 스키마 설명. notes 는 테이블별 부가 설명 (예: 원본 시트 이름).
+    `_` 로 시작하는 내부 테이블은 빼고, 적재 시 감지한 타입을 컬럼 뒤에 붙인다.
+    columns 에 있는 테이블은 그 컬럼만 싣고 "[N of M columns shown]" 을 붙인다 (api/schema_index.py).
+    """
+    notes = notes or {}
+    types = read_types(conn)
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') ORDER BY name;")
+    tables = [r[0] for r in cur.fetchall() if not r[0].startswith(("_", "sqlite_"))]
+
+    lines = [f"Database: {db_path.name}", "Tables:"]
+    for tbl in tables:
+        cur.execute(f"PRAGMA table_info('{tbl}');")
+        cols = cur.fetchall()     # (cid, name, type, notnull, dflt_value, pk)
+        shown = [c for c in cols if c[1] in columns[tbl]] if columns and tbl in columns else cols
+        col_defs = []
+        for _, name, ctype, notnull, default, pk in shown:
+            bits = [name, ctype]
+            if notnull:              bits.append("NOT NULL")
+            if default is not None:  bits.append(f"DEFAULT {default}")
+            if pk:                   bits.append("PRIMARY KEY")
+            note = describe(types[tbl][name]) if name in types.get(tbl, {}) else ""
+            if note:                 bits.append(note)
+            col_defs.append(" ".join(bits))
+        label = f"{tbl} ({notes[tbl]})" if tbl in notes else tbl
+        if len(shown) < len(cols):
+            label += f" [{len(shown)} of {len(cols)} columns shown]"
+        lines.append(f"- {label}: " + ", ".join(col_defs))
+    return "\n".join(lines)
+
+
+def write_frames(frames: Iterable[pd.DataFrame], conn: sqlite3.Connection, table: str,
+                 if_exists: str = "append") -> tuple[int, dict[str, ColumnType]]:
+    """
+    DataFrame 청크들을 타입 정규화해 table 에 이어 쓴다. 타입은 첫 청크로 한 번만 정한다.
+
+    Returns:
+        (행 수, 컬럼 타입)
+    """
+    types: dict[str, ColumnType] = {}
+    n = 0
+    for df in frames:
+        if df.columns.empty:
+            break
+        if not types:
+            types = infer_types(df)
+        df = apply_types(df, types)
+        df.to_sql(table, conn, if_exists=if_exists if n == 0 else "append", index=False)
+        n += len(df)
+    return n, types
+
+
+def finish_table(conn: sqlite3.Connection, table: str, types: dict[str, ColumnType],
+                 physical: str | None = None, rollups: bool = False) -> None:
+    """
+    감지한 타입 기록 + 날짜 컬럼 인덱스 (compact 레이아웃이면 인덱스는 physical(_data_*) 테이블에).
+    rollups 이면 집계 쿼리용 날짜 × 범주 롤업 테이블도 만든다 (api/rollups.py).
+    """
+    if types:
+        write_types(conn, table, types)
+        index_columns(conn, physical or table, types)
+        if rollups:
+            build_rollups(conn, table, types)
+
+
+# ── compact layout ───────────────────────────────────────────
+def _q(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def compact_table(conn: sqlite3.Connection, source: str, table: str,
+                  types: dict[str, ColumnType]) -> str | None:
+    """
+    source(ATTACH 된 임시 DB 의 테이블, 예: src."sheet")를 사전 인코딩해 table 로 설치한다.
+
+        _dict_<table>_<col>   (code INTEGER PRIMARY KEY, value TEXT UNIQUE)
+        _data_<table>         category 컬럼만 INTEGER 코드로 바뀐 실제 행
+        <table>               VIEW, 원래 컬럼 이름·순서 그대로 (코드 → 값)
+
+    Returns:
+        실제 행이 든 테이블 이름, 인코딩할 컬럼이 없으면 None (호출 측에서 그대로 복사)
+    """
+    schema, _, src_name = source.partition(".")
+    cols = conn.execute(f"PRAGMA {schema}.table_info({src_name})").fetchall()
+    encoded = []
+    for _, name, *_ in cols:
+        t = types.get(name)
+        if t is None or t.kind != "category" or t.derived_from:
+            continue
+        n = conn.execute(f"SELECT COUNT(DISTINCT {_q(name)}) FROM {source}").fetchone()[0]
+        if n <= DICT_MAX_VALUES:
+            encoded.append(name)
+    if not encoded:
+        return None
+
+    data = f"_data_{table}"
+    dicts = {col: f"_dict_{table}_{col}" for col in encoded}
+    for col, d in dicts.items():
+        conn.execute(f"CREATE TABLE {_q(d)} (code INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)")
+        conn.execute(f"INSERT INTO {_q(d)} (value) SELECT DISTINCT {_q(col)} FROM {source} "
+                     f"WHERE {_q(col)} IS NOT NULL ORDER BY 1")
+
+    # 뷰는 LEFT JOIN 대신 상관 스칼라 서브쿼리로 값을 찾는다. SQLite 는 쓰지 않는 LEFT JOIN 도
+    # 매 행 실행하지만, 서브쿼리 컬럼은 쿼리에서 참조할 때만 평가된다.
+    defs, select, view_cols = [], [], []
+    for _, name, ctype, *_ in cols:
+        if name in dicts:
+            defs.append(f"{_q(name)} INTEGER")
+            select.append(f"(SELECT code FROM {_q(dicts[name])} WHERE value = s.{_q(name)})")
+            view_cols.append(f"(SELECT value FROM {_q(dicts[name])} WHERE code = d.{_q(name)}) AS {_q(name)}")
+        else:
+            defs.append(f"{_q(name)} {ctype}".rstrip())
+            select.append(f"s.{_q(name)}")
+            view_cols.append(f"d.{_q(name)}")
+    conn.execute(f"CREATE TABLE {_q(data)} ({', '.join(defs)})")
+    conn.execute(f"INSERT INTO {_q(data)} SELECT {', '.join(select)} FROM {source} s")
+    conn.execute(f"CREATE VIEW {_q(table)} AS SELECT {', '.join(view_cols)} FROM {_q(data)} d")
+    return data
+
+
+def _install(conn: sqlite3.Connection, part: str, table: str,
+             types: dict[str, ColumnType], layout: str, rollups: bool = False) -> None:
+    """임시 DB(part)의 SHEET_TABLE 을 conn 의 table 로 옮긴다."""
+    conn.execute("ATTACH DATABASE ? AS src", (part,))
+    source = f'src."{SHEET_TABLE}"'
+    physical = compact_table(conn, source, table, types) if layout == "compact" else None
+    if physical is None:
+        ddl = conn.execute("SELECT sql FROM src.sqlite_master WHERE name = ?", (SHEET_TABLE,)).fetchone()[0]
+        conn.execute(ddl.replace(f'"{SHEET_TABLE}"', f'"{table}"', 1))
+        conn.execute(f'INSERT INTO "{table}" SELECT * FROM {source}')
+    finish_table(conn, table, types, physical, rollups)
+    conn.commit()
+    conn.execute("DETACH DATABASE src")
+
+
+# ── header detection ─────────────────────────────────────────
+def _filled(row: tuple) -> list:
+    return [v for v in row if v is not None and not (isinstance(v, str) and not v.strip())]
+
+
+def detect_header(sample: list[tuple]) -> int | None:
+    """
+    sample(시트 앞부분 행들)에서 헤더 행 인덱스를 찾는다.
+
+    제목/메모처럼 폭이 좁은 행은 건너뛰고, 가장 넓은 행의 절반 이상이 채워진
+    첫 행이 서로 다른 문자열로만 이루어져 있으면 헤더로 본다. 그렇지 않으면
+    헤더가 없는 시트로 보고 None.
+    """
+    widths = [len(_filled(r)) for r in sample]
+    widest = max(widths, default=0)
+    if widest == 0:
+        return None
+    for i, (row, width) in enumerate(zip(sample, widths)):
+        if width < max(1, widest / 2):
+            continue
+        values = _filled(row)
+        if all(isinstance(v, str) for v in values) and len({v.strip() for v in values}) == len(values):
+            return i
+        return None
+    return None
+
+
+def _column_names(header: tuple | None, width: int) -> list[str]:
+    names, seen = [], {}
+    for i in range(width):
+        raw = header[i] if header is not None and i < len(header) else None
+        name = str(raw).strip().replace("\n", " ") if raw is not None and str(raw).strip() else f"col{i + 1}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 1
+        names.append(name)
+    return names
+
+
+def _frames(rows: Iterator[tuple]) -> Iterator[pd.DataFrame]:
+    """행 스트림 → 헤더 감지 → BATCH_ROWS 단위 DataFrame"""
+    sample = []
+    for row in rows:
+        sample.append(row)
+        if len(sample) >= HEADER_SCAN_ROWS:
+            break
+    header_idx = detect_header(sample)
+
+    if header_idx is None:
+        data_start = next((i for i, r in enumerate(sample) if _filled(r)), len(sample))
+        width = max((len(r) for r in sample), default=0)
+        header = None
+    else:
+        data_start = header_idx + 1
+        header = sample[header_idx]
+        # 헤더 오른쪽 끝의 빈 칸은 잘라낸다
+        width = max(i + 1 for i, v in enumerate(header) if v is not None and str(v).strip())
+    columns = _column_names(header, width)
+
+    def body() -> Iterable[tuple]:
+        yield from sample[data_start:]
+        yield from rows
+
+    batch = []
+    for row in body():
+        row = tuple(row[:width])
+        if not _filled(row):
+            continue
+        batch.append(row + (None,) * (width - len(row)))
+        if len(batch) >= BATCH_ROWS:
+            yield pd.DataFrame.from_records(batch, columns=columns)
+            batch = []
+    if batch or not columns:
+        yield pd.DataFrame.from_records(batch, columns=columns)
+
+
+# ── xlsx streaming reader ────────────────────────────────────
+# openpyxl read-only 모드도 셀마다 Cell/스타일 객체를 거쳐 느리다. 값만 필요하므로
+# 시트 XML 을 직접 pull-parse 하고 공유 문자열·날짜 서식만 해석한다.
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+_DATE_NUMFMT_IDS = set(range(14, 23)) | set(range(27, 37)) | {45, 46, 47} | set(range(50, 59))
+_COL_CACHE: dict[str, int] = {}
+
+
+def _col_index(ref: str) -> int:
+    letters = ref.rstrip("0123456789")
+    idx = _COL_CACHE.get(letters)
+    if idx is None:
+        idx = 0
+        for ch in letters:
+            idx = idx * 26 + (ord(ch) - 64)
+        idx = _COL_CACHE[letters] = idx - 1
+    return idx
+
+
+def _ns(zf, member: str) -> str:
+    head = zf.open(member).read(4096).decode("utf-8", "ignore")
+    m = re.search(r'xmlns="([^"]+)"', head)
+    return "{%s}" % m.group(1) if m else ""
+
+
+def _sheet_member(zf, sheet: str) -> str:
+    ns = _ns(zf, "xl/workbook.xml")
+    wb_root = ET.fromstring(zf.read("xl/workbook.xml"))
+    rid = next(s.get(_REL_NS) for s in wb_root.iter(f"{ns}sheet") if s.get("name") == sheet)
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    target = next(r.get("Target") for r in rels if r.get("Id") == rid)
+    return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+
+
+def _date_epoch(zf) -> datetime:
+    pr = ET.fromstring(zf.read("xl/workbook.xml")).find("{*}workbookPr")
+    date1904 = pr is not None and pr.get("date1904") in ("1", "true")
+    return CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+
+
+def _shared_strings(zf) -> list[str]:
+    if "xl/sharedStrings.xml" not in zf.namelist():
+        return []
+    ns = _ns(zf, "xl/sharedStrings.xml")
+    si_tag, t_tag, rph_tag = f"{ns}si", f"{ns}t", f"{ns}rPh"
+    out = []
+    for _, el in ET.iterparse(zf.open("xl/sharedStrings.xml")):
+        if el.tag == si_tag:
+            phonetic = {id(t) for r in el.iter(rph_tag) for t in r.iter(t_tag)}
+            out.append("".join(t.text or "" for t in el.iter(t_tag) if id(t) not in phonetic))
+            el.clear()
+    return out
+
+
+def _date_styles(zf) -> set[int]:
+    if "xl/styles.xml" not in zf.namelist():
+        return set()
+    ns = _ns(zf, "xl/styles.xml")
+    root = ET.fromstring(zf.read("xl/styles.xml"))
+    custom = {int(f.get("numFmtId")): f.get("formatCode") for f in root.iter(f"{ns}numFmt")}
+    xfs = root.find(f"{ns}cellXfs")
+    dates = set()
+    for i, xf in enumerate(xfs if xfs is not None else []):
+        fmt_id = int(xf.get("numFmtId", 0))
+        if fmt_id in _DATE_NUMFMT_IDS or (fmt_id in custom and is_date_format(custom[fmt_id])):
+            dates.add(i)
+    return dates
+
+
+def iter_xlsx_rows(file_path: Path, sheet: str) -> Iterator[tuple]:
+    """시트의 행을 값 튜플로 스트리밍 (openpyxl data_only=True 와 같은 값)"""
+    with zipfile.ZipFile(file_path) as zf:
+        member = _sheet_member(zf, sheet)
+        strings = _shared_strings(zf)
+        date_styles = _date_styles(zf)
+        epoch = _date_epoch(zf)
+        ns = _ns(zf, member)
+        row_tag, c_tag, v_tag, is_tag, t_tag = (f"{ns}row", f"{ns}c", f"{ns}v", f"{ns}is", f"{ns}t")
+
+        parser = ET.XMLPullParser(events=("end",))
+        with zf.open(member) as fh:
+            while chunk := fh.read(1 << 16):
+                parser.feed(chunk)
+                for _, el in parser.read_events():
+                    if el.tag != row_tag:
+                        continue
+                    values: list = []
+                    for c in el.iter(c_tag):
+                        ref = c.get("r")
+                        col = _col_index(ref) if ref else len(values)
+                        if col > len(values):
+                            values.extend([None] * (col - len(values)))
+                        kind = c.get("t")
+                        if kind == "inlineStr":
+                            is_el = c.find(is_tag)
+                            value = "".join(x.text or "" for x in is_el.iter(t_tag)) if is_el is not None else None
+                        else:
+                            v = c.find(v_tag)
+                            raw = v.text if v is not None else None
+                            if raw is None:
+                                value = None
+                            elif kind == "s":
+                                value = strings[int(raw)]
+                            elif kind == "b":
+                                value = raw == "1"
+                            elif kind in ("str", "e"):
+                                value = raw if kind == "str" else None
+                            elif kind == "d":
+                                value = datetime.fromisoformat(raw)
+                            else:
+                                value = float(raw) if ("." in raw or "E" in raw or "e" in raw) else int(raw)
+                                if date_styles and c.get("s") and int(c.get("s")) in date_styles:
+                                    value = from_excel(value, epoch)
+                        values.append(value)
+                    el.clear()
+                    yield tuple(values)
+
+
+# ── per-sheet loaders (run in worker processes) ──────────────
+def _stage(frames: Iterable[pd.DataFrame], out_db: str) -> tuple[int, dict[str, ColumnType]]:
+    """frames 를 임시 DB out_db 의 SHEET_TABLE 로 적재 (저널 없이, 최종 DB 로 옮기기 전 단계)"""
+    conn = sqlite3.connect(out_db)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    try:
+        loaded = write_frames(frames, conn, SHEET_TABLE)
+        conn.commit()
+    finally:
+        conn.close()
+    return loaded
+
+
+def _load_sheet(file_path: str, sheet: str, out_db: str) -> tuple[int, dict[str, ColumnType]]:
+    """시트 하나를 out_db 의 SHEET_TABLE 로 적재하고 (행 수, 컬럼 타입)을 반환"""
+    file_path = Path(file_path)
+    if file_path.suffix.lower() == ".xls":
+        return _stage(_xls_frames(file_path, sheet), out_db)
+    return _stage(_frames(iter_xlsx_rows(file_path, sheet)), out_db)
+
+
+def _xls_frames(file_path: Path, sheet: str) -> Iterator[pd.DataFrame]:
+    raw = pd.read_excel(file_path, sheet_name=sheet, header=None, engine="xlrd")
+    rows = (tuple(None if pd.isna(v) else v for v in r) for r in raw.itertuples(index=False, name=None))
+    return _frames(rows)
+
+
+def xls_supported() -> bool:
+    try:
+        import xlrd  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def sheet_names(file_path: Path) -> list[str]:
+    if file_path.suffix.lower() == ".xls":
+        if not xls_supported():
+            raise UnsupportedSpreadsheet(
+                ".xls (Excel 97-2003) files need the optional 'xlrd' package; "
+                "re-save the file as .xlsx or .csv")
+        return list(pd.ExcelFile(file_path, engine="xlrd").sheet_names)
+
+    from openpyxl import load_workbook
+    wb = load_workbook(file_path, read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+# ── entry points ─────────────────────────────────────────────
+def csv_to_sqlite(file_path: str | Path, db_path: str | Path, chunksize: int | None = None,
+                  if_exists: str = "replace", layout: str = "plain",
+                  rollups: bool = False) -> tuple[Path, str]:
+    """
+    CSV 를 chunksize(기본 BATCH_ROWS) 행씩 읽어 다음 table{n} 으로 적재한다.
+    plain 은 바로 쓰고, compact 는 임시 DB 에 적재한 뒤 사전 인코딩해 옮긴다.
+
+    Returns
+    -------
+    (db_path, schema_text)
+    """
+    file_path, db_path = Path(file_path), Path(db_path)
+    chunks = pd.read_csv(file_path, chunksize=chunksize or BATCH_ROWS)
+
+    with sqlite3.connect(db_path) as conn:
+        table = next_table_name(conn)
+        if layout == "compact":
+            tmpdir = Path(tempfile.mkdtemp(prefix="ingest_", dir=db_path.parent))
+            try:
+                part = str(tmpdir / "csv.db")
+                _, types = _stage(chunks, part)
+                _install(conn, part, table, types, layout, rollups)
+            finally:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+        else:
+            _, types = write_frames(chunks, conn, table, if_exists=if_exists)
+            finish_table(conn, table, types, rollups=rollups)
+        return db_path, build_schema_text(conn, db_path)
+
+
+def excel_to_sqlite(file_path: str | Path, db_path: str | Path,
+                    workers: int | None = None, layout: str = "plain",
+                    rollups: bool = False) -> tuple[Path, str]:
+    """
+    통합 문서의 모든 시트를 table1, table2 … 로 적재한다 (빈 시트는 건너뜀).
+
+    Returns
+    -------
+    (db_path, schema_text)
+    """
+    file_path, db_path = Path(file_path), Path(db_path)
+    sheets = sheet_names(file_path)
+    if not sheets:
+        raise UnsupportedSpreadsheet("workbook has no sheets")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    parallel = workers > 1 and len(sheets) > 1 and file_path.stat().st_size >= PARALLEL_MIN_BYTES
+
+    tmpdir = Path(tempfile.mkdtemp(prefix="ingest_", dir=db_path.parent))
+    try:
+        parts = [str(tmpdir / f"sheet{i}.db") for i in range(len(sheets))]
+        if parallel:
+            # 요청 처리 스레드가 있는 프로세스에서 fork 하지 않도록 spawn 사용
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=min(workers, len(sheets)), mp_context=ctx) as pool:
+                loaded = list(pool.map(_load_sheet, [str(file_path)] * len(sheets), sheets, parts))
+        else:
+            loaded = [_load_sheet(str(file_path), s, p) for s, p in zip(sheets, parts)]
+
+        if not any(n for n, _ in loaded):
+            raise UnsupportedSpreadsheet("workbook has no data rows")
+
+        notes = {}
+        with sqlite3.connect(db_path) as conn:
+            for sheet, part, (n, types) in zip(sheets, parts, loaded):
+                if not n:
+                    continue
+                table = next_table_name(conn)
+                _install(conn, part, table, types, layout, rollups)
+                notes[table] = f"sheet: {sheet}"
+            schema_text = build_schema_text(conn, db_path, notes)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return db_path, schema_text
@@ -0,0 +1,209 @@
+"""
+LLM client layer.
+
+Every ChatOpenAI instance (chat turns, text2sql, make_title …) sends through
+one shared, keep-alive `httpx.Client` with tuned pool limits and timeouts,
+instead of each instance opening its own connection pool. Models are looked up
+by purpose:
+
+    from .llm import get_model
+    text2sql(get_model("sql"), question, schema)
+
+Each purpose (answer / sql / title) is routed to its own model, temperature
+and max_tokens through settings.LLM_PURPOSES; a route may name an
+`escalate_to` purpose whose (larger) model is used when the cheap model's
+output fails validation (`escalation()`). `record_call()` tracks latency and
+estimated cost per purpose and model.
+Connection reuse is measured with httpcore's `trace` extension and exported
+as pos_llm_http_requests_total / pos_llm_connections_opened_total plus a
+"llm.connect" latency stage (TCP + TLS setup).
+
+`get_embeddings()` returns the OpenAIEmbeddings client used by schema
+retrieval (api/schema_index.py) on the same httpx client.
+
+`configure()` rebuilds every model against another endpoint (the offline
+stub server in benchmarks and tests).
+"""
+import logging
+import threading
+import time
+from typing import Any
+
+import httpx
+from django.conf import settings
+from langchain_openai.chat_models import ChatOpenAI
+from langchain_openai.embeddings import OpenAIEmbeddings
+
+from .tracing import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PURPOSES = ("answer", "sql", "title")
+DEFAULT_MODEL = "gpt-4o-2024-08-06"
+
+# USD / 1M tokens: (input, cached input, output). 가장 긴 prefix 가 일치하는 항목을 쓴다
+MODEL_PRICES: dict[str, tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+}
+_ROUTE_KEYS = ("escalate_to",)      # ChatOpenAI 인자가 아닌 라우팅 설정
+
+_LOCK = threading.Lock()
+_client: httpx.Client | None = None
+_models: dict[str, ChatOpenAI] = {}
+_embeddings: OpenAIEmbeddings | None = None
+_overrides: dict[str, Any] = {}      # configure() 로 바꾼 생성 인자 (base_url, api_key, model_cls …)
+
+
+def _cfg(name: str, default):
+    return getattr(settings, f"LLM_{name}", default)
+
+
+def http2_supported() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# ── connection metrics ───────────────────────────────────────
+def _on_request(request: httpx.Request) -> None:
+    """요청마다 httpcore trace 콜백을 달아 새 연결인지 재사용인지 센다."""
+    started: list[float] = []
+
+    def trace(event: str, info: dict) -> None:
+        if event == "connection.connect_tcp.started":
+            started.append(time.perf_counter())
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete") and started:
+            if event == "connection.connect_tcp.complete":
+                REGISTRY.inc("pos_llm_connections_opened_total")
+            if event == "connection.start_tls.complete" or request.url.scheme == "http":
+                REGISTRY.observe("llm.connect", time.perf_counter() - started[0])
+        elif event in ("http11.send_request_headers.started", "http2.send_request_headers.started"):
+            REGISTRY.inc("pos_llm_http_requests_total", reused="false" if started else "true")
+
+    request.extensions["trace"] = trace
+
+
+def _build_client() -> httpx.Client:
+    http2 = bool(_cfg("HTTP2", False))
+    if http2 and not http2_supported():
+        logger.warning("[llm] LLM_HTTP2=1 needs the optional 'h2' package; falling back to HTTP/1.1")
+        http2 = False
+    return httpx.Client(
+        http2=http2,
+        limits=httpx.Limits(max_connections=_cfg("MAX_CONNECTIONS", 16),
+                            max_keepalive_connections=_cfg("MAX_KEEPALIVE", 16),
+                            keepalive_expiry=_cfg("KEEPALIVE_EXPIRY", 60)),
+        timeout=httpx.Timeout(_cfg("READ_TIMEOUT", 120), connect=_cfg("CONNECT_TIMEOUT", 5)),
+        event_hooks={"request": [_on_request]},
+    )
+
+
+def http_client() -> httpx.Client:
+    global _client
+    if _client is None:
+        with _LOCK:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+# ── per-purpose registry ─────────────────────────────────────
+def _model_kwargs(purpose: str) -> dict[str, Any]:
+    # 재시도는 resilience.invoke 가 맡으므로 openai 클라이언트 자체 재시도는 끈다.
+    # stream_usage: 스트리밍 응답도 마지막 chunk 로 토큰 사용량을 받는다
+    kwargs = {"model": _cfg("MODEL", DEFAULT_MODEL), "temperature": 0.0, "max_retries": 0,
+              "stream_usage": True}
+    kwargs.update({k: v for k, v in _cfg("PURPOSES", {}).get(purpose, {}).items() if k not in _ROUTE_KEYS})
+    kwargs.update({k: v for k, v in _overrides.items() if k != "model_cls"})
+    return kwargs
+
+
+def get_model(purpose: str = "answer") -> ChatOpenAI:
+    """목적(answer / sql / title)별 ChatOpenAI. 모두 같은 httpx 클라이언트를 쓴다."""
+    if purpose not in PURPOSES:
+        raise ValueError(f"unknown LLM purpose {purpose!r}; expected one of {PURPOSES}")
+    model = _models.get(purpose)
+    if model is None:
+        client = http_client()
+        with _LOCK:
+            model = _models.get(purpose)
+            if model is None:
+                cls = _overrides.get("model_cls", ChatOpenAI)
+                # timeout 을 넘기지 않으면 openai 클라이언트가 요청마다 timeout=None(무제한)을 보낸다
+                model = _models[purpose] = cls(http_client=client, timeout=client.timeout,
+                                               **_model_kwargs(purpose))
+    return model
+
+
+def get_embeddings() -> OpenAIEmbeddings:
+    """스키마 검색용 임베딩 모델 (settings.SCHEMA_EMBEDDING_MODEL). 채팅 모델과 같은 httpx 클라이언트를 쓴다."""
+    global _embeddings
+    if _embeddings is None:
+        client = http_client()
+        with _LOCK:
+            if _embeddings is None:
+                # 컬럼 설명은 짧으므로 tiktoken 으로 잘라 보내는 길이 검사는 끈다
+                kwargs = {k: v for k, v in _overrides.items() if k in ("base_url", "api_key")}
+                _embeddings = OpenAIEmbeddings(model=settings.SCHEMA_EMBEDDING_MODEL, http_client=client,
+                                               timeout=client.timeout, max_retries=0,
+                                               check_embedding_ctx_length=False, **kwargs)
+    return _embeddings
+
+
+def escalation(purpose: str) -> ChatOpenAI | None:
+    """검증 실패 시 다시 물어볼 큰 모델 (route 의 escalate_to). 같은 모델이면 None"""
+    target = _cfg("PURPOSES", {}).get(purpose, {}).get("escalate_to")
+    if not target or target == purpose:
+        return None
+    model = get_model(target)
+    return None if model.model_name == get_model(purpose).model_name else model
+
+
+# ── per-purpose latency / cost ───────────────────────────────
+def _price(model_name: str) -> tuple[float, float, float] | None:
+    prices = {**MODEL_PRICES, **_cfg("PRICES", {})}
+    matches = [name for name in prices if model_name.startswith(name)]
+    return prices[max(matches, key=len)] if matches else None
+
+
+def cost_usd(model_name: str, usage: dict) -> float | None:
+    price = _price(model_name)
+    if price is None:
+        return None
+    cached = (usage.get("input_token_details") or {}).get("cache_read") or 0
+    uncached = usage.get("input_tokens", 0) - cached
+    return (uncached * price[0] + cached * price[1] + usage.get("output_tokens", 0) * price[2]) / 1e6
+
+
+def record_call(purpose: str, model: ChatOpenAI, response: Any, seconds: float) -> None:
+    """목적·모델별 호출 수, 지연시간(llm.<purpose>), 토큰, 추정 비용"""
+    name = getattr(model, "model_name", "") or "unknown"
+    usage = getattr(response, "usage_metadata", None) or {}
+    REGISTRY.observe(f"llm.{purpose}", seconds)
+    REGISTRY.inc("pos_llm_calls_total", purpose=purpose, model=name)
+    REGISTRY.inc("pos_llm_input_tokens_total", usage.get("input_tokens", 0), purpose=purpose, model=name)
+    REGISTRY.inc("pos_llm_output_tokens_total", usage.get("output_tokens", 0), purpose=purpose, model=name)
+    cost = cost_usd(name, usage)
+    if cost is not None:
+        REGISTRY.inc("pos_llm_cost_usd_total", cost, purpose=purpose, model=name)
+
+
+def configure(**overrides) -> None:
+    """
+    모든 목적의 모델을 주어진 생성 인자로 다시 만든다 (예: base_url=stub.base_url,
+    api_key="stub", model_cls=OfflineChatOpenAI). 인자 없이 부르면 기본 설정으로 되돌린다.
+    """
+    global _client, _embeddings, _overrides
+    with _LOCK:
+        _models.clear()
+        _embeddings = None
+        _overrides = dict(overrides)
+        if _client is not None:
+            _client.close()
+            _client = None
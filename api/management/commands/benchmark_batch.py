@@ -0,0 +1,109 @@
+"""
+배치 질문(api/batch.py) 벤치마크
+
+$ python manage.py benchmark_batch --rows 20000 --workers 1,2,4,8 --llm-latency-ms 300
+
+카페 더미 데이터에 api/bench/schema_questions.json 의 질문(+ --repeat 번 반복한 질문)을
+배치 작업 하나로 돌린다. 로컬 stub OpenAI 서버가 질문마다 정답 SQL 을 --llm-latency-ms 뒤에 돌려주므로,
+워커 수에 따라 처리량(질문/초)이 어떻게 늘어나는지와 중복 질문·SQL 이 몇 번 재사용됐는지를 본다.
+"""
+import json
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from api import admission, batch, fewshot, llm
+from api.bench.dummy import load_generator
+from api.bench.stub_openai import OfflineChatOpenAI, StubOpenAIServer
+from api.models import BatchItem, BatchJob, File, User
+from api.tracing import REGISTRY
+from api.utils import file_to_sqlite
+from api.views import _generate_sql, _query
+
+QUESTIONS = Path(__file__).resolve().parents[2] / "bench" / "schema_questions.json"
+
+
+class Command(BaseCommand):
+    help = "Run one batch job per worker count against a stub LLM and report throughput and reuse"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=20000)
+        parser.add_argument("--workers", default="1,2,4,8", help="comma separated BATCH_WORKERS values")
+        parser.add_argument("--repeat", type=int, default=4, help="questions sent twice (duplicate questions)")
+        parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="simulated LLM latency per call")
+        parser.add_argument("--json", action="store_true", help="also print a machine-readable summary")
+
+    def handle(self, *args, **opts):
+        gold = {q["question"]: q["sql"] for q in json.loads(QUESTIONS.read_text(encoding="utf-8"))}
+        questions = list(gold) + list(gold)[:opts["repeat"]]
+
+        def reply(messages: list[dict]) -> str:
+            question = str(messages[-1].get("content", "")).split("NL Question: ")[-1].split("\n")[0]
+            return f"```sql\n{gold.get(question, 'SELECT 1')}\n```"
+
+        workdir = Path(tempfile.mkdtemp(prefix="bench_batch_"))
+        user, _ = User.objects.get_or_create(
+            user_id="bench_batch",
+            defaults={"user_email": "bench_batch@bench.local", "user_password": "x", "user_name": "bench"})
+        summary = []
+        try:
+            csv_path = workdir / "cafe.csv"
+            load_generator().write_pos("cafe", opts["rows"], csv_path, seed=opts["rows"])
+            db_path, schema = file_to_sqlite(csv_path, csv_path.with_suffix(".db"), rollups=settings.ROLLUPS_ENABLED)
+            file = File.objects.create(user_id=user, file_name=csv_path.name, file_size=csv_path.stat().st_size,
+                                       file_type="csv", file_path=str(csv_path), file_sqlpath=str(db_path),
+                                       file_schema=schema, file_processed=File.FileProcessingStatus.COMPLETED,
+                                       file_business_category="cafe")
+
+            self.stdout.write(f"\n== cafe rows={opts['rows']:,}  questions={len(questions)} "
+                              f"(unique {len(gold)})  llm latency={opts['llm_latency_ms']:.0f}ms ==")
+            with StubOpenAIServer(reply, delay=opts["llm_latency_ms"] / 1000) as stub:
+                llm.configure(model_cls=OfflineChatOpenAI, base_url=stub.base_url, api_key="stub", max_retries=0)
+                for workers in [int(w) for w in opts["workers"].split(",") if w.strip()]:
+                    with override_settings(BATCH_WORKERS=workers, SCHEMA_EMBEDDING_MODEL="local"):
+                        summary.append(self._run(user, file, questions, workers, stub))
+        finally:
+            llm.configure()
+            batch.reset()
+            admission.reset()
+            fewshot.reset()
+            shutil.rmtree(workdir, ignore_errors=True)
+            user.delete()
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2))
+
+    def _run(self, user: User, file: File, questions: list[str], workers: int, stub: StubOpenAIServer) -> dict:
+        # 실행마다 같은 조건: 새 풀, 빈 few-shot 저장소
+        batch.reset()
+        admission.reset()
+        fewshot.reset()
+        user.sqlexample_set.all().delete()
+        REGISTRY.reset()
+        requests = stub.requests
+
+        job = BatchJob.objects.create(user_id=user, file_id=file, question_count=len(questions))
+        BatchItem.objects.bulk_create([BatchItem(job_id=job, position=i, question=q) for i, q in enumerate(questions)])
+        wall = time.perf_counter()
+        batch.run(job.job_id, _generate_sql, _query)
+        wall = time.perf_counter() - wall
+
+        items = list(job.items.all())
+        totals = [i.total_ms for i in items if i.item_source != BatchItem.ItemSource.DUPLICATE]
+        failed = sum(i.item_status == BatchJob.JobStatus.FAILED for i in items)
+        row = {"workers": workers, "wall_s": wall, "questions_per_s": len(items) / wall,
+               "question_p50_ms": statistics.median(totals), "failed": failed,
+               "llm_calls": stub.requests - requests,
+               "duplicate_questions": REGISTRY.counter("pos_batch_duplicate_questions_total"),
+               "shared_sql": REGISTRY.counter("pos_batch_sql_shared_total")}
+        self.stdout.write(f"  workers={workers:<3} wall={wall:6.2f}s  {row['questions_per_s']:6.2f} questions/s  "
+                          f"p50/question={row['question_p50_ms']:7.1f}ms  llm calls={row['llm_calls']}  "
+                          f"reused: questions={row['duplicate_questions']:.0f} sql={row['shared_sql']:.0f}  "
+                          f"failed={failed}")
+        return row
@@ -0,0 +1,198 @@
+"""
+오프라인 end-to-end 채팅 벤치마크
+
+$ python manage.py benchmark_chat --type cafe --sizes 1000,10000,100000 --sessions 10 --concurrency 4
+
+make_dummy_csv.py 로 여러 크기의 데이터셋을 만들어 SQLite 로 변환한 뒤,
+로컬 stub OpenAI 서버(api/bench/stub_openai.py)가 녹화된 응답(api/bench/recordings.json)을
+재생하는 상태에서 /api/chat/start → /api/chat/query 세션을 반복 실행한다.
+실제 ChatOpenAI 클라이언트·HTTP·미들웨어·DB 경로를 모두 거치므로
+같은 머신에서 브랜치 간 성능을 비교할 수 있다.
+
+출력: 세션 처리량, 엔드포인트별 지연시간, 단계별(tracing) 지연시간, 메모리
+토큰 카운팅은 근사치(OfflineChatOpenAI)를 사용하므로 네트워크 없이 실행된다.
+"""
+import json
+import resource
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+from django.test import Client
+from django.test.utils import override_settings
+
+from api import admission, llm
+from api.bench.dummy import load_generator
+from api.bench.replay import ReplayResponder
+from api.bench.stub_openai import StubOpenAIServer, OfflineChatOpenAI
+from api.models import ChatTrace, User, File
+from api.tracing import REGISTRY
+from api.utils import file_to_sqlite
+
+
+def _pct(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+class Command(BaseCommand):
+    help = "Replay recorded LLM responses through start_chat/query_chat and report latency, throughput and memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--type", choices=["cafe", "cvs"], default="cafe")
+        parser.add_argument("--sizes", default="1000,10000,100000", help="comma separated dataset row counts")
+        parser.add_argument("--sessions", type=int, default=10, help="start+query sessions per dataset")
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--llm-latency-ms", type=float, default=0.0,
+                            help="simulated LLM latency per call (0 = measure server overhead only)")
+        parser.add_argument("--llm-chunk-ms", type=float, default=0.0,
+                            help="simulated generation time per streamed chunk of 8 characters")
+        parser.add_argument("--fastpath", action="store_true",
+                            help="let template questions skip the LLM loop (off: every question goes to the LLM)")
+        parser.add_argument("--json", action="store_true", help="also print a machine-readable summary")
+
+    def handle(self, *args, **opts):
+        gen = load_generator()
+        responder = ReplayResponder()
+        workdir = Path(tempfile.mkdtemp(prefix="bench_chat_"))
+
+        user, _ = User.objects.get_or_create(
+            user_id="bench_chat",
+            defaults={"user_email": "bench_chat@bench.local", "user_password": "x", "user_name": "bench"})
+
+        summary = []
+        try:
+            # 한 사용자가 수십 세션을 연달아 만들므로 사용자별 속도 제한은 끈다 (동시 실행 제한은 유지).
+            # 녹화된 질문은 fast path 템플릿에 맞으므로 --fastpath 가 없으면 LLM 루프를 재도록 끈다
+            with override_settings(ADMISSION_RATES={}, FASTPATH_ENABLED=opts["fastpath"]), \
+                 StubOpenAIServer(responder, delay=opts["llm_latency_ms"] / 1000,
+                                  stream_chunk_delay=opts["llm_chunk_ms"] / 1000) as stub:
+                admission.reset()
+                llm.configure(model_cls=OfflineChatOpenAI, base_url=stub.base_url, api_key="stub", max_retries=0)
+                for size in [int(s) for s in opts["sizes"].split(",") if s.strip()]:
+                    summary.append(self._run_size(gen, size, user, workdir, responder, stub, opts))
+        finally:
+            llm.configure()
+            admission.reset()
+            shutil.rmtree(Path("media") / user.user_id, ignore_errors=True)
+            shutil.rmtree(workdir, ignore_errors=True)
+            user.delete()
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2))
+
+    def _run_size(self, gen, size: int, user: User, workdir: Path, responder: ReplayResponder,
+                  stub: StubOpenAIServer, opts) -> dict:
+        csv_path = workdir / f"{opts['type']}_{size}.csv"
+        gen.write_pos(opts["type"], size, csv_path, seed=size)
+
+        t0 = time.perf_counter()
+        db_path, schema = file_to_sqlite(csv_path, csv_path.with_suffix(".db"), chunksize=1000,
+                                         rollups=settings.ROLLUPS_ENABLED)
+        ingest_s = time.perf_counter() - t0
+
+        file = File.objects.create(user_id=user, file_name=csv_path.name, file_size=csv_path.stat().st_size,
+                                   file_type="csv", file_path=str(csv_path), file_sqlpath=str(db_path),
+                                   file_schema=schema, file_processed=File.FileProcessingStatus.COMPLETED,
+                                   file_business_category=opts["type"])
+
+        REGISTRY.reset()
+        latencies: dict[str, list[float]] = {"start": [], "query": []}
+        errors = [0]
+        lock = threading.Lock()
+        pending = list(range(opts["sessions"]))
+        cancelled = stub.cancelled_streams
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        pending.pop()
+                    t = time.perf_counter()
+                    r = client.post("/api/chat/start", json.dumps({
+                        "user_id": user.user_id, "message_text": responder.questions["start"],
+                        "file_id": file.file_id}), content_type="application/json").json()
+                    t_start = time.perf_counter() - t
+                    if r["response"] != 200:
+                        with lock:
+                            errors[0] += 1
+                        continue
+                    t = time.perf_counter()
+                    q = client.post("/api/chat/query", json.dumps({
+                        "chat_id": r["data"]["chat_id"], "message_text": responder.questions["query"]}),
+                        content_type="application/json").json()
+                    t_query = time.perf_counter() - t
+                    with lock:
+                        latencies["start"].append(t_start)
+                        latencies["query"].append(t_query)
+                        errors[0] += q["response"] != 200
+            finally:
+                connection.close()
+
+        since = timezone.now()
+        tracemalloc.start()
+        wall = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(opts["concurrency"])]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - wall
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        done = len(latencies["start"])
+        self.stdout.write(f"\n== {opts['type']} rows={size:,}  ingest={ingest_s:.2f}s  "
+                          f"db={db_path.stat().st_size / 1e6:.1f}MB ==")
+        self.stdout.write(f"sessions={done} errors={errors[0]} concurrency={opts['concurrency']} "
+                          f"wall={wall:.2f}s → {done / wall:.2f} sessions/sec")
+        for name, values in latencies.items():
+            if values:
+                self.stdout.write(f"  /api/chat/{name:<6} p50={statistics.median(values) * 1000:8.1f}ms "
+                                  f"p95={_pct(values, 0.95) * 1000:8.1f}ms")
+        stages = {k: v for k, v in REGISTRY.snapshot().items() if not k.startswith("http ")}
+        for stage, s in sorted(stages.items(), key=lambda kv: -kv[1]["mean"] * kv[1]["count"]):
+            self.stdout.write(f"  {stage:<16} n={s['count']:<5} mean={s['mean'] * 1000:8.2f}ms "
+                              f"p50={s['p50'] * 1000:8.2f}ms p95={s['p95'] * 1000:8.2f}ms")
+        self.stdout.write(f"  memory: python peak={peak / 1e6:.1f}MB  max RSS={rss_mb:.0f}MB")
+        requests = REGISTRY.counter("pos_llm_http_requests_total")
+        self.stdout.write(f"  llm http: requests={requests:.0f}  "
+                          f"new connections={REGISTRY.counter('pos_llm_connections_opened_total'):.0f}  "
+                          f"reused={REGISTRY.counter('pos_llm_http_requests_total', reused='true'):.0f}")
+        for purpose in llm.PURPOSES:
+            calls = REGISTRY.counter("pos_llm_calls_total", purpose=purpose)
+            if calls:
+                self.stdout.write(f"  llm {purpose:<7} calls={calls:.0f}  "
+                                  f"est. cost=${REGISTRY.counter('pos_llm_cost_usd_total', purpose=purpose):.4f}")
+        self.stdout.write(f"  llm streams stopped early="
+                          f"{REGISTRY.counter('pos_llm_stream_early_stops_total'):.0f}  "
+                          f"cancelled at server={stub.cancelled_streams - cancelled}")
+        self.stdout.write(f"  sql rewritten onto rollups={REGISTRY.counter('pos_sql_rollup_rewrites_total'):.0f}")
+        self.stdout.write(f"  few-shot examples shown={REGISTRY.counter('pos_fewshot_examples_total'):.0f}  "
+                          f"recorded={REGISTRY.counter('pos_fewshot_recorded_total'):.0f}")
+        tokens = ChatTrace.objects.filter(chat_id__user_id=user, created_at__gte=since).aggregate(
+            prompt=Sum("prompt_tokens"), cached=Sum("cached_tokens"))
+        prompt, cached = tokens["prompt"] or 0, tokens["cached"] or 0
+        self.stdout.write(f"  prompt tokens={prompt:,}  cached={cached:,} "
+                          f"({100 * cached / prompt if prompt else 0:.1f}%)")
+
+        return {"rows": size, "ingest_s": ingest_s, "sessions": done, "errors": errors[0],
+                "sessions_per_s": done / wall,
+                "latency_ms": {k: {"p50": statistics.median(v) * 1000, "p95": _pct(v, 0.95) * 1000}
+                               for k, v in latencies.items() if v},
+                "stages_ms": {k: {"mean": v["mean"] * 1000, "p95": v["p95"] * 1000} for k, v in stages.items()},
+                "peak_mb": peak / 1e6, "max_rss_mb": rss_mb,
+                "prompt_tokens": prompt, "cached_tokens": cached}
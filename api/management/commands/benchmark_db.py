@@ -0,0 +1,142 @@
+"""
+메타데이터 DB 벤치마크 / 쿼리 플랜 점검
+
+$ python manage.py benchmark_db --users 5 --chats 50 --messages 40 --repeat 30 --explain
+
+N users × M chats × K messages 를 시드한 뒤 list_chats / get_chat_history /
+get_chat_history_all 엔드포인트와 [T2S] 파일 조회 쿼리를 반복 호출하여
+호출당 쿼리 수와 지연시간(p50/p95)을 출력한다.
+기본적으로 하나의 트랜잭션 안에서 실행 후 롤백하므로 DB 에 흔적이 남지 않는다.
+"""
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from api.models import User, File, Chat, Message
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Seed users/chats/messages and report per-endpoint query counts and latencies"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=3)
+        parser.add_argument("--chats", type=int, default=20, help="chats per user")
+        parser.add_argument("--messages", type=int, default=30, help="messages per chat")
+        parser.add_argument("--files", type=int, default=5, help="files per user")
+        parser.add_argument("--repeat", type=int, default=20, help="calls per endpoint")
+        parser.add_argument("--page-size", type=int, default=50)
+        parser.add_argument("--explain", action="store_true", help="print the query plan of every captured statement")
+        parser.add_argument("--keep", action="store_true", help="commit the seeded rows instead of rolling back")
+
+    def handle(self, *args, **opts):
+        try:
+            with transaction.atomic():
+                self._run(opts)
+                if not opts["keep"]:
+                    raise _Rollback()
+        except _Rollback:
+            self.stdout.write("(seed data rolled back)")
+
+    # ── seed ─────────────────────────────────────────────────
+    def _seed(self, opts) -> tuple[User, Chat]:
+        now = timezone.now()
+        roles = [Message.MessageRole.USER, Message.MessageRole.INTERNAL, Message.MessageRole.ASSISTANT]
+
+        users = User.objects.bulk_create([
+            User(user_id=f"bench_{i}", user_email=f"bench_{i}@bench.local",
+                 user_password="x", user_name=f"bench_{i}")
+            for i in range(opts["users"])
+        ])
+
+        File.objects.bulk_create([
+            File(user_id=u, file_name=f"f{j}.csv", file_size=0, file_type="csv",
+                 file_path="", file_processed=(File.FileProcessingStatus.COMPLETED if j % 2 == 0
+                                               else File.FileProcessingStatus.FAILED))
+            for u in users for j in range(opts["files"])
+        ])
+
+        chats = Chat.objects.bulk_create([
+            Chat(user_id=u, chat_title=f"chat {j}", created_at=now - timedelta(minutes=j))
+            for u in users for j in range(opts["chats"])
+        ])
+
+        batch = []
+        for c in chats:
+            for k in range(opts["messages"]):
+                batch.append(Message(chat_id=c, message_text="x" * 200,
+                                     message_role=roles[k % 3],
+                                     created_at=c.created_at + timedelta(seconds=k)))
+            if len(batch) >= 5000:
+                Message.objects.bulk_create(batch)
+                batch = []
+        Message.objects.bulk_create(batch)
+
+        return users[0], chats[0]
+
+    # ── measure ──────────────────────────────────────────────
+    def _measure(self, label: str, fn, repeat: int, explain: bool):
+        timings, n_queries, captured = [], 0, None
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as ctx:
+                t0 = time.perf_counter()
+                fn()
+                timings.append((time.perf_counter() - t0) * 1000)
+            n_queries = len(ctx.captured_queries)
+            captured = ctx.captured_queries
+
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(f"{label:<32} queries={n_queries:<3} "
+                          f"p50={statistics.median(timings):7.2f}ms  p95={p95:7.2f}ms")
+
+        if explain and captured:
+            for q in captured:
+                self._explain(q["sql"])
+
+    def _explain(self, sql: str):
+        if not sql.lstrip().upper().startswith("SELECT"):
+            return
+        prefix = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+        with connection.cursor() as cur:
+            cur.execute(prefix + sql)
+            plan = cur.fetchall()
+        self.stdout.write(f"    {sql[:120]}{'…' if len(sql) > 120 else ''}")
+        for row in plan:
+            self.stdout.write(f"      {row[-1]}")
+
+    def _run(self, opts):
+        t0 = time.perf_counter()
+        user, chat = self._seed(opts)
+        total_msgs = opts["users"] * opts["chats"] * opts["messages"]
+        self.stdout.write(f"Seeded {opts['users']} users × {opts['chats']} chats × {opts['messages']} messages "
+                          f"({total_msgs:,} messages) in {time.perf_counter() - t0:.2f}s")
+
+        client = Client()
+        repeat, explain, size = opts["repeat"], opts["explain"], opts["page_size"]
+
+        self._measure("list_chats (all)",
+                      lambda: client.get("/api/chat/list", {"user_id": user.user_id}), repeat, explain)
+        self._measure(f"list_chats (limit={size})",
+                      lambda: client.get("/api/chat/list", {"user_id": user.user_id, "limit": size}), repeat, explain)
+        self._measure("get_chat_history",
+                      lambda: client.get("/api/chat/history", {"chat_id": chat.chat_id}), repeat, explain)
+        self._measure("get_chat_history_all",
+                      lambda: client.get("/api/chat/history/all", {"chat_id": chat.chat_id}), repeat, explain)
+        self._measure(f"get_chat_history (limit={size})",
+                      lambda: client.get("/api/chat/history", {"chat_id": chat.chat_id, "limit": size}),
+                      repeat, explain)
+        self._measure("[T2S] latest completed file",
+                      lambda: File.objects.filter(user_id=user,
+                                                  file_processed=File.FileProcessingStatus.COMPLETED)
+                                          .latest("updated_at"),
+                      repeat, explain)
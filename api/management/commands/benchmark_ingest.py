@@ -0,0 +1,160 @@
+"""
+스프레드시트 적재 벤치마크
+
+$ python manage.py benchmark_ingest --type cvs --rows 100000 --sheets 4 --workers 4
+
+make_dummy_csv.py 로 시트 여러 개짜리 .xlsx 를 만든 뒤 (각 시트 위에 제목 행과
+빈 행을 두어 헤더 감지도 함께 거친다) 다음 경로의 적재 시간과 메모리를 비교한다.
+
+  legacy       pd.read_excel (첫 시트만, openpyxl 전체 객체 모델) + to_sql
+  streaming    ingest.excel_to_sqlite, 프로세스 1개
+  parallel     ingest.excel_to_sqlite, 시트별 프로세스 (--workers)
+
+각 경로는 별도 프로세스에서 실행하므로 최대 RSS 가 서로 섞이지 않는다
+(parallel 의 RSS 는 시트 워커를 제외한 메인 프로세스 기준).
+
+이어서 같은 통합 문서를 plain / compact(사전 인코딩 + 뷰) 레이아웃으로 적재해
+DB 파일 크기와 범주형 컬럼 GROUP BY / 필터 쿼리 시간을 비교한다 (--skip-layouts 로 생략).
+"""
+import multiprocessing
+import resource
+import statistics
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from api.bench.dummy import load_generator
+from api.column_types import read_types
+from api.ingest import excel_to_sqlite
+
+
+def _make_workbook(gen, kind: str, rows: int, sheets: int, path: Path) -> None:
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    for s in range(sheets):
+        ws = wb.create_sheet(f"2025-Q{s + 1}")
+        ws.append([f"{kind.upper()} POS 매출 보고서 (Q{s + 1})"])     # 제목 행
+        ws.append([])
+        for i, df in enumerate(gen.iter_pos_chunks(kind, rows, seed=s)):
+            if i == 0:
+                ws.append(list(df.columns))
+            for row in df.itertuples(index=False, name=None):
+                ws.append([v.item() if hasattr(v, "item") else v for v in row])
+    wb.save(path)
+
+
+def _legacy(xlsx: str, db: str) -> None:
+    df = pd.read_excel(xlsx)
+    with sqlite3.connect(db) as conn:
+        df.to_sql("table1", conn, index=False, chunksize=1000)
+
+
+def _variant(name: str, xlsx: str, db: str, workers: int, out) -> None:
+    t0 = time.perf_counter()
+    if name == "legacy":
+        _legacy(xlsx, db)
+    else:
+        excel_to_sqlite(xlsx, db, workers=workers)
+    seconds = time.perf_counter() - t0
+    with sqlite3.connect(db) as conn:
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")
+                  if not r[0].startswith("_")]
+        rows = sum(conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables)
+    out.put({"seconds": seconds, "tables": len(tables), "rows": rows,
+             "rss_mb": _peak_rss_mb()})
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss 는 fork 직후 부모의 최대값을 물려받으므로 exec 이후 값인 VmHWM 을 읽는다
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _layout_queries(db: Path) -> list[tuple[str, str]]:
+    """table1 의 범주형 컬럼(최대 3개)마다 GROUP BY 집계 + 등치 필터 쿼리"""
+    with sqlite3.connect(db) as conn:
+        types = read_types(conn).get("table1", {})
+        money = next((c for c, t in types.items() if t.kind == "currency"), None)
+        agg = f'SUM("{money}")' if money else "COUNT(*)"
+        queries = []
+        for col in [c for c, t in types.items() if t.kind == "category"][:3]:
+            value = conn.execute(f'SELECT "{col}" FROM table1 WHERE "{col}" IS NOT NULL LIMIT 1').fetchone()[0]
+            queries.append((f"GROUP BY {col}", f'SELECT "{col}", COUNT(*), {agg} FROM table1 GROUP BY "{col}"'))
+            queries.append((f"{col} = ?", f'SELECT COUNT(*), {agg} FROM table1 WHERE "{col}" = \'{value}\''))
+    return queries
+
+
+def _time_query(db: Path, sql: str, repeat: int = 5) -> float:
+    with sqlite3.connect(db) as conn:
+        conn.execute(sql).fetchall()      # 페이지 캐시 예열
+        runs = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            conn.execute(sql).fetchall()
+            runs.append(time.perf_counter() - t0)
+    return statistics.median(runs) * 1000
+
+
+class Command(BaseCommand):
+    help = "Compare spreadsheet ingestion paths (legacy read_excel vs streaming / parallel openpyxl)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--type", choices=["cafe", "cvs"], default="cvs")
+        parser.add_argument("--rows", type=int, default=50_000, help="rows per sheet")
+        parser.add_argument("--sheets", type=int, default=4)
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--skip-layouts", action="store_true", help="skip the plain vs compact comparison")
+
+    def handle(self, *args, **opts):
+        gen = load_generator()
+        workdir = Path(tempfile.mkdtemp(prefix="bench_ingest_"))
+        ctx = multiprocessing.get_context("spawn")
+        try:
+            xlsx = workdir / "workbook.xlsx"
+            t0 = time.perf_counter()
+            _make_workbook(gen, opts["type"], opts["rows"], opts["sheets"], xlsx)
+            self.stdout.write(f"workbook: {opts['sheets']} sheets × {opts['rows']:,} rows, "
+                              f"{xlsx.stat().st_size / 1e6:.1f} MB (built in {time.perf_counter() - t0:.1f}s)\n")
+
+            self.stdout.write(f"{'path':<12}{'seconds':>9}{'tables':>8}{'rows':>12}{'rows/s':>11}"
+                              f"{'peak RSS MB':>13}")
+            for name, workers in (("legacy", 1), ("streaming", 1), ("parallel", opts["workers"])):
+                db = workdir / f"{name}.db"
+                out = ctx.Queue()
+                proc = ctx.Process(target=_variant, args=(name, str(xlsx), str(db), workers, out))
+                proc.start()
+                r = out.get()
+                proc.join()
+                self.stdout.write(f"{name:<12}{r['seconds']:>9.2f}{r['tables']:>8}{r['rows']:>12,}"
+                                  f"{r['rows'] / r['seconds']:>11,.0f}{r['rss_mb']:>13.0f}")
+
+            if not opts["skip_layouts"]:
+                self._compare_layouts(xlsx, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _compare_layouts(self, xlsx: Path, workdir: Path) -> None:
+        dbs = {}
+        self.stdout.write(f"\n{'layout':<12}{'load s':>9}{'DB MB':>9}")
+        for layout in ("plain", "compact"):
+            db = dbs[layout] = workdir / f"layout_{layout}.db"
+            t0 = time.perf_counter()
+            excel_to_sqlite(xlsx, db, workers=1, layout=layout)
+            seconds = time.perf_counter() - t0
+            self.stdout.write(f"{layout:<12}{seconds:>9.2f}{db.stat().st_size / 1e6:>9.1f}")
+
+        self.stdout.write(f"\n{'query (table1, median ms)':<36}{'plain':>9}{'compact':>9}")
+        for label, sql in _layout_queries(dbs["plain"]):
+            self.stdout.write(f"{label:<36}{_time_query(dbs['plain'], sql):>9.1f}"
+                              f"{_time_query(dbs['compact'], sql):>9.1f}")
@@ -0,0 +1,164 @@
+"""
+스키마 검색(api/schema_index.py) 벤치마크
+
+$ python manage.py benchmark_schema --rows 5000 --extra-columns 120
+$ python manage.py benchmark_schema --live          # 실제 OpenAI 로 SQL 정확도까지
+
+카페 더미 데이터에 ERP/WMS/CRM … 식의 잡음 컬럼을 붙여 넓은 테이블을 만들고,
+api/bench/schema_questions.json 의 질문마다 전체 schema 와 줄인 schema 를 비교한다.
+
+오프라인: 로컬 stub 서버의 /embeddings (hashed n-gram 벡터)로 검색을 돌려
+          프롬프트 토큰 수(tiktoken, 인코딩이 없으면 근사치)와
+          정답 SQL 에 필요한 컬럼이 줄인 schema 에 모두 남았는지(column recall)를 본다.
+--live:   SCHEMA_EMBEDDING_MODEL 과 sql 모델을 실제로 호출해 두 schema 로 text2sql 을 돌리고,
+          정답 SQL 과 실행 결과가 같은지(execution accuracy)를 비교한다.
+"""
+import json
+import re
+import shutil
+import sqlite3
+import tempfile
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from api import llm, schema_index
+from api.backend import text2sql
+from api.bench.dummy import load_generator
+from api.bench.stub_openai import StubOpenAIServer, _approx_tokens
+from api.utils import file_to_sqlite
+
+QUESTIONS = Path(__file__).resolve().parents[2] / "bench" / "schema_questions.json"
+
+# 잡음 컬럼: <시스템>_<필드>. 일부(amount_adj, tax_amount, lot_qty …)는 일부러 매출·수량과 헷갈리게
+_SYSTEMS = ("erp", "wms", "crm", "fin", "hr", "mkt")
+_FIELDS = ("ref_code", "batch_no", "status", "memo", "updated_at", "sync_flag", "owner", "score", "rate",
+           "amount_adj", "region", "grade", "vendor", "lot_qty", "tax_amount", "approval", "terminal",
+           "version", "cost_center", "note")
+_NUMERIC = ("sync_flag", "score", "rate", "amount_adj", "lot_qty", "tax_amount", "version")
+
+
+def _token_counter():
+    try:
+        import tiktoken
+        enc = tiktoken.get_encoding("o200k_base")
+        return (lambda text: len(enc.encode(text))), "tiktoken o200k_base"
+    except Exception:
+        return _approx_tokens, "approx (len/4; tiktoken encoding unavailable)"
+
+
+def _widen(df: pd.DataFrame, extra: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    names = [f"{s}_{f}" for f in _FIELDS for s in _SYSTEMS][:extra]
+    cols = {}
+    for name in names:
+        field = name.split("_", 1)[1]
+        if field in _NUMERIC:
+            cols[name] = rng.integers(0, 1000, len(df))
+        elif field == "updated_at":
+            cols[name] = pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, len(df)), unit="D")
+        else:
+            cols[name] = [f"{field.upper()}-{v}" for v in rng.integers(0, 200, len(df))]
+    return pd.concat([df, pd.DataFrame(cols, index=df.index)], axis=1)
+
+
+def _shown(schema: str, column: str) -> bool:
+    return re.search(rf"(?:: |, ){re.escape(column)} ", schema) is not None
+
+
+def _rows(df: pd.DataFrame) -> list:
+    """컬럼 이름·순서와 무관하게 비교할 수 있도록 행마다 값을 정렬한 multiset"""
+    def norm(v):
+        return round(float(v), 4) if isinstance(v, (int, float, np.number)) and not isinstance(v, bool) else str(v)
+    return sorted(tuple(sorted((norm(v) for v in row), key=repr)) for row in df.itertuples(index=False))
+
+
+class Command(BaseCommand):
+    help = "Measure schema pruning on a wide table: prompt tokens, column recall and (--live) SQL execution accuracy"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000)
+        parser.add_argument("--extra-columns", type=int, default=120, help=f"at most {len(_SYSTEMS) * len(_FIELDS)}")
+        parser.add_argument("--top-k", type=int, default=settings.SCHEMA_TOP_K)
+        parser.add_argument("--live", action="store_true",
+                            help="call the real embedding / sql models and compare SQL execution results")
+        parser.add_argument("--json", action="store_true", help="also print a machine-readable summary")
+
+    def handle(self, *args, **opts):
+        questions = json.loads(QUESTIONS.read_text(encoding="utf-8"))
+        workdir = Path(tempfile.mkdtemp(prefix="bench_schema_"))
+        try:
+            csv_path = workdir / "wide.csv"
+            load_generator().write_pos("cafe", opts["rows"], csv_path, seed=opts["rows"])
+            _widen(pd.read_csv(csv_path), opts["extra_columns"], seed=opts["rows"]).to_csv(csv_path, index=False)
+            db_path, schema = file_to_sqlite(csv_path, csv_path.with_suffix(".db"))
+
+            with override_settings(SCHEMA_RETRIEVAL_ENABLED=True, SCHEMA_TOP_K=opts["top_k"]):
+                if opts["live"]:
+                    summary = self._run(questions, db_path, schema, opts)
+                else:
+                    with StubOpenAIServer(lambda messages: "") as stub:
+                        llm.configure(base_url=stub.base_url, api_key="stub")
+                        try:
+                            summary = self._run(questions, db_path, schema, opts)
+                        finally:
+                            llm.configure()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2))
+
+    def _run(self, questions: list[dict], db_path: Path, schema: str, opts) -> dict:
+        count, counter_name = _token_counter()
+        full_tokens = count(schema)
+        with closing(sqlite3.connect(db_path)) as conn:
+            n_cols = len(conn.execute("PRAGMA table_info(table1)").fetchall())
+            gold = [pd.read_sql_query(q["sql"], conn) for q in questions] if opts["live"] else []
+
+        self.stdout.write(f"\n== wide cafe table: rows={opts['rows']:,} columns={n_cols} "
+                          f"top_k={opts['top_k']} embedding="
+                          f"{settings.SCHEMA_EMBEDDING_MODEL if opts['live'] else 'stub (local n-grams)'} ==")
+        self.stdout.write(f"tokens: {counter_name}")
+
+        results = []
+        for i, q in enumerate(questions):
+            pruned = schema_index.prune(db_path, schema, q["question"])
+            missing = [c for c in q["columns"] if not _shown(pruned, c)]
+            row = {"question": q["question"], "tokens": count(pruned), "missing": missing}
+            if opts["live"]:
+                for name, text in (("full", schema), ("pruned", pruned)):
+                    row[name] = self._correct(db_path, q["question"], text, gold[i])
+            results.append(row)
+            mark = "ok" if not missing else f"missing {', '.join(missing)}"
+            live = f"  full={'✓' if row['full'] else '✗'} pruned={'✓' if row['pruned'] else '✗'}" \
+                if opts["live"] else ""
+            self.stdout.write(f"  {row['tokens']:6d} tok  {mark:<28}{live}  {q['question']}")
+
+        mean_tokens = sum(r["tokens"] for r in results) / len(results)
+        recall = sum(not r["missing"] for r in results) / len(results)
+        self.stdout.write(f"schema tokens: full={full_tokens:,}  pruned mean={mean_tokens:,.0f} "
+                          f"({100 * (1 - mean_tokens / full_tokens):.1f}% smaller)")
+        self.stdout.write(f"questions whose columns all survived pruning: {recall * 100:.1f}%")
+        summary = {"columns": n_cols, "full_tokens": full_tokens, "pruned_tokens_mean": mean_tokens,
+                   "column_recall": recall, "questions": results}
+        if opts["live"]:
+            for name in ("full", "pruned"):
+                summary[f"accuracy_{name}"] = sum(r[name] for r in results) / len(results)
+            self.stdout.write(f"execution accuracy: full={summary['accuracy_full'] * 100:.1f}%  "
+                              f"pruned={summary['accuracy_pruned'] * 100:.1f}%")
+        return summary
+
+    def _correct(self, db_path: Path, question: str, schema: str, gold: pd.DataFrame) -> bool:
+        try:
+            sql = text2sql(llm.get_model("sql"), question, schema)
+            with closing(sqlite3.connect(db_path)) as conn:
+                return _rows(pd.read_sql_query(sql, conn)) == _rows(gold)
+        except Exception as e:
+            self.stderr.write(f"  [{question}] {type(e).__name__}: {e}")
+            return False
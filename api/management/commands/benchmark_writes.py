@@ -0,0 +1,145 @@
+"""
+메타데이터 DB 동시 쓰기 벤치마크
+
+$ python manage.py benchmark_writes --threads 16 --messages 200
+
+여러 요청 스레드가 동시에 Message.objects.create 를 호출하고, 백그라운드
+파일 처리 스레드가 File 행을 갱신하는 상황을 흉내 내어 초당 저장 메시지 수와
+`database is locked` 오류 수를 출력한다.
+
+이어서 --turns 턴짜리 채팅 요청 하나가 메시지를 개별 create 로 저장할 때와
+MessageBuffer 로 일괄 저장할 때의 요청당 쓰기(INSERT / 트랜잭션) 수와 지연시간을 비교한다.
+
+설정 전/후 비교:
+$ DB_SQLITE_TUNING=0 DB_CONN_MAX_AGE=0 DB_NAME=/tmp/before.sqlite3 python manage.py migrate
+$ DB_SQLITE_TUNING=0 DB_CONN_MAX_AGE=0 DB_NAME=/tmp/before.sqlite3 python manage.py benchmark_writes
+$ python manage.py benchmark_writes
+"""
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+from django.test.utils import CaptureQueriesContext
+
+from api.message_buffer import MessageBuffer
+from api.models import User, File, Chat, Message
+
+
+class Command(BaseCommand):
+    help = "Concurrent Message.objects.create throughput (messages/sec) against the configured database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8, help="concurrent request threads")
+        parser.add_argument("--messages", type=int, default=100, help="messages per thread")
+        parser.add_argument("--file-updaters", type=int, default=2,
+                            help="threads that repeatedly save File rows (background ingestion)")
+        parser.add_argument("--turns", type=int, default=6, help="LLM turns per simulated chat request")
+        parser.add_argument("--requests", type=int, default=20, help="simulated chat requests per persistence mode")
+
+    def _describe_db(self) -> str:
+        if connection.vendor != "sqlite":
+            return f"{connection.vendor} (CONN_MAX_AGE={connection.settings_dict['CONN_MAX_AGE']})"
+        with connection.cursor() as cur:
+            cur.execute("PRAGMA journal_mode;")
+            journal = cur.fetchone()[0]
+            cur.execute("PRAGMA busy_timeout;")
+            busy = cur.fetchone()[0]
+        return (f"sqlite journal_mode={journal} busy_timeout={busy}ms "
+                f"CONN_MAX_AGE={connection.settings_dict['CONN_MAX_AGE']}")
+
+    def handle(self, *args, **opts):
+        self.stdout.write(self._describe_db())
+
+        user, _ = User.objects.get_or_create(
+            user_id="bench_writes",
+            defaults={"user_email": "bench_writes@bench.local", "user_password": "x", "user_name": "bench"})
+        chats = [Chat.objects.create(user_id=user, chat_title=f"bench {i}") for i in range(opts["threads"])]
+        files = [File.objects.create(user_id=user, file_name="bench.csv", file_size=0, file_type="csv", file_path="")
+                 for _ in range(opts["file_updaters"])]
+
+        written, errors = [0], [0]
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def writer(chat: Chat):
+            ok = err = 0
+            try:
+                for i in range(opts["messages"]):
+                    try:
+                        Message.objects.create(chat_id=chat, message_text=f"bench message {i}",
+                                               message_role=Message.MessageRole.INTERNAL)
+                        ok += 1
+                    except OperationalError:
+                        err += 1
+            finally:
+                connection.close()
+                with lock:
+                    written[0] += ok
+                    errors[0] += err
+
+        def updater(file: File):
+            try:
+                while not stop.is_set():
+                    try:
+                        file.file_processed = File.FileProcessingStatus.PROCESSING
+                        file.save()
+                    except OperationalError:
+                        with lock:
+                            errors[0] += 1
+            finally:
+                connection.close()
+
+        updaters = [threading.Thread(target=updater, args=(f,)) for f in files]
+        writers = [threading.Thread(target=writer, args=(c,)) for c in chats]
+
+        for t in updaters:
+            t.start()
+        t0 = time.perf_counter()
+        for t in writers:
+            t.start()
+        for t in writers:
+            t.join()
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        for t in updaters:
+            t.join()
+
+        self.stdout.write(f"threads={opts['threads']} file_updaters={opts['file_updaters']} "
+                          f"messages={written[0]:,} errors={errors[0]:,} "
+                          f"elapsed={elapsed:.2f}s → {written[0] / elapsed:,.0f} messages/sec")
+
+        self._compare_per_request(user, opts["turns"], opts["requests"])
+
+        user.delete()   # CASCADE 로 Chat / Message / File 정리
+
+    def _compare_per_request(self, user: User, turns: int, requests: int):
+        """턴마다 INTERNAL 로그 + assistant 응답이 생기는 채팅 요청을 흉내 낸다"""
+        chat = Chat.objects.create(user_id=user, chat_title="bench per-request")
+
+        def individual():
+            for turn in range(turns):
+                Message.objects.create(chat_id=chat, message_text=f"TURN {turn} RAW",
+                                       message_role=Message.MessageRole.INTERNAL)
+                Message.objects.create(chat_id=chat, message_text=f"reply {turn}",
+                                       message_role=Message.MessageRole.ASSISTANT)
+
+        def buffered():
+            buffer = MessageBuffer(chat)
+            for turn in range(turns):
+                buffer.add(f"TURN {turn} RAW", Message.MessageRole.INTERNAL)
+                buffer.add(f"reply {turn}", Message.MessageRole.ASSISTANT)
+            buffer.flush()
+
+        for label, fn in (("individual create", individual), ("MessageBuffer", buffered)):
+            inserts = 0
+            t0 = time.perf_counter()
+            for _ in range(requests):
+                with CaptureQueriesContext(connection) as ctx:
+                    fn()
+                inserts = sum(q["sql"].lstrip().upper().startswith("INSERT") for q in ctx.captured_queries)
+            elapsed = (time.perf_counter() - t0) * 1000 / requests
+            # autocommit 에서는 INSERT 하나가 트랜잭션(=fsync) 하나, MessageBuffer 는 한 트랜잭션
+            txns = inserts if label == "individual create" else 1
+            self.stdout.write(f"{label:<18} turns={turns} INSERTs/request={inserts:<3} "
+                              f"transactions/request={txns:<3} {elapsed:6.2f} ms/request")
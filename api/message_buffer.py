@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Chat, Message
+from .tracing import span
+
+
+class MessageBuffer:
+    """
+    한 요청(채팅 턴) 동안 생성되는 INTERNAL 로그 / assistant 응답 / 에러 메시지를
+    모아 두었다가 turn 경계에서 bulk_create 한 번(트랜잭션 하나)으로 저장한다.
+
+    * created_at 은 add() 시점에 찍으므로 저장 시점과 무관하게 순서가 유지된다.
+    * bulk_create 는 입력 순서대로 message_id 를 부여하므로 (created_at, message_id)
+      정렬도 그대로 맞는다.
+    * 사용자 메시지는 크래시에 대비해 버퍼를 거치지 않고 즉시 저장해야 한다.
+    """
+
+    def __init__(self, chat: Chat):
+        self.chat = chat
+        self._pending: list[Message] = []
+
+    def add(self, text: str, role: int, image_url: str | None = None) -> None:
+        self._pending.append(Message(chat_id=self.chat,
+                                     message_text=text,
+                                     message_role=role,
+                                     message_image_url=image_url,
+                                     created_at=timezone.now()))
+
+    def flush(self) -> int:
+        """대기 중인 메시지를 한 트랜잭션으로 저장하고 저장한 개수를 반환"""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, []
+        with span("orm.flush", messages=len(pending)), transaction.atomic():
+            Message.objects.bulk_create(pending)
+        return len(pending)
+
+    def __len__(self) -> int:
+        return len(self._pending)
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_file_file_business_category'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['user_id', '-updated_at', '-chat_id'], name='chat_user_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['user_id', 'file_processed', 'updated_at'], name='file_user_status_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat_id', 'created_at', 'message_id'], name='message_chat_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat_id', 'message_role', 'created_at'], name='message_chat_role_idx'),
+        ),
+    ]
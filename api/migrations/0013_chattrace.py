@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-19 12:43
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatTrace',
+            fields=[
+                ('trace_id', models.AutoField(primary_key=True, serialize=False)),
+                ('trace_kind', models.CharField(default='', max_length=16)),
+                ('total_ms', models.FloatField(default=0)),
+                ('stages', models.JSONField(default=dict)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('completion_tokens', models.IntegerField(default=0)),
+                ('rows_returned', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('chat_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.chat')),
+            ],
+        ),
+    ]
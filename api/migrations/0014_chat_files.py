@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_chattrace'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='files',
+            field=models.ManyToManyField(blank=True, related_name='chats', to='api.file'),
+        ),
+    ]
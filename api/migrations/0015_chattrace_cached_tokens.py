@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_chat_files'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chattrace',
+            name='cached_tokens',
+            field=models.IntegerField(default=0),
+        ),
+    ]
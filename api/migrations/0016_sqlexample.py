@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-19 14:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_chattrace_cached_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SqlExample',
+            fields=[
+                ('example_id', models.AutoField(primary_key=True, serialize=False)),
+                ('question', models.TextField()),
+                ('sql', models.TextField()),
+                ('schema_fingerprint', models.CharField(max_length=40)),
+                ('refs', models.TextField(default='')),
+                ('digest', models.CharField(max_length=40, unique=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('chat_id', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='api.chat')),
+                ('user_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_id', 'example_id'], name='sqlexample_user_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.1 on 2026-10-19 14:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_sqlexample'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchJob',
+            fields=[
+                ('job_id', models.AutoField(primary_key=True, serialize=False)),
+                ('job_status', models.IntegerField(choices=[(1, 'Pending'), (2, 'Running'), (3, 'Completed'), (4, 'Failed')], default=1)),
+                ('job_error', models.TextField(default='')),
+                ('question_count', models.IntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, default=None, null=True)),
+                ('file_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.file')),
+                ('user_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.user')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BatchItem',
+            fields=[
+                ('item_id', models.AutoField(primary_key=True, serialize=False)),
+                ('position', models.IntegerField()),
+                ('question', models.TextField()),
+                ('item_status', models.IntegerField(choices=[(1, 'Pending'), (2, 'Running'), (3, 'Completed'), (4, 'Failed')], default=1)),
+                ('item_source', models.CharField(choices=[('fastpath', 'Fast path'), ('llm', 'LLM'), ('duplicate', 'Duplicate question')], default='', max_length=16)),
+                ('sql', models.TextField(default='')),
+                ('answer_text', models.TextField(default='')),
+                ('image_url', models.CharField(blank=True, default=None, max_length=255, null=True)),
+                ('result', models.JSONField(blank=True, default=None, null=True)),
+                ('row_count', models.IntegerField(default=0)),
+                ('error', models.TextField(default='')),
+                ('shared_with', models.IntegerField(blank=True, default=None, null=True)),
+                ('queue_ms', models.FloatField(default=0)),
+                ('generate_ms', models.FloatField(default=0)),
+                ('sql_ms', models.FloatField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('job_id', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='api.batchjob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job_id', 'position'), name='batchitem_job_position_uniq')],
+            },
+        ),
+    ]
@@ -36,6 +36,12 @@ class File(models.Model):
     file_business_category = models.CharField(max_length=32, default="default")
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # [T2S] fallback: filter(user_id, file_processed).latest('updated_at')
+            models.Index(fields=["user_id", "file_processed", "updated_at"], name="file_user_status_upd_idx"),
+        ]
     
     def __str__(self):
         return self.file_path
@@ -48,6 +54,14 @@ class Chat(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     file_id = models.ForeignKey(File, on_delete=models.CASCADE, null=True, blank=True)
+    # 여러 파일을 함께 분석하는 채팅 (file_id 는 첫 번째 파일, 시스템 프롬프트 카테고리 기준)
+    files = models.ManyToManyField(File, blank=True, related_name="chats")
+
+    class Meta:
+        indexes = [
+            # list_chats: filter(user_id).order_by('-updated_at', '-chat_id')
+            models.Index(fields=["user_id", "-updated_at", "-chat_id"], name="chat_user_updated_idx"),
+        ]
     
     def __str__(self):
         return self.chat_title
@@ -68,5 +82,108 @@ class Message(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # chat history: filter(chat_id).order_by('created_at', 'message_id')
+            models.Index(fields=["chat_id", "created_at", "message_id"], name="message_chat_created_idx"),
+            # history 에서 INTERNAL 제외 / 역할별 조회
+            models.Index(fields=["chat_id", "message_role", "created_at"], name="message_chat_role_idx"),
+        ]
+
     def __str__(self):
         return self.message_text
+
+
+class ChatTrace(models.Model):
+    """채팅 요청(start/query) 1회의 단계별 소요 시간 요약"""
+    chat_id = models.ForeignKey(Chat, on_delete=models.CASCADE)
+    trace_id = models.AutoField(primary_key=True) # incremental
+    trace_kind = models.CharField(max_length=16, default="")   # "start" | "query"
+    total_ms = models.FloatField(default=0)
+    stages = models.JSONField(default=dict)    # {"llm.chat": {"count": 3, "total_ms": 4210.5}, ...}
+    prompt_tokens = models.IntegerField(default=0)
+    completion_tokens = models.IntegerField(default=0)
+    cached_tokens = models.IntegerField(default=0)     # prompt_tokens 중 prompt cache 적중분
+    rows_returned = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.chat_id_id}:{self.trace_kind} {self.total_ms:.0f}ms"
+
+
+class SqlExample(models.Model):
+    """실행에 성공한 text2sql 결과. 같은 사용자의 비슷한 질문에 few-shot 예시로 쓴다 (api/fewshot.py)"""
+    example_id = models.AutoField(primary_key=True) # incremental
+    user_id = models.ForeignKey(User, on_delete=models.CASCADE)
+    chat_id = models.ForeignKey(Chat, on_delete=models.SET_NULL, null=True, blank=True)
+    question = models.TextField()
+    sql = models.TextField()
+    schema_fingerprint = models.CharField(max_length=40)   # 테이블·컬럼 이름의 해시
+    refs = models.TextField(default="")                    # SQL 이 쓰는 테이블·컬럼 이름 (소문자, 쉼표 구분)
+    digest = models.CharField(max_length=40, unique=True)  # (사용자, 지문, 질문, SQL) 중복 방지
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # 검색 인덱스 동기화: filter(user_id, example_id__gt=last)
+            models.Index(fields=["user_id", "example_id"], name="sqlexample_user_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.question} → {self.sql[:40]}"
+
+
+class BatchJob(models.Model):
+    """한 파일에 여러 질문을 한꺼번에 돌리는 배치 작업 (api/batch.py)"""
+    class JobStatus(models.IntegerChoices):
+        PENDING = 1, 'Pending'
+        RUNNING = 2, 'Running'
+        COMPLETED = 3, 'Completed'
+        FAILED = 4, 'Failed'
+
+    job_id = models.AutoField(primary_key=True) # incremental
+    user_id = models.ForeignKey(User, on_delete=models.CASCADE)
+    file_id = models.ForeignKey(File, on_delete=models.CASCADE)
+    job_status = models.IntegerField(choices=JobStatus.choices, default=JobStatus.PENDING)
+    job_error = models.TextField(default="")
+    question_count = models.IntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True, default=None)
+
+    def __str__(self):
+        return f"batch {self.job_id} ({self.question_count} questions)"
+
+
+class BatchItem(models.Model):
+    """배치 작업의 질문 하나와 그 결과·단계별 소요 시간"""
+    class ItemSource(models.TextChoices):
+        FASTPATH = 'fastpath', 'Fast path'
+        LLM = 'llm', 'LLM'
+        DUPLICATE = 'duplicate', 'Duplicate question'
+
+    job_id = models.ForeignKey(BatchJob, on_delete=models.CASCADE, related_name="items")
+    item_id = models.AutoField(primary_key=True) # incremental
+    position = models.IntegerField()                 # 요청의 questions 순서 (0부터)
+    question = models.TextField()
+    item_status = models.IntegerField(choices=BatchJob.JobStatus.choices, default=BatchJob.JobStatus.PENDING)
+    item_source = models.CharField(max_length=16, choices=ItemSource.choices, default="")
+    sql = models.TextField(default="")
+    answer_text = models.TextField(default="")       # fast path 템플릿 답변
+    image_url = models.CharField(max_length=255, null=True, blank=True, default=None)
+    result = models.JSONField(null=True, blank=True, default=None)   # {"columns": [...], "data": [[...]]}
+    row_count = models.IntegerField(default=0)
+    error = models.TextField(default="")
+    shared_with = models.IntegerField(null=True, blank=True, default=None)  # 결과를 같이 쓴 항목의 position
+    queue_ms = models.FloatField(default=0)          # 작업 시작부터 워커가 잡을 때까지
+    generate_ms = models.FloatField(default=0)       # fast path 또는 text2sql
+    sql_ms = models.FloatField(default=0)
+    total_ms = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["job_id", "position"], name="batchitem_job_position_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.job_id_id}#{self.position} {self.question}"
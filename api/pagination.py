@@ -0,0 +1,125 @@
+"""
+Keyset pagination / field projection / ETag helpers for the chat list and
+chat history endpoints.
+
+Cursors are opaque to clients: url-safe base64 of "<iso timestamp>|<pk>".
+Paging is done on (timestamp, pk) so new rows never shift a page the way
+OFFSET would, and every page is an index range scan.
+"""
+import base64
+import hashlib
+from datetime import datetime
+
+from django.db.models import Q, QuerySet
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE     = 500
+
+
+class PaginationError(ValueError):
+    """잘못된 limit / cursor / fields 파라미터"""
+
+
+def encode_cursor(ts: datetime, pk: int) -> str:
+    raw = f"{ts.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts_str, pk_str = base64.urlsafe_b64decode(padded).decode().rsplit("|", 1)
+        return datetime.fromisoformat(ts_str), int(pk_str)
+    except Exception as e:
+        raise PaginationError("invalid cursor") from e
+
+
+def parse_limit(value: str | None) -> int | None:
+    """`limit` 가 없으면 None (= 전체 반환, 기존 동작 유지)"""
+    if value is None or value == "":
+        return None
+    try:
+        limit = int(value)
+    except ValueError as e:
+        raise PaginationError("invalid limit") from e
+    if limit <= 0:
+        raise PaginationError("invalid limit")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_fields(value: str | None, allowed: tuple[str, ...], required: tuple[str, ...]) -> tuple[str, ...]:
+    """
+    `fields=a,b,c` 프로젝션. 지정하지 않으면 allowed 전체.
+    required(커서 계산에 필요한 키 등)는 항상 포함된다.
+    """
+    if not value:
+        return allowed
+    fields = tuple(f.strip() for f in value.split(",") if f.strip())
+    unknown = set(fields) - set(allowed)
+    if unknown:
+        raise PaginationError(f"unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(dict.fromkeys(required + fields))
+
+
+def keyset_page(
+    qs: QuerySet,
+    ts_field: str,
+    pk_field: str,
+    cursor: str | None,
+    limit: int | None,
+    descending: bool = False
+) -> tuple[list, str | None]:
+    """
+    qs 를 (ts_field, pk_field) 순으로 정렬해 cursor 다음 페이지를 돌려준다.
+    qs 는 `.values(...)` 쿼리셋이어야 하며 ts_field, pk_field 를 포함해야 한다.
+
+    Returns:
+        (rows, next_cursor) — 마지막 페이지면 next_cursor 는 None
+    """
+    op = "lt" if descending else "gt"
+    if cursor:
+        ts, pk = decode_cursor(cursor)
+        qs = qs.filter(Q(**{f"{ts_field}__{op}": ts}) |
+                       Q(**{ts_field: ts, f"{pk_field}__{op}": pk}))
+
+    prefix = "-" if descending else ""
+    qs = qs.order_by(f"{prefix}{ts_field}", f"{prefix}{pk_field}")
+
+    if limit is None:
+        return list(qs), None
+
+    rows = list(qs[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last[ts_field], last[pk_field])
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.md5("|".join(str(p) for p in parts).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: HttpRequest, etag: str) -> bool:
+    header = request.headers.get("If-None-Match", "")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {c.strip().removeprefix("W/") for c in header.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def not_modified(etag: str) -> HttpResponse:
+    response = HttpResponseNotModified()
+    set_etag(response, etag)
+    return response
+
+
+def set_etag(response: HttpResponse, etag: str) -> HttpResponse:
+    response["ETag"] = etag
+    # 브라우저가 매번 재검증하도록 (fetch 폴링 시 304 로 응답)
+    response["Cache-Control"] = "private, no-cache"
+    return response
@@ -0,0 +1,226 @@
+"""
+Content-addressed cache for rendered [PLOT] charts.
+
+The key is sha256(normalized plot code + render settings). The code the model
+writes is self-contained (data is inlined, only `plt` is in scope), so the
+same code always produces the same image and a repeated chart is served from
+disk without executing anything.
+
+    media/_plots/<k[:2]>/<k>.png         full image (PLOT_FORMAT, PLOT_DPI)
+    media/_plots/<k[:2]>/<k>.thumb.png   thumbnail for the chat list
+
+Hits bump the file mtime; when the directory grows past PLOT_CACHE_MAX_MB the
+least recently used entries are removed (image + thumbnail together). Charts
+a chat message or batch item still points at are never removed — their URL is
+stored with the message and the code that drew them is not — so the cache can
+stay above the quota until those chats are deleted.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+from django.conf import settings
+from PIL import Image
+
+from .models import BatchItem, Message
+from .tracing import REGISTRY, span
+from .utils import run_pyplot_code
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = "1"     # 렌더링 방식이 바뀌면 올려서 기존 캐시 무효화
+CACHE_DIRNAME = "_plots"
+
+# pyplot 은 전역 상태(현재 figure)를 쓰므로 동시에 두 요청이 그리면 그림이 섞인다
+_RENDER_LOCK = threading.Lock()
+_QUOTA_LOCK  = threading.Lock()
+_cache_bytes: int | None = None     # 대략적인 캐시 크기 (프로세스별, 초과 시 재계산)
+
+
+def _cfg() -> tuple[int, str, int, int]:
+    fmt = getattr(settings, "PLOT_FORMAT", "png")
+    return (getattr(settings, "PLOT_DPI", 100),
+            fmt if fmt in ("png", "webp") else "png",
+            getattr(settings, "PLOT_THUMB_SIZE", 320),
+            getattr(settings, "PLOT_CACHE_MAX_MB", 512) * 1024 * 1024)
+
+
+def cache_root() -> Path:
+    return Path(settings.MEDIA_ROOT) / CACHE_DIRNAME
+
+
+def plot_key(code: str) -> str:
+    dpi, fmt, thumb, _ = _cfg()
+    # 줄 끝 공백 / 앞뒤 빈 줄 차이로 캐시가 갈라지지 않도록
+    normalized = "\n".join(line.rstrip() for line in code.strip().splitlines())
+    return hashlib.sha256(f"{CACHE_VERSION}|{dpi}|{fmt}|{thumb}|{normalized}".encode()).hexdigest()
+
+
+def _paths(key: str, fmt: str) -> tuple[Path, Path]:
+    d = cache_root() / key[:2]
+    return d / f"{key}.{fmt}", d / f"{key}.thumb.{fmt}"
+
+
+def _url(path: Path) -> str:
+    return settings.MEDIA_URL + path.relative_to(settings.MEDIA_ROOT).as_posix()
+
+
+def thumbnail_url(image_url: str | None) -> str | None:
+    """캐시 이미지 URL → 썸네일 URL. 캐시 도입 전 이미지(채팅별 uuid.png)는 썸네일이 없어 None."""
+    if not image_url or f"/{CACHE_DIRNAME}/" not in image_url:
+        return None
+    stem, dot, ext = image_url.rpartition(".")
+    return f"{stem}.thumb.{ext}" if dot else None
+
+
+def _encode(img: Image.Image, fmt: str) -> bytes:
+    out = io.BytesIO()
+    if fmt == "webp":
+        img.save(out, format="WEBP", quality=82, method=4)
+    else:
+        # 차트는 색 수가 적어 팔레트(256색)로 줄여도 눈에 띄는 차이가 없다
+        img.quantize(colors=256, method=Image.Quantize.FASTOCTREE).save(out, format="PNG", optimize=True)
+    return out.getvalue()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def render_plot(code: str) -> tuple[str, bool]:
+    """
+    plot code 를 렌더링(또는 캐시 재사용)하고 이미지 URL 을 돌려준다.
+
+    Returns:
+        (image_url, cache_hit)
+    Raises:
+        RuntimeError: 코드 실행 실패 또는 그려진 축이 없음
+    """
+    dpi, fmt, thumb_px, _ = _cfg()
+    key = plot_key(code)
+    image_path, thumb_path = _paths(key, fmt)
+
+    if image_path.exists():
+        _touch(image_path, thumb_path)
+        REGISTRY.inc("pos_plot_cache_total", result="hit")
+        return _url(image_path), True
+
+    with _RENDER_LOCK:
+        if image_path.exists():     # 같은 차트를 다른 요청이 방금 그렸으면 재사용
+            REGISTRY.inc("pos_plot_cache_total", result="hit")
+            return _url(image_path), True
+
+        try:
+            fig = run_pyplot_code(code, raise_errors=True)
+        except Exception as e:
+            plt.close("all")
+            raise RuntimeError(f"plot code failed: {type(e).__name__}: {e}") from e
+        if fig is None or not fig.get_axes():
+            plt.close("all")
+            raise RuntimeError("plot code failed to produce a figure")
+        with span("plot.savefig"):
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png", dpi=dpi, bbox_inches="tight")
+            plt.close(fig)
+
+    with span("plot.encode") as sp:
+        img = Image.open(io.BytesIO(buf.getvalue())).convert("RGBA" if fmt == "png" else "RGB")
+        image_bytes = _encode(img, fmt)
+        img.thumbnail((thumb_px, thumb_px))
+        thumb_bytes = _encode(img, fmt)
+        sp.set(bytes=len(image_bytes))
+
+    _write_atomic(thumb_path, thumb_bytes)
+    _write_atomic(image_path, image_bytes)     # 이미지가 마지막: 존재하면 썸네일도 존재
+    REGISTRY.inc("pos_plot_cache_total", result="miss")
+    _account(len(image_bytes) + len(thumb_bytes))
+    return _url(image_path), False
+
+
+def _touch(*paths: Path) -> None:
+    for p in paths:
+        try:
+            os.utime(p)
+        except OSError:
+            pass
+
+
+# ── LRU quota ────────────────────────────────────────────────
+def _entries() -> list[tuple[float, int, Path]]:
+    out = []
+    root = cache_root()
+    if not root.exists():
+        return out
+    for sub in os.scandir(root):
+        if not sub.is_dir():
+            continue
+        for e in os.scandir(sub.path):
+            if e.name.startswith(".") or ".thumb." in e.name:
+                continue
+            st = e.stat()
+            thumb = Path(e.path).with_name(e.name.replace(".", ".thumb.", 1))
+            size = st.st_size + (thumb.stat().st_size if thumb.exists() else 0)
+            out.append((st.st_mtime, size, Path(e.path)))
+    return out
+
+
+def _account(added: int) -> None:
+    global _cache_bytes
+    *_, quota = _cfg()
+    with _QUOTA_LOCK:
+        if _cache_bytes is None:
+            _cache_bytes = sum(size for _, size, _ in _entries())
+        else:
+            _cache_bytes += added
+        if _cache_bytes > quota:
+            _cache_bytes = evict(int(quota * 0.9))
+
+
+def _referenced() -> set[str]:
+    """채팅 메시지·배치 항목이 아직 가리키는 캐시 이미지 URL (그린 코드는 저장되지 않아 다시 그릴 수 없다)"""
+    marker = f"/{CACHE_DIRNAME}/"
+    urls = set(Message.objects.filter(message_image_url__contains=marker)
+               .values_list("message_image_url", flat=True).distinct())
+    urls.update(BatchItem.objects.filter(image_url__contains=marker)
+                .values_list("image_url", flat=True).distinct())
+    return urls
+
+
+def evict(target_bytes: int) -> int:
+    """
+    가장 오래 쓰이지 않은 항목부터 지워 캐시를 target_bytes 이하로 줄이고 남은 크기를 반환.
+    메시지가 참조하는 항목은 건너뛰므로 남은 크기가 target_bytes 보다 클 수 있다.
+    """
+    entries = sorted(_entries())
+    total = sum(size for _, size, _ in entries)
+    if total <= target_bytes:
+        return total
+    keep = _referenced()
+    removed = kept = 0
+    for _, size, path in entries:
+        if total <= target_bytes:
+            break
+        if _url(path) in keep:
+            kept += 1
+            continue
+        for p in (path, path.with_name(path.name.replace(".", ".thumb.", 1))):
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+        total -= size
+        removed += 1
+    if removed:
+        REGISTRY.inc("pos_plot_cache_evictions_total", removed)
+        logger.info("[plot_cache] evicted %d plots, %.1f MB left", removed, total / 1e6)
+    if total > target_bytes:
+        logger.warning("[plot_cache] %d plots still referenced by messages keep the cache at %.1f MB",
+                       kept, total / 1e6)
+    return total
@@ -0,0 +1,262 @@
+"""
+Tail-latency control for LLM calls (`langchain`, `text2sql`, `make_title`).
+
+* Deadlines — `request_deadline()` (applied to the chat views with
+  `@llm_deadline`) bounds the time all LLM calls of one request may take.
+  Every attempt gets min(LLM_CALL_TIMEOUT, time left) as its HTTP timeout;
+  once the deadline passes, `DeadlineExceeded` is raised instead of calling.
+* Retries — tenacity with exponential backoff and full jitter on transient
+  errors only (connection errors / timeouts, 429, 5xx). A retry is not
+  started if its backoff would end past the deadline.
+* Streaming — `stream()` applies the same deadline and retry rules, retrying
+  only until the first chunk arrives; a connection lost after that surfaces
+  as `LLMUnavailable` like a failed call. Closing the generator closes the
+  HTTP response, which cancels the rest of the generation.
+* Hedging (optional, LLM_HEDGE=1) — when an attempt of a hedged stage is still
+  running after that stage's recent p95, an identical second request is sent
+  and whichever answers first wins. The loser cannot be cancelled (sync
+  httpx); its result is discarded.
+
+Every attempt goes through `admission.llm_slot()` separately, so a request
+backing off between retries does not hold a concurrency slot.
+"""
+import contextvars
+import functools
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager
+from typing import Any, Iterator
+
+import httpx
+import openai
+from django.conf import settings
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from .admission import llm_slot
+from .llm import record_call
+from .tracing import REGISTRY, Span, record_usage
+
+logger = logging.getLogger(__name__)
+
+# 재시도할 만한 오류 (네트워크·타임아웃·429·5xx). 4xx 는 다시 보내도 같은 결과
+TRANSIENT = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError,
+             httpx.TransportError)
+
+
+class LLMUnavailable(RuntimeError):
+    """재시도·헤징을 다 써도 응답을 받지 못함"""
+
+
+class DeadlineExceeded(LLMUnavailable):
+    """요청 전체의 LLM 시간 한도를 넘김"""
+
+
+def _cfg(name: str, default):
+    return getattr(settings, f"LLM_{name}", default)
+
+
+# ── deadlines ────────────────────────────────────────────────
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def request_deadline(seconds: float | None) -> Iterator[None]:
+    """블록 안의 LLM 호출 전체에 seconds 한도를 건다 (이미 더 짧은 한도가 있으면 유지)."""
+    if not seconds:
+        yield
+        return
+    current = _deadline.get()
+    deadline = time.monotonic() + seconds
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def llm_deadline(view):
+    """뷰 전체를 settings.LLM_REQUEST_DEADLINE 으로 감싸는 데코레이터"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with request_deadline(_cfg("REQUEST_DEADLINE", None)):
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def remaining() -> float | None:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+# ── attempts ─────────────────────────────────────────────────
+_HEDGE_POOL: ThreadPoolExecutor | None = None
+_HEDGE_LOCK = threading.Lock()
+
+
+def _hedge_pool() -> ThreadPoolExecutor:
+    global _HEDGE_POOL
+    if _HEDGE_POOL is None:
+        with _HEDGE_LOCK:
+            if _HEDGE_POOL is None:
+                _HEDGE_POOL = ThreadPoolExecutor(max_workers=_cfg("HEDGE_WORKERS", 8),
+                                                 thread_name_prefix="llm-hedge")
+    return _HEDGE_POOL
+
+
+def _once(model, messages, stage: str, timeout: float) -> Any:
+    with llm_slot():
+        t0 = time.perf_counter()
+        response = model.invoke(messages, timeout=timeout)
+        REGISTRY.observe(f"{stage}.attempt", time.perf_counter() - t0)
+    return response
+
+
+def _hedge_delay(stage: str) -> float | None:
+    if not _cfg("HEDGE", False) or stage not in _cfg("HEDGE_STAGES", ()):
+        return None
+    p = REGISTRY.quantile(f"{stage}.attempt", _cfg("HEDGE_QUANTILE", 0.95),
+                          min_samples=_cfg("HEDGE_MIN_SAMPLES", 20))
+    return None if p is None else max(p, _cfg("HEDGE_MIN_DELAY", 0.5))
+
+
+def _hedged(model, messages, stage: str, timeout: float, delay: float) -> Any:
+    pool = _hedge_pool()
+    first = pool.submit(contextvars.copy_context().run, _once, model, messages, stage, timeout)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+
+    REGISTRY.inc("pos_llm_hedged_total", stage=stage)
+    second = pool.submit(contextvars.copy_context().run, _once, model, messages, stage, timeout - delay)
+    pending, error = {first, second}, None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is second:
+                    REGISTRY.inc("pos_llm_hedge_wins_total", stage=stage)
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def _timeout(stage: str) -> float:
+    timeout = _cfg("CALL_TIMEOUT", 60)
+    left = remaining()
+    if left is not None:
+        if left <= 0:
+            REGISTRY.inc("pos_llm_deadline_exceeded_total", stage=stage)
+            raise DeadlineExceeded(f"{stage}: request deadline exceeded")
+        timeout = min(timeout, left)
+    return timeout
+
+
+def _attempt(model, messages, stage: str) -> Any:
+    timeout = _timeout(stage)
+    delay = _hedge_delay(stage)
+    if delay is None or delay >= timeout:
+        return _once(model, messages, stage, timeout)
+    return _hedged(model, messages, stage, timeout, delay)
+
+
+def _past_deadline(retry_state) -> bool:
+    left = remaining()
+    return left is not None and left <= (retry_state.upcoming_sleep or 0)
+
+
+def _before_sleep(stage: str):
+    def log(retry_state) -> None:
+        REGISTRY.inc("pos_llm_retries_total", stage=stage)
+        logger.warning("[llm] %s attempt %d failed (%s); retrying in %.2fs", stage,
+                       retry_state.attempt_number, retry_state.outcome.exception(), retry_state.upcoming_sleep)
+    return log
+
+
+def _retrying(stage: str) -> Retrying:
+    return Retrying(
+        retry=retry_if_exception_type(TRANSIENT),
+        stop=stop_after_attempt(_cfg("RETRIES", 2) + 1) | _past_deadline,
+        wait=wait_random_exponential(multiplier=_cfg("RETRY_BASE", 0.5), max=_cfg("RETRY_MAX", 8)),
+        before_sleep=_before_sleep(stage),
+        reraise=True,
+    )
+
+
+def invoke(model, messages, stage: str, purpose: str | None = None) -> Any:
+    """
+    model.invoke(messages) + 호출별 timeout, 재시도, (선택) 헤징, 요청 deadline.
+    purpose 를 주면 성공한 호출의 지연시간·비용을 목적별로 기록한다 (llm.record_call).
+    """
+    t0 = time.perf_counter()
+    try:
+        for attempt in _retrying(stage):
+            with attempt:
+                response = _attempt(model, messages, stage)
+    except TRANSIENT as e:
+        REGISTRY.inc("pos_llm_failures_total", stage=stage)
+        raise LLMUnavailable(f"{stage}: {e}") from e
+    if purpose is not None:
+        record_call(purpose, model, response, time.perf_counter() - t0)
+    return response
+
+
+# ── streaming ────────────────────────────────────────────────
+def _open_stream(model, messages, stage: str) -> tuple[ExitStack, Iterator, Any]:
+    """슬롯을 잡고 스트림을 열어 첫 chunk 까지 받는다 (여기까지만 재시도 대상)"""
+    stack = ExitStack()
+    try:
+        stack.enter_context(llm_slot())
+        chunks = iter(model.stream(messages, timeout=_timeout(stage)))
+        stack.callback(getattr(chunks, "close", lambda: None))
+        first = next(chunks, None)
+    except BaseException:
+        stack.close()
+        raise
+    return stack, chunks, first
+
+
+def _estimate_usage(model, messages, chunks: int) -> dict:
+    """중간에 끊은 스트림은 usage chunk 를 못 받으므로 prompt 는 직접 세고 출력은 chunk 수로 어림"""
+    try:
+        prompt = model.get_num_tokens_from_messages(messages)
+    except Exception:            # 토크나이저를 쓸 수 없는 환경
+        prompt = 0
+    return {"input_tokens": prompt, "output_tokens": chunks, "total_tokens": prompt + chunks}
+
+
+def stream(model, messages, stage: str, purpose: str | None = None, sp: Span | None = None) -> Iterator[Any]:
+    """
+    model.stream(messages) 를 invoke() 와 같은 timeout·재시도·deadline 규칙으로.
+    소비자가 generator 를 닫으면 HTTP 응답을 닫아 나머지 생성을 취소한다.
+    끝나거나 닫힐 때 usage 를 sp 와 llm.record_call 에 기록한다.
+    """
+    t0 = time.perf_counter()
+    try:
+        for attempt in _retrying(stage):
+            with attempt:
+                stack, chunks, first = _open_stream(model, messages, stage)
+    except TRANSIENT as e:
+        REGISTRY.inc("pos_llm_failures_total", stage=stage)
+        raise LLMUnavailable(f"{stage}: {e}") from e
+
+    response, count = None, 0
+    try:
+        with stack:
+            for chunk in (itertools.chain((first,), chunks) if first is not None else ()):
+                response = chunk if response is None else response + chunk
+                count += 1
+                yield chunk
+    except TRANSIENT as e:
+        # 첫 chunk 이후에 끊긴 스트림은 다시 보낼 수 없다 (이미 소비자에게 일부를 넘겼다)
+        REGISTRY.inc("pos_llm_failures_total", stage=stage)
+        raise LLMUnavailable(f"{stage}: stream interrupted: {e}") from e
+    finally:
+        if response is not None and not response.usage_metadata:
+            response.usage_metadata = _estimate_usage(model, messages, count)
+        if sp is not None:
+            record_usage(sp, response)
+        if purpose is not None:
+            record_call(purpose, model, response, time.perf_counter() - t0)
@@ -0,0 +1,460 @@
+"""
+Materialized rollups and the SQL rewriter that answers aggregate queries from them.
+
+At ingest (`build_rollups`, ROLLUPS_ENABLED) every table with a date column
+gets small pre-aggregated tables:
+
+    _rollup_<table>          GROUP BY date
+    _rollup_<table>_<n>      GROUP BY date, <category column n>
+
+Each row keeps the date, its derived month / weekday and the category value,
+plus `n__` = COUNT(*) and, for every integer measure (qty, total_price,
+promo_flag …), `sum__m`, `cnt__m`, `min__m`, `max__m`. Only columns whose
+values are all INTEGER (or NULL) become measures: integer sums are exact in any
+order, so a re-aggregated sum is bit-for-bit the raw one (REAL columns would
+not be). A rollup that is not much smaller than its table is dropped. What was
+built is recorded in `_rollups`.
+
+`rewrite(db_path, sql)` parses a text2sql statement with sqlparse and, when a
+rollup can answer it, returns the same query over the rollup:
+
+    SELECT month, SUM(total_price) AS sales FROM table1
+    WHERE date >= '2025-03-01' GROUP BY month ORDER BY month
+      →  SELECT month, SUM("sum__total_price") AS sales FROM "_rollup_table1" …
+
+Supported: one table, no alias / JOIN / subquery / UNION / window; SUM, TOTAL,
+COUNT(*), COUNT, AVG, MIN, MAX over a measure (or MIN / MAX / COUNT and
+DISTINCT over a grouping column); WHERE / GROUP BY / HAVING / ORDER BY over the
+date columns and at most one category column; every non-aggregated output
+column must be a GROUP BY key. Anything else returns None and runs unchanged.
+Aggregate outputs without an alias get their original text as alias, so the
+result — values and column names — is identical.
+"""
+import logging
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import sqlparse
+from sqlparse import tokens as T
+
+from .column_types import ColumnType
+from .tracing import REGISTRY, span
+
+logger = logging.getLogger(__name__)
+
+META_TABLE     = "_rollups"
+PREFIX         = "_rollup_"
+MAX_SHARE      = 0.25       # 원본 행 수의 이 비율보다 큰 롤업은 만들지 않는다
+MAX_DIMENSIONS = 12
+MAX_SOURCES    = 64         # rewrite() 메타데이터 캐시 (DB 파일 수)
+
+_ID_HINT = re.compile(r"(^|_)(id|no|code|barcode|seq)$|번호", re.I)
+_MEASURE_KINDS = ("integer", "currency", "boolean")
+_AGGREGATES = {"count", "sum", "total", "avg", "min", "max", "group_concat", "string_agg",
+               "json_group_array", "json_group_object", "jsonb_group_array", "jsonb_group_object"}
+_REAGGREGATE = ("count", "sum", "total", "avg", "min", "max")
+_CLAUSES = {"SELECT", "FROM", "WHERE", "GROUP BY", "HAVING", "ORDER BY", "LIMIT", "OFFSET"}
+_REJECT = {"UNION", "UNION ALL", "INTERSECT", "EXCEPT", "WITH", "WITH RECURSIVE", "OVER", "WINDOW",
+           "FILTER", "NATURAL", "USING", "ON", "VALUES", "INDEXED BY", "NOT INDEXED"}
+_NOT_ALIASES = {"END", "NULL", "TRUE", "FALSE", "ASC", "DESC", "CURRENT_DATE", "CURRENT_TIME",
+                "CURRENT_TIMESTAMP"}
+_ORDER_WORDS = {"ASC", "DESC", "NULLS", "FIRST", "LAST", "COLLATE", "NOCASE", "BINARY", "RTRIM"}
+
+
+def _q(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+# ── build ────────────────────────────────────────────────────
+def _profile(conn: sqlite3.Connection, table: str, cols: list[str]) -> tuple[int, list[str]]:
+    """(행 수, 값이 모두 INTEGER 또는 NULL 인 컬럼) 을 한 번의 스캔으로"""
+    checks = "".join(f", SUM(typeof({_q(c)}) NOT IN ('integer', 'null'))" for c in cols)
+    rows, *bad = conn.execute(f"SELECT COUNT(*){checks} FROM {_q(table)}").fetchone()
+    return rows, [c for c, b in zip(cols, bad) if not b]
+
+
+def build_rollups(conn: sqlite3.Connection, table: str, types: dict[str, ColumnType]) -> list[str]:
+    """
+    table(또는 compact 레이아웃의 뷰)의 날짜 × 범주 롤업을 만들고 `_rollups` 에 기록한다.
+
+    Returns:
+        만든 롤업 테이블 이름들 (date 컬럼이 없거나 충분히 작아지지 않으면 빈 목록)
+    """
+    date_col = next((c for c, t in types.items() if t.kind == "date" and not t.derived_from), None)
+    if date_col is None:
+        return []
+    date_cols = [date_col] + [c for c, t in types.items() if t.derived_from == date_col]
+    dims = [c for c, t in types.items() if t.kind == "category" and not t.derived_from][:MAX_DIMENSIONS]
+    candidates = [c for c, t in types.items()
+                  if t.kind in _MEASURE_KINDS and not t.derived_from and c not in date_cols
+                  and not (t.kind == "integer" and _ID_HINT.search(c))]
+
+    with span("ingest.rollups") as sp:
+        source_rows, measures = _profile(conn, table, candidates)
+        aggs = ["COUNT(*) AS n__"]
+        reaggs = ['SUM("n__") AS n__']
+        for m in measures:
+            s_, c_, lo, hi = (_q(f"{p}__{m}") for p in ("sum", "cnt", "min", "max"))
+            aggs += [f"SUM({_q(m)}) AS {s_}", f"COUNT({_q(m)}) AS {c_}", f"MIN({_q(m)}) AS {lo}",
+                     f"MAX({_q(m)}) AS {hi}"]
+            reaggs += [f"SUM({s_}) AS {s_}", f"SUM({c_}) AS {c_}", f"MIN({lo}) AS {lo}", f"MAX({hi}) AS {hi}"]
+
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {META_TABLE} ("
+                     "source_table TEXT, rollup_table TEXT PRIMARY KEY, dimension TEXT, "
+                     "date_columns TEXT, measures TEXT, rows INTEGER, source_rows INTEGER)")
+        dates = ", ".join(_q(c) for c in date_cols)
+        built: dict[str | None, str] = {}
+
+        def create(name: str, dim: str | None, select: str) -> None:
+            conn.execute(f"DROP TABLE IF EXISTS {_q(name)}")
+            conn.execute(f"CREATE TABLE {_q(name)} AS {select}")
+            rows = conn.execute(f"SELECT COUNT(*) FROM {_q(name)}").fetchone()[0]
+            if rows > source_rows * MAX_SHARE:
+                conn.execute(f"DROP TABLE {_q(name)}")
+                return
+            conn.execute(f"INSERT OR REPLACE INTO {META_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (table, name, dim, ",".join(date_cols), ",".join(measures), rows, source_rows))
+            built[dim] = name
+
+        # month / weekday 는 date 로 정해지므로 GROUP BY 없이 그대로 가져온다.
+        # +date: 날짜 인덱스를 타면 행을 무작위로 읽으므로 테이블을 순서대로 읽고 정렬하게 한다
+        for i, dim in enumerate(dims, 1):
+            create(f"{PREFIX}{table}_{i}", dim,
+                   f"SELECT {dates}, {_q(dim)}, {', '.join(aggs)} FROM {_q(table)} "
+                   f"GROUP BY +{_q(date_col)}, {_q(dim)}")
+        # 날짜만의 롤업은 원본 대신 범주 롤업을 다시 묶어 만든다 (정수 합·개수·최소·최대는 그대로 합쳐진다)
+        base = next(iter(built.values()), None)
+        create(f"{PREFIX}{table}", None,
+               f"SELECT {dates}, {', '.join(reaggs)} FROM {_q(base)} GROUP BY {_q(date_col)}" if base else
+               f"SELECT {dates}, {', '.join(aggs)} FROM {_q(table)} GROUP BY +{_q(date_col)}")
+        sp.set(tables=len(built))
+    return list(built.values())
+
+
+# ── metadata ─────────────────────────────────────────────────
+@dataclass
+class _Source:
+    columns: set[str]                                   # 원본 테이블 컬럼 (소문자)
+    date_cols: set[str]
+    measures: set[str]
+    rollups: dict[str | None, tuple[str, int]]         # dimension(소문자, 날짜만이면 None) → (이름, 행 수)
+    internal: set[str] = field(default_factory=set)    # 롤업에만 있는 컬럼 이름
+
+
+_META: "OrderedDict[tuple[str, int], dict[str, _Source]]" = OrderedDict()
+_META_LOCK = threading.Lock()
+
+
+def _load(db_path: str, mtime: int) -> dict[str, _Source]:
+    key = (db_path, mtime)
+    with _META_LOCK:
+        if key in _META:
+            _META.move_to_end(key)
+            return _META[key]
+    sources: dict[str, _Source] = {}
+    with closing(sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)) as conn:
+        try:
+            rows = conn.execute(f"SELECT source_table, rollup_table, dimension, date_columns, measures, rows "
+                                f"FROM {META_TABLE}").fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        for table, name, dim, date_cols, measures, n in rows:
+            src = sources.get(table.lower())
+            if src is None:
+                columns = {r[1].lower() for r in conn.execute(f"PRAGMA table_info({_q(table)})")}
+                measure_set = {m.lower() for m in measures.split(",") if m}
+                internal = {"n__"} | {f"{p}__{m}" for m in measure_set for p in ("sum", "cnt", "min", "max")}
+                src = sources[table.lower()] = _Source(
+                    columns, {c.lower() for c in date_cols.split(",")}, measure_set, {}, internal)
+            src.rollups[dim.lower() if dim else None] = (name, n)
+    with _META_LOCK:
+        _META[key] = sources
+        while len(_META) > MAX_SOURCES:
+            _META.popitem(last=False)
+    return sources
+
+
+# ── parsing ──────────────────────────────────────────────────
+class _Unsupported(Exception):
+    """롤업으로 답할 수 없는 쿼리"""
+
+
+def _word(tok) -> str | None:
+    """식별자로 쓰일 수 있는 토큰이면 소문자 이름 ("quoted" 포함)"""
+    if tok.ttype in T.Name or tok.ttype is T.Keyword:
+        return tok.value.lower()
+    if tok.ttype in T.String.Symbol:
+        return tok.value[1:-1].replace(tok.value[0] * 2, tok.value[0]).lower()
+    return None
+
+
+def _implicit_alias(prev, last) -> bool:
+    """`SUM(x) sales`, `payment_type pt` 처럼 AS 없이 붙은 별칭인지"""
+    if last.ttype is T.Keyword:
+        named = prev.value == ")" and last.normalized not in _NOT_ALIASES
+    else:
+        named = last.ttype in T.Name or last.ttype in T.String.Symbol
+    return named and (prev.value == ")" or prev.ttype in T.Name or prev.ttype in T.Literal)
+
+
+def _key(tokens: list) -> str:
+    return " ".join(_word(t) or t.value.lower() for t in tokens)
+
+
+@dataclass
+class _Call:
+    func: str
+    start: int          # 함수 이름 토큰 위치
+    end: int            # 닫는 괄호 위치
+    arg: str | None     # 컬럼 이름, COUNT(*) 이면 None
+    distinct: bool
+
+
+@dataclass
+class _Item:
+    tokens: list
+    start: int
+    end: int
+    alias: str | None = None
+    has_agg: bool = False
+    refs: set[str] = field(default_factory=set)
+
+
+@dataclass
+class Rewrite:
+    sql: str
+    rollup: str
+    rows: int
+
+
+def _split(items: list[tuple[int, object]], depth: dict[int, int]) -> list[list[tuple[int, object]]]:
+    parts, cur = [], []
+    for i, tok in items:
+        if tok.ttype is T.Punctuation and tok.value == "," and depth[i] == 0:
+            parts.append(cur)
+            cur = []
+        else:
+            cur.append((i, tok))
+    parts.append(cur)
+    return [p for p in parts if p]
+
+
+def _plan(sql: str, sources: dict[str, _Source]) -> tuple[list, dict[int, tuple[int, str]], dict[int, str], str, int]:
+    """
+    Returns:
+        (flatten 된 토큰, {시작 위치: (끝 위치, 바꿀 텍스트)}, {위치: 그 뒤에 붙일 텍스트}, 롤업 이름, 롤업 행 수)
+    """
+    statements = [s for s in sqlparse.parse(sql) if s.token_first(skip_cm=True) is not None]
+    if len(statements) != 1:
+        raise _Unsupported("not a single statement")
+    toks = list(statements[0].flatten())
+    sig = [(i, t) for i, t in enumerate(toks) if not t.is_whitespace and t.ttype not in T.Comment]
+    if sig and sig[-1][1].value == ";":
+        sig.pop()
+    if not sig or sig[0][1].normalized != "SELECT":
+        raise _Unsupported("not a SELECT")
+
+    # 괄호 깊이와 최상위 절 나누기
+    depth: dict[int, int] = {}
+    clauses: dict[str, list[tuple[int, object]]] = {}
+    d, current = 0, None
+    for i, tok in sig:
+        if tok.ttype is T.Punctuation and tok.value == ")":
+            d -= 1
+        depth[i] = d
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            d += 1
+        norm = " ".join(tok.normalized.upper().split()) if tok.is_keyword else ""     # 'GROUP  BY' → 'GROUP BY'
+        if norm in _REJECT or "JOIN" in norm or (tok.ttype is T.Punctuation and tok.value == "."):
+            raise _Unsupported(norm or "qualified name")
+        if norm == "SELECT" and d > 0 or tok.ttype in T.Keyword.DML and norm != "SELECT":
+            raise _Unsupported("subquery")
+        if d == 0 and norm in _CLAUSES:
+            if norm in clauses:
+                raise _Unsupported(f"repeated {norm}")
+            current = clauses.setdefault(norm, [])
+            continue
+        current.append((i, tok))
+
+    from_ = clauses.get("FROM", [])
+    table = _word(from_[0][1]) if len(from_) == 1 else None
+    src = sources.get(table) if table else None
+    if src is None:
+        raise _Unsupported("no rollup for table")
+    for name in ("WHERE", "GROUP BY", "HAVING", "ORDER BY", "SELECT"):
+        for i, tok in clauses.get(name, []):
+            if tok.is_keyword and tok.normalized in ("DISTINCT", "ALL") and depth[i] == 0:
+                raise _Unsupported("SELECT DISTINCT")
+
+    # 집계 함수 호출 찾기
+    position = {i: n for n, (i, _) in enumerate(sig)}
+    calls: dict[int, _Call] = {}
+    inside: set[int] = set()
+    for n, (i, tok) in enumerate(sig[:-1]):
+        name = _word(tok)
+        nxt = sig[n + 1][1]
+        if name not in _AGGREGATES or not (nxt.ttype is T.Punctuation and nxt.value == "("):
+            continue
+        if i in inside:
+            raise _Unsupported("nested aggregate")
+        close = next((m for m in range(n + 2, len(sig)) if depth[sig[m][0]] == depth[i]
+                      and sig[m][1].value == ")"), None)
+        if close is None:
+            raise _Unsupported("unbalanced parentheses")
+        args = [t for _, t in sig[n + 2:close]]
+        distinct = bool(args) and args[0].is_keyword and args[0].normalized == "DISTINCT"
+        args = args[1:] if distinct else args
+        if len(args) == 1 and args[0].ttype is T.Wildcard and name == "count" and not distinct:
+            arg = None
+        elif len(args) == 1 and _word(args[0]) in src.columns:
+            arg = _word(args[0])
+        else:
+            raise _Unsupported(f"{name}() argument")
+        calls[i] = _Call(name, i, sig[close][0], arg, distinct)
+        inside.update(j for j, _ in sig[n:close + 1])
+
+    def refs(items: list[tuple[int, object]]) -> set[str]:
+        """집계 밖에서 쓰인 원본 컬럼 (함수 이름·AS 뒤 이름 제외)"""
+        out = set()
+        for i, tok in items:
+            name = _word(tok)
+            if i in inside or name is None:
+                continue
+            n = position[i]
+            if n + 1 < len(sig) and sig[n + 1][1].value == "(":
+                continue
+            if n > 0 and sig[n - 1][1].is_keyword and sig[n - 1][1].normalized == "AS":
+                continue
+            if name in src.internal:
+                raise _Unsupported(f"unknown column {name}")
+            if name in src.columns:
+                out.add(name)
+        return out
+
+    # 집계하지 않은 출력 컬럼은 GROUP BY 키여야 한다 (아니면 원본에서 임의의 행 값이 나온다)
+    select = []
+    for part in _split(clauses.get("SELECT", []), depth):
+        toks_ = [t for _, t in part]
+        alias, expr = None, part
+        if len(toks_) >= 2 and toks_[-2].is_keyword and toks_[-2].normalized == "AS":
+            alias, expr = _word(toks_[-1]), part[:-2]
+        elif len(toks_) >= 2 and _implicit_alias(toks_[-2], toks_[-1]):
+            alias, expr = _word(toks_[-1]), part[:-1]
+        if any(t.ttype is T.Wildcard for i, t in expr if i not in inside):
+            raise _Unsupported("SELECT *")
+        select.append(_Item([t for _, t in expr], part[0][0], part[-1][0], alias,
+                            has_agg=any(i in calls for i, _ in expr), refs=refs(expr)))
+    aliases = {s.alias: s for s in select if s.alias}
+
+    group = set()
+    for part in _split(clauses.get("GROUP BY", []), depth):
+        toks_ = [t for _, t in part]
+        if len(toks_) == 1 and toks_[0].ttype in T.Number.Integer:
+            k = int(toks_[0].value)
+            if not 1 <= k <= len(select) or select[k - 1].has_agg:
+                raise _Unsupported("GROUP BY ordinal")
+            group.add(_key(select[k - 1].tokens))
+        elif len(toks_) == 1 and _word(toks_[0]) in aliases and _word(toks_[0]) not in src.columns:
+            group.add(_key(aliases[_word(toks_[0])].tokens))
+        else:
+            if any(i in calls for i, _ in part):
+                raise _Unsupported("aggregate in GROUP BY")
+            group.add(_key(toks_))
+    if any(i in calls for i, _ in clauses.get("WHERE", [])):
+        raise _Unsupported("aggregate in WHERE")
+
+    def grouped(tokens: list, names: set[str]) -> bool:
+        return not names or _key(tokens) in group or names <= group
+
+    if not group and not any(s.has_agg for s in select):
+        raise _Unsupported("not an aggregate query")
+    for item in select:
+        if not grouped(item.tokens, item.refs):
+            raise _Unsupported("column not in GROUP BY")
+    if not grouped([], refs(clauses.get("HAVING", []))):
+        raise _Unsupported("HAVING on a non-grouped column")
+    plain = {_key(s.tokens) for s in select if not s.has_agg}
+    order = []          # 출력 별칭·순번이 아닌 ORDER BY 식
+    for part in _split(clauses.get("ORDER BY", []), depth):
+        while len(part) > 1 and part[-1][1].is_keyword and set(part[-1][1].normalized.upper().split()) <= _ORDER_WORDS:
+            part = part[:-1]
+        toks_ = [t for _, t in part]
+        if len(toks_) == 1 and (toks_[0].ttype in T.Number.Integer or _word(toks_[0]) in aliases):
+            continue
+        if _key(toks_) not in plain and not grouped(toks_, refs(part)):
+            raise _Unsupported("ORDER BY a non-grouped column")
+        order.append(part)
+
+    # 롤업 고르기: 날짜 컬럼 외에 쓰인 컬럼은 집계 안의 측정값이거나 하나의 범주 컬럼이어야 한다
+    used = set().union(*(item.refs for item in select), *(refs(part) for part in order))
+    for name in ("WHERE", "GROUP BY", "HAVING"):
+        used |= refs(clauses.get(name, []))
+    for call in calls.values():
+        if call.func not in _REAGGREGATE:
+            raise _Unsupported(f"{call.func}()")
+        if call.arg is None or call.arg in src.measures and not call.distinct:
+            continue
+        if call.func in ("sum", "total", "avg") and not call.distinct:
+            raise _Unsupported(f"{call.func}({call.arg}) needs raw rows")
+        used.add(call.arg)      # COUNT/MIN/MAX(범주·날짜), … DISTINCT: 롤업에 같은 값이 있어야 한다
+    dims = used - src.date_cols
+    if len(dims) > 1:
+        raise _Unsupported("more than one grouping column")
+    dim = next(iter(dims), None)
+    if dim not in src.rollups:
+        raise _Unsupported(f"no rollup by {dim}")
+    rollup, rows = src.rollups[dim]
+
+    # 바꿀 텍스트
+    edits: dict[int, tuple[int, str]] = {from_[0][0]: (from_[0][0], _q(rollup))}
+    after: dict[int, str] = {}
+    for call in calls.values():
+        m = call.arg
+        if m is not None and m in src.measures and not call.distinct:
+            s_, c_ = _q("sum__" + m), _q("cnt__" + m)
+            text = {"sum": f"SUM({s_})", "total": f"TOTAL({s_})", "count": f"COALESCE(SUM({c_}), 0)",
+                    "avg": f"(CAST(SUM({s_}) AS REAL) / SUM({c_}))",
+                    "min": f"MIN({_q('min__' + m)})", "max": f"MAX({_q('max__' + m)})"}[call.func]
+        elif m is None:
+            text = 'COALESCE(SUM("n__"), 0)'
+        elif call.func == "count" and not call.distinct:
+            text = f'COALESCE(SUM(CASE WHEN {_q(m)} IS NOT NULL THEN "n__" END), 0)'
+        else:
+            continue        # MIN/MAX(범주·날짜), COUNT(DISTINCT …) 는 롤업에서도 같은 값
+        edits[call.start] = (call.end, text)
+    for item in select:
+        if item.has_agg and item.alias is None:
+            # 별칭 없는 집계 출력은 원래 식 텍스트가 컬럼 이름이므로 그대로 별칭으로 붙인다
+            original = "".join(t.value for t in toks[item.start:item.end + 1])
+            after[item.end] = f" AS {_q(original)}"
+    return toks, edits, after, rollup, rows
+
+
+def rewrite(db_path: str | Path, sql: str) -> Rewrite | None:
+    """롤업 테이블로 답할 수 있으면 바꾼 SQL, 아니면 None (원래 SQL 그대로 실행)"""
+    try:
+        db_path = str(db_path)
+        sources = _load(db_path, Path(db_path).stat().st_mtime_ns)
+        if not sources:
+            return None
+        with span("sql.rewrite"):
+            toks, edits, after, rollup, rows = _plan(sql, sources)
+    except _Unsupported as e:
+        logger.debug("rollup rewrite skipped: %s", e)
+        return None
+    except Exception:
+        logger.exception("rollup rewrite failed")
+        return None
+
+    out, i = [], 0
+    while i < len(toks):
+        end, text = edits.get(i, (i, toks[i].value))
+        out.append(text + after.get(end, ""))
+        i = end + 1
+    REGISTRY.inc("pos_sql_rollup_rewrites_total")
+    return Rewrite("".join(out).strip(), rollup, rows)
@@ -0,0 +1,282 @@
+"""
+Schema retrieval for wide uploads: send only the columns a question needs.
+
+`file_schema` lists every column, and it is sent with every chat turn and
+every text2sql call. For tables with at least SCHEMA_PRUNE_MIN_COLUMNS
+columns (ERP / POS exports with 100+ columns), `prune(db_path, schema,
+question)` re-renders the schema with
+
+* the key columns — primary key, up to MAX_ID_KEYS id / code-like columns,
+  the date column and its derived month / weekday / hour columns,
+* the SCHEMA_TOP_K columns most similar to the question, and
+* columns whose name or a sample value appears literally in the question,
+
+and marks the table "[N of M columns shown]". Narrower tables are unchanged.
+
+Similarity comes from a per-file faiss `IndexFlatIP` over one short document
+per column: name, detected type, sample values and POS glossary terms in
+English and Korean (매출, 수량, 결제 …), so Korean questions match English
+headers. Documents are embedded with a hashed word / character n-gram
+embedder when SCHEMA_EMBEDDING_MODEL is "local" (the default, no network), or
+with that OpenAI embedding model through the shared client. Indexes are built on first use and cached per
+(DB path, mtime); question vectors are cached too.
+
+The pruned schema depends only on the question, so it stays the same across
+the turns of one chat request and the provider prompt cache still applies.
+Any failure falls back to the full schema.
+"""
+import logging
+import re
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+from .column_types import read_types
+from .ingest import build_schema_text
+from .llm import get_embeddings
+from .tracing import REGISTRY, span
+
+logger = logging.getLogger(__name__)
+
+LOCAL_DIM      = 4096       # "local" 임베딩 차원
+SAMPLE_ROWS    = 500        # 샘플 값을 뽑을 행 수
+SAMPLE_VALUES  = 8          # 컬럼 설명에 넣을 샘플 값 수
+MAX_ID_KEYS    = 2          # 항상 보내는 id / code 컬럼 수
+MAX_FILES      = 32         # 인덱스 캐시 (DB 파일 수)
+MAX_QUESTIONS  = 1024       # 질문 임베딩 캐시
+
+_ID_HINT = re.compile(r"(^|_)(id|no|code|seq)$|번호|코드", re.I)
+_ID_FIRST = re.compile(r"(^|_)id$", re.I)
+_WORD_RE = re.compile(r"[^\W_]+")
+_CAMEL_RE = re.compile(r"([a-z])([A-Z])")
+_LABEL_RE = re.compile(r"^- (\S+) \((.*?)\)(?: \[\d+ of \d+ columns shown\])?: ")
+
+# 컬럼 이름 조각 → 한국어 질문에 나올 말
+_GLOSSARY: dict[str, str] = {
+    "date": "날짜 일자 기간 일별", "day": "일 일별", "time": "시간 시각", "month": "월 월별",
+    "weekday": "요일", "hour": "시간대", "year": "연도 년", "week": "주 주별",
+    "channel": "채널 주문경로 배달 매장", "store": "매장 지점 점포", "branch": "지점",
+    "item": "메뉴 상품 품목", "product": "상품 제품", "menu": "메뉴", "name": "이름 명",
+    "category": "카테고리 분류", "brand": "브랜드", "size": "사이즈 크기", "barcode": "바코드",
+    "qty": "수량 판매량 개수 팔린", "quantity": "수량 판매량", "count": "건수 개수",
+    "price": "가격 단가", "unit": "단위 단가", "total": "합계 총액 매출 결제금액", "amount": "금액",
+    "sales": "매출 판매", "revenue": "매출 수익", "cost": "원가 비용", "margin": "마진 이익",
+    "profit": "이익", "discount": "할인", "tax": "세금", "vat": "부가세",
+    "payment": "결제 결제수단", "pay": "결제", "card": "카드", "cash": "현금",
+    "promo": "프로모션 행사", "coupon": "쿠폰", "point": "포인트 적립",
+    "customer": "고객", "member": "회원", "gender": "성별", "age": "나이 연령",
+    "employee": "직원", "staff": "직원", "cashier": "계산원", "pos": "포스 단말",
+    "order": "주문", "transaction": "거래", "receipt": "영수증", "refund": "환불", "cancel": "취소",
+    "stock": "재고", "inventory": "재고", "supplier": "공급사 거래처", "region": "지역",
+    "temperature": "온도 아이스 핫", "milk": "우유", "shot": "샷", "syrup": "시럽", "topping": "토핑",
+}
+
+
+# ── embedding ────────────────────────────────────────────────
+def _words(text: str) -> list[str]:
+    return _WORD_RE.findall(_CAMEL_RE.sub(r"\1 \2", text).lower())
+
+
+def terms(question: str) -> list[str]:
+    """질문에 나온 한국어 용어의 영어 컬럼 이름 조각 (예: 단가 → price, unit)"""
+    return [k for k, words in _GLOSSARY.items() if any(len(w) > 1 and w in question for w in words.split())]
+
+
+def local_embed(text: str) -> np.ndarray:
+    """단어 + 글자 2·3-gram 을 LOCAL_DIM 칸에 해싱 (한국어 조사가 붙어도 n-gram 이 겹친다)"""
+    vec = np.zeros(LOCAL_DIM, dtype="float32")
+    for word in _words(text):
+        grams = [(word, 1.0)]
+        padded = f"<{word}>"
+        grams += [(padded[i:i + n], 0.5) for n in (2, 3) for i in range(len(padded) - n + 1)]
+        for gram, weight in grams:
+            h = zlib.crc32(gram.encode())
+            vec[h % LOCAL_DIM] += weight if h & 0x10000 else -weight
+    return vec
+
+
+def embed(texts: list[str]) -> np.ndarray:
+    """L2 정규화한 float32 벡터 (내적 = 코사인 유사도)"""
+    with span("schema.embed", texts=len(texts)):
+        if settings.SCHEMA_EMBEDDING_MODEL == "local":
+            vecs = np.stack([local_embed(t) for t in texts])
+        else:
+            vecs = np.asarray(get_embeddings().embed_documents(texts), dtype="float32")
+    faiss.normalize_L2(vecs)
+    return vecs
+
+
+_QUESTIONS: "OrderedDict[tuple[str, str], np.ndarray]" = OrderedDict()
+_QUESTIONS_LOCK = threading.Lock()
+
+
+def vectors(texts: list[str]) -> np.ndarray:
+    """질문·용어 벡터 (캐시에 없는 것만 한 번에 임베딩)"""
+    model = settings.SCHEMA_EMBEDDING_MODEL
+    with _QUESTIONS_LOCK:
+        found = {t: _QUESTIONS[(model, t)] for t in texts if (model, t) in _QUESTIONS}
+        for t in found:
+            _QUESTIONS.move_to_end((model, t))
+    missing = [t for t in dict.fromkeys(texts) if t not in found]
+    if missing:
+        found.update(zip(missing, embed(missing)))
+        with _QUESTIONS_LOCK:
+            _QUESTIONS.update(((model, t), found[t]) for t in missing)
+            while len(_QUESTIONS) > MAX_QUESTIONS:
+                _QUESTIONS.popitem(last=False)
+    return np.stack([found[t] for t in texts])
+
+
+# ── column documents ─────────────────────────────────────────
+@dataclass
+class ColumnDoc:
+    name: str
+    text: str                 # 임베딩할 설명
+    values: list[str]         # 샘플 값 (질문에 그대로 나오면 그 컬럼을 싣는다)
+
+
+def _keys(cols: list[tuple], types: dict) -> list[str]:
+    names = [c[1] for c in cols]
+    keys = [c[1] for c in cols if c[5]]
+    derived = [n for n in names if n in types and types[n].derived_from]
+    dates = {types[n].derived_from for n in derived} or \
+        set([n for n in names if n in types and types[n].kind in ("date", "timestamp")][:1])
+    keys += [n for n in names if (n in dates or n in derived) and n not in keys]
+    ids = [n for n in names if _ID_HINT.search(n) and n not in keys]
+    keys += sorted(ids, key=lambda n: not _ID_FIRST.search(n))[:MAX_ID_KEYS]   # *_id 먼저
+    return keys
+
+
+def column_docs(conn: sqlite3.Connection, min_columns: int) -> dict[str, tuple[list[str], list[ColumnDoc]]]:
+    """컬럼이 min_columns 개 이상인 테이블마다 (키 컬럼, 나머지 컬럼의 설명)"""
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') "
+                                         "ORDER BY name") if not r[0].startswith(("_", "sqlite_"))]
+    all_types = None
+    out = {}
+    for tbl in tables:
+        cols = conn.execute(f'PRAGMA table_info("{tbl}")').fetchall()
+        if len(cols) < min_columns:
+            continue
+        if all_types is None:
+            all_types = read_types(conn)
+        types = all_types.get(tbl, {})
+        keys = _keys(cols, types)
+
+        rows = conn.execute(f'SELECT * FROM "{tbl}" LIMIT {SAMPLE_ROWS}').fetchall()
+        docs = []
+        for i, (_, name, ctype, *_rest) in enumerate(cols):
+            if name in keys:
+                continue
+            t = types.get(name)
+            kind = t.kind if t else (ctype or "").lower()
+            values = []
+            if kind in ("category", "text", ""):
+                values = list(dict.fromkeys(str(r[i]) for r in rows if isinstance(r[i], str) and r[i].strip()))
+                values = values[:SAMPLE_VALUES]
+            terms = " ".join(_GLOSSARY[w] for w in dict.fromkeys(_words(name)) if w in _GLOSSARY)
+            text = f"{name} ({' '.join(_words(name))}) {kind}"
+            if values:
+                text += f"; values: {', '.join(values)}"
+            if terms:
+                text += f"; {terms}"
+            docs.append(ColumnDoc(name, text, values))
+        out[tbl] = (keys, docs)
+    return out
+
+
+# ── per-file index ───────────────────────────────────────────
+@dataclass
+class _Table:
+    keys: list[str]
+    docs: list[ColumnDoc]
+    index: faiss.Index
+
+
+_FILES: "OrderedDict[tuple, dict[str, _Table]]" = OrderedDict()
+_FILES_LOCK = threading.Lock()
+
+
+def _load(db_path: str, mtime: int) -> dict[str, _Table]:
+    key = (db_path, mtime, settings.SCHEMA_EMBEDDING_MODEL, settings.SCHEMA_PRUNE_MIN_COLUMNS)
+    with _FILES_LOCK:
+        if key in _FILES:
+            _FILES.move_to_end(key)
+            return _FILES[key]
+    with closing(sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)) as conn:
+        found = column_docs(conn, settings.SCHEMA_PRUNE_MIN_COLUMNS)
+    tables: dict[str, _Table] = {}
+    texts = [d.text for _, docs in found.values() for d in docs]
+    if texts:
+        with span("schema.index", columns=len(texts)):
+            vecs, start = embed(texts), 0
+            for tbl, (keys, docs) in found.items():
+                index = faiss.IndexFlatIP(vecs.shape[1])
+                index.add(vecs[start:start + len(docs)])
+                start += len(docs)
+                tables[tbl] = _Table(keys, docs, index)
+    with _FILES_LOCK:
+        _FILES[key] = tables
+        while len(_FILES) > MAX_FILES:
+            _FILES.popitem(last=False)
+    return tables
+
+
+def _mentioned(docs: list[ColumnDoc], question: str) -> set[str]:
+    q = question.lower()
+    return {d.name for d in docs
+            if (len(d.name) > 1 and (d.name.lower() in q or d.name.lower().replace("_", " ") in q))
+            or any(len(v) > 1 and v.lower() in q for v in d.values)}
+
+
+def select_columns(table: _Table, question: str, top_k: int) -> set[str]:
+    """
+    키 + 질문에 그대로 나온 컬럼 + 용어마다 가장 가까운 컬럼 하나 + 질문 전체와 가까운 순으로 top_k 까지.
+    용어별 검색이 없으면 짧은 잡음 컬럼 설명이 긴 설명(샘플 값이 많은 범주 컬럼)보다 앞서기 쉽다.
+    """
+    keep = set(table.keys) | _mentioned(table.docs, question)
+    found = terms(question)
+    k = min(top_k, table.index.ntotal)
+    _, ids = table.index.search(vectors([question] + found), k)
+    ranked = [table.docs[i].name for i in ids[0] if i >= 0]
+    picked = list(dict.fromkeys(table.docs[row[0]].name for row in ids[1:] if row[0] >= 0))
+    picked += [name for name in ranked if name not in picked]
+    keep.update(picked[:max(k, len(found))])
+    return keep
+
+
+def _notes(schema: str) -> dict[str, str]:
+    """file_schema 의 "- table1 (sheet: 매출): …" 에서 테이블 설명을 되살린다"""
+    return {m.group(1): m.group(2) for m in map(_LABEL_RE.match, schema.splitlines()) if m}
+
+
+# ── public API ───────────────────────────────────────────────
+def prune(db_path: str | Path, schema: str, question: str) -> str:
+    """넓은 테이블은 질문에 필요한 컬럼만 남긴 스키마, 아니면 schema 그대로"""
+    if not settings.SCHEMA_RETRIEVAL_ENABLED or not question.strip():
+        return schema
+    try:
+        db_path = str(db_path)
+        tables = _load(db_path, Path(db_path).stat().st_mtime_ns)
+        if not tables:
+            return schema
+        with span("schema.retrieve", tables=len(tables)) as sp:
+            keep = {tbl: select_columns(t, question, settings.SCHEMA_TOP_K) for tbl, t in tables.items()}
+            with closing(sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)) as conn:
+                text = build_schema_text(conn, Path(db_path), _notes(schema), keep)
+            omitted = sum(len(t.keys) + len(t.docs) - len(keep[tbl]) for tbl, t in tables.items())
+            sp.set(columns=sum(len(v) for v in keep.values()), omitted=omitted)
+    except Exception:
+        logger.exception("schema retrieval failed; sending the full schema")
+        REGISTRY.inc("pos_schema_prune_total", result="error")
+        return schema
+    REGISTRY.inc("pos_schema_prune_total", result="pruned")
+    REGISTRY.inc("pos_schema_columns_omitted_total", omitted)
+    return text
@@ -1,3 +1,1516 @@
-from django.test import TestCase
+import json
+import os
+import re
+import runpy
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import date, datetime, time as dtime
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import openai
+import pandas as pd
+from django.conf import settings
+from django.db.utils import ConnectionHandler
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils.datetime import CALENDAR_MAC_1904
+
+from . import admission, backend, batch, fastpath, fewshot, ingest, llm, plot_cache, rollups, schema_index, views
+from .bench.dummy import load_generator
+from .bench.stub_openai import OfflineChatOpenAI, StubOpenAIServer
+from .column_types import _detect, apply_types, infer_types
+from .directives import read_reply
+from .file_delivery import _parse_range, serve_file
+from .fileset import FileSet
+from .ingest import LAYOUTS, UnsupportedSpreadsheet, detect_header, excel_to_sqlite, iter_xlsx_rows
+from .models import Chat, ChatTrace, File, Message, SqlExample, User
+from .pagination import PaginationError, etag_matches, keyset_page, make_etag, parse_fields, parse_limit
+from .resilience import DeadlineExceeded, LLMUnavailable, invoke, request_deadline
+from .tracing import REGISTRY, Trace, _current
+from .utils import file_to_sqlite
+
+
+def _call_concurrently(models: dict, threads: int, calls: int) -> None:
+    purposes = list(models)
+
+    def worker(i: int) -> None:
+        for j in range(calls):
+            models[purposes[(i + j) % len(purposes)]].invoke("ping")
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, range(threads)))
+
+
+class SharedLLMClientTests(SimpleTestCase):
+    THREADS, CALLS = 6, 5
+
+    def tearDown(self):
+        llm.configure()
+
+    def test_shared_client_reuses_connections_under_concurrency(self):
+        # 기존 방식: 목적별 ChatOpenAI 가 각자 커넥션 풀을 가진다
+        with StubOpenAIServer(lambda messages: "ok", delay=0.03) as stub:
+            separate = {p: OfflineChatOpenAI(model="stub", base_url=stub.base_url, api_key="stub", max_retries=0)
+                        for p in llm.PURPOSES}
+            # openai 응답 모델은 프로세스 첫 파싱이 동시에 일어나면 빈 객체가 될 수 있어 한 번 먼저 호출
+            separate["answer"].invoke("warm up")
+            _call_concurrently(separate, self.THREADS, self.CALLS)
+            separate_connections = stub.connections
+
+        REGISTRY.reset()
+        with StubOpenAIServer(lambda messages: "ok", delay=0.03) as stub:
+            llm.configure(model_cls=OfflineChatOpenAI, base_url=stub.base_url, api_key="stub", max_retries=0)
+            shared = {p: llm.get_model(p) for p in llm.PURPOSES}
+            _call_concurrently(shared, self.THREADS, self.CALLS)
+            shared_connections, requests = stub.connections, stub.requests
+
+        self.assertEqual(requests, self.THREADS * self.CALLS)
+        self.assertLessEqual(shared_connections, self.THREADS)
+        self.assertLess(shared_connections, separate_connections)
+
+        # 클라이언트 쪽 계측이 서버가 본 값과 일치
+        self.assertEqual(REGISTRY.counter("pos_llm_connections_opened_total"), shared_connections)
+        self.assertEqual(REGISTRY.counter("pos_llm_http_requests_total"), requests)
+        self.assertEqual(REGISTRY.counter("pos_llm_http_requests_total", reused="true"),
+                         requests - shared_connections)
+
+    def test_purposes_share_one_http_client(self):
+        llm.configure(base_url="http://127.0.0.1:9/v1", api_key="stub")
+        clients = {llm.get_model(p).root_client._client for p in llm.PURPOSES}
+        self.assertEqual(clients, {llm.http_client()})
+        with self.assertRaises(ValueError):
+            llm.get_model("unknown")
+
+
+@override_settings(LLM_RETRIES=2, LLM_RETRY_BASE=0.01, LLM_RETRY_MAX=0.05, LLM_CALL_TIMEOUT=5,
+                   LLM_HEDGE=False)
+class ResilienceTests(SimpleTestCase):
+    """재시도·deadline·헤징을 지연/실패를 주입한 stub 서버로 확인"""
+
+    def setUp(self):
+        REGISTRY.reset()
+
+    def tearDown(self):
+        llm.configure()
+
+    def _stub(self, **kwargs) -> StubOpenAIServer:
+        stub = StubOpenAIServer(lambda messages: "ok", **kwargs).start()
+        self.addCleanup(stub.stop)
+        llm.configure(model_cls=OfflineChatOpenAI, base_url=stub.base_url, api_key="stub")
+        return stub
+
+    def test_transient_failures_are_retried(self):
+        stub = self._stub(failures=2, failure_status=503)
+        self.assertEqual(invoke(llm.get_model("sql"), "ping", "text2sql").content, "ok")
+        self.assertEqual(stub.requests, 3)
+        self.assertEqual(REGISTRY.counter("pos_llm_retries_total", stage="text2sql"), 2)
+
+    def test_gives_up_after_retry_budget(self):
+        stub = self._stub(failures=10, failure_status=500)
+        with self.assertRaises(LLMUnavailable):
+            invoke(llm.get_model("sql"), "ping", "text2sql")
+        self.assertEqual(stub.requests, 3)
+
+    def test_client_errors_are_not_retried(self):
+        stub = self._stub(failures=1, failure_status=400)
+        with self.assertRaises(openai.BadRequestError):
+            invoke(llm.get_model("sql"), "ping", "text2sql")
+        self.assertEqual(stub.requests, 1)
+
+    def test_request_deadline_bounds_slow_calls(self):
+        self._stub(delay=2.0)
+        t0 = time.monotonic()
+        with request_deadline(0.3), self.assertRaises(LLMUnavailable):
+            invoke(llm.get_model("answer"), "ping", "llm.chat")
+        self.assertLess(time.monotonic() - t0, 1.5)
+
+        with request_deadline(0.01):
+            time.sleep(0.02)
+            with self.assertRaises(DeadlineExceeded):
+                invoke(llm.get_model("answer"), "ping", "llm.chat")
+
+    @override_settings(LLM_HEDGE=True, LLM_HEDGE_STAGES=("make_title",), LLM_HEDGE_MIN_DELAY=0.05,
+                       LLM_HEDGE_MIN_SAMPLES=5)
+    def test_hedged_request_wins_over_slow_attempt(self):
+        lock, seen = threading.Lock(), []
+
+        def delay(body) -> float:
+            with lock:
+                seen.append(body)
+                return 2.0 if len(seen) == 1 else 0.01      # 첫 요청만 느리게
+
+        stub = self._stub(delay=delay)
+        for _ in range(5):                                   # p95 ≈ 50ms 로 채워 둔다
+            REGISTRY.observe("make_title.attempt", 0.05)
+
+        t0 = time.monotonic()
+        self.assertEqual(invoke(llm.get_model("title"), "ping", "make_title").content, "ok")
+        self.assertLess(time.monotonic() - t0, 1.0)
+        self.assertEqual(stub.requests, 2)
+        self.assertEqual(REGISTRY.counter("pos_llm_hedged_total", stage="make_title"), 1)
+        self.assertEqual(REGISTRY.counter("pos_llm_hedge_wins_total", stage="make_title"), 1)
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    """DB_ENGINE / DB_SQLITE_TUNING 환경변수로 메타데이터 DB 설정이 바뀌는지 (project/settings.py 를 새로 읽는다)"""
+
+    KEYS = ("DB_ENGINE", "DB_NAME", "DB_HOST", "DB_CONN_MAX_AGE", "DB_SQLITE_TUNING", "DB_BUSY_TIMEOUT")
+
+    def _load(self, **env) -> dict:
+        clean = {k: v for k, v in os.environ.items() if k not in self.KEYS}
+        with mock.patch.dict(os.environ, {**clean, **env}, clear=True):
+            return runpy.run_path(str(settings.BASE_DIR / "project" / "settings.py"))["DATABASES"]["default"]
+
+    def test_sqlite_connections_use_wal_and_busy_timeout(self):
+        workdir = Path(tempfile.mkdtemp(prefix="test_settings_"))
+        self.addCleanup(shutil.rmtree, workdir, True)
+        db = self._load(DB_NAME=str(workdir / "meta.sqlite3"), DB_BUSY_TIMEOUT="7")
+        self.assertEqual(db["ENGINE"], "django.db.backends.sqlite3")
+        self.assertEqual(db["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+
+        conn = ConnectionHandler({"default": db, "settings_check": db})["settings_check"]
+        try:
+            with conn.cursor() as cur:
+                self.assertEqual(cur.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+                self.assertEqual(cur.execute("PRAGMA busy_timeout").fetchone()[0], 7000)
+                self.assertEqual(cur.execute("PRAGMA synchronous").fetchone()[0], 1)      # NORMAL
+        finally:
+            conn.close()
+
+        self.assertNotIn("OPTIONS", self._load(DB_SQLITE_TUNING="0"))
+
+    def test_postgres_and_invalid_engine(self):
+        db = self._load(DB_ENGINE="postgres", DB_HOST="db.internal", DB_CONN_MAX_AGE="0")
+        self.assertEqual((db["ENGINE"], db["HOST"], db["PORT"], db["CONN_MAX_AGE"]),
+                         ("django.db.backends.postgresql", "db.internal", "5432", 0))
+        with self.assertRaises(ValueError):
+            self._load(DB_ENGINE="mysql")
+
+
+class HttpStageLabelTests(TestCase):
+    """요청 지연시간 stage 는 URL 이름으로 — 없는 경로가 히스토그램·시계열을 늘리지 않는지"""
+
+    def test_stage_is_labelled_by_url_name(self):
+        REGISTRY.reset()
+        for i in range(3):
+            self.assertEqual(self.client.get(f"/api/nope{i}").status_code, 404)
+        self.client.get("/api/chat/list", {"user_id": "nobody"})
+        stages = {k: v["count"] for k, v in REGISTRY.snapshot().items() if k.startswith("http ")}
+        self.assertEqual(stages, {"http unmatched": 3, "http list_chats": 1})
+
+
+class PaginationTests(TestCase):
+    """keyset 커서가 같은 시각의 행을 건너뛰거나 반복하지 않는지, 잘못된 파라미터와 If-None-Match 처리"""
+
+    def setUp(self):
+        self.user = User.objects.create(user_id="pages", user_email="pages@test.local",
+                                        user_password="x", user_name="pages")
+        self.chat = Chat.objects.create(user_id=self.user, chat_title="t")
+        same = timezone.now()
+        self.ids = [Message.objects.create(chat_id=self.chat, message_text=f"m{i}", created_at=same).message_id
+                    for i in range(5)]
+        chats = [Chat.objects.create(user_id=self.user, chat_title=f"c{i}") for i in range(4)]
+        Chat.objects.filter(user_id=self.user).update(updated_at=same)      # auto_now 를 우회해 동률로
+        self.chat_ids = sorted([self.chat.chat_id] + [c.chat_id for c in chats], reverse=True)
+
+    def _pages(self, path: str, key: str, pk: str, **params) -> list[int]:
+        """next_cursor 를 따라 끝까지 읽은 pk 목록"""
+        seen, cursor = [], None
+        while True:
+            data = self.client.get(path, {**params, **({"cursor": cursor} if cursor else {})}).json()["data"]
+            seen += [row[pk] for row in data[key]]
+            if (cursor := data["next_cursor"]) is None:
+                return seen
+
+    def test_cursor_continues_across_equal_timestamps(self):
+        qs = Message.objects.filter(chat_id=self.chat).values("message_id", "created_at")
+        rows, cursor = keyset_page(qs, "created_at", "message_id", None, 2)
+        self.assertEqual([r["message_id"] for r in rows], self.ids[:2])
+        rows, _ = keyset_page(qs, "created_at", "message_id", cursor, 2)
+        self.assertEqual([r["message_id"] for r in rows], self.ids[2:4])
+
+        self.assertEqual(self._pages("/api/chat/history", "messages", "message_id",
+                                     chat_id=self.chat.chat_id, limit=2, fields="message_text"), self.ids)
+        # 최근 순: 같은 시각이면 chat_id 내림차순
+        self.assertEqual(self._pages("/api/chat/list", "chats", "chat_id", user_id="pages", limit=2,
+                                     fields="chat_title"), self.chat_ids)
+
+    def test_invalid_limit_fields_and_cursor(self):
+        for value in ("abc", "0", "-3", "1.5"):
+            with self.subTest(limit=value), self.assertRaises(PaginationError):
+                parse_limit(value)
+        self.assertIsNone(parse_limit(""))
+        self.assertEqual(parse_limit("100000"), 500)
+        self.assertEqual(parse_fields("message_text, message_id", ("message_id", "message_text", "created_at"),
+                                      required=("message_id", "created_at")),
+                         ("message_id", "created_at", "message_text"))
+        with self.assertRaisesMessage(PaginationError, "unknown fields: password"):
+            parse_fields("message_text,password", ("message_id", "message_text"), required=("message_id",))
+
+        for params in ({"limit": "x"}, {"fields": "message_text,secret"}, {"cursor": "not-a-cursor"}):
+            with self.subTest(params):
+                body = self.client.get("/api/chat/history", {"chat_id": self.chat.chat_id, **params}).json()
+                self.assertEqual(body["response"], 400)
+
+    def test_if_none_match(self):
+        etag = make_etag("x")
+        strong = etag.removeprefix("W/")
+        request = RequestFactory().get
+        for header, expected in ((etag, True), (strong, True), ("*", True), (f'"other", {etag}', True),
+                                 ('W/"other", "again"', False), ("", False)):
+            with self.subTest(header):
+                self.assertEqual(etag_matches(request("/", HTTP_IF_NONE_MATCH=header), etag), expected)
+
+        path, params = "/api/chat/history", {"chat_id": self.chat.chat_id}
+        first = self.client.get(path, params)
+        self.assertEqual(first["Cache-Control"], "private, no-cache")
+        cached = self.client.get(path, params, HTTP_IF_NONE_MATCH=f'"stale", {first["ETag"]}')
+        self.assertEqual((cached.status_code, cached["ETag"]), (304, first["ETag"]))
+        Message.objects.create(chat_id=self.chat, message_text="new")
+        self.assertEqual(self.client.get(path, params, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 200)
+
+
+class FileDeliveryTests(SimpleTestCase):
+    """/media/ 전송: Range(구간·접미·열린 구간·416), HEAD, 조건부 304, 프록시 헤더 모드"""
+
+    BODY = b"0123456789"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = Path(tempfile.mkdtemp(prefix="test_media_"))
+        (cls.root / "plots").mkdir()
+        (cls.root / "plots" / "a.png").write_bytes(cls.BODY)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root, ignore_errors=True)
+        super().tearDownClass()
+
+    def _get(self, method: str = "get", **headers):
+        request = getattr(RequestFactory(), method)("/media/plots/a.png", headers=headers)
+        response = serve_file(request, "plots/a.png", document_root=self.root)
+        self.addCleanup(response.close)     # FileResponse 가 연 파일
+        return response
+
+    def test_parse_range(self):
+        size = len(self.BODY)
+        cases = {"bytes=0-3": (0, 3), "bytes=5-": (5, 9), "bytes=-3": (7, 9), "bytes=-50": (0, 9),
+                 "bytes=2-100": (2, 9), "bytes=0-1,4-5": None, "items=0-1": None, "bytes=-": None}
+        for header, expected in cases.items():
+            with self.subTest(header):
+                self.assertEqual(_parse_range(header, size), expected)
+        for header in ("bytes=10-", "bytes=5-2", "bytes=-0"):
+            with self.subTest(header), self.assertRaises(ValueError):
+                _parse_range(header, size)
+
+    def test_full_and_partial_responses(self):
+        full = self._get()
+        self.assertEqual((full.status_code, b"".join(full.streaming_content)), (200, self.BODY))
+        self.assertEqual((full["Content-Length"], full["Accept-Ranges"]), ("10", "bytes"))
+
+        for header, body, content_range in (("bytes=2-4", b"234", "bytes 2-4/10"),
+                                            ("bytes=7-", b"789", "bytes 7-9/10"),
+                                            ("bytes=-2", b"89", "bytes 8-9/10")):
+            with self.subTest(header):
+                response = self._get(Range=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b"".join(response.streaming_content), body)
+                self.assertEqual((response["Content-Range"], response["Content-Length"]),
+                                 (content_range, str(len(body))))
+
+        unsatisfiable = self._get(Range="bytes=20-")
+        self.assertEqual((unsatisfiable.status_code, unsatisfiable["Content-Range"]), (416, "bytes */10"))
+        self.assertEqual(self._get(Range="bytes=2-4", If_Range='"stale"').status_code, 200)     # 바뀐 파일은 전체
+
+    def test_head_and_conditional_requests(self):
+        head = self._get("head")
+        self.assertEqual((head.status_code, head["Content-Length"]), (200, "10"))
+        self.assertEqual(self._get("post").status_code, 405)
+
+        etag, modified = head["ETag"], head["Last-Modified"]
+        for headers in ({"If-None-Match": etag}, {"If-None-Match": f'"x", W/{etag}'}, {"If-Modified-Since": modified}):
+            with self.subTest(headers):
+                response = self._get(**headers)
+                self.assertEqual((response.status_code, response["ETag"]), (304, etag))
+        # If-None-Match 가 있으면 If-Modified-Since 는 보지 않는다
+        self.assertEqual(self._get(**{"If-None-Match": '"other"', "If-Modified-Since": modified}).status_code, 200)
+
+        for path in ("../etc/passwd", "plots", "plots/missing.png"):
+            with self.subTest(path), self.assertRaises(Http404):
+                serve_file(RequestFactory().get("/"), path, document_root=self.root)
+
+    def test_proxy_modes_only_send_headers(self):
+        with override_settings(FILE_DELIVERY="x-sendfile"):
+            response = self._get(Range="bytes=0-1")
+            self.assertEqual((response.status_code, response.content), (200, b""))
+            self.assertEqual(response["X-Sendfile"], str(self.root.resolve() / "plots" / "a.png"))
+        with override_settings(FILE_DELIVERY="x-accel", FILE_ACCEL_PREFIX="/_internal/"):
+            response = self._get()
+            self.assertEqual(response["X-Accel-Redirect"], "/_internal/media/plots/a.png")
+            self.assertEqual(response["Content-Type"], "image/png")
+
+
+class ColumnTypeTests(SimpleTestCase):
+    """업로드 컬럼 타입 감지와 정규화 (날짜·시각·금액·플래그·식별자)"""
+
+    def test_detect(self):
+        cases = {
+            ("date", ("2025/1/3", "2025.01.04", "2025-01-05")): ("date", "YYYY-MM-DD"),
+            ("sold_at", ("2025-01-03 9:05", "2025-01-03T13:27:39")): ("timestamp", "YYYY-MM-DD HH:MM:SS"),
+            ("time", ("0 days 13:27:39", "9:05", "23:59:59")): ("time", "HH:MM:SS"),
+            ("excel_date", (datetime(2025, 1, 3), datetime(2025, 1, 4))): ("date", "YYYY-MM-DD"),
+            ("excel_time", (dtime(9, 5), dtime(13, 0))): ("time", "HH:MM:SS"),
+            ("price", ("₩1,200", "3,500원", "$3.50")): ("currency", ""),
+            ("unit_price", (1200, 3500)): ("currency", ""),
+            ("memo", ("1200", "3500", "1200", "3500", "1200")): ("category", "1200, 3500"),   # 통화 표시 없음
+            ("promo_flag", (0, 0, 0)): ("boolean", "0/1"),
+            ("delivered", (1, 0, 1)): ("boolean", "0/1"),
+            ("age_restricted", ("Y", "N", "Y")): ("boolean", "0/1"),
+            ("active", (True, False)): ("boolean", "0/1"),
+            ("order_id", (1, 2, 3, 4)): ("integer", ""),
+            ("store_id", (0, 1, 0, 1)): ("integer", ""),
+            ("매장코드", (1, 0, 1)): ("integer", ""),
+            ("qty", (1.0, 2.0, None)): ("integer", ""),
+            ("payment", ("Card", "Cash", "Card", "Card")): ("category", "Card, Cash"),
+            ("note", ("a", "b", "c")): ("text", ""),
+        }
+        for (name, values), (kind, detail) in cases.items():
+            with self.subTest(name):
+                t = _detect(name, pd.Series(values))
+                self.assertEqual((t.kind, t.detail), (kind, detail))
+
+    def test_apply_types_normalizes_and_derives(self):
+        df = pd.DataFrame({
+            "date": ["2025/1/3", "2025.01.04", "2025-01-05", "2025-1-6"],
+            "time": ["0 days 13:27:39", "9:05", "23:59:59", None],
+            "price": ["₩1,200", "3,500원", "1,000", "₩0"],
+            "flag": ["Y", "N", "y", "n"],
+            "store_id": [0, 1, 0, 1],
+        })
+        types = infer_types(df)
+        self.assertEqual({c: t.derived_from for c, t in types.items() if t.derived_from},
+                         {"month": "date", "weekday": "date", "hour": "time"})
+        out = apply_types(df, types)
+        self.assertEqual(out["date"].tolist(), ["2025-01-03", "2025-01-04", "2025-01-05", "2025-01-06"])
+        self.assertEqual(out["time"].tolist()[:3], ["13:27:39", "09:05:00", "23:59:59"])
+        self.assertEqual(out["price"].tolist(), [1200, 3500, 1000, 0])
+        self.assertEqual(out["flag"].tolist(), [1, 0, 1, 0])
+        self.assertEqual(out["store_id"].tolist(), [0, 1, 0, 1])
+        self.assertEqual(out["month"].tolist(), ["2025-01"] * 4)
+        self.assertEqual(out["weekday"].tolist(), [4, 5, 6, 0])       # 2025-01-03 은 금요일
+        self.assertEqual(out["hour"].tolist()[:3], [13, 9, 23])
+
+    def test_values_that_do_not_parse_are_kept(self):
+        dates = [f"2025-02-{d:02d}" for d in range(1, 28)] + ["미정"]
+        types = infer_types(pd.DataFrame({"date": dates}))
+        self.assertEqual(types["date"].kind, "date")        # DATE_MIN_SHARE 이상 맞으면 날짜
+        self.assertEqual(apply_types(pd.DataFrame({"date": dates}), types)["date"].tolist()[-2:],
+                         ["2025-02-27", "미정"])
+
+        prices = pd.DataFrame({"price": ["₩1,200", "무료"]})
+        types = {"price": _detect("price", pd.Series(["₩1,200", "₩900"]))}      # 첫 청크에서 감지한 타입
+        self.assertEqual(apply_types(prices, types)["price"].tolist(), ["₩1,200", "무료"])
+
+
+def _share_strings(path: Path) -> None:
+    """openpyxl 이 inlineStr 로 쓴 문자열을 Excel 처럼 sharedStrings.xml 로 옮긴다"""
+    with zipfile.ZipFile(path) as zf:
+        parts = {name: zf.read(name) for name in zf.namelist()}
+    strings: dict[str, int] = {}
+
+    def shared(m: re.Match) -> str:
+        index = strings.setdefault(m.group(3), len(strings))
+        return f'<c r="{m.group(1)}"{m.group(2)} t="s"><v>{index}</v></c>'
+
+    for name in [n for n in parts if n.startswith("xl/worksheets/")]:
+        parts[name] = re.sub(r'<c r="(\w+)"((?: s="\d+")?) t="inlineStr"><is><t[^>]*>(.*?)</t></is></c>',
+                             shared, parts[name].decode()).encode()
+    main = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    parts["xl/sharedStrings.xml"] = (f'<sst xmlns="{main}" count="{len(strings)}" uniqueCount="{len(strings)}">'
+                                     + "".join(f"<si><t>{t}</t></si>" for t in strings) + "</sst>").encode()
+    parts["xl/_rels/workbook.xml.rels"] = parts["xl/_rels/workbook.xml.rels"].replace(b"</Relationships>", (
+        b'<Relationship Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" '
+        b'Target="sharedStrings.xml" Id="rIdStrings" /></Relationships>'))
+    parts["[Content_Types].xml"] = parts["[Content_Types].xml"].replace(b"</Types>", (
+        b'<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+        b'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml" /></Types>'))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in parts.items():
+            zf.writestr(name, data)
+
+
+def _rows(rows) -> list[tuple]:
+    """끝의 빈 칸을 자르고 빈 행은 뺀다 (read-only openpyxl 은 시트 폭만큼 채우고 빈 행도 돌려준다)"""
+    out = []
+    for row in rows:
+        row = list(row)
+        while row and row[-1] is None:
+            row.pop()
+        if row:
+            out.append(tuple(row))
+    return out
+
+
+class SpreadsheetIngestTests(SimpleTestCase):
+    """xlsx 스트리밍 리더가 openpyxl 과 같은 값을 읽고, 헤더 감지·빈 시트·병렬 적재가 맞는지"""
+
+    SALES = [
+        ["2025년 1월 매출 보고서"],                                    # 제목 행
+        [None, "작성: 본점"],
+        ["date", "time", "item", "qty", "price", "paid", "memo"],
+        [date(2025, 1, 3), dtime(9, 5), "Latte", 2, 4500.5, True, None],
+        [date(2025, 1, 4), dtime(13, 27, 39), "Mocha", 1, 5000, False, "단골"],
+        [],
+        [date(2025, 1, 5), None, "Tea", None, 3000, None, None],   # 비어 있는 칸이 많은 행
+    ]
+    RAW = [[1, 2.5, "a"], [2, 3.5, "b"], [3, 4.5, "c"]]
+
+    def setUp(self):
+        self.workdir = Path(tempfile.mkdtemp(prefix="test_xlsx_"))
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+
+    def _workbook(self, name: str, epoch=None, shared: bool = False) -> Path:
+        wb = Workbook()
+        if epoch is not None:
+            wb.epoch = epoch
+        sales = wb.active
+        sales.title = "sales"
+        for row in self.SALES:
+            sales.append(row)
+        sales["J12"] = "far"                    # 헤더 밖의 외딴 셀
+        raw = wb.create_sheet("raw")
+        for row in self.RAW:
+            raw.append(row)
+        wb.create_sheet("empty")
+        path = self.workdir / name
+        wb.save(path)
+        if shared:
+            _share_strings(path)
+        return path
+
+    def test_streamed_values_match_openpyxl(self):
+        for epoch, shared in ((None, False), (None, True), (CALENDAR_MAC_1904, True)):
+            with self.subTest(epoch=epoch, shared=shared):
+                path = self._workbook("book.xlsx", epoch, shared)
+                wb = load_workbook(path, read_only=True, data_only=True)
+                try:
+                    for sheet in wb.sheetnames:
+                        expected = _rows(wb[sheet].iter_rows(values_only=True))
+                        self.assertEqual(_rows(iter_xlsx_rows(path, sheet)), expected)
+                finally:
+                    wb.close()
+                self.assertEqual(_rows(iter_xlsx_rows(path, "sales"))[3][:3],
+                                 (datetime(2025, 1, 3), dtime(9, 5), "Latte"))
+                if shared:
+                    with zipfile.ZipFile(path) as zf:
+                        self.assertNotIn(b"inlineStr", zf.read("xl/worksheets/sheet1.xml"))
+
+    def test_header_detection(self):
+        self.assertEqual(detect_header([("보고서",), (None, "작성"), ("a", "b", "c"), (1, 2, 3)]), 2)
+        self.assertIsNone(detect_header([(1, 2.5, "a"), (2, 3.5, "b")]))
+        self.assertIsNone(detect_header([("a", "a", "b"), (1, 2, 3)]))      # 같은 이름이 있으면 헤더가 아님
+        self.assertIsNone(detect_header([]))
+
+    def test_sheets_become_tables(self):
+        db, schema = excel_to_sqlite(self._workbook("book.xlsx", shared=True), self.workdir / "book.db", workers=1)
+        with closing(sqlite3.connect(db)) as conn:
+            sales = pd.read_sql_query("SELECT * FROM table1", conn)
+            raw = pd.read_sql_query("SELECT * FROM table2", conn)
+            tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'table%'")]
+        self.assertEqual(tables, ["table1", "table2"])             # 빈 시트는 건너뜀
+        self.assertIn("- table1 (sheet: sales): date TEXT [date YYYY-MM-DD]", schema)
+        self.assertIn("- table2 (sheet: raw): col1 INTEGER", schema)
+        self.assertEqual(list(sales.columns)[:7], ["date", "time", "item", "qty", "price", "paid", "memo"])
+        self.assertEqual(sales["date"].tolist(), ["2025-01-03", "2025-01-04", "2025-01-05"])
+        self.assertEqual(sales["time"].tolist(), ["09:05:00", "13:27:39", None])
+        self.assertEqual(sales["paid"].tolist()[:2], [1, 0])
+        self.assertEqual(sales["item"].tolist(), ["Latte", "Mocha", "Tea"])
+        self.assertEqual(list(raw.columns), ["col1", "col2", "col3"])
+        self.assertEqual(raw.values.tolist(), [[1, 2.5, "a"], [2, 3.5, "b"], [3, 4.5, "c"]])
+
+    def test_xls_needs_xlrd(self):
+        path = self.workdir / "old.xls"
+        path.write_bytes(b"\xd0\xcf\x11\xe0")
+        with mock.patch.dict(sys.modules, {"xlrd": None}), self.assertRaises(UnsupportedSpreadsheet):
+            excel_to_sqlite(path, self.workdir / "old.db")
+
+    def test_parallel_load_matches_serial(self):
+        path = self._workbook("book.xlsx", shared=True)
+        serial, serial_schema = excel_to_sqlite(path, self.workdir / "serial.db", workers=1)
+        with mock.patch.object(ingest, "PARALLEL_MIN_BYTES", 0), \
+             mock.patch.object(ingest, "ProcessPoolExecutor", wraps=ingest.ProcessPoolExecutor) as pool:
+            parallel, parallel_schema = excel_to_sqlite(path, self.workdir / "parallel.db", workers=2)
+        pool.assert_called_once()
+        self.assertEqual(parallel_schema.replace("parallel.db", "serial.db"), serial_schema)
+        for table in ("table1", "table2", "_column_types"):
+            with self.subTest(table), closing(sqlite3.connect(serial)) as a, closing(sqlite3.connect(parallel)) as b:
+                pd.testing.assert_frame_equal(pd.read_sql_query(f"SELECT * FROM {table}", b),
+                                              pd.read_sql_query(f"SELECT * FROM {table}", a), check_exact=True)
+
+
+class CompactLayoutTests(SimpleTestCase):
+    """INGEST_LAYOUT=compact (_data_* + _dict_* + 뷰) 가 plain 과 같은 스키마·같은 결과를 주는지"""
+
+    QUERIES = [
+        "SELECT * FROM table1 ORDER BY transaction_id, item_name, size, topping LIMIT 50",
+        "SELECT payment_type, COUNT(*) AS n, SUM(total_price) AS sales FROM table1 GROUP BY payment_type ORDER BY 1",
+        "SELECT item_name, size, SUM(qty) FROM table1 WHERE channel = 'Kiosk' AND size IN ('S', 'L') "
+        "GROUP BY 1, 2 ORDER BY 1, 2",
+        "SELECT COUNT(*) FROM table1 WHERE topping IS NULL",
+        "SELECT topping, COUNT(*) FROM table1 GROUP BY topping ORDER BY topping",
+        "SELECT COUNT(*) FROM table1 WHERE item_name LIKE '%a%' AND milk_type <> 'Oat'",
+        "SELECT month, weekday, hour, COUNT(DISTINCT transaction_id) FROM table1 "
+        "WHERE date >= '2025-03-01' GROUP BY 1, 2, 3 ORDER BY 1, 2, 3",
+        "SELECT a.item_name, COUNT(*) FROM table1 a JOIN table1 b ON a.transaction_id = b.transaction_id "
+        "AND a.item_name <> b.item_name GROUP BY 1 ORDER BY 1",
+        "SELECT MAX(item_name), MIN(payment_type), GROUP_CONCAT(DISTINCT channel) FROM "
+        "(SELECT * FROM table1 ORDER BY channel)",
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = Path(tempfile.mkdtemp(prefix="test_compact_"))
+        csv_path = cls.workdir / "cafe.csv"
+        load_generator().write_pos("cafe", 1500, csv_path, seed=5)
+        cls.plain, cls.plain_schema = file_to_sqlite(csv_path, cls.workdir / "plain.db", layout="plain")
+        cls.compact, cls.compact_schema = file_to_sqlite(csv_path, cls.workdir / "compact.db", layout="compact")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def _run(self, db: Path, sql: str) -> pd.DataFrame:
+        with closing(sqlite3.connect(db)) as conn:
+            return pd.read_sql_query(sql, conn)
+
+    def test_layout(self):
+        with closing(sqlite3.connect(self.compact)) as conn:
+            objects = dict(conn.execute("SELECT name, type FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"))
+            self.assertEqual((objects["table1"], objects["_data_table1"]), ("view", "table"))
+            self.assertEqual(objects["ix__data_table1_date"], "index")       # 인덱스는 실제 행 테이블에
+            self.assertEqual(conn.execute("SELECT value FROM _dict_table1_payment_type ORDER BY code").fetchall(),
+                             [("Card",), ("Cash",), ("MobilePay",)])
+            self.assertEqual(conn.execute("SELECT typeof(payment_type) FROM _data_table1 LIMIT 1").fetchone(),
+                             ("integer",))
+        # 뷰가 원래 컬럼 이름·순서·타입 설명을 유지하므로 LLM 이 보는 스키마도 같다
+        self.assertEqual(self.compact_schema.replace("compact.db", "plain.db"), self.plain_schema)
+
+    def test_queries_return_the_same_results(self):
+        for sql in self.QUERIES:
+            with self.subTest(sql=sql):
+                pd.testing.assert_frame_equal(self._run(self.compact, sql), self._run(self.plain, sql),
+                                              check_exact=True)
+
+
+class _Chunks:
+    """청크를 하나씩 내주고, 몇 개를 읽었는지와 닫혔는지(= HTTP 스트림 종료)를 기록하는 스트림"""
+
+    def __init__(self, chunks: list[str]):
+        self.chunks, self.read, self.closed = chunks, 0, False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if self.read == len(self.chunks):
+            raise StopIteration
+        self.read += 1
+        return self.chunks[self.read - 1]
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class DirectiveStreamTests(SimpleTestCase):
+    """read_reply: 지시문이 끝나는 청크에서 정확히 멈추는지 (청크 경계가 어디에 오든)"""
+
+    PLOT = "[PLOT]\n```python\nplt.bar(['a', 'b'], [1, 2])\n```\nHere is the chart. <END>"
+    BATCH = ("[T2S_BATCH]\n```sql\nSELECT 1\n```\n```sql\nSELECT 2\n```\n\n```sql\nSELECT 3\n```\n"
+             "I will wait for the results.")
+
+    def setUp(self):
+        REGISTRY.reset()
+
+    def _read(self, reply: str, size: int, **kwargs):
+        stream = _Chunks([reply[i:i + size] for i in range(0, len(reply), size)])
+        return read_reply(stream, **kwargs), stream
+
+    def _assert_stops_at(self, reply: str, end: int, directive: str, **kwargs):
+        """end = 지시문이 완성되는 글자 위치. 그 글자가 든 청크까지만 읽고 스트림을 닫아야 한다"""
+        for size in (1, 2, 3, 5, 8, 13):
+            with self.subTest(size=size):
+                result, stream = self._read(reply, size, **kwargs)
+                self.assertEqual((result.directive, result.stopped_early), (directive, True))
+                self.assertEqual(len(result.text), min(-(-end // size) * size, len(reply)))
+                self.assertEqual(result.text, reply[:len(result.text)])
+                self.assertTrue(stream.closed)
+
+    def test_t2s_stops_right_after_the_directive(self):
+        self._assert_stops_at("[T2S]\nI will ask the text2sql tool.", len("[T2S]"), "[T2S]")
+        self.assertEqual(REGISTRY.counter("pos_llm_stream_early_stops_total", directive="[T2S]"), 6)
+
+    def test_plot_stops_when_the_fence_closes(self):
+        self._assert_stops_at(self.PLOT, self.PLOT.index("```\nHere") + 3, "[PLOT]")
+
+    def test_batch_stops_after_the_last_fence(self):
+        # 마지막 fence 뒤에 fence 가 아닌 글자가 와야 끝난 줄 안다
+        self._assert_stops_at(self.BATCH, self.BATCH.index("I will") + 1, "[T2S_BATCH]")
+        # max_fences 개가 닫히면 바로
+        self._assert_stops_at(self.BATCH, self.BATCH.index("SELECT 2\n```") + len("SELECT 2\n```"),
+                              "[T2S_BATCH]", max_fences=2)
+        # 끝까지 fence 만 있으면 스트림 끝까지 읽는다
+        result, _ = self._read(self.BATCH[:self.BATCH.index("I will")], 4)
+        self.assertEqual((result.directive, result.stopped_early), ("[T2S_BATCH]", False))
+
+    def test_directive_split_across_chunks(self):
+        cases = ((["[T2", "S", "_BA", "TCH]\n```s", "ql\nSELECT 1\n``", "`\nok", " rest"], "[T2S_BATCH]", 6),
+                 (["[T2", "S", "]", "\nrest"], "[T2S]", 3),
+                 (["[", "PL", "OT]\n`", "``python\nx = 1\n`", "``", "\nrest"], "[PLOT]", 5))
+        for chunks, directive, read in cases:
+            with self.subTest(directive):
+                stream = _Chunks(chunks)
+                result = read_reply(stream)
+                self.assertEqual((result.directive, result.stopped_early, stream.read), (directive, True, read))
+                self.assertEqual(result.text, "".join(chunks[:read]))
+
+    def test_plain_answers_are_read_to_the_end(self):
+        for reply in ("매출은 1,200원입니다. [T2S] 는 쓰지 않았습니다. <END>", "[Note] 참고하세요 <END>",
+                      "[T2S_BATC", ""):
+            with self.subTest(reply):
+                result, stream = self._read(reply, 2)
+                self.assertEqual((result.text, result.directive, result.stopped_early), (reply, None, False))
+                self.assertEqual(stream.read, len(stream.chunks))
+        self.assertEqual(REGISTRY.counter("pos_llm_stream_early_stops_total", directive="[T2S]"), 0)
+
+
+class RollupRewriteTests(SimpleTestCase):
+    """생성한 POS 데이터(카페·편의점 × plain·compact)에서 롤업으로 바꾼 쿼리가 원래 쿼리와 같은 결과를 내는지"""
+    ROWS = 12_000
+
+    REWRITTEN = [
+        "SELECT SUM(total_price) FROM table1",
+        "SELECT COUNT(*), SUM(qty), AVG(total_price), MIN(unit_price), MAX(unit_price), TOTAL(qty), COUNT(qty) "
+        "FROM table1 WHERE date >= '2025-03-01' AND date < '2025-04-01'",
+        "SELECT strftime('%Y-%m', date) AS month, SUM(total_price) AS sales FROM table1 "
+        "GROUP BY strftime('%Y-%m', date) ORDER BY month",
+        "SELECT month, SUM(total_price) FROM table1 GROUP BY month ORDER BY month DESC LIMIT 3",
+        "select payment_type, count(*) as n, sum(total_price) as sales from table1 group by payment_type "
+        "order by sales desc",
+        'SELECT "item_name", SUM("qty") AS qty FROM "table1" WHERE month = \'2025-06\' '
+        "GROUP BY 1 ORDER BY qty DESC, 1 LIMIT 5;",
+        "SELECT weekday, AVG(total_price) avg_sales FROM table1 GROUP BY weekday ORDER BY 1",
+        "SELECT date, channel, SUM(total_price) FROM table1 WHERE date BETWEEN '2025-05-01' AND '2025-05-31' "
+        "GROUP BY date, channel ORDER BY date, channel",
+        "SELECT substr(date, 1, 7) AS m, COUNT(DISTINCT payment_type), MIN(date), MAX(date) FROM table1 "
+        "GROUP BY m ORDER BY m",
+        "SELECT payment_type, ROUND(SUM(total_price) * 1.0 / SUM(qty), 2) AS per_unit FROM table1 "
+        "GROUP BY payment_type HAVING COUNT(*) > 10 ORDER BY per_unit",
+        "SELECT COUNT(payment_type), COUNT(date) FROM table1 WHERE weekday IN (5, 6)",
+        "SELECT month, SUM(total_price) FROM table1 GROUP BY month HAVING SUM(total_price) > 0 "
+        "ORDER BY SUM(total_price) DESC",
+        "SELECT SUM(total_price) FROM table1 WHERE date >= '2030-01-01'",
+        "SELECT date,\n       SUM(total_price) AS sales\nFROM   table1\nGROUP  BY date\nORDER  BY date;",
+    ]
+    UNCHANGED = [
+        "SELECT * FROM table1 LIMIT 5",
+        "SELECT hour, SUM(total_price) FROM table1 GROUP BY hour",
+        "SELECT payment_type, channel, SUM(total_price) FROM table1 GROUP BY payment_type, channel",
+        "SELECT SUM(total_price) FROM table1 WHERE time >= '12:00:00'",
+        "SELECT SUM(qty * unit_price) FROM table1",
+        "SELECT date, SUM(total_price) FROM table1 GROUP BY month",
+        "SELECT t.payment_type, SUM(t.total_price) FROM table1 t GROUP BY 1",
+        "SELECT COUNT(DISTINCT transaction_id) FROM table1",
+        "SELECT SUM(total_price) FROM table1 WHERE total_price > 10000",
+        "SELECT payment_type, SUM(total_price) OVER () FROM table1",
+        "SELECT SUM(total_price) FROM (SELECT * FROM table1)",
+        "SELECT month, SUM(total_price) FROM table1 GROUP BY month UNION ALL SELECT 'all', SUM(total_price) FROM table1",
+        "SELECT GROUP_CONCAT(payment_type) FROM table1",
+        "SELECT SUM(DISTINCT total_price) FROM table1",
+        "SELECT date, MAX(total_price) FROM table1",
+        "SELECT SUM(n__) FROM table1",
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        gen = load_generator()
+        cls.workdir = Path(tempfile.mkdtemp(prefix="test_rollups_"))
+        cls.dbs = []
+        for kind, seed in (("cafe", 1), ("cvs", 2)):
+            csv_path = cls.workdir / f"{kind}.csv"
+            gen.write_pos(kind, cls.ROWS, csv_path, seed=seed)
+            for layout in LAYOUTS:
+                db, _ = file_to_sqlite(csv_path, cls.workdir / f"{kind}_{layout}.db", layout=layout, rollups=True)
+                cls.dbs.append(db)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def _run(self, db: Path, sql: str) -> pd.DataFrame:
+        with closing(sqlite3.connect(db)) as conn:
+            return pd.read_sql_query(sql, conn)
+
+    def test_rewritten_queries_return_identical_results(self):
+        for db in self.dbs:
+            for sql in self.REWRITTEN:
+                with self.subTest(db=db.name, sql=sql):
+                    rw = rollups.rewrite(db, sql)
+                    self.assertIsNotNone(rw)
+                    self.assertIn(rollups.PREFIX, rw.sql)
+                    pd.testing.assert_frame_equal(self._run(db, rw.sql), self._run(db, sql), check_exact=True)
+
+    def test_unsupported_queries_run_unchanged(self):
+        for db in self.dbs:
+            for sql in self.UNCHANGED:
+                with self.subTest(db=db.name, sql=sql):
+                    self.assertIsNone(rollups.rewrite(db, sql))
+
+    def test_real_measures_and_plain_ingest_are_not_rewritten(self):
+        # 실수 합계는 더하는 순서에 따라 달라질 수 있으므로 측정값으로 쓰지 않는다
+        csv_path = self.workdir / "real.csv"
+        days = pd.date_range("2025-01-01", periods=30).strftime("%Y-%m-%d")
+        pd.DataFrame({"date": [days[i % 30] for i in range(3000)],
+                      "weight": [0.1 * (i % 7) for i in range(3000)],
+                      "qty": [i % 5 for i in range(3000)]}).to_csv(csv_path, index=False)
+        db, _ = file_to_sqlite(csv_path, self.workdir / "real.db", rollups=True)
+        self.assertIsNone(rollups.rewrite(db, "SELECT SUM(weight) FROM table1"))
+        self.assertIsNotNone(rollups.rewrite(db, "SELECT date, SUM(qty) FROM table1 GROUP BY date"))
+
+        plain, _ = file_to_sqlite(csv_path, self.workdir / "no_rollups.db")
+        self.assertIsNone(rollups.rewrite(plain, "SELECT date, SUM(qty) FROM table1 GROUP BY date"))
+
+
+@override_settings(SCHEMA_EMBEDDING_MODEL="local", SCHEMA_RETRIEVAL_ENABLED=True,
+                   SCHEMA_PRUNE_MIN_COLUMNS=40, SCHEMA_TOP_K=12)
+class SchemaPruneTests(SimpleTestCase):
+    """넓은 테이블의 스키마를 줄여도 벤치마크 질문(api/bench/schema_questions.json)에 필요한 컬럼은 남는지"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = Path(tempfile.mkdtemp(prefix="test_schema_"))
+        csv_path = cls.workdir / "cafe.csv"
+        load_generator().write_pos("cafe", 500, csv_path, seed=3)
+        df = pd.read_csv(csv_path)
+        for system in ("erp", "wms", "crm", "fin", "hr"):
+            for field in ("ref_code", "status", "memo", "amount_adj", "tax_amount", "lot_qty", "owner", "rate"):
+                df[f"{system}_{field}"] = [f"{field}-{i % 37}" for i in range(len(df))]
+        df.to_csv(csv_path, index=False)
+        cls.db, cls.schema = file_to_sqlite(csv_path, cls.workdir / "wide.db")
+        cls.narrow, cls.narrow_schema = file_to_sqlite(Path(__file__).parent.parent / "test" / "cafe_data_eg.csv",
+                                                       cls.workdir / "narrow.db")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_pruned_schema_keeps_required_columns(self):
+        questions = json.loads((Path(__file__).parent / "bench" / "schema_questions.json").read_text(encoding="utf-8"))
+        for q in questions:
+            with self.subTest(question=q["question"]):
+                pruned = schema_index.prune(self.db, self.schema, q["question"])
+                self.assertIn("columns shown]", pruned)
+                self.assertLess(len(pruned), len(self.schema) / 2)
+                for col in q["columns"] + ["date", "transaction_id"]:
+                    self.assertRegex(pruned, rf"(: |, ){col} ")
+
+    def test_narrow_tables_are_unchanged(self):
+        self.assertEqual(schema_index.prune(self.narrow, self.narrow_schema, "메뉴별 매출"), self.narrow_schema)
+
+
+@override_settings(SCHEMA_EMBEDDING_MODEL="local", FEWSHOT_ENABLED=True, FEWSHOT_K=3, FEWSHOT_TOKEN_BUDGET=800)
+class FewShotStoreTests(TestCase):
+    """성공한 text2sql SQL 을 저장해 비슷한 질문에 예시로 주고, 현재 파일에 없는 컬럼을 쓰는 예시는 빼는지"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = Path(tempfile.mkdtemp(prefix="test_fewshot_"))
+        cls.cafe, _ = file_to_sqlite(Path(__file__).parent.parent / "test" / "cafe_data_eg.csv", cls.workdir / "cafe.db")
+        csv_path = cls.workdir / "ledger.csv"
+        pd.DataFrame({"date": ["2025-01-01", "2025-01-02"], "amount": [100, 200]}).to_csv(csv_path, index=False)
+        cls.ledger, _ = file_to_sqlite(csv_path, cls.workdir / "ledger.db")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        fewshot.reset()
+        self.user = User.objects.create(user_id="fewshot", user_email="fewshot@test.local",
+                                        user_password="x", user_name="fewshot")
+
+    def test_refs_exclude_functions_and_aliases(self):
+        self.assertEqual(fewshot.refs("SELECT t.item_name, SUM(qty) AS n FROM \"table1\" t "
+                                      "WHERE date >= DATE('now') GROUP BY 1 ORDER BY n DESC"),
+                         {"item_name", "qty", "table1", "t", "date"})
+
+    def test_recorded_sql_is_retrieved_for_similar_questions(self):
+        sql = "SELECT size, SUM(qty) AS qty FROM table1 WHERE item_name = 'Latte' GROUP BY size"
+        for _ in range(2):
+            fewshot.record(self.user.user_id, None, self.cafe, "라떼 사이즈별 판매 수량", sql)
+        self.assertEqual(SqlExample.objects.filter(user_id=self.user).count(), 1)
+
+        examples = fewshot.examples_for(self.user.user_id, self.cafe, "라떼의 사이즈별 판매 수량은?")
+        self.assertTrue(examples.startswith(fewshot.HEADER))
+        self.assertIn(sql, examples.split("### ")[1])
+        self.assertEqual(examples.count("```sql"), 3)
+
+        with override_settings(FEWSHOT_TOKEN_BUDGET=60):
+            self.assertEqual(fewshot.examples_for(self.user.user_id, self.cafe, "라떼 사이즈별 판매 수량").count("```sql"), 1)
+
+    def test_examples_need_every_column_in_the_current_file(self):
+        fewshot.record(self.user.user_id, None, self.cafe, "메뉴별 매출",
+                       "SELECT item_name, SUM(total_price) FROM table1 GROUP BY item_name")
+        self.assertIsNone(fewshot.examples_for(self.user.user_id, self.ledger, "메뉴별 매출"))
+        fewshot.record(self.user.user_id, None, self.ledger, "일별 금액 합계",
+                       "SELECT date, SUM(amount) FROM table1 GROUP BY date")
+        self.assertIn("SUM(amount)", fewshot.examples_for(self.user.user_id, self.ledger, "일별 금액"))
+
+
+class FileSetTests(TestCase):
+    """여러 파일을 ATTACH 해 f<n>.table1 과 union 뷰로 질의하고, 기존 file_id 요청도 받는지"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = Path(tempfile.mkdtemp(prefix="test_fileset_"))
+        frames = {
+            "may.csv": pd.DataFrame({"date": ["2025-05-01", "2025-05-02"], "amount": [100, 200]}),
+            "june.csv": pd.DataFrame({"date": ["2025-06-01", "2025-06-02", "2025-06-03"], "amount": [10, 20, 30]}),
+            "stock.csv": pd.DataFrame({"item": ["Latte"], "qty": [5]}),
+        }
+        cls.dbs = {}
+        for name, df in frames.items():
+            csv_path = cls.workdir / name
+            df.to_csv(csv_path, index=False)
+            cls.dbs[name] = file_to_sqlite(csv_path, csv_path.with_suffix(".db"))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create(user_id="files", user_email="files@test.local",
+                                        user_password="x", user_name="files")
+        self.files = [File.objects.create(user_id=self.user, file_name=name, file_size=1, file_type="csv",
+                                          file_path=str(self.workdir / name), file_sqlpath=str(db),
+                                          file_schema=schema, file_processed=File.FileProcessingStatus.COMPLETED)
+                      for name, (db, schema) in self.dbs.items()]
+
+    def test_schema_lists_attached_files_and_union_views(self):
+        schema = FileSet(self.files).schema
+        self.assertIn("- f1 = may.csv", schema)
+        self.assertIn("  - f3.table1:", schema)
+        self.assertIn("- all_table1 = f1.table1 ∪ f2.table1: source_file, date, amount", schema)
+        self.assertNotIn("f3.table1 ∪", schema)       # 컬럼 구성이 다른 파일은 뷰에 안 들어간다
+        self.assertEqual(FileSet(self.files[:1]).schema, self.files[0].file_schema)
+
+    def test_queries_address_attached_files_and_views(self):
+        data = FileSet(list(reversed(self.files)))       # 별칭은 file_id 순서
+        df = data.query("SELECT source_file, COUNT(*) AS n, SUM(amount) AS amount "
+                        "FROM all_table1 GROUP BY source_file ORDER BY source_file")
+        self.assertEqual(df.values.tolist(), [["june.csv", 3, 60], ["may.csv", 2, 300]])
+        self.assertEqual(data.query("SELECT qty FROM f3.table1").iloc[0, 0], 5)
+        self.assertIsNone(data.explain("SELECT amount FROM f2.table1"))
+        self.assertIn("no such column", data.explain("SELECT qty FROM f1.table1"))
+
+        results = data.query_batch(["SELECT COUNT(*) AS n FROM f1.table1", "SELECT nope FROM f2.table1"])
+        self.assertEqual(results[0].iloc[0, 0], 2)
+        self.assertIsInstance(results[1], sqlite3.OperationalError)
+        with self.assertRaises(sqlite3.OperationalError):       # 파일은 읽기 전용으로 ATTACH
+            data.query("DELETE FROM f1.table1")
+
+    def test_batch_query_spans_reach_the_request_trace(self):
+        for files in (self.files[:1], self.files):       # utils.execute_sqlite_queries / ATTACH 풀
+            with self.subTest(files=len(files)):
+                data = FileSet(files)
+                data.schema         # 뷰에서처럼 스키마(ORM)는 요청 스레드에서 먼저 만든다
+                trace = Trace("test")
+                token = _current.set(trace)
+                try:
+                    data.query_batch(["SELECT 1", "SELECT 2", "SELECT 3"])
+                finally:
+                    _current.reset(token)
+                self.assertEqual(trace.stages["sql.batch"]["count"], 1)
+                self.assertEqual(trace.stages["sql"]["count"], 3)
+                self.assertEqual(trace.attrs["rows"], 3)
+
+    @override_settings(FASTPATH_ENABLED=False, ADMISSION_ENABLED=False, LLM_RETRIES=0)
+    def test_start_chat_file_ids(self):
+        stub = StubOpenAIServer(lambda messages: "파일을 확인했습니다. <END>").start()
+        self.addCleanup(stub.stop)
+        llm.configure(model_cls=OfflineChatOpenAI, base_url=stub.base_url, api_key="stub")
+        self.addCleanup(llm.configure)
+
+        def start(**body) -> dict:
+            return self.client.post("/api/chat/start", {"user_id": "files", "message_text": "요약해줘", **body},
+                                    content_type="application/json").json()
+
+        body = start(file_id=str(self.files[1].file_id))      # 예전 클라이언트: 문자열 file_id
+        self.assertEqual(body["response"], 200)
+        self.assertEqual(Chat.objects.get(chat_id=body["data"]["chat_id"]).file_id, self.files[1])
+        self.assertEqual(start(file_id="june")["response"], 400)
+        self.assertEqual(start(file_ids=[str(self.files[0].file_id)])["response"], 400)
+        self.assertEqual(start(file_ids=[self.files[0].file_id, 10**6])["response"], 404)
+
+        body = start(file_ids=[f.file_id for f in self.files])
+        chat = Chat.objects.get(chat_id=body["data"]["chat_id"])
+        self.assertEqual(chat.file_id, self.files[0])
+        self.assertEqual(set(chat.files.all()), set(self.files))
+
+
+@override_settings(SCHEMA_EMBEDDING_MODEL="local", FASTPATH_ENABLED=True, BATCH_WORKERS=3, BATCH_MAX_ROWS=2,
+                   LLM_RETRIES=0, ADMISSION_ENABLED=False)
+class BatchJobTests(TransactionTestCase):
+    """배치 작업: 같은 질문·같은 SQL 은 한 번만 돌리고, 실패한 질문이 다른 질문을 막지 않는지"""
+
+    # 질문 → text2sql 응답. 두 번째 SQL 은 첫 번째와 키워드 대소문자·공백·주석·';' 만 다르다
+    REPLIES = {
+        "메뉴별 판매 수량": "SELECT item_name, SUM(qty) AS qty FROM table1 GROUP BY item_name",
+        "각 메뉴의 판매량": "select item_name, SUM(qty) as qty\n  from table1 -- 메뉴별\n group by item_name;",
+        "없는 컬럼": "SELECT no_such_column FROM table1",
+    }
+
+    def setUp(self):
+        fewshot.reset()
+        batch.reset()
+        self.workdir = Path(tempfile.mkdtemp(prefix="test_batch_"))
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        db, schema = file_to_sqlite(Path(__file__).parent.parent / "test" / "cafe_data_eg.csv", self.workdir / "cafe.db")
+        self.user = User.objects.create(user_id="batch", user_email="batch@test.local",
+                                        user_password="x", user_name="batch")
+        self.file = File.objects.create(user_id=self.user, file_name="cafe.csv", file_size=1, file_type="csv",
+                                        file_path=str(self.workdir / "cafe.csv"), file_sqlpath=str(db),
+                                        file_schema=schema, file_processed=File.FileProcessingStatus.COMPLETED)
+
+        def reply(messages: list[dict]) -> str:
+            question = messages[-1]["content"].split("NL Question: ")[-1].split("\n")[0]
+            return f"```sql\n{self.REPLIES[question]}\n```"
+
+        stub = StubOpenAIServer(reply).start()
+        self.addCleanup(stub.stop)
+        llm.configure(model_cls=OfflineChatOpenAI, base_url=stub.base_url, api_key="stub")
+        self.addCleanup(llm.configure)
+        REGISTRY.reset()
+
+    def _result(self, job_id: int) -> dict:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            data = self.client.get("/api/batch/result", {"job_id": job_id}).json()["data"]
+            if data["status"] in ("completed", "failed"):
+                return data
+            time.sleep(0.05)
+        self.fail("batch job did not finish")
+
+    def test_batch_shares_duplicate_questions_and_sql(self):
+        questions = ["메뉴별 판매 수량", "각 메뉴의 판매량", "없는 컬럼", "  메뉴별   판매 수량 ", "지난달 가장 많이 팔린 메뉴는?"]
+        response = self.client.post("/api/batch/start", {"user_id": "batch", "file_id": self.file.file_id,
+                                                         "questions": questions}, content_type="application/json")
+        body = response.json()
+        self.assertEqual(body["response"], 200)
+
+        data = self._result(body["data"]["job_id"])
+        self.assertEqual(data["status"], "completed")
+        items = data["items"]
+        self.assertEqual([i["source"] for i in items], ["llm", "llm", "llm", "duplicate", "fastpath"])
+        self.assertEqual([i["status"] for i in items], ["completed", "completed", "failed", "completed", "completed"])
+        self.assertEqual((data["completed"], data["failed"]), (4, 1))
+
+        # 같은 SQL 은 한 번만 실행하고, 같은 질문은 다시 풀지 않는다
+        self.assertEqual(REGISTRY.counter("pos_batch_sql_shared_total"), 1)
+        self.assertEqual({items[1]["shared_with"], items[3]["shared_with"]}, {0})
+        self.assertEqual(items[0]["result"], items[1]["result"])
+        self.assertEqual(len(items[0]["result"]["data"]), 2)
+        self.assertGreater(items[0]["row_count"], 2)
+        self.assertIn("no_such_column", items[2]["error"])
+        self.assertTrue(items[4]["answer_text"])
+        self.assertGreater(items[0]["timing_ms"]["total"], 0)
+
+        # 행을 돌려준 text2sql SQL 은 few-shot 예시로 남는다
+        self.assertEqual(SqlExample.objects.filter(user_id=self.user).count(), 2)
+
+    def test_batch_rejects_invalid_requests(self):
+        def start(**body):
+            return self.client.post("/api/batch/start", {"user_id": "batch", "file_id": self.file.file_id, **body},
+                                    content_type="application/json").json()["response"]
+
+        self.assertEqual(start(questions=["ok", " "]), 400)
+        self.assertEqual(start(questions="메뉴별 판매 수량"), 400)
+        with override_settings(BATCH_MAX_QUESTIONS=2):
+            self.assertEqual(start(questions=["a", "b", "c"]), 400)
+        self.assertEqual(start(questions=["a"], file_id=self.file.file_id + 1), 404)
+        self.assertEqual(self.client.get("/api/batch/result", {"job_id": 999}).json()["response"], 404)
+
+
+class FastPathTests(SimpleTestCase):
+    """템플릿 질문만 LLM 없이 답하고, 특정 값·다른 조건을 묻는 질문은 LLM 으로 넘기는지 (카페 샘플 데이터)"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = Path(tempfile.mkdtemp(prefix="test_fastpath_"))
+        # 템플릿 그래프가 실제 media/_plots 에 쌓이지 않도록
+        cls.media = override_settings(MEDIA_ROOT=cls.workdir / "media", MEDIA_URL="/media/")
+        cls.media.enable()
+        db, _ = file_to_sqlite(Path(__file__).parent.parent / "test" / "cafe_data_eg.csv", cls.workdir / "cafe.db")
+        cls.data = FileSet([File(file_id=1, file_sqlpath=str(db), file_schema="")])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media.disable()
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_parse_strips_period_grain_and_particles(self):
+        q = fastpath.parse("지난달 일별 매출 추이를 그래프로 보여줘")
+        self.assertEqual(q.period.label, "지난달")
+        self.assertEqual(q.grain, "day")
+        self.assertIn("추이", q.stems)
+        self.assertTrue(q.plot)
+        self.assertEqual(fastpath.parse("상위 3개 메뉴").top_n, 3)
+        self.assertIsNone(fastpath.parse("지난주 이번 달 매출 추이"))     # 기간이 둘
+
+    def test_template_questions(self):
+        cases = {
+            "지난달 가장 많이 팔린 메뉴는?": ("top_items", "ORDER BY qty DESC"),
+            "최근 3개월 매출 추이": ("sales_trend", "GROUP BY 1"),
+            "결제 수단별 매출 비중": ("split", "ORDER BY sales DESC"),
+            "채널별 주문 건수": ("split", "ORDER BY orders DESC"),
+        }
+        for question, (template, sql) in cases.items():
+            with self.subTest(question):
+                fast = fastpath.answer(question, self.data)
+                self.assertEqual(fast.template, template)
+                self.assertIn(sql, fast.sql)
+
+    def test_named_values_are_compared_with_a_filter(self):
+        fast = fastpath.answer("카드와 현금 결제 매출을 비교해줘", self.data)
+        self.assertIn("IN ('Card', 'Cash')", fast.sql)
+        self.assertNotIn("MobilePay", fast.text)
+
+    def test_other_questions_fall_through_to_the_llm(self):
+        for question in ("배달 매출은?", "카드 결제 건수는?", "현금 결제 비율", "키오스크 주문 건수는?",
+                         "결제 수단별 매출과 건수", "배달과 포장 매출 비교",       # 포장은 이 파일에 없음
+                         "가장 적게 팔린 메뉴는?", "작년 대비 매출 추이", "라떼 매출 추이"):
+            with self.subTest(question):
+                self.assertIsNone(fastpath.answer(question, self.data))
+
+
+class PlotCacheTests(TestCase):
+    """LRU 축출이 메시지가 아직 가리키는 그래프는 남기는지, 실행 오류가 원래 예외와 함께 올라오는지"""
+
+    def setUp(self):
+        self.media = Path(tempfile.mkdtemp(prefix="test_plots_"))
+        self.addCleanup(shutil.rmtree, self.media, True)
+        override = override_settings(MEDIA_ROOT=self.media, MEDIA_URL="/media/")
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _plot(self, n: int) -> str:
+        url, hit = plot_cache.render_plot(f"plt.plot([1, 2, 3], [{n}, 1, {n}])")
+        self.assertFalse(hit)
+        return url
+
+    def test_evict_keeps_plots_referenced_by_messages(self):
+        old, used, new = self._plot(1), self._plot(2), self._plot(3)
+        user = User.objects.create(user_id="plots", user_email="plots@test.local", user_password="x", user_name="p")
+        Message.objects.create(chat_id=Chat.objects.create(user_id=user, chat_title="t"),
+                               message_text="그래프", message_role=Message.MessageRole.ASSISTANT,
+                               message_image_url=used)
+
+        left = plot_cache.evict(0)
+        self.assertEqual([url for url in (old, used, new) if (self.media / url.removeprefix("/media/")).exists()],
+                         [used])
+        self.assertEqual(left, sum(size for _, size, _ in plot_cache._entries()))
+        self.assertTrue(plot_cache.render_plot("plt.plot([1, 2, 3], [2, 1, 2])")[1])      # 참조된 그래프는 캐시 hit
+
+    def test_render_error_is_chained(self):
+        with self.assertRaises(RuntimeError) as cm:
+            plot_cache.render_plot("plt.plot(undefined_name)")
+        self.assertIsInstance(cm.exception.__cause__, NameError)
+        self.assertIn("NameError", str(cm.exception))
+
+
+@override_settings(ADMISSION_ENABLED=True, ADMISSION_MAX_INFLIGHT_LLM=1, ADMISSION_MAX_QUEUE=4,
+                   ADMISSION_QUEUE_TIMEOUT=0.05, ADMISSION_RATES={}, FASTPATH_ENABLED=False)
+class ChatSaturationTests(TestCase):
+    """LLM 대기열이 넘쳐도 질문만 남은 채팅이 생기지 않는지"""
+
+    def setUp(self):
+        admission.reset()
+        self.addCleanup(admission.reset)
+        llm.configure(model_cls=OfflineChatOpenAI, base_url="http://127.0.0.1:9/v1", api_key="stub")
+        self.addCleanup(llm.configure)
+        REGISTRY.reset()
+        self.user = User.objects.create(user_id="busy", user_email="busy@test.local",
+                                        user_password="x", user_name="busy")
+        # 하나뿐인 LLM 슬롯을 테스트가 잡고 있는다
+        _, limiter = admission._state()
+        limiter.acquire("other", 1)
+        self.addCleanup(limiter.release, 0)
+
+    def _post(self, path: str, body: dict):
+        return self.client.post(path, body, content_type="application/json")
+
+    def test_start_is_rejected_before_anything_is_saved(self):
+        response = self._post("/api/chat/start", {"user_id": "busy", "message_text": "안녕"})
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(Chat.objects.filter(user_id=self.user).exists())
+
+    def test_query_records_the_error_in_history(self):
+        chat = Chat.objects.create(user_id=self.user, chat_title="t")
+        body = self._post("/api/chat/query", {"chat_id": chat.chat_id, "message_text": "매출 알려줘"}).json()
+        self.assertEqual(body["response"], 200)
+        self.assertTrue(body["data"]["response"].startswith("[ERROR/LLM] server is busy"))
+        roles = list(Message.objects.filter(chat_id=chat).order_by("message_id")
+                     .values_list("message_role", flat=True))
+        self.assertEqual(roles, [Message.MessageRole.USER, Message.MessageRole.ASSISTANT])
+        self.assertEqual(REGISTRY.counter("pos_admission_rejected_total", endpoint="chat.query", reason="queue"), 1)
+
+
+@override_settings(FASTPATH_ENABLED=False, ADMISSION_ENABLED=False, LLM_STREAM_DIRECTIVES=True, LLM_RETRIES=1,
+                   LLM_RETRY_BASE=0.01)
+class ChatStreamFailureTests(TestCase):
+    """첫 chunk 뒤에 끊긴 스트리밍 응답이 500 이 아니라 채팅 오류로 남는지"""
+
+    def setUp(self):
+        stub = StubOpenAIServer(lambda messages: "지난달 매출은 1,200,000원이고 카드 결제가 가장 많았습니다. <END>",
+                                stream_chunk_chars=4, stream_cut_after=3).start()
+        self.addCleanup(stub.stop)
+        self.stub = stub
+        llm.configure(model_cls=OfflineChatOpenAI, base_url=stub.base_url, api_key="stub")
+        self.addCleanup(llm.configure)
+        REGISTRY.reset()
+        user = User.objects.create(user_id="cut", user_email="cut@test.local", user_password="x", user_name="cut")
+        self.chat = Chat.objects.create(user_id=user, chat_title="t")
+
+    def test_interrupted_stream_is_recorded_as_llm_error(self):
+        response = self.client.post("/api/chat/query", {"chat_id": self.chat.chat_id, "message_text": "매출 알려줘"},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        answer = response.json()["data"]["response"]
+        self.assertTrue(answer.startswith("[ERROR/LLM] llm.chat: stream interrupted"), answer)
+        self.assertEqual(REGISTRY.counter("pos_llm_failures_total", stage="llm.chat"), 1)
+        self.assertEqual(len(self.stub.bodies), 1)       # 일부를 받은 뒤에는 다시 보내지 않는다
+        roles = list(Message.objects.filter(chat_id=self.chat).order_by("message_id")
+                     .values_list("message_role", flat=True))
+        self.assertEqual(roles, [Message.MessageRole.USER, Message.MessageRole.ASSISTANT])
+
+
+@override_settings(FASTPATH_ENABLED=False, ADMISSION_ENABLED=False, FEWSHOT_ENABLED=False,
+                   LLM_STREAM_DIRECTIVES=True, LLM_RETRIES=0)
+class ChatSqlTurnTests(TestCase):
+    """query_chat 의 [T2S_BATCH] 병렬 실행과 SQL 오류가 history 에 남는지 (스트리밍 stub)"""
+
+    BATCH = ("[T2S_BATCH]\n```sql\nSELECT channel, COUNT(*) AS n FROM table1 GROUP BY channel ORDER BY channel\n```\n"
+             "```sql\nSELECT SUM(qty) AS qty FROM table1\n```\n```sql\nSELECT nope FROM table1\n```\n"
+             "I will wait for the results.")
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = Path(tempfile.mkdtemp(prefix="test_chat_sql_"))
+        cls.db, cls.schema = file_to_sqlite(Path(__file__).parent.parent / "test" / "cafe_data_eg.csv",
+                                            cls.workdir / "cafe.db")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create(user_id="sqlturn", user_email="sqlturn@test.local",
+                                        user_password="x", user_name="sqlturn")
+        file = File.objects.create(user_id=self.user, file_name="cafe.csv", file_size=1, file_type="csv",
+                                   file_path=str(self.workdir / "cafe.csv"), file_sqlpath=str(self.db),
+                                   file_schema=self.schema, file_processed=File.FileProcessingStatus.COMPLETED)
+        self.chat = Chat.objects.create(user_id=self.user, chat_title="t", file_id=file)
+        self.replies: list[str] = []
+        REGISTRY.reset()
+
+        def reply(messages: list[dict]) -> str:
+            if "NL Question:" in str(messages[-1].get("content", "")):
+                return "```sql\nSELECT nope FROM table1\n```"        # text2sql (에스컬레이션 포함)
+            return self.replies.pop(0)
+
+        stub = StubOpenAIServer(reply, stream_chunk_chars=5).start()
+        self.addCleanup(stub.stop)
+        llm.configure(model_cls=OfflineChatOpenAI, base_url=stub.base_url, api_key="stub")
+        self.addCleanup(llm.configure)
+
+    def _query(self, text: str) -> dict:
+        return self.client.post("/api/chat/query", {"chat_id": self.chat.chat_id, "message_text": text},
+                                content_type="application/json").json()
+
+    def _messages(self, role: int) -> list[str]:
+        return list(Message.objects.filter(chat_id=self.chat, message_role=role)
+                    .order_by("message_id").values_list("message_text", flat=True))
+
+    def test_batch_queries_run_and_feed_the_next_turn(self):
+        self.replies = [self.BATCH, "채널은 3개이고 판매량 합계는 출력과 같습니다. <END>"]
+        body = self._query("채널 수와 총 판매량")
+        self.assertEqual(body["data"]["response"], "채널은 3개이고 판매량 합계는 출력과 같습니다.")
+
+        internal = self._messages(Message.MessageRole.INTERNAL)[0]
+        self.assertIn("SQL BATCH (3)", internal)
+        self.assertIn("### Q2", internal)
+        self.assertIn("| DeliveryApp |", internal)
+        self.assertIn("[ERROR/SQL] no such column: nope", internal)     # 실패한 쿼리만 오류, 나머지는 결과
+        self.assertEqual(REGISTRY.snapshot()["sql.batch"]["count"], 1)    # execute_sqlite_queries 병렬 경로
+
+    def test_sql_error_is_saved_to_history(self):
+        self.replies = ["[T2S]"]
+        body = self._query("없는 컬럼 보여줘")
+        self.assertTrue(body["data"]["response"].startswith("[ERROR/SQL]"))
+        self.assertEqual(self._messages(Message.MessageRole.ASSISTANT), [body["data"]["response"]])
+
+
+@override_settings(FASTPATH_ENABLED=False, ADMISSION_ENABLED=False, FEWSHOT_ENABLED=False,
+                   LLM_STREAM_DIRECTIVES=True, LLM_RETRIES=0)
+class MessageBufferTurnTests(TestCase):
+    """여러 단계의 query_chat 에서 MessageBuffer 가 add() 순서대로, 오류로 끝나도 flush 하는지"""
+
+    SQL = "SELECT channel, COUNT(*) AS n FROM table1 GROUP BY channel ORDER BY channel"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = Path(tempfile.mkdtemp(prefix="test_msg_buffer_"))
+        cls.db, cls.schema = file_to_sqlite(Path(__file__).parent.parent / "test" / "cafe_data_eg.csv",
+                                            cls.workdir / "cafe.db")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create(user_id="msgbuf", user_email="msgbuf@test.local",
+                                        user_password="x", user_name="msgbuf")
+        file = File.objects.create(user_id=self.user, file_name="cafe.csv", file_size=1, file_type="csv",
+                                   file_path=str(self.workdir / "cafe.csv"), file_sqlpath=str(self.db),
+                                   file_schema=self.schema, file_processed=File.FileProcessingStatus.COMPLETED)
+        self.chat = Chat.objects.create(user_id=self.user, chat_title="t", file_id=file)
+        self.replies: list[str] = []
+
+        def reply(messages: list[dict]) -> str:
+            if "NL Question:" in str(messages[-1].get("content", "")):
+                return f"```sql\n{self.SQL}\n```"
+            return self.replies.pop(0)
+
+        stub = StubOpenAIServer(reply, stream_chunk_chars=5).start()
+        self.addCleanup(stub.stop)
+        llm.configure(model_cls=OfflineChatOpenAI, base_url=stub.base_url, api_key="stub")
+        self.addCleanup(llm.configure)
+
+        # LLM 호출 직전마다 DB 에 저장된 메시지 role 을 기록한다 (요청 스레드 = 테스트 트랜잭션)
+        self.saved_before_turn: list[list[int]] = []
+        self.fail_on_turn: int | None = None
+        real_turn = views._chat_turn
+
+        def chat_turn(*args):
+            self.saved_before_turn.append(self._roles())
+            if len(self.saved_before_turn) == self.fail_on_turn:
+                raise RuntimeError("boom")
+            return real_turn(*args)
+
+        patcher = mock.patch.object(views, "_chat_turn", side_effect=chat_turn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _roles(self) -> list[int]:
+        return list(Message.objects.filter(chat_id=self.chat).order_by("created_at", "message_id")
+                    .values_list("message_role", flat=True))
+
+    def _query(self, text: str):
+        return self.client.post("/api/chat/query", {"chat_id": self.chat.chat_id, "message_text": text},
+                                content_type="application/json")
+
+    def _history(self, path: str) -> list[tuple[str, str]]:
+        body = self.client.get(path, {"chat_id": self.chat.chat_id}).json()
+        return [(m["message_role"], m["message_text"]) for m in body["data"]["messages"]]
+
+    def test_multi_step_turn_is_saved_in_add_order(self):
+        self.replies = ["[T2S]", "채널별 건수를 확인했습니다. <REQUEST_INFO>", "채널은 3개입니다. <END>"]
+        body = self._query("채널별 주문 수").json()
+        self.assertEqual(body["data"]["response"], "채널은 3개입니다.")
+
+        # 사용자 메시지는 첫 LLM 호출 전에 저장되고, 나머지는 루프가 끝날 때 한 번에 flush 된다
+        self.assertEqual(self.saved_before_turn, [[Message.MessageRole.USER]] * 3)
+
+        history = self._history("/api/chat/history/all")
+        self.assertEqual([role for role, _ in history], ["user", "internal", "assistant", "assistant"])
+        self.assertTrue(history[1][1].startswith(f"[INTERNAL] SQL\n{self.SQL}"))
+        self.assertEqual(history[2][1], "채널별 건수를 확인했습니다. <REQUEST_INFO>")
+        self.assertEqual(history[3][1], "채널은 3개입니다.")
+        self.assertEqual(self._history("/api/chat/history"), [history[0], history[2], history[3]])
+
+    def test_buffer_is_flushed_when_the_loop_raises(self):
+        self.replies = ["[T2S]"]
+        self.fail_on_turn = 2
+        with self.assertRaisesMessage(RuntimeError, "boom"):
+            self._query("채널별 주문 수")
+        self.assertEqual(self._roles(), [Message.MessageRole.USER, Message.MessageRole.INTERNAL])
+
+
+@override_settings(FEWSHOT_ENABLED=False, LLM_RETRIES=0, LLM_HEDGE=False,
+                   LLM_PURPOSES={"answer": {"model": "gpt-4o"},
+                                 "sql": {"model": "gpt-4o-mini", "escalate_to": "answer"},
+                                 "title": {"model": "gpt-4o-mini"}})
+class SqlEscalationTests(SimpleTestCase):
+    """EXPLAIN 에 실패한 text2sql SQL 만 큰 모델로 한 번 다시 만들고, 호출·토큰·비용이 목적별로 남는지"""
+
+    GOOD = "SELECT channel, COUNT(*) AS n FROM table1 GROUP BY channel"
+    BAD = "SELECT nope FROM table1"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = Path(tempfile.mkdtemp(prefix="test_escalation_"))
+        db, schema = file_to_sqlite(Path(__file__).parent.parent / "test" / "cafe_data_eg.csv", cls.workdir / "cafe.db")
+        cls.data = FileSet([File(file_id=1, file_sqlpath=str(db), file_schema=schema)])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.replies: list[str] = []
+        self.stub = StubOpenAIServer(lambda messages: f"```sql\n{self.replies.pop(0)}\n```").start()
+        self.addCleanup(self.stub.stop)
+        llm.configure(model_cls=OfflineChatOpenAI, base_url=self.stub.base_url, api_key="stub")
+        self.addCleanup(llm.configure)
+        REGISTRY.reset()
+
+    def test_escalation_target(self):
+        self.assertEqual(llm.escalation("sql").model_name, "gpt-4o")
+        self.assertIsNone(llm.escalation("title"))                  # escalate_to 없음
+        with override_settings(LLM_PURPOSES={"answer": {"model": "gpt-4o-mini"},
+                                             "sql": {"model": "gpt-4o-mini", "escalate_to": "answer"}}):
+            llm.configure(model_cls=OfflineChatOpenAI, base_url=self.stub.base_url, api_key="stub")
+            self.assertIsNone(llm.escalation("sql"))                # 같은 모델이면 다시 물을 이유가 없다
+
+    def test_invalid_sql_escalates_once(self):
+        self.replies = [self.BAD, self.GOOD]
+        notes: list[str] = []
+        self.assertEqual(views._generate_sql("채널별 주문 수", self.data, notes), self.GOOD)
+
+        self.assertEqual([b["model"] for b in self.stub.bodies], ["gpt-4o-mini", "gpt-4o"])
+        self.assertIn(self.BAD, self.stub.bodies[1]["messages"][-1]["content"])     # 실패한 SQL·오류를 힌트로
+        self.assertIn("no such column: nope", self.stub.bodies[1]["messages"][-1]["content"])
+        self.assertIn("escalating to gpt-4o", notes[0])
+        self.assertEqual(REGISTRY.counter("pos_llm_escalations_total", purpose="sql"), 1)
+
+        for model in ("gpt-4o-mini", "gpt-4o"):
+            self.assertEqual(REGISTRY.counter("pos_llm_calls_total", purpose="sql", model=model), 1)
+            self.assertGreater(REGISTRY.counter("pos_llm_input_tokens_total", purpose="sql", model=model), 0)
+            self.assertGreater(REGISTRY.counter("pos_llm_cost_usd_total", purpose="sql", model=model), 0)
+        self.assertEqual(REGISTRY.counter("pos_llm_calls_total", purpose="answer"), 0)
+        self.assertEqual(REGISTRY.snapshot()["llm.sql"]["count"], 2)
+
+    def test_valid_sql_is_not_escalated(self):
+        self.replies = [self.GOOD]
+        notes: list[str] = []
+        self.assertEqual(views._generate_sql("채널별 주문 수", self.data, notes), self.GOOD)
+        self.assertEqual([b["model"] for b in self.stub.bodies], ["gpt-4o-mini"])
+        self.assertEqual(notes, [])
+        self.assertEqual(REGISTRY.counter("pos_llm_escalations_total"), 0)
+        self.assertEqual(REGISTRY.counter("pos_llm_calls_total", purpose="sql", model="gpt-4o-mini"), 1)
+
+
+def _leading_system(body: dict) -> list[str]:
+    """요청 맨 앞의 연속된 system 메시지 (system prompt → schema → few-shot)"""
+    prefix = []
+    for m in body["messages"]:
+        if m["role"] != "system":
+            break
+        prefix.append(m["content"])
+    return prefix
+
+
+@override_settings(FASTPATH_ENABLED=False, ADMISSION_ENABLED=False, FEWSHOT_ENABLED=False,
+                   LLM_STREAM_DIRECTIVES=True, LLM_RETRIES=0)
+class PromptPrefixTests(TestCase):
+    """턴·채팅이 달라도 같은 파일이면 prompt 앞부분이 바이트 단위로 같고, cache 적중분이 ChatTrace 에 남는지"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.workdir = Path(tempfile.mkdtemp(prefix="test_prefix_"))
+        cls.db, cls.schema = file_to_sqlite(Path(__file__).parent.parent / "test" / "cafe_data_eg.csv",
+                                            cls.workdir / "cafe.db")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        user = User.objects.create(user_id="prefix", user_email="prefix@test.local",
+                                   user_password="x", user_name="prefix")
+        self.file = File.objects.create(user_id=user, file_name="cafe.csv", file_size=1, file_type="csv",
+                                        file_path=str(self.workdir / "cafe.csv"), file_sqlpath=str(self.db),
+                                        file_schema=self.schema, file_processed=File.FileProcessingStatus.COMPLETED)
+        self.chats = [Chat.objects.create(user_id=user, chat_title=f"t{i}", file_id=self.file) for i in range(2)]
+        self.stub = StubOpenAIServer(lambda messages: "확인했습니다. <END>").start()
+        self.addCleanup(self.stub.stop)
+        llm.configure(model_cls=OfflineChatOpenAI, base_url=self.stub.base_url, api_key="stub")
+        self.addCleanup(llm.configure)
+
+    def _query(self, chat: Chat, text: str) -> None:
+        response = self.client.post("/api/chat/query", {"chat_id": chat.chat_id, "message_text": text},
+                                    content_type="application/json")
+        self.assertEqual(response.json()["response"], 200)
+
+    def test_chat_prefix_is_identical_across_turns_and_chats(self):
+        self._query(self.chats[0], "채널별 매출")
+        self._query(self.chats[0], "그중 가장 큰 채널은?")     # 같은 채팅의 다음 턴 (history 가 뒤에 붙는다)
+        self._query(self.chats[1], "메뉴별 판매량")
+
+        prefixes = [_leading_system(b) for b in self.stub.bodies]
+        self.assertEqual(len(prefixes), 3)
+        self.assertEqual(len(prefixes[0]), 2)                              # system prompt → schema
+        self.assertEqual(prefixes[0][1], f"file의 db schema:\n{self.file.file_schema}")
+        self.assertTrue(all(p == prefixes[0] for p in prefixes))
+        self.assertGreater(len(self.stub.bodies[1]["messages"]), len(self.stub.bodies[0]["messages"]))
+
+        # 첫 요청은 cache 가 비어 있고, 이후 요청은 같은 앞부분만큼 stub usage 의 cached_tokens 가 ChatTrace 로 간다
+        traces = [list(ChatTrace.objects.filter(chat_id=chat).order_by("trace_id")
+                       .values_list("prompt_tokens", "cached_tokens")) for chat in self.chats]
+        (first, second), (other,) = traces
+        self.assertEqual(first[1], 0)
+        prefix_tokens = sum(len(m) // 4 for m in prefixes[0])
+        for prompt, cached in (second, other):
+            self.assertGreaterEqual(cached, 1024)
+            self.assertLessEqual(cached, min(prompt, prefix_tokens + 128))
+
+    def test_text2sql_prefix_keeps_examples_before_the_question(self):
+        examples = "-- 예시\nQ: 채널별 주문 수\n```sql\nSELECT channel, COUNT(*) FROM table1 GROUP BY channel\n```"
+        self.stub.responder = lambda messages: "```sql\nSELECT 1\n```"
+        for question in ("채널별 매출", "메뉴별 판매량"):
+            backend.text2sql(llm.get_model("sql"), question, self.schema, examples=examples)
+
+        first, second = (_leading_system(b) for b in self.stub.bodies)
+        self.assertEqual(first, second)
+        self.assertEqual(first[1:], [f"Database schema:\n{self.schema}", examples])
+        self.assertNotEqual(self.stub.bodies[0]["messages"][-1], self.stub.bodies[1]["messages"][-1])
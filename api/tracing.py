@@ -0,0 +1,279 @@
+"""
+Per-request tracing and stage-level latency metrics for the chat pipeline.
+
+* `span("text2sql")` times a block, attaches attributes (tokens, rows …) to the
+  current request trace and feeds the process-wide histograms.
+* `TracingMiddleware` opens a trace per /api/ request and times every ORM
+  query as an "orm" span; views call `bind_chat()` so the summary can be
+  persisted as a `ChatTrace` row.
+* `render_prometheus()` exposes histograms (+ p50/p95/p99 over a recent
+  window) in the Prometheus text format for `/api/metrics`.
+
+Metrics are per process; scrape every worker.
+"""
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+WINDOW = 1024     # 최근 샘플 수 (quantile 계산용)
+
+
+# ── process-wide metrics ─────────────────────────────────────
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+        self.recent: deque[float] = deque(maxlen=WINDOW)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.n += 1
+        self.recent.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: dict[str, _Histogram] = defaultdict(_Histogram)
+        self._counters: dict[tuple[str, tuple], float] = defaultdict(float)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._histograms[stage].observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def counter(self, name: str, **labels) -> float:
+        """labels 가 모두 일치하는 counter 값의 합 (labels 생략 시 전체 합)"""
+        want = set(labels.items())
+        with self._lock:
+            return sum(v for (n, ls), v in self._counters.items() if n == name and want <= set(ls))
+
+    def quantile(self, stage: str, q: float, min_samples: int = 1) -> float | None:
+        with self._lock:
+            h = self._histograms.get(stage)
+            return h.quantile(q) if h and h.n >= max(1, min_samples) else None
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        """stage → {count, mean, p50, p95, p99} (초 단위)"""
+        with self._lock:
+            return {stage: {"count": h.n, "mean": h.total / h.n if h.n else 0.0,
+                            **{f"p{int(q * 100)}": h.quantile(q) for q in QUANTILES}}
+                    for stage, h in self._histograms.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self) -> str:
+        out = [
+            "# HELP pos_stage_latency_seconds Latency of chat pipeline stages.",
+            "# TYPE pos_stage_latency_seconds histogram",
+        ]
+        with self._lock:
+            for stage, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, h.counts):
+                    cumulative += count
+                    out.append(f'pos_stage_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                out.append(f'pos_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.n}')
+                out.append(f'pos_stage_latency_seconds_sum{{stage="{stage}"}} {h.total:.6f}')
+                out.append(f'pos_stage_latency_seconds_count{{stage="{stage}"}} {h.n}')
+
+            out.append(f"# HELP pos_stage_latency_window_seconds Quantiles over the last {WINDOW} samples.")
+            out.append("# TYPE pos_stage_latency_window_seconds gauge")
+            for stage, h in sorted(self._histograms.items()):
+                for q in QUANTILES:
+                    out.append(f'pos_stage_latency_window_seconds{{stage="{stage}",quantile="{q}"}} '
+                               f'{h.quantile(q):.6f}')
+
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                out.append(f"# TYPE {name} counter")
+                for (n, labels), value in sorted(self._counters.items()):
+                    if n != name:
+                        continue
+                    label_txt = ",".join(f'{k}="{v}"' for k, v in labels)
+                    out.append(f"{name}{{{label_txt}}} {value:g}" if label_txt else f"{name} {value:g}")
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ── per-request trace ────────────────────────────────────────
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.chat_id: int | None = None
+        self.kind: str = ""
+        self.stages: dict[str, dict[str, float]] = {}
+        self.attrs: dict[str, float] = defaultdict(float)
+
+    def record(self, stage: str, seconds: float, attrs: dict[str, Any]) -> None:
+        entry = self.stages.setdefault(stage, {"count": 0, "total_ms": 0.0})
+        entry["count"] += 1
+        entry["total_ms"] += seconds * 1000
+        for k, v in attrs.items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                self.attrs[k] += v
+
+    @property
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+
+_current: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("pos_trace", default=None)
+
+
+def current_trace() -> Trace | None:
+    return _current.get()
+
+
+def bind_chat(chat_id: int, kind: str) -> None:
+    """현재 요청 trace 를 채팅에 연결 (요청 종료 시 ChatTrace 로 저장됨)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.chat_id = chat_id
+        trace.kind = kind
+
+
+class Span:
+    def __init__(self, stage: str, attrs: dict[str, Any]):
+        self.stage = stage
+        self.attrs = attrs
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+
+@contextmanager
+def span(stage: str, **attrs) -> Iterator[Span]:
+    sp = Span(stage, attrs)
+    t0 = time.perf_counter()
+    try:
+        yield sp
+    except Exception:
+        sp.attrs["errors"] = sp.attrs.get("errors", 0) + 1
+        REGISTRY.inc("pos_stage_errors_total", stage=stage)
+        raise
+    finally:
+        seconds = time.perf_counter() - t0
+        REGISTRY.observe(stage, seconds)
+        for key in ("prompt_tokens", "completion_tokens", "cached_tokens", "rows"):
+            if sp.attrs.get(key):
+                REGISTRY.inc(f"pos_{key}_total", sp.attrs[key], stage=stage)
+        trace = _current.get()
+        if trace is not None:
+            trace.record(stage, seconds, sp.attrs)
+
+
+def traced(stage: str) -> Callable:
+    """함수 전체를 하나의 span 으로 감싸는 데코레이터"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def record_usage(sp: Span, message: Any) -> None:
+    """LangChain AIMessage.usage_metadata → span 속성"""
+    usage = getattr(message, "usage_metadata", None) or {}
+    # cached_tokens: prompt 중 provider prompt cache 에서 읽힌 부분 (prompt_tokens 에 포함됨)
+    sp.set(prompt_tokens=usage.get("input_tokens", 0),
+           completion_tokens=usage.get("output_tokens", 0),
+           cached_tokens=(usage.get("input_token_details") or {}).get("cache_read") or 0)
+
+
+def render_prometheus() -> str:
+    return REGISTRY.render()
+
+
+# ── middleware ───────────────────────────────────────────────
+def _orm_wrapper(execute, sql, params, many, context):
+    with span("orm"):
+        return execute(sql, params, many, context)
+
+
+def _http_stage(request) -> str:
+    """URL 이름으로 라벨을 붙인다. 경로를 그대로 쓰면 /api/<아무거나> 404 마다 새 히스토그램·시계열이 생긴다"""
+    match = getattr(request, "resolver_match", None)     # URL 해석은 미들웨어 안쪽에서 일어난다
+    return f"http {match.url_name}" if match is not None and match.url_name else "http unmatched"
+
+
+class TracingMiddleware:
+    """/api/ 요청마다 trace 를 열고 ORM 쿼리를 계측, 채팅 요청이면 요약을 저장"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith("/api/") or request.path == "/api/metrics":
+            return self.get_response(request)
+
+        trace = Trace(request.path)
+        token = _current.set(trace)
+        t0 = time.perf_counter()
+        try:
+            with connection.execute_wrapper(_orm_wrapper):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+            REGISTRY.observe(_http_stage(request), time.perf_counter() - t0)
+
+        if trace.chat_id is not None:
+            self._persist(trace)
+        return response
+
+    @staticmethod
+    def _persist(trace: Trace) -> None:
+        from .models import Chat, ChatTrace
+
+        total_ms = trace.elapsed_ms
+        prompt, cached = trace.attrs.get("prompt_tokens", 0), trace.attrs.get("cached_tokens", 0)
+        logger.info("[trace] chat=%s kind=%s total=%.0fms prompt_cached=%.0f%% %s", trace.chat_id, trace.kind,
+                    total_ms, 100 * cached / prompt if prompt else 0,
+                    " ".join(f"{k}={v['total_ms']:.0f}ms" for k, v in trace.stages.items()))
+        try:
+            ChatTrace.objects.create(
+                chat_id=Chat(chat_id=trace.chat_id),
+                trace_kind=trace.kind,
+                total_ms=total_ms,
+                stages={k: {"count": v["count"], "total_ms": round(v["total_ms"], 2)}
+                        for k, v in trace.stages.items()},
+                prompt_tokens=int(trace.attrs.get("prompt_tokens", 0)),
+                completion_tokens=int(trace.attrs.get("completion_tokens", 0)),
+                cached_tokens=int(cached),
+                rows_returned=int(trace.attrs.get("rows", 0)),
+            )
+        except Exception as e:      # 계측 실패가 응답을 막지 않도록
+            logger.warning("[trace] failed to persist chat trace: %s", e)
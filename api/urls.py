@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path('api/health', views.health_check, name='health_check'),
+    path('api/metrics', views.metrics, name='metrics'),
     path('api/auth/register', views.register, name='register'),
     path('api/auth/login', views.login, name='login'),
     path('api/auth/user', views.get_user, name='get_user'),
@@ -15,5 +16,7 @@ urlpatterns = [
     path('api/chat/history', views.get_chat_history, name='get_chat_history'),
     path('api/chat/delete', views.delete_chat, name='delete_chat'),
     path('api/chat/history/all', views.get_chat_history_all, name='get_chat_history_all'),
+    path('api/batch/start', views.start_batch, name='start_batch'),
+    path('api/batch/result', views.get_batch_result, name='get_batch_result'),
     path('demo/', views.chat_demo, name='chat_demo')
 ]
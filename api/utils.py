@@ -1,8 +1,10 @@
 from pathlib import Path
+import contextvars
 import sqlite3
 import pandas as pd
 import types
 from typing import Optional, Tuple, List, Union
+from concurrent.futures import ThreadPoolExecutor
 
 import matplotlib
 matplotlib.use("Agg")   # non-interactive backend
@@ -12,6 +14,9 @@ from matplotlib.figure import Figure
 from datetime import date, timedelta
 from dateutil.relativedelta import relativedelta
 
+from .tracing import span, traced
+from .ingest import LAYOUTS, csv_to_sqlite, excel_to_sqlite
+
 from matplotlib import font_manager as fm
 
 # ────── KOREAN FONT CONFIG ──────
@@ -44,10 +49,17 @@ def file_to_sqlite(
     file_path: str | Path,
     db_path: str | Path,
     if_exists: str = "replace",
-    chunksize: Optional[int] = None
+    chunksize: Optional[int] = None,
+    layout: str = "plain",
+    rollups: bool = False
 ) -> Tuple[Path, str]:
     """
     Load a CSV/Excel file into SQLite using an auto-generated table name (table1, table2 …).
+    Excel workbooks go through `ingest.excel_to_sqlite` (every sheet → its own table),
+    CSV through `ingest.csv_to_sqlite` (read in `chunksize` row chunks). Both type
+    the columns (normalized dates / times / money, derived columns).
+    layout="compact" dictionary-encodes category columns behind a view.
+    rollups=True also builds the date × category rollups used by `rollups.rewrite`.
 
     Returns
     -------
@@ -56,47 +68,15 @@ def file_to_sqlite(
     file_path = Path(file_path)
     db_path   = Path(db_path)
 
-    # ── 1. read file into DataFrame ──────────────────────────
     suffix = file_path.suffix.lower()
-    if suffix == ".csv":
-        df = pd.read_csv(file_path)
-    elif suffix in {".xls", ".xlsx"}:
-        df = pd.read_excel(file_path)
-    else:
+    if layout not in LAYOUTS:
+        raise ValueError(f"layout must be one of {LAYOUTS}")
+    if suffix in {".xls", ".xlsx"}:
+        return excel_to_sqlite(file_path, db_path, layout=layout, rollups=rollups)
+    if suffix != ".csv":
         raise ValueError("Extension must be .csv / .xls / .xlsx")
-
-    # ── 2. decide table name (table1, table2, …) ─────────────
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        existing = {r[0] for r in cur.fetchall()}
-        idx = 1
-        while f"table{idx}" in existing:
-            idx += 1
-        table_name = f"table{idx}"
-
-        # ── 3. write DataFrame ───────────────────────────────
-        df.to_sql(table_name, conn,
-                  if_exists=if_exists, index=False, chunksize=chunksize)
-
-        # ── 4. build human-readable schema text ──────────────
-        cur.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name;")
-        tables = [r[0] for r in cur.fetchall()]
-
-        lines = [f"Database: {db_path.name}", "Tables:"]
-        for tbl in tables:
-            cur.execute(f"PRAGMA table_info('{tbl}');")
-            cols = cur.fetchall()     # (cid, name, type, notnull, dflt_value, pk)
-            col_defs = []
-            for _, name, ctype, notnull, default, pk in cols:
-                bits = [name, ctype]
-                if notnull:              bits.append("NOT NULL")
-                if default is not None:  bits.append(f"DEFAULT {default}")
-                if pk:                   bits.append("PRIMARY KEY")
-                col_defs.append(" ".join(bits))
-            lines.append(f"- {tbl}: " + ", ".join(col_defs))
-
-    return db_path, "\n".join(lines)
+    return csv_to_sqlite(file_path, db_path, chunksize=chunksize, if_exists=if_exists, layout=layout,
+                         rollups=rollups)
 
 
 def execute_sqlite_query(
@@ -121,13 +101,14 @@ def execute_sqlite_query(
     print(repr(query.lstrip().upper()))
     
     db_path = Path(db_path)
-    with sqlite3.connect(db_path) as conn:
+    with span("sql") as sp, sqlite3.connect(db_path) as conn:
         cur = conn.cursor()
         cur.execute(query)
 
         if cur.description is not None:
             rows    = cur.fetchall()
             columns = [col[0] for col in cur.description]
+            sp.set(rows=len(rows))
             if return_dataframe:
                 return pd.DataFrame(rows, columns=columns)
             return rows
@@ -136,14 +117,88 @@ def execute_sqlite_query(
         return cur.rowcount
 
 
+def _readonly_query(db_path: Path, query: str) -> pd.DataFrame:
+    """Run a single SELECT on its own read-only connection."""
+    uri = f"{db_path.resolve().as_uri()}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    try:
+        with span("sql") as sp:
+            cur = conn.cursor()
+            cur.execute(query)
+            if cur.description is None:
+                return pd.DataFrame()
+            columns = [col[0] for col in cur.description]
+            rows = cur.fetchall()
+            sp.set(rows=len(rows))
+            return pd.DataFrame(rows, columns=columns)
+    finally:
+        conn.close()
+
+
+def explain_sqlite_query(db_path: Union[str, Path], query: str) -> Optional[str]:
+    """
+    Compile `query` with EXPLAIN on a read-only connection without running it.
+
+    Returns:
+        None if SQLite accepts the statement (syntax, tables, columns, functions),
+        otherwise the error message.
+    """
+    uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    try:
+        conn.execute(f"EXPLAIN {query}")
+        return None
+    except sqlite3.Error as e:
+        return str(e)
+    finally:
+        conn.close()
+
+
+def execute_sqlite_queries(
+    db_path: Union[str, Path],
+    queries: List[str],
+    max_workers: int = 4
+) -> List[Union[pd.DataFrame, Exception]]:
+    """
+    Execute several read-only queries against the same SQLite file concurrently.
+
+    Each query gets its own `mode=ro` connection, so writes are rejected and
+    readers never block each other. sqlite3 releases the GIL while stepping
+    a statement, so the queries really overlap.
+
+    Returns:
+        One entry per query, in input order: a DataFrame on success or the
+        raised Exception on failure (a failing query does not cancel the rest).
+    """
+    db_path = Path(db_path)
+    if not db_path.exists():
+        raise FileNotFoundError(f"database not found: {db_path}")
+
+    results: List[Union[pd.DataFrame, Exception]] = [None] * len(queries)
+    with span("sql.batch", queries=len(queries)), \
+         ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(queries)))) as pool:
+        # 워커의 "sql" span 이 요청 trace 에 기록되도록 contextvar 를 작업마다 복사해 넘긴다
+        futures = {pool.submit(contextvars.copy_context().run, _readonly_query, db_path, q): i
+                   for i, q in enumerate(queries)}
+        for fut, i in futures.items():
+            try:
+                results[i] = fut.result()
+            except Exception as e:
+                results[i] = e
+    return results
+
+
+@traced("plot")
 def run_pyplot_code(
     code: str,
     save_path: Optional[str | Path] = None,
+    raise_errors: bool = False,
 ) -> Optional[Figure]:
     """
     Execute pyplot code safely in headless mode.
     * GUI backend disabled via matplotlib.use("Agg")
     * plt.show() is monkey-patched to NO-OP.
+    * raise_errors=True re-raises the exec error instead of returning None.
     """
     try:
         plt.close("all")
@@ -168,6 +223,8 @@ def run_pyplot_code(
 
     except Exception as e:
         print(f"[run_pyplot_code] Error: {e}")
+        if raise_errors:
+            raise
         return None
 
 # (1) generic relative date
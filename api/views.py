@@ -1,15 +1,30 @@
+from django.conf import settings
 from django.shortcuts import render
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.hashers import make_password, check_password
 from django.core.handlers.wsgi import WSGIRequest
-from django.db import transaction
+from django.db import transaction, connection
+from django.db.models import Count, Max, OuterRef, Subquery
 from django.utils import timezone
 import logging
 
-from .utils import file_to_sqlite, execute_sqlite_query, run_pyplot_code
+from .utils import file_to_sqlite
+from .ingest import xls_supported
 from .backend import langchain, text2sql, make_title
-from .models import User, File, Chat, Message
+from .directives import read_reply
+from . import batch, fastpath, fewshot
+from .llm import escalation, get_model
+from .admission import Saturated
+from .resilience import LLMUnavailable, llm_deadline
+from .models import User, File, Chat, Message, BatchJob, BatchItem
+from .message_buffer import MessageBuffer
+from .plot_cache import render_plot, thumbnail_url
+from .fileset import MAX_FILES, FileSet, FileSetError, forget_file
+from .rollups import Rewrite
+from .tracing import REGISTRY, bind_chat, render_prometheus
+from .pagination import (PaginationError, parse_limit, parse_fields, keyset_page,
+                         make_etag, etag_matches, not_modified, set_etag)
 from . import utils
 
 import threading
@@ -18,21 +33,18 @@ import os
 import uuid
 import time
 import re
+import sqlite3
 import pandas as pd
 from pathlib import Path
 
-from langchain_openai.chat_models import ChatOpenAI
-
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
-model = ChatOpenAI(
-    model="gpt-4o-2024-08-06",
-    temperature=0.0,
-)
-
 # 모델 최대 호출 횟수
 MAX_ITER = 6
+# [T2S_BATCH] 한 턴에서 병렬 실행할 최대 SQL 개수
+MAX_BATCH_QUERIES = 5
 DATE_RE  = re.compile(r"{{\s*(get_\w+)\((.*?)\)\s*}}")    # 자리표시자 패턴
+SQL_FENCE_RE = re.compile(r"```sql\s*(.*?)\s*```", re.S | re.I)
 
 def _eval_date_placeholder(expr: str) -> str:
     """`{{get_date(...)}}` · `{{get_weekdate(...)}}` → ISO-8601 문자열"""
@@ -64,6 +76,10 @@ def health_check(request):
         "data": None
     })
 
+def metrics(request):
+    """Prometheus 텍스트 포맷의 단계별 지연시간 히스토그램 / 토큰·행 카운터"""
+    return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 @csrf_exempt
 def register(request):
     if request.method == 'POST':
@@ -244,7 +260,9 @@ def _background_file_processing(file_id: int):
             file_path=file_path,
             db_path=dest,
             if_exists='replace',
-            chunksize=1000
+            chunksize=1000,
+            layout=settings.INGEST_LAYOUT,
+            rollups=settings.ROLLUPS_ENABLED
         )
         
         file.file_sqlpath = db_path
@@ -267,6 +285,10 @@ def _background_file_processing(file_id: int):
             
         else:
             print(f"file id {file_id} is not found")
+
+    finally:
+        # 스레드별 DB 커넥션은 요청 사이클 밖이라 자동으로 닫히지 않는다
+        connection.close()
         
 
 @csrf_exempt
@@ -299,6 +321,14 @@ def upload_file(request):
                 "message": "unsupported file type",
                 "data": None
             })
+
+        # .xls 는 선택 패키지(xlrd)가 있을 때만 처리 가능
+        if file.name.endswith('.xls') and not xls_supported():
+            return JsonResponse({
+                "response": 415,
+                "message": "xls (Excel 97-2003) is not supported, please convert to xlsx or csv",
+                "data": None
+            })
             
         # 파일 크기 확인
         if file.size > MAX_FILE_SIZE:
@@ -468,7 +498,8 @@ def delete_file(request):
         except Exception as e:
             print(f"Error deleting SQL file: {e}")
             
-        # File 객체 삭제
+        # 이 파일을 ATTACH 한 여러 파일 채팅 커넥션 정리 후 File 객체 삭제
+        forget_file(file.file_id)
         file.delete()
         
         # 파일 삭제 성공
@@ -487,22 +518,144 @@ def delete_file(request):
         })
 
 
-def _record_error(chat: Chat, prev_msgs: list, image_url: str | None, err: Exception, label: str):
+def _record_error(buffer: MessageBuffer, prev_msgs: list, image_url: str | None, err: Exception, label: str):
     """에러를 assistant role 로 저장하고 history 리스트도 갱신."""
     msg_txt = f"[ERROR/{label}] {err}"
     # history에 추가 ― 다음 turn 에 LLM이 참고할 수 있음
     prev_msgs.append({"role": "assistant", "content": msg_txt})
-    # DB에도 저장 (ASSISTANT 역할, 이미지 링크 유지)
-    Message.objects.create(
-        chat_id=chat,
-        message_text=msg_txt,
-        message_role=Message.MessageRole.ASSISTANT,
-        message_image_url=image_url
-    )
+    # DB에도 저장 (ASSISTANT 역할, 이미지 링크 유지) ― 턴 종료 시 일괄 저장
+    buffer.add(msg_txt, Message.MessageRole.ASSISTANT, image_url)
     return msg_txt
 
 
+def _chat_turn(system_prompt: str, prev_msgs: list[dict], data: FileSet | None, question: str) -> str:
+    """
+    대화 한 턴의 모델 응답. system prompt + schema 는 매 턴 같은 prefix 로, 바뀌는 대화는 그 뒤에.
+    넓은 테이블의 schema 는 사용자 질문에 필요한 컬럼만 남긴다 (같은 요청의 턴끼리는 같다).
+    LLM_STREAM_DIRECTIVES 이면 스트리밍으로 받아 지시문이 끝나는 즉시 생성을 멈춘다.
+    """
+    reply = langchain(get_model("answer"),
+                      system_prompt,
+                      prev_msgs[1:],          # system 제외
+                      prev_msgs[-1]["content"],
+                      streaming=settings.LLM_STREAM_DIRECTIVES,
+                      schema=data.schema_for(question) if data is not None else None)
+    if isinstance(reply, str):
+        return reply
+    return read_reply(reply, max_fences=MAX_BATCH_QUERIES).text
+
+
+def _fast_reply(buffer: MessageBuffer, fast: fastpath.FastAnswer) -> tuple[str, str | None, bool]:
+    """템플릿 답변을 INTERNAL(SQL·결과) + ASSISTANT 메시지로 저장. (최종 답변, 이미지, need_more)"""
+    print(f"[FastPath] {fast.template}: {fast.title}")
+    buffer.add(fast.internal_log, Message.MessageRole.INTERNAL, fast.image_url)
+    buffer.add(fast.text, Message.MessageRole.ASSISTANT, fast.image_url)
+    return fast.text, fast.image_url, False
+
+
+def _generate_sql(question: str, data: FileSet, internal_log: list[str]) -> str:
+    """
+    sql 용 (저렴한) 모델로 SQL 을 만들고 EXPLAIN 으로 검증한다.
+    통과하지 못하면 escalate_to 모델에 오류를 알려 주고 전체 schema 로 한 번 더 만든다
+    (질문에 맞춰 줄인 schema 에 필요한 컬럼이 빠졌을 수도 있으므로).
+    """
+    examples = _examples(data, question)
+    sql_query = text2sql(get_model("sql"), question, data.schema_for(question), examples=examples)
+    error = data.explain(sql_query)
+    larger = escalation("sql") if error else None
+    if larger is not None:
+        REGISTRY.inc("pos_llm_escalations_total", purpose="sql")
+        internal_log.append(f"\nSQL (rejected: {error}, escalating to {larger.model_name}):\n{sql_query}")
+        sql_query = text2sql(larger, question, data.schema, previous=(sql_query, error), examples=examples)
+    return sql_query
+
+
+def _examples(data: FileSet, question: str) -> str | None:
+    """같은 사용자가 전에 성공한 비슷한 질문의 SQL (단일 파일만; 여러 파일이면 f1.table1 식 SQL 이라 제외)"""
+    if len(data.files) != 1:
+        return None
+    return fewshot.examples_for(data.primary.user_id_id, data.primary.file_sqlpath, question)
+
+
+def _remember(data: FileSet, chat: Chat, question: str, sql: str) -> None:
+    """오류 없이 행을 돌려준 text2sql SQL 을 few-shot 예시로 저장"""
+    if len(data.files) == 1:
+        fewshot.record(data.primary.user_id_id, chat.chat_id, data.primary.file_sqlpath, question, sql)
+
+
+def _rewritten(data: FileSet, sql: str) -> Rewrite | None:
+    return data.rewrite(sql) if settings.ROLLUPS_ENABLED else None
+
+
+def _query(data: FileSet, sql: str, notes: list[str]):
+    """
+    SQL 실행. 롤업 테이블로 답할 수 있는 집계 쿼리는 바꾼 SQL 로 실행하고 notes(INTERNAL 로그)에 남긴다.
+    바꾼 SQL 이 실패하면 원래 SQL 로 다시 실행한다. 모델에게 보여 주는 SQL 은 원래 SQL 그대로.
+    """
+    rw = _rewritten(data, sql)
+    if rw is not None:
+        try:
+            result = data.query(rw.sql)
+        except sqlite3.Error as e:
+            print(f"[Rollup] rewritten SQL failed ({e}); running the original")
+        else:
+            notes.append(f"\nSQL (rewritten onto {rw.rollup}, {rw.rows:,} rows):\n{rw.sql}")
+            return result
+    return data.query(sql)
+
+
+def _run_sql_batch(data: FileSet, queries: list[str], notes: list[str]) -> str:
+    """[T2S_BATCH] 쿼리들을 병렬 실행하고 결과를 하나의 메시지로 묶는다. 롤업으로 바꾼 쿼리는 notes 에."""
+    rewrites = [_rewritten(data, sql) for sql in queries]
+    results = data.query_batch([rw.sql if rw else sql for sql, rw in zip(queries, rewrites)],
+                               max_workers=MAX_BATCH_QUERIES)
+
+    parts = []
+    for i, (sql, rw, result) in enumerate(zip(queries, rewrites, results), start=1):
+        if rw is not None and isinstance(result, Exception):
+            print(f"[Rollup] rewritten SQL failed ({result}); running the original")
+            result = data.query_batch([sql], max_workers=1)[0]
+        elif rw is not None:
+            notes.append(f"\nQ{i} rewritten onto {rw.rollup} ({rw.rows:,} rows):\n{rw.sql}")
+        if isinstance(result, Exception):
+            body = f"[ERROR/SQL] {result}"
+        elif result.empty:
+            body = "SQL 쿼리 결과가 없습니다."
+        else:
+            body = result.head(5).to_markdown(index=False)
+        parts.append(f"### Q{i}\n```sql\n{sql}\n```\n{body}")
+    return "\n\n".join(parts)
+
+
+def _select_files(user: User, file_ids) -> list[File] | JsonResponse:
+    """요청의 file_ids(또는 file_id) → 처리 완료된 사용자 파일 목록. 잘못되면 오류 응답."""
+    if not isinstance(file_ids, list) or not all(isinstance(i, int) for i in file_ids):
+        return JsonResponse({"response": 400, "message": "file_ids must be a list of integers", "data": None})
+    file_ids = list(dict.fromkeys(file_ids))
+    if len(file_ids) > MAX_FILES:
+        return JsonResponse({"response": 400,
+                             "message": f"at most {MAX_FILES} files can be attached to a chat",
+                             "data": None})
+    files = list(File.objects.filter(file_id__in=file_ids, user_id=user,
+                                     file_processed=File.FileProcessingStatus.COMPLETED))
+    if len(files) != len(file_ids):
+        return JsonResponse({"response": 404,
+                             "message": "file id is not found or not processed",
+                             "data": None})
+    return files
+
+
+def _latest_file(user: User) -> FileSet | None:
+    """파일을 고르지 않은 채팅의 [T2S] fallback: 가장 최근에 처리된 파일"""
+    try:
+        return FileSet([File.objects.filter(
+            user_id=user, file_processed=File.FileProcessingStatus.COMPLETED).latest('updated_at')])
+    except File.DoesNotExist:
+        return None
+
+
 @csrf_exempt
+@llm_deadline
 def start_chat(request: WSGIRequest) -> JsonResponse:
     if request.method != 'POST':
         return JsonResponse({"response": 405,
@@ -513,6 +666,12 @@ def start_chat(request: WSGIRequest) -> JsonResponse:
     user_id       = body.get('user_id')
     user_question = (body.get('message_text') or "").strip()
     sel_file_id   = body.get('file_id')              # 선택 파일 ID
+    sel_file_ids  = body.get('file_ids')             # 여러 파일을 함께 분석할 때
+    if sel_file_ids is None and sel_file_id is not None:
+        try:
+            sel_file_ids = [int(sel_file_id)]       # 기존 클라이언트는 "3" 처럼 문자열로 보낸다
+        except (TypeError, ValueError):
+            return JsonResponse({"response": 400, "message": "file_id must be an integer", "data": None})
 
     if not user_id or not user_question:
         return JsonResponse({"response": 400,
@@ -527,36 +686,47 @@ def start_chat(request: WSGIRequest) -> JsonResponse:
                              "message": "user id is not found",
                              "data": None})
 
+    data: FileSet | None = None
+    if sel_file_ids is not None:
+        files = _select_files(user, sel_file_ids)
+        if isinstance(files, JsonResponse):
+            return files
+        if files:
+            data = FileSet(files)
+            try:
+                data.schema     # 여러 파일이면 여기서 ATTACH 커넥션과 union 뷰가 만들어진다
+            except FileSetError as e:
+                return JsonResponse({"response": 404, "message": str(e), "data": None})
+
+    # 템플릿으로 답할 수 있는 질문이면 LLM 을 부르지 않는다 (제목도 템플릿이 만든다)
+    fast = fastpath.answer(user_question, data)
+
     # 1) Chat 및 첫 User Message
     with transaction.atomic(): 
         chat = Chat.objects.create(user_id=user)
-        chat.chat_title = make_title(model=model, message=user_question) or "새 대화"
-
-        target_file: File | None = None
-        if sel_file_id is not None:
+        if fast is not None:
+            chat.chat_title = fast.title
+        else:
             try:
-                target_file = File.objects.get(file_id=sel_file_id,
-                                               user_id=user,
-                                               file_processed=File.FileProcessingStatus.COMPLETED)
-                chat.file_id = target_file
-            except File.DoesNotExist:
-                return JsonResponse({"response": 404,
-                                     "message": "file id is not found or not processed",
-                                     "data": None})
+                chat.chat_title = make_title(model=get_model("title"), message=user_question) or "새 대화"
+            except LLMUnavailable:
+                chat.chat_title = "새 대화"
+        if data is not None:
+            chat.file_id = data.primary
         chat.save()
+        if data is not None:
+            chat.files.set(data.files)
 
         Message.objects.create(chat_id=chat,
                                message_text=user_question,
                                message_role=Message.MessageRole.USER)
 
-    # user prompt에 schema 추가
-    if target_file is not None:
-        user_question = f"file의 db schema:\n{target_file.file_schema}\n\n{user_question}"
+    bind_chat(chat.chat_id, "start")
 
     # 2) 대화 컨텍스트
     # 선택한 파일 카테고리에 따라 시스템 프롬프트를 결정
-    if target_file is not None:
-        cat = target_file.file_business_category
+    if data is not None:
+        cat = data.business_category
     else:
         cat = "default"
     
@@ -575,128 +745,158 @@ def start_chat(request: WSGIRequest) -> JsonResponse:
     print(f"[Chat {chat.chat_id}] Start. Question: {user_question}")
 
     # 3) 대화 루프
-    while need_more and turn < MAX_ITER:
-        turn += 1
-        print(f"[Chat {chat.chat_id}] === LLM TURN {turn}/{MAX_ITER} ===")
-
-        assistant_reply = langchain(model,
-                                    system_prompt,
-                                    prev_msgs[1:],          # system 제외
-                                    prev_msgs[-1]["content"])
-        print(f"[Chat {chat.chat_id}] LLM raw ↴\n{assistant_reply}\n")
-
-        # ── 날짜 자리표시자 치환 ───────────────────────────────
-        for ph in DATE_RE.findall(assistant_reply):
-            full = "{{" + ph[0] + "(" + ph[1] + ")}}"
-            assistant_reply = assistant_reply.replace(
-                full, _eval_date_placeholder(full))
-
-        internal_log = [f"TURN {turn} RAW\n{assistant_reply}"]
-
-        # ── [T2S] 분기 ───────────────────────────────────────
-        if assistant_reply.startswith("[T2S]"):
-            if target_file is None:
-                try:
-                    target_file = File.objects.filter(
-                        user_id=user, file_processed=File.FileProcessingStatus.COMPLETED).latest('updated_at')
-                except File.DoesNotExist:
-                    assistant_final = "처리된 파일이 없습니다. 데이터를 먼저 업로드해 주세요."
+    buffer = MessageBuffer(chat)
+    try:
+        if fast is not None:
+            assistant_final, image_url, need_more = _fast_reply(buffer, fast)
+        while need_more and turn < MAX_ITER:
+            turn += 1
+            print(f"[Chat {chat.chat_id}] === LLM TURN {turn}/{MAX_ITER} ===")
+
+            assistant_reply = _chat_turn(system_prompt, prev_msgs, data, user_question)
+            print(f"[Chat {chat.chat_id}] LLM raw ↴\n{assistant_reply}\n")
+
+            # ── 날짜 자리표시자 치환 ───────────────────────────────
+            for ph in DATE_RE.findall(assistant_reply):
+                full = "{{" + ph[0] + "(" + ph[1] + ")}}"
+                assistant_reply = assistant_reply.replace(
+                    full, _eval_date_placeholder(full))
+
+            internal_log = [f"TURN {turn} RAW\n{assistant_reply}"]
+
+            # ── [T2S_BATCH] 분기 (여러 SQL 병렬 실행) ─────────────
+            if assistant_reply.startswith("[T2S_BATCH]"):
+                if data is None:
+                    data = _latest_file(user)
+                    if data is None:
+                        assistant_final = "처리된 파일이 없습니다. 데이터를 먼저 업로드해 주세요."
+                        break
+
+                queries = SQL_FENCE_RE.findall(assistant_reply)[:MAX_BATCH_QUERIES]
+                if not queries:
+                    assistant_final = "SQL 코드를 읽을 수 없습니다."
                     break
 
-            sql_query = text2sql(model, user_question, target_file.file_schema)
-            internal_log.append(f"\nSQL:\n{sql_query}")
+                rewrite_notes: list[str] = []
+                try:
+                    batch_result = _run_sql_batch(data, queries, rewrite_notes)
+                except Exception as e:
+                    assistant_final = _record_error(buffer, prev_msgs, image_url, e, "SQL")
+                    need_more = False
+                    break
+                internal_log.append(f"\nBATCH ({len(queries)} queries):\n{batch_result}")
+                internal_log.extend(rewrite_notes)
+
+                prev_msgs.append({"role": "assistant", "content": batch_result})
+                buffer.add("\n".join(internal_log),
+                           Message.MessageRole.INTERNAL,
+                           image_url)
+                continue
+
+            # ── [T2S] 분기 ───────────────────────────────────────
+            if assistant_reply.startswith("[T2S]"):
+                if data is None:
+                    data = _latest_file(user)
+                    if data is None:
+                        assistant_final = "처리된 파일이 없습니다. 데이터를 먼저 업로드해 주세요."
+                        break
+
+                sql_query = _generate_sql(user_question, data, internal_log)
+                internal_log.append(f"\nSQL:\n{sql_query}")
 
-            try:
-                result = execute_sqlite_query(target_file.file_sqlpath, sql_query, True)
-            except Exception as e:
-                assistant_final = _record_error(chat, prev_msgs, image_url, e, "SQL")
-                need_more = False
-                break
-            
-            if isinstance(result, pd.DataFrame):
-                if result.empty:
-                    assistant_final = "SQL 쿼리 결과가 없습니다."
+                try:
+                    result = _query(data, sql_query, internal_log)
+                except Exception as e:
+                    assistant_final = _record_error(buffer, prev_msgs, image_url, e, "SQL")
+                    need_more = False
                     break
-                preview = result.head(5).to_markdown(index=False)
+            
+                if isinstance(result, pd.DataFrame):
+                    if result.empty:
+                        assistant_final = "SQL 쿼리 결과가 없습니다."
+                        break
+                    preview = result.head(5).to_markdown(index=False)
+                    _remember(data, chat, user_question, sql_query)
                 
-            elif isinstance(result, list):
-                if not result:
-                    assistant_final = "SQL 쿼리 결과가 없습니다."
-                    break
-                tmp_df = pd.DataFrame(result, columns=[f"c{i+1}" for i in range(len(result[0]))])
-                preview = tmp_df.head(5).to_markdown(index=False)
+                elif isinstance(result, list):
+                    if not result:
+                        assistant_final = "SQL 쿼리 결과가 없습니다."
+                        break
+                    tmp_df = pd.DataFrame(result, columns=[f"c{i+1}" for i in range(len(result[0]))])
+                    preview = tmp_df.head(5).to_markdown(index=False)
                 
-            elif isinstance(result, int):
-                preview = f"{result:,} row(s) affected."
+                elif isinstance(result, int):
+                    preview = f"{result:,} row(s) affected."
                 
-            else:   # pd.Series 등 예외적인 타입 대비
-                preview = str(result)[:500]
+                else:   # pd.Series 등 예외적인 타입 대비
+                    preview = str(result)[:500]
             
-            internal_log.append(f"\nResult preview:\n{preview}")
-
-            prev_msgs.append({"role": "assistant",
-                              "content": f"```sql\n{sql_query}\n```\n{preview}"})
-            Message.objects.create(chat_id=chat,
-                                   message_text="\n".join(internal_log),
-                                   message_role=Message.MessageRole.INTERNAL,
-                                   message_image_url=image_url)
-            continue
-
-        # ── [PLOT] 분기 ─────────────────────────────────────
-        if assistant_reply.startswith("[PLOT]"):
-            m = re.search(r"```python\s*(.*?)\s*```", assistant_reply, re.S | re.I)
-            if not m:
-                assistant_final = "그래프 코드를 읽을 수 없습니다."
-                break
-            py_code = m.group(1)
-
-            img_dir = Path(f"media/{user_id}/{chat.chat_id}")
-            img_dir.mkdir(parents=True, exist_ok=True) 
-            img_path = img_dir / f"{uuid.uuid4()}.png" 
+                internal_log.append(f"\nResult preview:\n{preview}")
+
+                prev_msgs.append({"role": "assistant",
+                                  "content": f"```sql\n{sql_query}\n```\n{preview}"})
+                buffer.add("\n".join(internal_log),
+                           Message.MessageRole.INTERNAL,
+                           image_url)
+                continue
+
+            # ── [PLOT] 분기 ─────────────────────────────────────
+            if assistant_reply.startswith("[PLOT]"):
+                m = re.search(r"```python\s*(.*?)\s*```", assistant_reply, re.S | re.I)
+                if not m:
+                    assistant_final = "그래프 코드를 읽을 수 없습니다."
+                    break
+                py_code = m.group(1)
 
-            try:
-                run_pyplot_code(py_code, img_path)
-                image_url = "/" + str(img_path)
-            except Exception as e:
-                assistant_final = _record_error(chat, prev_msgs, image_url, e, "PLOT")
+                try:
+                    # 같은 코드의 차트는 캐시된 이미지를 그대로 재사용
+                    image_url, _ = render_plot(py_code)
+                except Exception as e:
+                    assistant_final = _record_error(buffer, prev_msgs, image_url, e, "PLOT")
+                    need_more = False
+                    break
+                
+                internal_log.append(f"\nPlot saved → {image_url}")
+
+                prev_msgs.append({"role": "assistant",
+                                  "content": f"Plot saved at {image_url}"})
+                buffer.add("\n".join(internal_log),
+                           Message.MessageRole.INTERNAL,
+                           image_url)
+                continue
+
+            # ── <ASK_USER> 즉시 반환 ────────────────────────────
+            if assistant_reply.rstrip().endswith("<ASK_USER>"):
+                assistant_final = assistant_reply.replace("<ASK_USER>", "").strip()
+                buffer.add(assistant_reply,
+                           Message.MessageRole.ASSISTANT,
+                           image_url)
                 need_more = False
                 break
-                
-            internal_log.append(f"\nPlot saved → {image_url}")
-
-            prev_msgs.append({"role": "assistant",
-                              "content": f"Plot saved at {image_url}"})
-            Message.objects.create(chat_id=chat,
-                                   message_text="\n".join(internal_log),
-                                   message_role=Message.MessageRole.INTERNAL,
-                                   message_image_url=image_url)
-            continue
-
-        # ── <ASK_USER> 즉시 반환 ────────────────────────────
-        if assistant_reply.rstrip().endswith("<ASK_USER>"):
-            assistant_final = assistant_reply.replace("<ASK_USER>", "").strip()
-            Message.objects.create(chat_id=chat,
-                                   message_text=assistant_reply,
-                                   message_role=Message.MessageRole.ASSISTANT,
-                                   message_image_url=image_url)
+
+            # ── 최종 답변 또는 추가 질문 ─────────────────────────
+            if "<REQUEST_INFO>" in assistant_reply and turn < MAX_ITER:
+                prev_msgs.append({"role": "assistant", "content": assistant_reply})
+                buffer.add(assistant_reply,
+                           Message.MessageRole.ASSISTANT,
+                           image_url)
+                continue
+
+            assistant_final = assistant_reply.replace("<END>", "").strip()
+            buffer.add(assistant_final,
+                       Message.MessageRole.ASSISTANT,
+                       image_url)
             need_more = False
-            break
-
-        # ── 최종 답변 또는 추가 질문 ─────────────────────────
-        if "<REQUEST_INFO>" in assistant_reply and turn < MAX_ITER:
-            prev_msgs.append({"role": "assistant", "content": assistant_reply})
-            Message.objects.create(chat_id=chat,
-                                   message_text=assistant_reply,
-                                   message_role=Message.MessageRole.ASSISTANT,
-                                   message_image_url=image_url)
-            continue
-
-        assistant_final = assistant_reply.replace("<END>", "").strip()
-        Message.objects.create(chat_id=chat,
-                               message_text=assistant_final,
-                               message_role=Message.MessageRole.ASSISTANT,
-                               message_image_url=image_url)
+    except (LLMUnavailable, Saturated) as e:
+        # 재시도·deadline 을 다 써도 LLM 응답이 없거나 LLM 대기열이 넘치면 지금까지의 결과와 함께 에러로 종료.
+        # Chat·사용자 메시지는 이미 저장됐으므로 429 로 돌려보내면 재시도 때 질문만 남은 채팅이 또 생긴다
+        if isinstance(e, Saturated):
+            REGISTRY.inc("pos_admission_rejected_total", endpoint="chat.start", reason="queue")
+        assistant_final = _record_error(buffer, prev_msgs, image_url, e, "LLM")
         need_more = False
+    finally:
+        # 이번 턴의 INTERNAL/assistant 메시지를 한 트랜잭션으로 저장
+        buffer.flush()
 
     # 4) 자동 종료 알림
     if turn >= MAX_ITER and need_more:
@@ -710,16 +910,18 @@ def start_chat(request: WSGIRequest) -> JsonResponse:
         "data": {
             "chat_id":   chat.chat_id,
             "chat_title": chat.chat_title,
+            "file_ids":  [f.file_id for f in data.files] if data is not None else [],
             "response":  assistant_final,
             "image_url": image_url
         }
     })
 
 @csrf_exempt
+@llm_deadline
 def query_chat(request: WSGIRequest) -> JsonResponse:
     """
     기존 채팅방에 메시지를 추가 전송하고 GPT-4o 응답을 받아온다.
-    요청 JSON: { "chat_id": <int>, "message_text": <str> }
+    요청 JSON: { "chat_id": <int>, "message_text": <str>, "file_ids": [<int>, ...] (선택, 채팅에 파일 추가) }
     """
     if request.method != "POST":
         return JsonResponse({"response": 405, "message": "method not allowed", "data": None})
@@ -728,6 +930,7 @@ def query_chat(request: WSGIRequest) -> JsonResponse:
         body = json.loads(request.body)
         chat_id = body.get("chat_id")
         user_input = (body.get("message_text") or "").strip()
+        add_file_ids = body.get("file_ids")
     except Exception:
         return JsonResponse({"response": 400, "message": "invalid body", "data": None})
 
@@ -741,7 +944,28 @@ def query_chat(request: WSGIRequest) -> JsonResponse:
         return JsonResponse({"response": 404, "message": "chat id is not found", "data": None})
 
     user = chat.user_id
-    target_file: File | None = chat.file_id      # may be None
+    files = list(chat.files.all()) or ([chat.file_id] if chat.file_id is not None else [])
+    if add_file_ids:
+        added = _select_files(user, add_file_ids)
+        if isinstance(added, JsonResponse):
+            return added
+        files = list({f.file_id: f for f in files + added}.values())
+        if len(files) > MAX_FILES:
+            return JsonResponse({"response": 400,
+                                 "message": f"at most {MAX_FILES} files can be attached to a chat",
+                                 "data": None})
+    data: FileSet | None = FileSet(files) if files else None    # may be None
+    if data is not None:
+        try:
+            data.schema
+        except FileSetError as e:
+            return JsonResponse({"response": 404, "message": str(e), "data": None})
+        if add_file_ids:
+            chat.files.set(data.files)
+            if chat.file_id is None:
+                chat.file_id = data.primary
+                chat.save(update_fields=["file_id"])
+    bind_chat(chat.chat_id, "query")
 
     # ── 1. User 메시지 저장 ───────────────────────────────────
     Message.objects.create(chat_id=chat,
@@ -752,11 +976,11 @@ def query_chat(request: WSGIRequest) -> JsonResponse:
     history = (Message.objects
                .filter(chat_id=chat)
                .exclude(message_role=Message.MessageRole.INTERNAL)
-               .order_by("created_at"))
+               .order_by("created_at", "message_id"))
 
     # 선택한 파일 카테고리에 따라 시스템 프롬프트를 결정
-    if target_file is not None:
-        cat = target_file.file_business_category
+    if data is not None:
+        cat = data.business_category
     else:
         cat = "default"
         
@@ -767,126 +991,149 @@ def query_chat(request: WSGIRequest) -> JsonResponse:
         role = "assistant" if m.message_role == Message.MessageRole.ASSISTANT else "user"
         prev_msgs.append({"role": role, "content": m.message_text})
 
-    # ── 3. 최신 질문 반영 (schema prefix 포함) ────────────────
-    augmented_question = user_input
-    if target_file is not None:
-        augmented_question = f"file의 db schema:\n{target_file.file_schema}\n\n{user_input}"
-    prev_msgs[-1]["content"] = augmented_question   # 마지막 user 메시지 대체
-
-    # ── 4. LLM ↔ 파이프라인 (start_chat 루프 재활용) ─────────
+    # ── 3. LLM ↔ 파이프라인 (start_chat 루프 재활용) ─────────
     assistant_final = ""
     image_url: str | None = None
     need_more, turn = True, 0
 
-    while need_more and turn < MAX_ITER:
-        turn += 1
-        print(f"[Chat {chat.chat_id}] === QUERY TURN {turn}/{MAX_ITER} ===")
-
-        assistant_reply = langchain(model,
-                                    system_prompt,
-                                    prev_msgs[1:],         # system 제외
-                                    prev_msgs[-1]["content"])
-        print(f"[Chat {chat.chat_id}] LLM raw ↴\n{assistant_reply}\n")
-
-        # 날짜 자리표시자 치환
-        for ph in DATE_RE.findall(assistant_reply):
-            full = "{{" + ph[0] + "(" + ph[1] + ")}}"
-            assistant_reply = assistant_reply.replace(full, _eval_date_placeholder(full))
-
-        # ── 분기 처리 (T2S / PLOT / ASK_USER / 종료) ──────────
-        if assistant_reply.startswith("[T2S]"):
-            if target_file is None:
-                try:
-                    target_file = File.objects.filter(user_id=user,
-                                                      file_processed=File.FileProcessingStatus.COMPLETED).latest("updated_at")
-                except File.DoesNotExist:
-                    assistant_final = "처리된 파일이 없습니다. 데이터를 먼저 업로드해 주세요."
+    buffer = MessageBuffer(chat)
+    try:
+        fast = fastpath.answer(user_input, data)
+        if fast is not None:
+            assistant_final, image_url, need_more = _fast_reply(buffer, fast)
+        while need_more and turn < MAX_ITER:
+            turn += 1
+            print(f"[Chat {chat.chat_id}] === QUERY TURN {turn}/{MAX_ITER} ===")
+
+            assistant_reply = _chat_turn(system_prompt, prev_msgs, data, user_input)
+            print(f"[Chat {chat.chat_id}] LLM raw ↴\n{assistant_reply}\n")
+
+            # 날짜 자리표시자 치환
+            for ph in DATE_RE.findall(assistant_reply):
+                full = "{{" + ph[0] + "(" + ph[1] + ")}}"
+                assistant_reply = assistant_reply.replace(full, _eval_date_placeholder(full))
+
+            # ── 분기 처리 (T2S_BATCH / T2S / PLOT / ASK_USER / 종료) ──
+            if assistant_reply.startswith("[T2S_BATCH]"):
+                if data is None:
+                    data = _latest_file(user)
+                    if data is None:
+                        assistant_final = "처리된 파일이 없습니다. 데이터를 먼저 업로드해 주세요."
+                        break
+
+                queries = SQL_FENCE_RE.findall(assistant_reply)[:MAX_BATCH_QUERIES]
+                if not queries:
+                    assistant_final = "SQL 코드를 읽을 수 없습니다."
                     break
 
-            sql_query = text2sql(model, user_input, target_file.file_schema)
-            try:
-                result = execute_sqlite_query(target_file.file_sqlpath, sql_query, True)
-            except Exception as e:
-                assistant_final = f"SQL 실행 오류: {e}"
-                break
-            
-            if isinstance(result, pd.DataFrame):
-                if result.empty:
-                    assistant_final = "SQL 쿼리 결과가 없습니다."
+                rewrite_notes: list[str] = []
+                try:
+                    batch_result = _run_sql_batch(data, queries, rewrite_notes)
+                except Exception as e:
+                    assistant_final = _record_error(buffer, prev_msgs, image_url, e, "SQL")
+                    need_more = False
                     break
-                preview = result.head(5).to_markdown(index=False)
 
-            elif isinstance(result, list):
-                if not result:
-                    assistant_final = "SQL 쿼리 결과가 없습니다."
+                prev_msgs.append({"role": "assistant", "content": batch_result})
+                buffer.add(f"[INTERNAL] SQL BATCH ({len(queries)})\n{batch_result}{''.join(rewrite_notes)}",
+                           Message.MessageRole.INTERNAL,
+                           image_url)
+                continue
+
+            if assistant_reply.startswith("[T2S]"):
+                if data is None:
+                    data = _latest_file(user)
+                    if data is None:
+                        assistant_final = "처리된 파일이 없습니다. 데이터를 먼저 업로드해 주세요."
+                        break
+
+                sql_notes: list[str] = []
+                rewrite_notes: list[str] = []
+                sql_query = _generate_sql(user_input, data, sql_notes)
+                try:
+                    result = _query(data, sql_query, rewrite_notes)
+                except Exception as e:
+                    assistant_final = _record_error(buffer, prev_msgs, image_url, e, "SQL")
+                    need_more = False
                     break
+            
+                if isinstance(result, pd.DataFrame):
+                    if result.empty:
+                        assistant_final = "SQL 쿼리 결과가 없습니다."
+                        break
+                    preview = result.head(5).to_markdown(index=False)
+                    _remember(data, chat, user_input, sql_query)
+
+                elif isinstance(result, list):
+                    if not result:
+                        assistant_final = "SQL 쿼리 결과가 없습니다."
+                        break
                 
-                tmp_df = pd.DataFrame(result, columns=[f"c{i+1}" for i in range(len(result[0]))])
-                preview = tmp_df.head(5).to_markdown(index=False)
+                    tmp_df = pd.DataFrame(result, columns=[f"c{i+1}" for i in range(len(result[0]))])
+                    preview = tmp_df.head(5).to_markdown(index=False)
                 
-            elif isinstance(result, int):
-                preview = f"{result:,} row(s) affected."
+                elif isinstance(result, int):
+                    preview = f"{result:,} row(s) affected."
                 
-            else:
-                preview = str(result)[:500]
-
-            prev_msgs.append({"role": "assistant",
-                              "content": f"```sql\n{sql_query}\n```\n{preview}"})
-            Message.objects.create(chat_id=chat,
-                                   message_text=f"[INTERNAL] SQL\n{sql_query}\n{preview}",
-                                   message_role=Message.MessageRole.INTERNAL,
-                                   message_image_url=image_url)
-            continue
-
-        if assistant_reply.startswith("[PLOT]"):
-            m = re.search(r"```python\s*(.*?)\s*```", assistant_reply, re.S | re.I)
-            if not m:
-                assistant_final = "그래프 코드를 읽을 수 없습니다."
-                break
-            py_code = m.group(1)
-            img_dir = Path(f"media/{user.user_id}/{chat.chat_id}")
-            img_dir.mkdir(parents=True, exist_ok=True)
-            img_path = img_dir / f"{uuid.uuid4()}.png"
-            
-            try:
-                run_pyplot_code(py_code, img_path)
-                image_url = "/" + str(img_path)
-            except Exception as e:
-                assistant_final = _record_error(chat, prev_msgs, image_url, e, "PLOT")
+                else:
+                    preview = str(result)[:500]
+
+                prev_msgs.append({"role": "assistant",
+                                  "content": f"```sql\n{sql_query}\n```\n{preview}"})
+                buffer.add(f"[INTERNAL] SQL{''.join(sql_notes)}\n{sql_query}{''.join(rewrite_notes)}\n{preview}",
+                           Message.MessageRole.INTERNAL,
+                           image_url)
+                continue
+
+            if assistant_reply.startswith("[PLOT]"):
+                m = re.search(r"```python\s*(.*?)\s*```", assistant_reply, re.S | re.I)
+                if not m:
+                    assistant_final = "그래프 코드를 읽을 수 없습니다."
+                    break
+                py_code = m.group(1)
+                try:
+                    image_url, _ = render_plot(py_code)
+                except Exception as e:
+                    assistant_final = _record_error(buffer, prev_msgs, image_url, e, "PLOT")
+                    need_more = False
+                    break
+
+                prev_msgs.append({"role": "assistant",
+                                  "content": f"Plot saved at {image_url}"})
+                buffer.add(f"[INTERNAL] Plot saved → {image_url}",
+                           Message.MessageRole.INTERNAL,
+                           image_url)
+                continue
+
+            if assistant_reply.rstrip().endswith("<ASK_USER>"):
+                assistant_final = assistant_reply.replace("<ASK_USER>", "").strip()
+                buffer.add(assistant_reply,
+                           Message.MessageRole.ASSISTANT,
+                           image_url)
                 need_more = False
                 break
 
-            prev_msgs.append({"role": "assistant",
-                              "content": f"Plot saved at {image_url}"})
-            Message.objects.create(chat_id=chat,
-                                   message_text=f"[INTERNAL] Plot saved → {image_url}",
-                                   message_role=Message.MessageRole.INTERNAL,
-                                   message_image_url=image_url)
-            continue
-
-        if assistant_reply.rstrip().endswith("<ASK_USER>"):
-            assistant_final = assistant_reply.replace("<ASK_USER>", "").strip()
-            Message.objects.create(chat_id=chat,
-                                   message_text=assistant_reply,
-                                   message_role=Message.MessageRole.ASSISTANT,
-                                   message_image_url=image_url)
+            if "<REQUEST_INFO>" in assistant_reply and turn < MAX_ITER:
+                prev_msgs.append({"role": "assistant", "content": assistant_reply})
+                buffer.add(assistant_reply,
+                           Message.MessageRole.ASSISTANT,
+                           image_url)
+                continue
+
+            assistant_final = assistant_reply.replace("<END>", "").strip()
+            buffer.add(assistant_final,
+                       Message.MessageRole.ASSISTANT,
+                       image_url)
             need_more = False
-            break
-
-        if "<REQUEST_INFO>" in assistant_reply and turn < MAX_ITER:
-            prev_msgs.append({"role": "assistant", "content": assistant_reply})
-            Message.objects.create(chat_id=chat,
-                                   message_text=assistant_reply,
-                                   message_role=Message.MessageRole.ASSISTANT,
-                                   message_image_url=image_url)
-            continue
-
-        assistant_final = assistant_reply.replace("<END>", "").strip()
-        Message.objects.create(chat_id=chat,
-                               message_text=assistant_final,
-                               message_role=Message.MessageRole.ASSISTANT,
-                               message_image_url=image_url)
+    except (LLMUnavailable, Saturated) as e:
+        # 재시도·deadline 을 다 써도 LLM 응답이 없거나 LLM 대기열이 넘치면 지금까지의 결과와 함께 에러로 종료.
+        # Chat·사용자 메시지는 이미 저장됐으므로 429 로 돌려보내면 재시도 때 질문만 남은 채팅이 또 생긴다
+        if isinstance(e, Saturated):
+            REGISTRY.inc("pos_admission_rejected_total", endpoint="chat.query", reason="queue")
+        assistant_final = _record_error(buffer, prev_msgs, image_url, e, "LLM")
         need_more = False
+    finally:
+        buffer.flush()
 
     if turn >= MAX_ITER and need_more:
         assistant_final += "\n(대화가 길어 자동 종료되었습니다.)"
@@ -895,14 +1142,22 @@ def query_chat(request: WSGIRequest) -> JsonResponse:
         "response": 200,
         "message": "query request success",
         "data": {
+            "file_ids": [f.file_id for f in data.files] if data is not None else [],
             "response": assistant_final,
             "image_url": image_url
         }
     })
 
+CHAT_LIST_FIELDS    = ("chat_id", "chat_title", "created_at", "updated_at", "thumbnail_url")
+MESSAGE_FIELDS      = ("message_id", "message_text", "message_role", "message_image_url", "created_at")
+
+
 @csrf_exempt
-def list_chats(request: WSGIRequest) -> JsonResponse:
-    """유저의 모든 채팅방 목록 반환"""
+def list_chats(request: WSGIRequest) -> HttpResponse:
+    """
+    유저의 채팅방 목록 반환 (최근 수정 순)
+    선택 파라미터: limit, cursor (keyset), fields (콤마 구분 프로젝션)
+    """
     if request.method != "GET":
         return JsonResponse({"response": 405, "message": "method not allowed", "data": None})
 
@@ -910,29 +1165,93 @@ def list_chats(request: WSGIRequest) -> JsonResponse:
     if not user_id:
         return JsonResponse({"response": 400, "message": "missing required fields", "data": None})
 
+    try:
+        limit  = parse_limit(request.GET.get("limit"))
+        fields = parse_fields(request.GET.get("fields"), CHAT_LIST_FIELDS,
+                              required=("chat_id", "updated_at"))
+    except PaginationError as e:
+        return JsonResponse({"response": 400, "message": str(e), "data": None})
+
     try:
         user = User.objects.get(user_id=user_id)
     except User.DoesNotExist:
         return JsonResponse({"response": 404, "message": "user id is not found", "data": None})
 
-    chats = (Chat.objects.filter(user_id=user)
-             .order_by("-updated_at")
-             .values("chat_id", "chat_title", "created_at", "updated_at"))
+    chats = Chat.objects.filter(user_id=user)
+
+    # 목록 전체의 변경 여부만 싸게 확인 (행 직렬화 전에 304 응답)
+    stamp = chats.aggregate(n=Count("chat_id"), last=Max("updated_at"), top=Max("chat_id"))
+    latest_image = None
+    if "thumbnail_url" in fields:
+        # query_chat 은 updated_at 을 바꾸지 않으므로 새 그래프는 따로 반영
+        latest_image = (Message.objects.filter(chat_id__user_id=user, message_image_url__isnull=False)
+                        .aggregate(top=Max("message_id"))["top"])
+    etag = make_etag("chats", user_id, stamp["n"], stamp["last"], stamp["top"], latest_image,
+                     request.GET.urlencode())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    if "thumbnail_url" in fields:
+        # 채팅의 가장 최근 그래프 (message_chat_created_idx 역방향 탐색)
+        chats = chats.annotate(thumbnail_url=Subquery(
+            Message.objects.filter(chat_id=OuterRef("chat_id"), message_image_url__isnull=False)
+            .order_by("-created_at", "-message_id")
+            .values("message_image_url")[:1]))
 
-    chat_list = [{
-        "chat_id": c["chat_id"],
-        "chat_title": c["chat_title"],
-        "created_at": c["created_at"].strftime("%Y/%m/%d %H:%M:%S"),
-        "updated_at": c["updated_at"].strftime("%Y/%m/%d %H:%M:%S")
-    } for c in chats]
+    try:
+        rows, next_cursor = keyset_page(chats.values(*fields), "updated_at", "chat_id",
+                                        request.GET.get("cursor"), limit, descending=True)
+    except PaginationError as e:
+        return JsonResponse({"response": 400, "message": str(e), "data": None})
+
+    chat_list = []
+    for c in rows:
+        for key in ("created_at", "updated_at"):
+            if key in c:
+                c[key] = c[key].strftime("%Y/%m/%d %H:%M:%S")
+        if "thumbnail_url" in c:
+            c["thumbnail_url"] = thumbnail_url(c["thumbnail_url"])
+        chat_list.append(c)
+
+    return set_etag(JsonResponse({"response": 200, "message": "request success",
+                                  "data": {"chats": chat_list, "next_cursor": next_cursor}}), etag)
+
+
+def _message_page(request: WSGIRequest, msgs, role_to_str) -> HttpResponse:
+    """get_chat_history / get_chat_history_all 공통 페이지네이션 + ETag 처리"""
+    try:
+        limit  = parse_limit(request.GET.get("limit"))
+        fields = parse_fields(request.GET.get("fields"), MESSAGE_FIELDS,
+                              required=("message_id", "created_at"))
+    except PaginationError as e:
+        return JsonResponse({"response": 400, "message": str(e), "data": None})
 
-    return JsonResponse({"response": 200, "message": "request success",
-                         "data": {"chats": chat_list}})
+    stamp = msgs.aggregate(n=Count("message_id"), last=Max("updated_at"), top=Max("message_id"))
+    etag = make_etag(request.path, stamp["n"], stamp["last"], stamp["top"], request.GET.urlencode())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    try:
+        rows, next_cursor = keyset_page(msgs.values(*fields), "created_at", "message_id",
+                                        request.GET.get("cursor"), limit)
+    except PaginationError as e:
+        return JsonResponse({"response": 400, "message": str(e), "data": None})
+
+    for m in rows:
+        m["created_at"] = m["created_at"].strftime("%Y/%m/%d %H:%M:%S")
+        if "message_role" in m:
+            m["message_role"] = role_to_str(m["message_role"])
+
+    return set_etag(JsonResponse({"response": 200, "message": "request success",
+                                  "data": {"messages": rows, "next_cursor": next_cursor}}), etag)
 
 
 @csrf_exempt
-def get_chat_history(request: WSGIRequest) -> JsonResponse:
-    """특정 채팅방의 메시지(Internal 제외) 리스트 반환"""
+def get_chat_history(request: WSGIRequest) -> HttpResponse:
+    """
+    특정 채팅방의 메시지(Internal 제외) 리스트 반환
+    선택 파라미터: limit, cursor (keyset), fields (콤마 구분 프로젝션)
+    """
     if request.method != "GET":
         return JsonResponse({"response": 405, "message": "method not allowed", "data": None})
 
@@ -947,24 +1266,20 @@ def get_chat_history(request: WSGIRequest) -> JsonResponse:
 
     msgs = (Message.objects
             .filter(chat_id=chat)
-            .exclude(message_role=Message.MessageRole.INTERNAL)
-            .order_by("created_at"))
+            .exclude(message_role=Message.MessageRole.INTERNAL))
 
-    msg_list = [{
-        "message_id": m.message_id,
-        "message_text": m.message_text,
-        "message_role": ("assistant" if m.message_role == Message.MessageRole.ASSISTANT else "user"),
-        "message_image_url": m.message_image_url,
-        "created_at": m.created_at.strftime("%Y/%m/%d %H:%M:%S")
-    } for m in msgs]
+    def _message_role_to_str(role):
+        return "assistant" if role == Message.MessageRole.ASSISTANT else "user"
 
-    return JsonResponse({"response": 200, "message": "request success",
-                         "data": {"messages": msg_list}})
+    return _message_page(request, msgs, _message_role_to_str)
 
 
 @csrf_exempt
-def get_chat_history_all(request: WSGIRequest) -> JsonResponse:
-    """특정 채팅방의 모든 메시지 리스트 반환"""
+def get_chat_history_all(request: WSGIRequest) -> HttpResponse:
+    """
+    특정 채팅방의 모든 메시지 리스트 반환
+    선택 파라미터: limit, cursor (keyset), fields (콤마 구분 프로젝션)
+    """
     if request.method != "GET":
         return JsonResponse({"response": 405, "message": "method not allowed", "data": None})
 
@@ -977,10 +1292,8 @@ def get_chat_history_all(request: WSGIRequest) -> JsonResponse:
     except Chat.DoesNotExist:
         return JsonResponse({"response": 404, "message": "chat id is not found", "data": None})
 
-    msgs = (Message.objects
-            .filter(chat_id=chat)
-            .order_by("created_at"))
-    
+    msgs = Message.objects.filter(chat_id=chat)
+
     def _message_role_to_str(role):
         if role == Message.MessageRole.ASSISTANT:
             return "assistant"
@@ -989,16 +1302,7 @@ def get_chat_history_all(request: WSGIRequest) -> JsonResponse:
         else:
             return "internal"
 
-    msg_list = [{
-        "message_id": m.message_id,
-        "message_text": m.message_text,
-        "message_role": _message_role_to_str(m.message_role),
-        "message_image_url": m.message_image_url,
-        "created_at": m.created_at.strftime("%Y/%m/%d %H:%M:%S")
-    } for m in msgs]
-
-    return JsonResponse({"response": 200, "message": "request success",
-                         "data": {"messages": msg_list}})
+    return _message_page(request, msgs, _message_role_to_str)
     
 
 @csrf_exempt
@@ -1016,7 +1320,8 @@ def delete_chat(request: WSGIRequest) -> JsonResponse:
     except Chat.DoesNotExist:
         return JsonResponse({"response": 404, "message": "chat id is not found", "data": None})
 
-    # 연관 이미지 파일도 정리 (media/<user>/<chat> 디렉터리)
+    # 연관 이미지 파일도 정리 (캐시 도입 전 media/<user>/<chat> 디렉터리)
+    # media/_plots 의 캐시 이미지는 여러 채팅이 공유하므로 LRU 축출에 맡긴다
     img_dir = Path(f"media/{chat.user_id.user_id}/{chat.chat_id}")
     if img_dir.exists():
         for p in img_dir.glob("*"):
@@ -1029,6 +1334,103 @@ def delete_chat(request: WSGIRequest) -> JsonResponse:
                          "message": "chat deletion success",
                          "data": None})
 
+# ── 배치 질문 ─────────────────────────────────────────────────
+@csrf_exempt
+def start_batch(request: WSGIRequest) -> JsonResponse:
+    """한 파일에 질문 여러 개를 배치 작업으로 등록하고 job_id 를 바로 돌려준다 (api/batch.py)"""
+    if request.method != "POST":
+        return JsonResponse({"response": 405, "message": "method not allowed", "data": None})
+
+    body      = json.loads(request.body)
+    user_id   = body.get("user_id")
+    file_id   = body.get("file_id")
+    questions = body.get("questions")
+
+    if not user_id or file_id is None or not questions:
+        return JsonResponse({"response": 400, "message": "missing required fields", "data": None})
+    if not isinstance(file_id, int):
+        return JsonResponse({"response": 400, "message": "file_id must be an integer", "data": None})
+    if not isinstance(questions, list) or not all(isinstance(q, str) and q.strip() for q in questions):
+        return JsonResponse({"response": 400, "message": "questions must be a list of non-empty strings",
+                             "data": None})
+    if len(questions) > settings.BATCH_MAX_QUESTIONS:
+        return JsonResponse({"response": 400,
+                             "message": f"at most {settings.BATCH_MAX_QUESTIONS} questions can be sent in a batch",
+                             "data": None})
+
+    try:
+        user = User.objects.get(user_id=user_id)
+    except User.DoesNotExist:
+        return JsonResponse({"response": 404, "message": "user id is not found", "data": None})
+
+    files = _select_files(user, [file_id])
+    if isinstance(files, JsonResponse):
+        return files
+
+    with transaction.atomic():
+        job = BatchJob.objects.create(user_id=user, file_id=files[0], question_count=len(questions))
+        BatchItem.objects.bulk_create([BatchItem(job_id=job, position=i, question=q.strip())
+                                       for i, q in enumerate(questions)])
+    batch.start(job.job_id, _generate_sql, _query)
+
+    return JsonResponse({"response": 200,
+                         "message": "batch job started",
+                         "data": {"job_id": job.job_id,
+                                  "question_count": job.question_count,
+                                  "status": "pending"}})
+
+
+@csrf_exempt
+def get_batch_result(request: WSGIRequest) -> JsonResponse:
+    """배치 작업의 상태와 (끝난) 질문별 결과·소요 시간"""
+    if request.method != "GET":
+        return JsonResponse({"response": 405, "message": "method not allowed", "data": None})
+
+    job_id = request.GET.get("job_id")
+    if not job_id:
+        return JsonResponse({"response": 400, "message": "missing required fields", "data": None})
+
+    try:
+        job = BatchJob.objects.get(job_id=job_id)
+    except (BatchJob.DoesNotExist, ValueError):
+        return JsonResponse({"response": 404, "message": "job id is not found", "data": None})
+
+    def _status(value: int) -> str:
+        return BatchJob.JobStatus(value).label.lower()
+
+    items = [{
+        "position": item.position,
+        "question": item.question,
+        "status": _status(item.item_status),
+        "source": item.item_source or None,
+        "sql": item.sql,
+        "answer_text": item.answer_text or None,
+        "image_url": item.image_url,
+        "result": item.result,
+        "row_count": item.row_count,
+        "error": item.error or None,
+        "shared_with": item.shared_with,
+        "timing_ms": {"queue": round(item.queue_ms, 1), "generate": round(item.generate_ms, 1),
+                      "sql": round(item.sql_ms, 1), "total": round(item.total_ms, 1)},
+    } for item in job.items.order_by("position")]
+
+    return JsonResponse({"response": 200,
+                         "message": "request success",
+                         "data": {
+                             "job_id": job.job_id,
+                             "file_id": job.file_id_id,
+                             "status": _status(job.job_status),
+                             "error": job.job_error or None,
+                             "question_count": job.question_count,
+                             "completed": sum(i["status"] == "completed" for i in items),
+                             "failed": sum(i["status"] == "failed" for i in items),
+                             "total_ms": round(job.total_ms, 1),
+                             "created_at": job.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+                             "finished_at": job.finished_at.strftime("%Y-%m-%d %H:%M:%S") if job.finished_at else None,
+                             "items": items,
+                         }})
+
+
 @csrf_exempt
 def chat_demo(request):
     return render(request, "api/chat_demo.html")
@@ -10,11 +10,18 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import re
 from pathlib import Path
 
+import dotenv
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Load environment variables from .env file
+dotenv.load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -48,6 +55,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.tracing.TracingMiddleware',
+    'api.admission.AdmissionMiddleware',
 ]
 
 ROOT_URLCONF = 'project.urls'
@@ -73,13 +82,59 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# Selected with DB_ENGINE=sqlite (default) | postgres. Connections are kept
+# open for DB_CONN_MAX_AGE seconds so chat turns don't reconnect per request.
+#
+# SQLite: WAL journal (readers never block the writer), a busy timeout so
+# concurrent writers wait instead of failing with "database is locked", and
+# BEGIN IMMEDIATE so write transactions take the lock up front instead of
+# failing on lock upgrade.
+#
+# PostgreSQL uses psycopg 3 (psycopg[binary] in requirements.txt).
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite').lower()
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+
+if DB_ENGINE not in ('sqlite', 'sqlite3', 'postgres', 'postgresql'):
+    raise ValueError(f"DB_ENGINE must be sqlite | postgres, got {DB_ENGINE!r}")
+
+if DB_ENGINE in ('postgres', 'postgresql'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'posinsight'),
+            'USER': os.getenv('DB_USER', 'posinsight'),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+            },
+        }
     }
-}
-
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        }
+    }
+    # DB_SQLITE_TUNING=0 restores Django's defaults (rollback journal, 5s timeout)
+    if os.getenv('DB_SQLITE_TUNING', '1') == '1':
+        SQLITE_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', '20'))   # seconds
+        DATABASES['default']['OPTIONS'] = {
+            'timeout': SQLITE_BUSY_TIMEOUT,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT * 1000};'
+            ),
+        }
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -121,6 +176,139 @@ STATIC_ROOT = BASE_DIR / 'static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# How /media/ and /static/ bytes are delivered (api/file_delivery.py):
+#   python     - FileResponse; sendfile under gunicorn/uWSGI, ETag + Range handled in Django
+#   x-sendfile - X-Sendfile header for Apache / lighttpd / Caddy
+#   x-accel    - X-Accel-Redirect to FILE_ACCEL_PREFIX + 'media/...' for an nginx internal location
+FILE_DELIVERY = os.getenv('FILE_DELIVERY', 'python').lower()
+FILE_ACCEL_PREFIX = os.getenv('FILE_ACCEL_PREFIX', '/_protected/')
+if FILE_DELIVERY not in ('python', 'x-sendfile', 'x-accel'):
+    raise ValueError(f"FILE_DELIVERY must be python | x-sendfile | x-accel, got {FILE_DELIVERY!r}")
+
+# [PLOT] rendering (api/plot_cache.py): charts are cached under MEDIA_ROOT/_plots
+# keyed by a hash of the plot code; least recently used entries are evicted
+# once the cache exceeds PLOT_CACHE_MAX_MB (charts a chat message still shows are kept).
+PLOT_DPI = int(os.getenv('PLOT_DPI', '100'))
+PLOT_FORMAT = os.getenv('PLOT_FORMAT', 'png').lower()         # png | webp
+PLOT_THUMB_SIZE = int(os.getenv('PLOT_THUMB_SIZE', '320'))    # px, longest side
+PLOT_CACHE_MAX_MB = int(os.getenv('PLOT_CACHE_MAX_MB', '512'))
+
+# Layout of the per-upload SQLite DBs (api/ingest.py):
+#   plain   - one table per CSV / sheet
+#   compact - category columns stored as integer codes + _dict_* lookup tables,
+#             exposed through a view with the original table / column names
+INGEST_LAYOUT = os.getenv('INGEST_LAYOUT', 'plain').lower()
+if INGEST_LAYOUT not in ('plain', 'compact'):
+    raise ValueError(f"INGEST_LAYOUT must be plain | compact, got {INGEST_LAYOUT!r}")
+
+# Materialized rollups (api/rollups.py): date × category summary tables built at
+# ingest; aggregate SQL from text2sql that they can answer runs on them instead
+# of the raw table (same result, logged in the INTERNAL message)
+ROLLUPS_ENABLED = os.getenv('ROLLUPS_ENABLED', '1') == '1'
+
+# Schema retrieval (api/schema_index.py): for tables with at least SCHEMA_PRUNE_MIN_COLUMNS
+# columns, prompts get only the key columns plus the SCHEMA_TOP_K columns most similar
+# to the question (faiss over column name / type / sample values).
+# SCHEMA_EMBEDDING_MODEL is 'local' for hashed n-grams (no network), or an OpenAI embedding
+# model. A remote model adds a blocking embeddings call per new question (schema retrieval
+# and few-shot lookup) that is not covered by the LLM admission slots, the request deadline
+# or the pos_llm_* metrics, so it stays opt-in
+SCHEMA_RETRIEVAL_ENABLED = os.getenv('SCHEMA_RETRIEVAL_ENABLED', '1') == '1'
+SCHEMA_PRUNE_MIN_COLUMNS = int(os.getenv('SCHEMA_PRUNE_MIN_COLUMNS', '40'))
+SCHEMA_TOP_K = int(os.getenv('SCHEMA_TOP_K', '12'))
+SCHEMA_EMBEDDING_MODEL = os.getenv('SCHEMA_EMBEDDING_MODEL', 'local')
+if SCHEMA_PRUNE_MIN_COLUMNS < 1 or SCHEMA_TOP_K < 1:
+    raise ValueError("SCHEMA_PRUNE_MIN_COLUMNS and SCHEMA_TOP_K must be at least 1")
+
+# Few-shot store (api/fewshot.py): SQL that text2sql wrote and that ran without error is
+# kept per user with the question and a schema fingerprint; the FEWSHOT_K most similar
+# examples whose tables / columns exist in the current file (at most FEWSHOT_TOKEN_BUDGET
+# tokens) are shown to text2sql. Questions are embedded with SCHEMA_EMBEDDING_MODEL
+FEWSHOT_ENABLED = os.getenv('FEWSHOT_ENABLED', '1') == '1'
+FEWSHOT_K = int(os.getenv('FEWSHOT_K', '3'))
+FEWSHOT_TOKEN_BUDGET = int(os.getenv('FEWSHOT_TOKEN_BUDGET', '800'))
+if FEWSHOT_K < 1 or FEWSHOT_TOKEN_BUDGET < 1:
+    raise ValueError("FEWSHOT_K and FEWSHOT_TOKEN_BUDGET must be at least 1")
+
+# LLM client (api/llm.py): one keep-alive httpx client shared by every model.
+# LLM_PURPOSES routes each call site to a model / temperature / max_tokens;
+# escalate_to names the purpose whose model retries output that fails validation
+# (text2sql SQL rejected by EXPLAIN). [PLOT] code is written by the answer model.
+LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-4o-2024-08-06')
+LLM_PURPOSES: dict[str, dict] = {
+    'answer': {'model': LLM_MODEL},
+    'sql': {'model': os.getenv('LLM_SQL_MODEL', 'gpt-4o-mini'),
+            'max_tokens': int(os.getenv('LLM_SQL_MAX_TOKENS', '1024')),
+            'escalate_to': 'answer'},
+    'title': {'model': os.getenv('LLM_TITLE_MODEL', 'gpt-4o-mini'),
+              'max_tokens': int(os.getenv('LLM_TITLE_MAX_TOKENS', '64'))},
+}
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '16'))
+LLM_MAX_KEEPALIVE = int(os.getenv('LLM_MAX_KEEPALIVE', '16'))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', '60'))     # seconds
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', '5'))
+LLM_READ_TIMEOUT = float(os.getenv('LLM_READ_TIMEOUT', '120'))
+LLM_HTTP2 = os.getenv('LLM_HTTP2', '0') == '1'                            # needs the optional 'h2' package
+
+# Tail-latency control for LLM calls (api/resilience.py):
+#   per attempt timeout, total LLM time per chat request, retries with backoff + jitter,
+#   optional hedged requests for LLM_HEDGE_STAGES after the stage's recent p95 latency
+LLM_CALL_TIMEOUT = float(os.getenv('LLM_CALL_TIMEOUT', '60'))
+LLM_REQUEST_DEADLINE = float(os.getenv('LLM_REQUEST_DEADLINE', '180'))
+LLM_RETRIES = int(os.getenv('LLM_RETRIES', '2'))
+LLM_RETRY_BASE = float(os.getenv('LLM_RETRY_BASE', '0.5'))
+LLM_RETRY_MAX = float(os.getenv('LLM_RETRY_MAX', '8'))
+LLM_HEDGE = os.getenv('LLM_HEDGE', '0') == '1'
+LLM_HEDGE_STAGES = tuple(s.strip() for s in os.getenv('LLM_HEDGE_STAGES', 'text2sql,make_title').split(',') if s.strip())
+LLM_HEDGE_QUANTILE = float(os.getenv('LLM_HEDGE_QUANTILE', '0.95'))
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '0.5'))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+# Stream chat turns and stop generating once the [T2S] / [T2S_BATCH] / [PLOT] directive is complete
+LLM_STREAM_DIRECTIVES = os.getenv('LLM_STREAM_DIRECTIVES', '1') == '1'
+
+# Template fast path (api/fastpath.py): common questions (top-N items, sales trend,
+# payment / channel split) answered with SQL only, without calling the LLM
+FASTPATH_ENABLED = os.getenv('FASTPATH_ENABLED', '1') == '1'
+FASTPATH_TEMPLATES = tuple(t.strip() for t in os.getenv('FASTPATH_TEMPLATES', 'top_items,sales_trend,split').split(',')
+                           if t.strip())
+if not set(FASTPATH_TEMPLATES) <= {'top_items', 'sales_trend', 'split'}:
+    raise ValueError(f"FASTPATH_TEMPLATES may list top_items, sales_trend, split; got {FASTPATH_TEMPLATES!r}")
+
+# Admission control for LLM-backed endpoints (api/admission.py):
+#   ADMISSION_RATES           - token bucket per user and endpoint, 'N/s|m|h' (empty = unlimited)
+#   ADMISSION_MAX_INFLIGHT_LLM - concurrent LLM calls per process; extra calls queue per user (round-robin)
+#   ADMISSION_MAX_QUEUE / ADMISSION_QUEUE_TIMEOUT - queue length / max wait (s) before answering 429
+#   ADMISSION_BACKEND         - memory (per process) | cache (shared through CACHES[ADMISSION_CACHE])
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', '1') == '1'
+ADMISSION_RATES = {
+    'chat.start': os.getenv('ADMISSION_RATE_CHAT_START', '10/m'),
+    'chat.query': os.getenv('ADMISSION_RATE_CHAT_QUERY', '30/m'),
+    'files.upload': os.getenv('ADMISSION_RATE_FILES_UPLOAD', '10/m'),
+    'batch.start': os.getenv('ADMISSION_RATE_BATCH_START', '5/m'),
+}
+ADMISSION_MAX_INFLIGHT_LLM = int(os.getenv('ADMISSION_MAX_INFLIGHT_LLM', '8'))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '32'))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '15'))
+ADMISSION_BACKEND = os.getenv('ADMISSION_BACKEND', 'memory').lower()
+ADMISSION_CACHE = os.getenv('ADMISSION_CACHE', 'default')
+ADMISSION_GLOBAL_MAX_INFLIGHT_LLM = int(os.getenv('ADMISSION_GLOBAL_MAX_INFLIGHT_LLM', '32'))
+if ADMISSION_BACKEND not in ('memory', 'cache'):
+    raise ValueError(f"ADMISSION_BACKEND must be memory | cache, got {ADMISSION_BACKEND!r}")
+if ADMISSION_MAX_INFLIGHT_LLM < 1:
+    raise ValueError("ADMISSION_MAX_INFLIGHT_LLM must be >= 1")
+for _endpoint, _rate in ADMISSION_RATES.items():
+    if _rate and not re.fullmatch(r"\d+/[smh]", _rate):
+        raise ValueError(f"ADMISSION_RATE for {_endpoint} must look like '30/m', got {_rate!r}")
+
+# Batch questions (api/batch.py): /api/batch/start runs up to BATCH_MAX_QUESTIONS questions
+# against one file on a process-wide pool of BATCH_WORKERS threads (identical questions and
+# identical SQL run once); the first BATCH_MAX_ROWS rows of each result are stored
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '4'))
+BATCH_MAX_QUESTIONS = int(os.getenv('BATCH_MAX_QUESTIONS', '50'))
+BATCH_MAX_ROWS = int(os.getenv('BATCH_MAX_ROWS', '200'))
+if BATCH_WORKERS < 1 or BATCH_MAX_QUESTIONS < 1 or BATCH_MAX_ROWS < 1:
+    raise ValueError("BATCH_WORKERS, BATCH_MAX_QUESTIONS and BATCH_MAX_ROWS must be at least 1")
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -15,16 +15,17 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
 
-from django.views.static import serve
-from django.urls import re_path
+from api.file_delivery import serve_file
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('api.urls')),
-    re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
-    re_path(r'^static/(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT}),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+    re_path(r'^media/(?P<path>.*)$', serve_file,
+            {'document_root': settings.MEDIA_ROOT, 'root_name': 'media'}),
+    re_path(r'^static/(?P<path>.*)$', serve_file,
+            {'document_root': settings.STATIC_ROOT, 'root_name': 'static',
+             'cache_control': 'public, max-age=86400'}),
+]
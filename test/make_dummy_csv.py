@@ -1,113 +1,332 @@
 #!/usr/bin/env python
 """
-Synthetic POS CSV Generator
+Synthetic POS data generator
 ────────────────────────────────────────────
 $ python make_dummy_csv.py --type=cafe --num-data=10  [-o output.csv]
-   • --type       {cafe | cvs}
-   • --num-data   # rows to generate
-   • --out / -o   optional output filename (default auto-naming)
+   • --type        {cafe | cvs}
+   • --num-data    # rows to generate
+   • --out / -o    optional output filename (default auto-naming)
+                   suffix decides the format: .csv | .xlsx | .db/.sqlite3
+   • --start/--end date range (default 2025-01-01 ~ 2025-12-31)
+   • --zipf        item popularity skew (0 = uniform, default 1.1)
+   • --seasonality yearly amplitude of daily volume (0 = flat, default 0.3)
+   • --peak-hours  comma separated rush hours (default per business type)
+   • --chunk-size  rows per chunk (default 200,000)
+   • --workers     processes used for generation (default: CPU count)
+   • --seed        RNG seed; same seed ⇒ same output regardless of workers
+
+$ python make_dummy_csv.py --type=cvs --num-data=10000000 -o cvs_10m.db
+   → 10M rows streamed chunk by chunk into a SQLite DB (table `table1`,
+     the layout file_to_sqlite produces), never holding the whole set in RAM.
 ────────────────────────────────────────────
 """
 import argparse
-import numpy as np
-import pandas as pd
+import os
+import sqlite3
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
 from datetime import datetime
 from pathlib import Path
-import sys
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNK = 200_000
+XLSX_MAX_ROWS = 1_048_575          # 시트당 최대 행 수 - 헤더 1행
+TXN_ID_BASE   = 1_000_000
+
+# HH:MM:SS 룩업 테이블 (초 → 문자열, 벡터 인덱싱용)
+_TIME_STR = np.array([f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(86_400)],
+                     dtype=object)
+
+
+# ╭─ distribution ─────────────────────────────────────────────────╮
+@dataclass(frozen=True)
+class Distribution:
+    start: str = "2025-01-01"
+    end: str = "2025-12-31"
+    zipf: float = 1.1                   # item_name 인기도 (rank^-zipf)
+    seasonality: float = 0.3            # 연중 일 매출량 진폭 (여름 피크)
+    weekend_boost: float = 0.15         # 토·일 가중치
+    peak_hours: tuple[int, ...] = ()    # 러시아워 (비어 있으면 시간대 균등)
+    peak_width: float = 1.2             # 러시아워 분포 폭 (시간)
+    open_hours: tuple[int, int] = (0, 24)
+
+    def days(self) -> pd.DatetimeIndex:
+        return pd.date_range(self.start, self.end, freq="D")
+
+
+def _day_weights(dist: Distribution) -> tuple[np.ndarray, np.ndarray]:
+    days = dist.days()
+    if len(days) == 0:
+        raise ValueError(f"empty date range: {dist.start} ~ {dist.end}")
+    doy = days.dayofyear.to_numpy()
+    w = 1.0 + dist.seasonality * np.cos(2 * np.pi * (doy - 200) / 365.25)
+    w = w * np.where(days.dayofweek.to_numpy() >= 5, 1.0 + dist.weekend_boost, 1.0)
+    w = np.clip(w, 1e-6, None)
+    return days.strftime("%Y-%m-%d").to_numpy(dtype=object), w / w.sum()
+
+
+def _hour_weights(dist: Distribution) -> np.ndarray:
+    hours = np.arange(24)
+    w = np.full(24, 0.15)
+    for peak in dist.peak_hours:
+        # 자정을 넘는 원형 거리
+        d = np.minimum(np.abs(hours - peak), 24 - np.abs(hours - peak))
+        w += np.exp(-0.5 * (d / dist.peak_width) ** 2)
+    lo, hi = dist.open_hours
+    w[(hours < lo) | (hours >= hi)] = 0.0
+    return w / w.sum()
+
+
+def _zipf_weights(n: int, a: float) -> np.ndarray:
+    w = 1.0 / np.arange(1, n + 1) ** a
+    return w / w.sum()
+
+
+def _sample_dates(rng: np.random.Generator, n: int, dist: Distribution) -> np.ndarray:
+    labels, p = _day_weights(dist)
+    return labels[rng.choice(len(labels), n, p=p)]
 
-# ╭─ util ─────────────────────────────────────────────────────────┐
-def _random_dates(start: str, end: str, n: int) -> pd.Series:
-    start_dt = pd.Timestamp(start)
-    end_dt   = pd.Timestamp(end)
-    days     = (end_dt - start_dt).days
-    return pd.to_datetime(
-        np.random.randint(0, days + 1, n), unit="D", origin=start_dt
-    ).normalize()
-
-def _random_times(n: int) -> pd.Series:
-    secs = np.random.randint(0, 86_400, n)   # seconds in a day
-    return pd.to_timedelta(secs, unit="s").astype(str)
+
+def _sample_times(rng: np.random.Generator, n: int, dist: Distribution) -> np.ndarray:
+    hours = rng.choice(24, n, p=_hour_weights(dist))
+    secs  = hours * 3600 + rng.integers(0, 3600, n)
+    return _TIME_STR[secs]
+
+
+def _txn_ids(row_offset: int, n: int) -> np.ndarray:
+    return np.arange(TXN_ID_BASE + row_offset, TXN_ID_BASE + row_offset + n, dtype=np.int64)
 # ╰─────────────────────────────────────────────────────────────────╯
 
 # ╭─ Café generator ───────────────────────────────────────────────╮
+CAFE_ITEMS  = ["Americano", "Latte", "Cappuccino", "Mocha", "Tea", "Smoothie"]   # 인기순
+CAFE_PRICE  = np.array([3500, 4500, 4500, 5000, 4000, 5500])
 CAFE_SIZES  = ["S", "M", "L"]
 CAFE_TEMP   = ["Hot", "Iced"]
 MILK_TYPES  = ["Regular", "Low-fat", "Soy", "Oat"]
 PAY_TYPES   = ["Card", "Cash", "MobilePay"]
+CAFE_DIST   = Distribution(peak_hours=(8, 12, 15), open_hours=(7, 23))
 
-def make_cafe_pos(num_data: int = 100) -> pd.DataFrame:
-    rng = np.random.default_rng()
+def make_cafe_pos(num_data: int = 100,
+                  rng: np.random.Generator | None = None,
+                  dist: Distribution | None = None,
+                  row_offset: int = 0) -> pd.DataFrame:
+    rng  = rng or np.random.default_rng()
+    dist = dist or CAFE_DIST
+    item = rng.choice(len(CAFE_ITEMS), num_data, p=_zipf_weights(len(CAFE_ITEMS), dist.zipf))
+    size = rng.choice(len(CAFE_SIZES), num_data, p=[0.3, 0.5, 0.2])
     df = pd.DataFrame({
-        "transaction_id": rng.integers(1_000_000, 9_999_999, num_data),
-        "date"          : _random_dates("2025-01-01", "2025-12-31", num_data),
-        "time"          : _random_times(num_data),
-        "channel"       : rng.choice(["Store", "DeliveryApp", "Kiosk"], num_data),
-        "item_name"     : rng.choice(
-            ["Americano", "Latte", "Cappuccino", "Mocha", "Tea", "Smoothie"], num_data),
-        "size"          : rng.choice(CAFE_SIZES, num_data),
+        "transaction_id": _txn_ids(row_offset, num_data),
+        "date"          : _sample_dates(rng, num_data, dist),
+        "time"          : _sample_times(rng, num_data, dist),
+        "channel"       : rng.choice(["Store", "DeliveryApp", "Kiosk"], num_data, p=[0.55, 0.25, 0.2]),
+        "item_name"     : np.asarray(CAFE_ITEMS, dtype=object)[item],
+        "size"          : np.asarray(CAFE_SIZES, dtype=object)[size],
         "temperature"   : rng.choice(CAFE_TEMP,  num_data),
         "shot_count"    : rng.integers(1, 4, num_data),
         "milk_type"     : rng.choice(MILK_TYPES, num_data),
         "syrup_pumps"   : rng.integers(0, 4, num_data),
         "topping"       : rng.choice(
-            ["None", "Whipped Cream", "Bubble", "Cheese Cap"], num_data),
+            ["None", "Whipped Cream", "Bubble", "Cheese Cap"], num_data, p=[0.7, 0.15, 0.1, 0.05]),
         "qty"           : 1,
-        "unit_price"    : rng.integers(3000, 7000, num_data),
+        # 메뉴 기본가 + 사이즈 업차지 + 소폭 변동
+        "unit_price"    : CAFE_PRICE[item] + size * 500 + rng.integers(0, 5, num_data) * 100,
     })
     df["total_price"]  = df["qty"] * df["unit_price"]
-    df["payment_type"] = rng.choice(PAY_TYPES, num_data)
-    return df.reset_index(drop=True)
+    df["payment_type"] = rng.choice(PAY_TYPES, num_data, p=[0.65, 0.1, 0.25])
+    return df
 # ╰─────────────────────────────────────────────────────────────────╯
 
 # ╭─ Convenience-store generator ──────────────────────────────────╮
+CVS_ITEMS  = ["Soda", "Chips", "Cigarette", "Beer", "Sandwich",
+              "Energy Drink", "Chocolate", "Ice cream"]                          # 인기순
+CVS_PRICE  = np.array([1800, 1700, 4500, 3000, 3200, 2200, 1500, 2000])
 CVS_CAT_L1 = ["Snack", "Beverage", "Daily", "Frozen", "Alcohol", "Cigarette"]
 CVS_PAY    = ["Card", "Cash", "Voucher", "Prepaid"]
+CVS_DIST   = Distribution(peak_hours=(8, 12, 18, 22))
 
-def make_cvs_pos(num_data: int = 100) -> pd.DataFrame:
-    rng = np.random.default_rng()
+def make_cvs_pos(num_data: int = 100,
+                 rng: np.random.Generator | None = None,
+                 dist: Distribution | None = None,
+                 row_offset: int = 0) -> pd.DataFrame:
+    rng  = rng or np.random.default_rng()
+    dist = dist or CVS_DIST
+    item = rng.choice(len(CVS_ITEMS), num_data, p=_zipf_weights(len(CVS_ITEMS), dist.zipf))
     df = pd.DataFrame({
-        "transaction_id": rng.integers(1_000_000, 9_999_999, num_data),
-        "date"          : _random_dates("2025-01-01", "2025-12-31", num_data),
-        "time"          : _random_times(num_data),
-        "channel"       : rng.choice(["Counter", "Self-Checkout"], num_data),
-        "barcode"       : rng.integers(8800000000000, 8800999999999, num_data),
-        "item_name"     : rng.choice(
-            ["Chips", "Chocolate", "Soda", "Energy Drink",
-             "Sandwich", "Ice cream", "Beer", "Cigarette"], num_data),
+        "transaction_id": _txn_ids(row_offset, num_data),
+        "date"          : _sample_dates(rng, num_data, dist),
+        "time"          : _sample_times(rng, num_data, dist),
+        "channel"       : rng.choice(["Counter", "Self-Checkout"], num_data, p=[0.7, 0.3]),
+        "barcode"       : 8800000000000 + item * 1_000_003 + rng.integers(0, 50, num_data),
+        "item_name"     : np.asarray(CVS_ITEMS, dtype=object)[item],
         "category_lv1"  : rng.choice(CVS_CAT_L1, num_data),
         "brand"         : rng.choice(
             ["Lotte", "PepsiCo", "Coca-Cola", "Nestlé", "Local"], num_data),
         "pack_size"     : rng.choice(["350 mL", "500 mL", "1 L", "60 g", "120 g"], num_data),
-        "qty"           : rng.integers(1, 4, num_data),
-        "unit_price"    : rng.integers(1000, 5000, num_data),
+        "qty"           : rng.choice([1, 2, 3], num_data, p=[0.75, 0.18, 0.07]),
+        "unit_price"    : CVS_PRICE[item] + rng.integers(-2, 3, num_data) * 100,
         "promo_flag"    : rng.choice([0, 1], num_data, p=[0.8, 0.2]),
         "age_restricted": rng.choice([0, 1], num_data, p=[0.7, 0.3]),
     })
     df["total_price"]  = df["qty"] * df["unit_price"]
     df["payment_type"] = rng.choice(CVS_PAY, num_data)
-    return df.reset_index(drop=True)
+    return df
+# ╰─────────────────────────────────────────────────────────────────╯
+
+# ╭─ chunked / parallel generation ────────────────────────────────╮
+GENERATORS = {"cafe": (make_cafe_pos, CAFE_DIST), "cvs": (make_cvs_pos, CVS_DIST)}
+
+
+def _chunk(kind: str, index: int, offset: int, n: int, seed: int,
+           dist: Distribution, as_csv: bool) -> pd.DataFrame | bytes:
+    """청크 하나 생성. 시드는 (seed, index) 로 고정되므로 워커 수와 무관하게 결과가 같다."""
+    make, _ = GENERATORS[kind]
+    df = make(n, rng=np.random.default_rng([seed, index]), dist=dist, row_offset=offset)
+    if as_csv:      # CSV 인코딩도 워커에서 처리해 메인 프로세스는 쓰기만 한다
+        return df.to_csv(index=False, header=False).encode("utf-8")
+    return df
+
+
+def iter_pos_chunks(kind: str,
+                    num_data: int,
+                    chunk_size: int = DEFAULT_CHUNK,
+                    seed: int | None = None,
+                    dist: Distribution | None = None,
+                    workers: int = 1,
+                    as_csv: bool = False) -> Iterator[pd.DataFrame | bytes]:
+    """
+    num_data 행을 chunk_size 단위로 순서대로 생성한다.
+    workers > 1 이면 프로세스 풀에서 생성하되, 메모리를 묶어 두기 위해
+    동시에 진행 중인 청크는 workers * 2 개로 제한한다.
+    """
+    dist = dist or GENERATORS[kind][1]
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % (2 ** 63))
+    tasks = [(kind, i, off, min(chunk_size, num_data - off), seed, dist, as_csv)
+             for i, off in enumerate(range(0, num_data, chunk_size))]
+
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield _chunk(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: deque = deque()
+        remaining = iter(tasks)
+        for task in remaining:
+            pending.append(pool.submit(_chunk, *task))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            yield pending.popleft().result()
+            nxt = next(remaining, None)
+            if nxt is not None:
+                pending.append(pool.submit(_chunk, *nxt))
+
+
+def _columns(kind: str) -> list[str]:
+    make, dist = GENERATORS[kind]
+    return list(make(1, rng=np.random.default_rng(0), dist=dist).columns)
+
+
+def write_pos(kind: str,
+              num_data: int,
+              out: str | Path,
+              chunk_size: int = DEFAULT_CHUNK,
+              seed: int | None = None,
+              dist: Distribution | None = None,
+              workers: int = 1) -> Path:
+    """
+    생성 결과를 out 에 스트리밍으로 기록한다. 형식은 확장자로 결정:
+      .csv          utf-8-sig CSV
+      .xlsx         openpyxl write-only 시트 (최대 1,048,575 행)
+      .db/.sqlite3  file_to_sqlite 와 같은 `table1` 테이블을 가진 SQLite DB
+    """
+    out = Path(out)
+    suffix = out.suffix.lower()
+    chunks = lambda as_csv=False: iter_pos_chunks(kind, num_data, chunk_size, seed, dist, workers, as_csv)
+
+    if suffix == ".csv":
+        with open(out, "wb") as f:
+            f.write(("\ufeff" + ",".join(_columns(kind)) + "\n").encode("utf-8"))
+            for blob in chunks(as_csv=True):
+                f.write(blob)
+
+    elif suffix == ".xlsx":
+        if num_data > XLSX_MAX_ROWS:
+            raise ValueError(f".xlsx holds at most {XLSX_MAX_ROWS:,} rows; use .csv or .db")
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Sheet1")
+        ws.append(_columns(kind))
+        for df in chunks():
+            for row in df.itertuples(index=False, name=None):
+                ws.append([v.item() if isinstance(v, np.generic) else v for v in row])
+        wb.save(out)
+
+    elif suffix in {".db", ".sqlite", ".sqlite3"}:
+        out.unlink(missing_ok=True)
+        with sqlite3.connect(out) as conn:
+            # 일회성 대량 적재: 저널/동기화 생략
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            insert = None
+            for df in chunks():
+                if insert is None:      # to_sql 과 같은 타입 매핑으로 테이블 생성
+                    conn.execute(pd.io.sql.get_schema(df, "table1"))
+                    insert = f"INSERT INTO table1 VALUES ({','.join('?' * len(df.columns))})"
+                # to_sql 보다 빠른 경로: 컬럼별 tolist() 로 파이썬 스칼라 변환 후 executemany
+                conn.executemany(insert, zip(*(df[c].tolist() for c in df.columns)))
+    else:
+        raise ValueError("Output extension must be .csv / .xlsx / .db / .sqlite3")
+
+    return out
 # ╰─────────────────────────────────────────────────────────────────╯
 
 # ╭─ CLI entry ────────────────────────────────────────────────────╮
 def _parse_args():
-    p = argparse.ArgumentParser(description="Generate dummy POS CSV data")
+    p = argparse.ArgumentParser(description="Generate dummy POS data (CSV / XLSX / SQLite)")
     p.add_argument("--type", choices=["cafe", "cvs"], required=True,
                    help="Business type to generate (cafe or cvs)")
     p.add_argument("--num-data", type=int, default=100,
                    help="Number of rows to generate (default: 100)")
     p.add_argument("-o", "--out", metavar="FILE",
-                   help="Output CSV filename (optional)")
+                   help="Output filename; .csv / .xlsx / .db / .sqlite3 (optional)")
+    p.add_argument("--start", default="2025-01-01", help="First date (default: 2025-01-01)")
+    p.add_argument("--end", default="2025-12-31", help="Last date (default: 2025-12-31)")
+    p.add_argument("--zipf", type=float, default=1.1,
+                   help="Item popularity skew exponent, 0 = uniform (default: 1.1)")
+    p.add_argument("--seasonality", type=float, default=0.3,
+                   help="Yearly amplitude of daily volume, 0 = flat (default: 0.3)")
+    p.add_argument("--peak-hours", metavar="H,H,...",
+                   help="Rush hours, e.g. 8,12,18 (default depends on --type)")
+    p.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK,
+                   help=f"Rows per chunk (default: {DEFAULT_CHUNK:,})")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                   help="Generator processes (default: CPU count)")
+    p.add_argument("--seed", type=int, help="RNG seed for reproducible output")
     return p.parse_args()
 
 def main():
     args = _parse_args()
-    gen = make_cafe_pos if args.type == "cafe" else make_cvs_pos
-    df  = gen(args.num_data)
+    base = GENERATORS[args.type][1]
+    dist = replace(base, start=args.start, end=args.end, zipf=args.zipf, seasonality=args.seasonality)
+    if args.peak_hours:
+        dist = replace(dist, peak_hours=tuple(int(h) for h in args.peak_hours.split(",")))
 
     out_path = Path(args.out) if args.out else \
         Path(f"{args.type}_pos_dummy_{datetime.now():%Y%m%d_%H%M%S}.csv")
-    df.to_csv(out_path, index=False, encoding="utf-8-sig")
-    print(f"✔ Generated {len(df):,} rows → {out_path}")
+
+    t0 = datetime.now()
+    write_pos(args.type, args.num_data, out_path, chunk_size=args.chunk_size,
+              seed=args.seed, dist=dist, workers=args.workers)
+    secs = (datetime.now() - t0).total_seconds()
+    size_mb = out_path.stat().st_size / 1e6
+    print(f"✔ Generated {args.num_data:,} rows → {out_path} ({size_mb:,.1f} MB in {secs:.1f}s)")
 
 if __name__ == "__main__":
     try: